@@ -1,6 +1,8 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
 from typing import List, Dict, Any, Optional
 import pandas as pd
 import numpy as np
@@ -8,7 +10,7 @@ import logging
 from datetime import datetime, timedelta
 import json
 
-from ...core.database import get_db, Customer, Campaign, CameraData
+from ...core.database import get_db, get_async_db, Customer, Campaign, CameraData
 from ...core.security import get_current_user
 from ...api.auth import require_permission
 from ...ai_engine.insight_generator import IntelligentInsightGenerator
@@ -22,7 +24,7 @@ router = APIRouter()
 async def get_dashboard_overview(
     time_range: str = Query("30d", regex="^(7d|30d|90d|1y)$"),
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     🏢 **Analytics Dashboard Overview**
@@ -41,22 +43,24 @@ async def get_dashboard_overview(
         start_date = datetime.now() - time_mapping[time_range]
         
         # Customer metrics
-        total_customers = db.query(Customer).count()
-        new_customers = db.query(Customer).filter(
-            Customer.created_at >= start_date
-        ).count()
+        total_customers = await db.scalar(select(func.count(Customer.id)))
+        new_customers = await db.scalar(
+            select(func.count(Customer.id)).where(Customer.created_at >= start_date)
+        )
         
         # Campaign metrics
-        total_campaigns = db.query(Campaign).count()
-        active_campaigns = db.query(Campaign).filter(
-            Campaign.status == "active"
-        ).count()
+        total_campaigns = await db.scalar(select(func.count(Campaign.id)))
+        active_campaigns = await db.scalar(
+            select(func.count(Campaign.id)).where(Campaign.status == "active")
+        )
         
         # Performance metrics
-        completed_campaigns = db.query(Campaign).filter(
-            Campaign.status == "completed",
-            Campaign.created_at >= start_date
-        ).all()
+        completed_campaigns = (await db.execute(
+            select(Campaign).where(
+                Campaign.status == "completed",
+                Campaign.created_at >= start_date
+            )
+        )).scalars().all()
         
         avg_roi = 0
         total_budget = 0
@@ -65,16 +69,16 @@ async def get_dashboard_overview(
             total_budget = sum(c.budget for c in completed_campaigns)
         
         # Customer segments analysis
-        segmented_customers = db.query(Customer).filter(
-            Customer.segment_id.isnot(None)
-        ).count()
+        segmented_customers = await db.scalar(
+            select(func.count(Customer.id)).where(Customer.segment_id.isnot(None))
+        )
         
         segmentation_rate = (segmented_customers / total_customers * 100) if total_customers > 0 else 0
         
         # High-value customers
-        high_value_customers = db.query(Customer).filter(
-            Customer.rating_id >= 4
-        ).count()
+        high_value_customers = await db.scalar(
+            select(func.count(Customer.id)).where(Customer.rating_id >= 4)
+        )
         
         return {
             "overview": {
@@ -439,14 +443,14 @@ async def get_predictive_customer_analytics(
         raise HTTPException(status_code=500, detail=f"Predictive analytics failed: {str(e)}")
 
 # Helper functions for analytics
-async def _generate_smart_alerts(db: Session, time_range: str) -> List[Dict]:
+async def _generate_smart_alerts(db: AsyncSession, time_range: str) -> List[Dict]:
     """Generate intelligent alerts based on data patterns"""
     alerts = []
     
     # Check for unusual customer patterns
-    recent_customers = db.query(Customer).filter(
-        Customer.created_at >= datetime.now() - timedelta(days=7)
-    ).count()
+    recent_customers = await db.scalar(
+        select(func.count(Customer.id)).where(Customer.created_at >= datetime.now() - timedelta(days=7))
+    )
     
     if recent_customers == 0:
         alerts.append({
@@ -457,7 +461,7 @@ async def _generate_smart_alerts(db: Session, time_range: str) -> List[Dict]:
         })
     
     # Check campaign performance
-    active_campaigns = db.query(Campaign).filter(Campaign.status == "active").count()
+    active_campaigns = await db.scalar(select(func.count(Campaign.id)).where(Campaign.status == "active"))
     if active_campaigns == 0:
         alerts.append({
             "type": "business",
@@ -468,13 +472,13 @@ async def _generate_smart_alerts(db: Session, time_range: str) -> List[Dict]:
     
     return alerts
 
-async def _generate_dashboard_recommendations(db: Session) -> List[str]:
+async def _generate_dashboard_recommendations(db: AsyncSession) -> List[str]:
     """Generate actionable recommendations for the dashboard"""
     recommendations = []
     
     # Analyze customer segments
-    total_customers = db.query(Customer).count()
-    segmented_customers = db.query(Customer).filter(Customer.segment_id.isnot(None)).count()
+    total_customers = await db.scalar(select(func.count(Customer.id)))
+    segmented_customers = await db.scalar(select(func.count(Customer.id)).where(Customer.segment_id.isnot(None)))
     
     if total_customers > 0:
         segmentation_rate = segmented_customers / total_customers
@@ -482,7 +486,7 @@ async def _generate_dashboard_recommendations(db: Session) -> List[str]:
             recommendations.append("🎯 Run customer segmentation on unsegmented customers")
     
     # Check high-value customers
-    high_value_customers = db.query(Customer).filter(Customer.rating_id >= 4).count()
+    high_value_customers = await db.scalar(select(func.count(Customer.id)).where(Customer.rating_id >= 4))
     if high_value_customers > total_customers * 0.3:
         recommendations.append("💎 Launch premium loyalty program for high-value customers")
     
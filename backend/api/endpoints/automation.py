@@ -1,15 +1,19 @@
 """
 Marketing Automation API Endpoints
 """
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from sqlalchemy.orm import Session
 
-from ...core.database import get_db
+from ...core.database import get_db, run_with_db
+from ...core.config import settings
 from ...core.security import get_current_user, require_permission
-from ...automation.workflow_engine import WorkflowEngine, WorkflowStatus
+from ...automation.workflow_engine import WorkflowEngine, WorkflowStatus, run_unscheduled_batch
+from ...automation.workflow_timers import workflow_timers
+from ...automation.execution_scheduler import execution_scheduler
 
 router = APIRouter()
 
@@ -24,6 +28,12 @@ class TriggerWorkflowRequest(BaseModel):
     customer_id: str
     trigger_data: Optional[Dict[str, Any]] = {}
 
+class TriggerWorkflowBatchRequest(BaseModel):
+    customer_ids: Optional[List[str]] = None
+    segment_id: Optional[str] = None
+    trigger_data: Optional[Dict[str, Any]] = {}
+    skip_active: bool = True
+
 class WorkflowResponse(BaseModel):
     success: bool
     workflow_id: Optional[str] = None
@@ -109,6 +119,42 @@ async def trigger_workflow_for_customer(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to trigger workflow: {str(e)}")
 
+@router.post("/workflows/{workflow_id}/trigger-batch")
+async def trigger_workflow_batch(
+    workflow_id: str,
+    request: TriggerWorkflowBatchRequest,
+    current_user: dict = Depends(require_permission("manage_campaigns"))
+):
+    """Trigger a workflow for a customer list and/or segment in one request"""
+    try:
+        # Audience resolution and inserts block, so they run on the database thread pool
+        result = await run_with_db(
+            lambda db: WorkflowEngine(db).trigger_workflow_batch(
+                workflow_id=workflow_id,
+                customer_ids=request.customer_ids,
+                segment_id=request.segment_id,
+                trigger_data=request.trigger_data,
+                skip_active=request.skip_active
+            )
+        )
+        execution_ids = result.pop("execution_ids")
+        if not settings.WORKFLOW_SCHEDULER_ENABLED:
+            for start in range(0, len(execution_ids), settings.WORKFLOW_RUN_BATCH_SIZE):
+                asyncio.create_task(run_unscheduled_batch(
+                    workflow_id, execution_ids[start:start + settings.WORKFLOW_RUN_BATCH_SIZE]
+                ))
+        
+        return {
+            "success": True,
+            **result,
+            "message": f"Workflow triggered for {result['triggered']} customers"
+        }
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to batch trigger workflow: {str(e)}")
+
 @router.get("/workflows")
 async def list_workflows(
     status: Optional[WorkflowStatus] = None,
@@ -194,6 +240,30 @@ async def get_workflow_performance(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get workflow performance: {str(e)}")
 
+@router.get("/timers/metrics")
+async def get_timer_metrics(
+    current_user: dict = Depends(require_permission("view_analytics")),
+    db: Session = Depends(get_db)
+):
+    """Delayed-step timer lag, resumed count and due backlog"""
+    try:
+        return workflow_timers.get_metrics(db)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get timer metrics: {str(e)}")
+
+@router.get("/scheduler/metrics")
+async def get_scheduler_metrics(
+    current_user: dict = Depends(require_permission("view_analytics")),
+    db: Session = Depends(get_db)
+):
+    """Run-queue depth, worker utilization and per-action throttling"""
+    try:
+        return execution_scheduler.get_metrics(db)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get scheduler metrics: {str(e)}")
+
 @router.get("/workflows/{workflow_id}/executions")
 async def get_workflow_executions(
     workflow_id: str,
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, desc, select
 from typing import List, Dict, Any, Optional
 import pandas as pd
 import io
@@ -10,8 +11,9 @@ import numpy as np
 import logging
 from datetime import datetime, timedelta
 
-from ...core.database import get_db, Customer, Purchase
+from ...core.database import get_db, get_async_db, Customer, Purchase
 from ...core.security import get_current_user
+from ...leads.rescoring_queue import rescoring_queue
 from ...ai_engine.adaptive_clustering import AdaptiveClustering as AdaptiveClusteringEngine
 from ...ai_engine.insight_generator import IntelligentInsightGenerator
 from ...data_pipeline.data_cleaner import AdvancedDataCleaner
@@ -55,15 +57,15 @@ async def get_customers(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, le=1000),
     segment_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
-    query = db.query(Customer)
+    query = select(Customer)
     
     if segment_id is not None:
-        query = query.filter(Customer.segment_id == segment_id)
+        query = query.where(Customer.segment_id == segment_id)
     
-    customers = query.offset(skip).limit(limit).all()
+    customers = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
     
     return [
         {
@@ -82,10 +84,12 @@ async def get_customers(
 async def get_customer(
     customer_id: str,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
-    customer = db.query(Customer).filter(Customer.customer_id == customer_id).first()
+    customer = (await db.execute(
+        select(Customer).where(Customer.customer_id == customer_id).limit(1)
+    )).scalars().first()
     
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -283,6 +287,7 @@ async def _process_upload(
         # Save to database with duplicate detection
         customers_saved = 0
         purchases_saved = 0
+        purchase_customer_ids = set()
         duplicates_skipped = 0
         processed_customer_ids = set()  # Track customers processed in this batch
         
@@ -366,10 +371,13 @@ async def _process_upload(
                         purchase_time=row.get('purchase_time') if pd.notna(row.get('purchase_time')) else None
                     )
                     db.add(purchase)
+                    purchase_customer_ids.add(customer_id)
                     purchases_saved += 1
                 else:
                     duplicates_skipped += 1
         
+        # Lead scores of buyers are now stale
+        rescoring_queue.enqueue(db, purchase_customer_ids, reason="purchase")
         db.commit()
 
         response_data = {
@@ -17,6 +17,7 @@ from dateutil import parser
 
 from core.database import get_db, Customer, Purchase, Campaign, Segment
 from core.security import get_current_user
+from leads.rescoring_queue import rescoring_queue
 
 logger = logging.getLogger(__name__)
 
@@ -135,6 +136,7 @@ def process_purchase_data(df: pd.DataFrame, db: Session) -> Dict[str, Any]:
     """Process purchase data from DataFrame"""
     imported_count = 0
     errors = []
+    purchase_customer_ids = set()
     
     try:
         for index, row in df.iterrows():
@@ -164,6 +166,7 @@ def process_purchase_data(df: pd.DataFrame, db: Session) -> Dict[str, Any]:
                 )
                 
                 db.add(purchase)
+                purchase_customer_ids.add(customer_id)
                 imported_count += 1
                 
             except Exception as e:
@@ -172,6 +175,8 @@ def process_purchase_data(df: pd.DataFrame, db: Session) -> Dict[str, Any]:
                 logger.error(f"Error processing purchase row {index + 1}: {e}")
                 continue
         
+        # Lead scores of buyers are now stale
+        rescoring_queue.enqueue(db, purchase_customer_ids, reason="purchase")
         db.commit()
         return {
             "imported_count": imported_count,
@@ -6,9 +6,11 @@ from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 import logging
 
-from ...core.database import get_db
+from ...core.database import get_db, get_async_db, run_with_db
 from ...core.security import get_current_user, require_permission
 from ...segmentation.dynamic_engine import (
     DynamicSegmentationEngine,
@@ -16,7 +18,8 @@ from ...segmentation.dynamic_engine import (
     SegmentStatus,
     UpdateFrequency,
     CriteriaOperator,
-    LogicalOperator
+    LogicalOperator,
+    RefreshMode
 )
 
 router = APIRouter()
@@ -60,6 +63,12 @@ class PredictiveSegmentRequest(BaseModel):
     tags: List[str] = []
     update_frequency: str = UpdateFrequency.DAILY.value
 
+class SegmentPreviewRequest(BaseModel):
+    criteria: Dict[str, Any]
+    exclusion_rules: List[Dict[str, Any]] = []
+    exact: bool = False
+    confidence_level: float = 0.95
+
 class SegmentResponse(BaseModel):
     success: bool
     message: str
@@ -107,6 +116,27 @@ async def create_dynamic_segment(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create segment: {str(e)}")
 
+@router.post("/segments/preview")
+async def preview_segment_size(
+    request: SegmentPreviewRequest,
+    current_user: dict = Depends(require_permission("view_segments"))
+):
+    """Estimate the size of a draft segment without executing it"""
+    try:
+        return await run_with_db(
+            lambda db: DynamicSegmentationEngine(db).preview_segment_size(
+                request.criteria,
+                request.exclusion_rules,
+                exact=request.exact,
+                confidence_level=request.confidence_level
+            )
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid segment criteria: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to preview segment: {str(e)}")
+
 @router.post("/segments/predictive", response_model=SegmentResponse)
 async def create_predictive_segment(
     request: PredictiveSegmentRequest,
@@ -157,26 +187,28 @@ async def list_segments(
     limit: int = Query(50, le=500),
     offset: int = Query(0, ge=0),
     current_user: dict = Depends(require_permission("view_segments")),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List dynamic segments with filtering"""
     try:
         from ...segmentation.dynamic_engine import DynamicSegment
         
-        query = db.query(DynamicSegment)
+        query = select(DynamicSegment)
         
         if segment_type:
-            query = query.filter(DynamicSegment.segment_type == segment_type)
+            query = query.where(DynamicSegment.segment_type == segment_type)
         
         if status:
-            query = query.filter(DynamicSegment.status == status)
+            query = query.where(DynamicSegment.status == status)
         
         if tags:
             # Filter by tags (simplified - would need proper JSON querying)
             tag_list = tags.split(",")
             # query = query.filter(DynamicSegment.tags.contains(tag_list))
         
-        segments = query.order_by(DynamicSegment.created_at.desc()).offset(offset).limit(limit).all()
+        segments = (await db.execute(
+            query.order_by(DynamicSegment.created_at.desc()).offset(offset).limit(limit)
+        )).scalars().all()
         
         segment_data = []
         for segment in segments:
@@ -306,6 +338,7 @@ async def execute_segmentation(
     segment_id: str,
     background_tasks: BackgroundTasks,
     execution_type: str = Query("manual", regex="^(manual|scheduled|incremental)$"),
+    refresh_mode: str = Query(RefreshMode.AUTO.value, regex="^(auto|full|incremental)$"),
     current_user: dict = Depends(require_permission("execute_segments")),
     db: Session = Depends(get_db)
 ):
@@ -316,18 +349,39 @@ async def execute_segmentation(
         # Execute segmentation in background
         background_tasks.add_task(
             _execute_segmentation_background,
-            db, segment_id, execution_type
+            db, segment_id, execution_type, refresh_mode
         )
         
         return {
             "success": True,
             "message": f"Segmentation execution started for segment {segment_id}",
-            "execution_type": execution_type
+            "execution_type": execution_type,
+            "refresh_mode": refresh_mode
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to execute segmentation: {str(e)}")
 
+@router.post("/segments/refresh-due")
+async def refresh_due_segments(
+    background_tasks: BackgroundTasks,
+    chunk_size: int = Query(50000, ge=1000, le=500000),
+    current_user: dict = Depends(require_permission("execute_segments")),
+    db: Session = Depends(get_db)
+):
+    """Refresh all due criteria-based segments in one pass over the customer table"""
+    try:
+        background_tasks.add_task(_refresh_due_segments_background, db, chunk_size)
+        
+        return {
+            "success": True,
+            "message": "Batch refresh of due segments started",
+            "chunk_size": chunk_size
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to refresh due segments: {str(e)}")
+
 @router.get("/segments/{segment_id}/analytics")
 async def get_segment_analytics(
     segment_id: str,
@@ -467,6 +521,22 @@ async def analyze_segment_overlap(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to analyze segment overlap: {str(e)}")
 
+@router.get("/segments/{segment_id}/difference")
+async def get_segment_difference(
+    segment_id: str,
+    exclude_segment_id: str,
+    limit: int = Query(1000, ge=1, le=100000),
+    current_user: dict = Depends(require_permission("view_segments")),
+    db: Session = Depends(get_db)
+):
+    """Get customers in a segment who are not in another segment"""
+    try:
+        segmentation_engine = DynamicSegmentationEngine(db)
+        return segmentation_engine.get_segment_difference(segment_id, exclude_segment_id, limit)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute segment difference: {str(e)}")
+
 @router.get("/segments/{segment_id}/executions")
 async def get_segment_executions(
     segment_id: str,
@@ -489,6 +559,7 @@ async def get_segment_executions(
                 "id": execution.id,
                 "execution_type": execution.execution_type,
                 "trigger": execution.trigger,
+                "refresh_mode": execution.refresh_mode,
                 "status": execution.status,
                 "metrics": {
                     "customers_processed": execution.customers_processed,
@@ -834,14 +905,24 @@ async def _create_predictive_segment_background(db: Session, config: Dict[str, A
     except Exception as e:
         logger.error(f"Background predictive segment creation failed: {e}")
 
-async def _execute_segmentation_background(db: Session, segment_id: str, execution_type: str):
+async def _execute_segmentation_background(db: Session, segment_id: str, execution_type: str,
+                                          refresh_mode: str = RefreshMode.AUTO.value):
     """Background task to execute segmentation"""
     try:
         segmentation_engine = DynamicSegmentationEngine(db)
-        await segmentation_engine.execute_segmentation(segment_id, execution_type)
+        await segmentation_engine.execute_segmentation(segment_id, execution_type, refresh_mode)
     except Exception as e:
         logger.error(f"Background segmentation execution failed: {e}")
 
+async def _refresh_due_segments_background(db: Session, chunk_size: int):
+    """Background task to refresh all due segments"""
+    try:
+        segmentation_engine = DynamicSegmentationEngine(db)
+        results = await segmentation_engine.execute_due_segments(chunk_size)
+        logger.info(f"Batch segment refresh finished: {sum(r.success for r in results)}/{len(results)} succeeded")
+    except Exception as e:
+        logger.error(f"Background batch segment refresh failed: {e}")
+
 # Helper functions
 def _generate_dashboard_insights(segments: List, executions: List, avg_conversion: float, avg_quality: float) -> List[str]:
     """Generate insights for segmentation dashboard"""
@@ -1,26 +1,36 @@
 """
 Lead Scoring and Qualification API Endpoints
 """
-from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from pydantic import BaseModel, Field
 from typing import Dict, List, Any, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
+import logging
+import numpy as np
 
-from ...core.database import get_db
+from ...core.database import get_db, get_db_context
 from ...core.security import get_current_user, require_permission
 from ...leads.scoring_engine import LeadScoringEngine, ScoreType, LeadStatus, LeadQuality
+from ...leads.model_registry import scoring_model_registry
+from ...leads.rescoring_queue import rescoring_queue
+from ...leads.leaderboard import lead_leaderboard
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class ScoreCustomerRequest(BaseModel):
     customer_id: str
     score_type: Optional[ScoreType] = None
+    force_refresh: bool = False  # Recalculate even if the stored score is still fresh
 
 class QualifyLeadRequest(BaseModel):
     customer_id: str
     threshold: Optional[float] = 70.0
 
+class BatchScoreRequest(BaseModel):
+    customer_ids: List[str] = Field(..., min_items=1, max_items=10000)
+
 class ScoreResponse(BaseModel):
     success: bool
     customer_id: str
@@ -36,10 +46,13 @@ async def calculate_customer_score(
     """Calculate lead score for a customer"""
     try:
         scoring_engine = LeadScoringEngine(db)
-        score_result = scoring_engine.calculate_lead_score(
-            customer_id=request.customer_id,
-            score_type=request.score_type
-        )
+        if request.force_refresh:
+            score_result = scoring_engine.calculate_lead_score(
+                customer_id=request.customer_id,
+                score_type=request.score_type
+            )
+        else:
+            score_result = scoring_engine.get_lead_score(request.customer_id)
         
         return ScoreResponse(
             success=True,
@@ -86,6 +99,56 @@ async def get_lead_insights(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get lead insights: {str(e)}")
 
+@router.post("/batch/score")
+async def calculate_batch_scores(
+    request: BatchScoreRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Calculate lead scores for many customers with the vectorized batch pipeline"""
+    try:
+        scoring_engine = LeadScoringEngine(db)
+        scores = scoring_engine.calculate_lead_scores_batch(request.customer_ids)
+        
+        return {
+            "success": True,
+            "scored_customers": len(scores),
+            "model_version": scoring_engine.model_version,
+            "scores": scores.to_dict(orient="records")
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to calculate batch scores: {str(e)}")
+
+@router.post("/batch/rescore-all")
+async def rescore_all_customers(
+    background_tasks: BackgroundTasks,
+    block_size: int = Query(2000, ge=100, le=20000),
+    current_user: dict = Depends(get_current_user)
+):
+    """Rescore the entire customer base in the background (nightly job)"""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    background_tasks.add_task(_rescore_all_background, block_size)
+    return {
+        "success": True,
+        "message": "Full customer rescoring started",
+        "block_size": block_size
+    }
+
+@router.get("/rescoring/metrics")
+async def get_rescoring_metrics(
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Rescoring queue depth, lag and batch throughput"""
+    try:
+        return rescoring_queue.get_metrics(db)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get rescoring metrics: {str(e)}")
+
 @router.get("/segment/{segment_id}/analysis")
 async def get_segment_scoring_analysis(
     segment_id: int,
@@ -179,51 +242,91 @@ async def get_scoring_dashboard(
 
 @router.get("/leaderboard")
 async def get_lead_leaderboard(
-    limit: int = Query(50, le=500),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0, le=10000),
     score_threshold: float = Query(0, ge=0, le=100),
+    segment_id: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     current_user: dict = Depends(require_permission("view_analytics")),
     db: Session = Depends(get_db)
 ):
     """Get top leads leaderboard by score"""
     try:
-        from ...leads.scoring_engine import LeadScore
-        from ...core.database import Customer
-        
-        # Get recent high-scoring leads
-        top_leads = db.query(LeadScore, Customer).join(
-            Customer, LeadScore.customer_id == Customer.customer_id
-        ).filter(
-            LeadScore.score_type == ScoreType.COMPOSITE.value,
-            LeadScore.score_value >= score_threshold,
-            LeadScore.calculated_at >= datetime.now() - timedelta(days=30)
-        ).order_by(LeadScore.score_value.desc()).limit(limit).all()
-        
-        leaderboard = []
-        for lead_score, customer in top_leads:
-            leaderboard.append({
-                "rank": len(leaderboard) + 1,
-                "customer_id": customer.customer_id,
-                "score": lead_score.score_value,
-                "score_factors": lead_score.score_factors,
-                "customer_info": {
-                    "age": customer.age,
-                    "gender": customer.gender,
-                    "segment_id": customer.segment_id,
-                    "rating_id": customer.rating_id
-                },
-                "calculated_at": lead_score.calculated_at.isoformat()
-            })
+        page = lead_leaderboard.get_page(
+            db, limit=limit, offset=offset, score_threshold=score_threshold,
+            segment_id=segment_id, cursor=cursor
+        )
         
         return {
-            "leaderboard": leaderboard,
-            "total_entries": len(leaderboard),
+            **page,
+            "total_entries": len(page["leaderboard"]),
             "score_threshold": score_threshold,
-            "date_range": "Last 30 days"
+            "segment_id": segment_id,
+            "date_range": f"Last {lead_leaderboard.window_days} days"
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get leaderboard: {str(e)}")
 
+@router.get("/leaderboard/rank/{customer_id}")
+async def get_lead_rank(
+    customer_id: str,
+    score_threshold: float = Query(0, ge=0, le=100),
+    segment_id: Optional[str] = None,
+    current_user: dict = Depends(require_permission("view_analytics")),
+    db: Session = Depends(get_db)
+):
+    """Leaderboard rank of a single customer"""
+    rank = lead_leaderboard.get_rank(db, customer_id, score_threshold=score_threshold, segment_id=segment_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail=f"Customer {customer_id} is not on the leaderboard")
+    return rank
+
+@router.post("/leaderboard/rebuild")
+async def rebuild_lead_leaderboard(
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Repopulate the leaderboard from stored composite scores"""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        return {"success": True, "customers": lead_leaderboard.rebuild(db)}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild leaderboard: {str(e)}")
+
+@router.get("/model")
+async def get_scoring_model_info(
+    current_user: dict = Depends(get_current_user)
+):
+    """Active lead scoring model version, load time and memory"""
+    try:
+        scoring_model_registry.get()
+        return scoring_model_registry.info()
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get scoring model info: {str(e)}")
+
+@router.post("/model/reload")
+async def reload_scoring_model(
+    version: Optional[str] = Query(None, regex=r"^\d+(\.\d+)*$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Load a scoring model version and pin it, or the newest (resuming automatic upgrades) when none is given"""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if version and version not in scoring_model_registry.available_versions():
+        raise HTTPException(status_code=404, detail=f"Scoring model version {version} not found")
+    try:
+        model = scoring_model_registry.reload(version)
+        return {"success": True, "model": model.to_dict()}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to reload scoring model: {str(e)}")
+
 @router.get("/analytics/scoring-performance")
 async def get_scoring_performance_analytics(
     time_range: str = Query("30d", regex="^(7d|30d|90d|1y)$"),
@@ -310,6 +413,15 @@ async def get_scoring_performance_analytics(
         raise HTTPException(status_code=500, detail=f"Failed to get performance analytics: {str(e)}")
 
 # Helper functions
+def _rescore_all_background(block_size: int):
+    """Background task to rescore every customer"""
+    try:
+        with get_db_context() as db:
+            summary = LeadScoringEngine(db).rescore_all_customers(block_size)
+        logger.info(f"Nightly lead rescoring finished: {summary}")
+    except Exception as e:
+        logger.error(f"Background lead rescoring failed: {e}")
+
 def _calculate_scoring_trends(db: Session) -> Dict[str, Any]:
     """Calculate scoring trends over time"""
     try:
@@ -9,6 +9,8 @@ from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.exception_handlers import http_exception_handler
 from contextlib import asynccontextmanager
+import asyncio
+import importlib
 import logging
 import time
 import json
@@ -27,7 +29,10 @@ sys.path.insert(0, str(backend_dir))
 
 # Core imports - WORKING
 from core.config import settings
-from core.database import init_database, get_db, Customer, Campaign, Segment
+from core.database import init_database, get_db, dispose_engines, engine, async_engine, SessionLocal, Customer, Campaign, Segment
+from core.engine_registry import EngineRegistry
+from core.cache import cache
+from core.query_profiler import query_profiler, QueryProfilingMiddleware
 from core.security import get_current_user, create_access_token, verify_password
 
 # Import auth separately
@@ -51,33 +56,6 @@ try:
 except ImportError as e:
     new_endpoints_available = False
 
-# AI Engines - NEW from today
-from ai_engine.adaptive_clustering import AdaptiveClustering
-from ai_engine.hyper_personalization import HyperPersonalizationEngine
-from ai_engine.insight_generator import IntelligentInsightGenerator
-from ai_engine.campaign_intelligence import CampaignIntelligenceEngine
-from ai_engine.conversational_ai import ConversationalCRMAssistant
-from ai_engine.generative_analytics import GenerativeAnalyticsEngine
-from ai_engine.local_llm_segmentation import LocalLLMSegmentation
-from ai_engine.campaign_advisor import CampaignAdvisor
-
-# Analytics Engines - NEW from today
-from analytics.predictive_engine import PredictiveAnalyticsEngine
-from analytics.journey_engine import JourneyAnalyticsEngine
-from analytics.network_engine import NetworkAnalyticsEngine
-from analytics.financial_engine import FinancialAnalyticsEngine
-from analytics.behavioral_engine import BehavioralAnalyticsEngine
-
-# Enterprise Features - NEW from today
-from cdp.unified_profile import CustomerDataPlatform
-from experiments.ab_testing import ABTestingFramework
-from revenue.attribution_engine import RevenueAttributionEngine
-from notifications.alert_engine import NotificationEngine
-from segmentation.dynamic_engine import DynamicSegmentationEngine
-from webhooks.webhook_engine import WebhookEngine
-from reporting.chart_engine import ChartEngine
-from monitoring.realtime_engine import RealTimeMonitoringEngine
-
 # Configure logging
 logging.basicConfig(
     level=getattr(logging, settings.LOG_LEVEL),
@@ -85,30 +63,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize engines as global instances - NEW from today
-clustering_engine = None
-personalization_engine = None
-insight_engine = None
-campaign_intel = None
-predictive_engine = None
-journey_engine = None
-network_engine = None
-financial_engine = None
-behavioral_engine = None
-cdp_engine = None
-ab_testing = None
-attribution_engine = None
-notification_engine = None
-segmentation_engine = None
-webhook_engine = None
-chart_engine = None
-monitoring_engine = None
+# Engines are imported and constructed on first use - see core/engine_registry.py.
+# Tables of models defined in an engine module are created once it is imported.
+engine_registry = EngineRegistry(session_factory=SessionLocal, on_import=init_database)
+
+# AI Engines
+engine_registry.register("clustering", "ai_engine.adaptive_clustering:AdaptiveClustering", needs_db=False)
+engine_registry.register("personalization", "ai_engine.hyper_personalization:HyperPersonalizationEngine", needs_db=False)
+engine_registry.register("insights", "ai_engine.insight_generator:IntelligentInsightGenerator", needs_db=False)
+engine_registry.register("campaign_intelligence", "ai_engine.campaign_intelligence:CampaignIntelligenceEngine", needs_db=False)
+engine_registry.register("conversational_ai", "ai_engine.conversational_ai:ConversationalCRMAssistant", needs_db=False)
+engine_registry.register("generative_analytics", "ai_engine.generative_analytics:GenerativeAnalyticsEngine", needs_db=False)
+engine_registry.register("llm_segmentation", "ai_engine.local_llm_segmentation:LocalLLMSegmentation", needs_db=False)
+engine_registry.register("campaign_advisor", "ai_engine.campaign_advisor:CampaignAdvisor", needs_db=False)
+engine_registry.register("computer_vision", "camera_system.cv_models:CVModelManager", needs_db=False)
+
+# Analytics Engines
+engine_registry.register("predictive_analytics", "analytics.predictive_engine:PredictiveAnalyticsEngine")
+engine_registry.register("journey_analytics", "analytics.journey_engine:JourneyAnalyticsEngine")
+engine_registry.register("network_analysis", "analytics.network_engine:NetworkAnalyticsEngine")
+engine_registry.register("financial_analytics", "analytics.financial_engine:FinancialAnalyticsEngine")
+engine_registry.register("behavioral_analytics", "analytics.behavioral_engine:BehavioralAnalyticsEngine")
+
+# Enterprise Features
+engine_registry.register("cdp", "cdp.unified_profile:CustomerDataPlatform")
+engine_registry.register("ab_testing", "experiments.ab_testing:ABTestingFramework")
+engine_registry.register("attribution", "revenue.attribution_engine:RevenueAttributionEngine")
+engine_registry.register("notifications", "notifications.alert_engine:NotificationEngine")
+engine_registry.register("segmentation", "segmentation.dynamic_engine:DynamicSegmentationEngine")
+engine_registry.register("webhooks", "webhooks.webhook_engine:WebhookEngine")
+engine_registry.register("charts", "reporting.chart_engine:ChartEngine")
+engine_registry.register("monitoring", "monitoring.realtime_engine:RealTimeMonitoringEngine")
+
+def preload_module(name: str):
+    """Import a module on a worker thread so the event loop never pays for it"""
+    def _import():
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"⚠️ Preloading {name} failed: {e}")
+    asyncio.get_running_loop().run_in_executor(None, _import)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager with full engine initialization"""
     logger.info("🚀 SBM AI CRM Backend Enterprise Edition starting up...")
     
+    # Tables of the background workers come from their lightweight model modules;
+    # the engines they run (sklearn/scipy) are imported off the event loop below
+    import leads.models, leads.rescoring_queue  # noqa: F401
+    import automation.models, automation.workflow_timers, automation.execution_scheduler  # noqa: F401
+    import cdp.activity_aggregates  # noqa: F401
+    
     # Initialize database - ORIGINAL
     try:
         init_database()
@@ -124,56 +130,82 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"⚠️  Database initialization issue: {e}")
     
-    # Initialize all engines - NEW from today
-    global clustering_engine, personalization_engine, insight_engine, campaign_intel
-    global predictive_engine, journey_engine, network_engine, financial_engine
-    global behavioral_engine, cdp_engine, ab_testing, attribution_engine
-    global notification_engine, segmentation_engine, webhook_engine, chart_engine
-    global monitoring_engine
+    # Warm up configured engines; everything else loads on first use.
+    # Real-time monitoring runs in the background, so it always starts with the app.
+    warmup = None if "all" in settings.ENGINE_WARMUP else ["monitoring", *settings.ENGINE_WARMUP]
+    report = await asyncio.get_running_loop().run_in_executor(None, engine_registry.warm_up, warmup)
+    engine_registry.log_report(report)
     
-    try:
-        from core.database import SessionLocal
-        db_session = SessionLocal()
-        
-        # Initialize AI Engines
-        clustering_engine = AdaptiveClustering(db_session)
-        personalization_engine = HyperPersonalizationEngine(db_session)
-        insight_engine = IntelligentInsightGenerator(db_session)
-        campaign_intel = CampaignIntelligenceEngine()
-        
-        # Initialize Analytics Engines
-        predictive_engine = PredictiveAnalyticsEngine(db_session)
-        journey_engine = JourneyAnalyticsEngine(db_session)
-        network_engine = NetworkAnalyticsEngine(db_session)
-        financial_engine = FinancialAnalyticsEngine(db_session)
-        behavioral_engine = BehavioralAnalyticsEngine()
-        
-        # Initialize Enterprise Features
-        cdp_engine = CustomerDataPlatform(db_session)
-        ab_testing = ABTestingFramework(db_session)
-        attribution_engine = RevenueAttributionEngine(db_session)
-        notification_engine = NotificationEngine(db_session)
-        segmentation_engine = DynamicSegmentationEngine(db_session)
-        webhook_engine = WebhookEngine(db_session)
-        chart_engine = ChartEngine(db_session)
-        monitoring_engine = RealTimeMonitoringEngine(db_session)
-        
-        # Start monitoring
-        await monitoring_engine.start_monitoring()
-        
-        logger.info("✅ All 22 engines initialized successfully!")
+    monitoring_task = None
+    monitoring_engine = await engine_registry.aget("monitoring")
+    if monitoring_engine:
+        # start_monitoring runs until stopped, so it must not block start-up
+        monitoring_task = asyncio.create_task(monitoring_engine.start_monitoring())
         logger.info("🎉 SBM AI CRM System started successfully")
-        
-    except Exception as e:
-        logger.error(f"❌ Engine initialization failed: {e}")
-        logger.warning("⚠️  Running in limited mode")
+    else:
+        logger.warning("⚠️  Real-time monitoring unavailable, running in limited mode")
+    
+    # Incremental lead rescoring of dirty and expired scores
+    rescoring_task = None
+    if settings.LEAD_RESCORE_WORKER_ENABLED:
+        from leads.rescoring_queue import rescoring_queue
+        preload_module("leads.scoring_engine")
+        rescoring_task = asyncio.create_task(rescoring_queue.run_worker())
+    
+    # Durable wake-ups of delayed workflow steps
+    timer_task = None
+    if settings.WORKFLOW_TIMER_WORKER_ENABLED:
+        from automation.workflow_timers import workflow_timers
+        preload_module("automation.workflow_engine")
+        timer_task = asyncio.create_task(workflow_timers.run_worker())
+    
+    # Bounded worker pool draining the persisted workflow run queue
+    if settings.WORKFLOW_SCHEDULER_ENABLED:
+        from automation.execution_scheduler import execution_scheduler
+        preload_module("automation.workflow_engine")
+        await execution_scheduler.start()
+    
+    # Pruning of CDP activity aggregates that left the rolling window
+    from cdp.activity_aggregates import activity_aggregator
+    prune_task = asyncio.create_task(activity_aggregator.run_pruner(settings.CDP_ACTIVITY_PRUNE_INTERVAL_SECONDS))
+    
+    # Segment size previews are served exactly until this sample is drawn
+    from segmentation.dynamic_engine import warm_preview_sample
+    warm_preview_sample()
+    
+    # Write-behind CDP event ingestion
+    if settings.CDP_EVENT_BUFFER_ENABLED:
+        from cdp.event_buffer import event_buffer
+        event_buffer.start()
+    
+    # Write-behind persistence of fast-path experiment assignments
+    from experiments.assignment import variant_assigner
+    variant_assigner.buffer.start()
     
     yield
     
     # Shutdown - ORIGINAL + NEW
     logger.info("🛑 SBM AI CRM Backend shutting down...")
-    if monitoring_engine:
-        await monitoring_engine.stop_monitoring()
+    if engine_registry.is_loaded("monitoring"):
+        await engine_registry.get("monitoring").stop_monitoring()
+        if monitoring_task is not None:
+            monitoring_task.cancel()
+    if rescoring_task is not None:
+        rescoring_queue.stop()
+        rescoring_task.cancel()
+    if timer_task is not None:
+        workflow_timers.stop()
+        timer_task.cancel()
+    if settings.WORKFLOW_SCHEDULER_ENABLED:
+        await execution_scheduler.stop()
+    activity_aggregator.stop()
+    prune_task.cancel()
+    if settings.CDP_EVENT_BUFFER_ENABLED:
+        # Drain buffered events before the database pool goes away
+        await asyncio.get_running_loop().run_in_executor(None, event_buffer.stop)
+    await asyncio.get_running_loop().run_in_executor(None, variant_assigner.buffer.stop)
+    engine_registry.close()
+    await dispose_engines()
     logger.info("✅ Shutdown completed")
 
 # Create FastAPI application - ORIGINAL structure with NEW features
@@ -279,11 +311,16 @@ app.add_middleware(
         "cache-control",
         "pragma"
     ],
-    expose_headers=["X-Process-Time", "X-New-Access-Token"]
+    expose_headers=["X-Process-Time", "X-New-Access-Token", "X-DB-Query-Count", "X-DB-Time", "X-DB-N-Plus-One"]
 )
 
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+# Per-request query counting and N+1 detection
+if settings.QUERY_PROFILING_ENABLED:
+    query_profiler.instrument(engine, async_engine)
+    app.add_middleware(QueryProfilingMiddleware, profiler=query_profiler)
+
 # Mount static files for frontend
 static_dir = Path(__file__).parent.parent / "static"
 if static_dir.exists():
@@ -472,31 +509,13 @@ async def health_check():
     except Exception as e:
         db_status = f"unhealthy: {str(e)}"
     
-    # Check engine status - NEW
-    engine_status = {
-        "clustering": clustering_engine is not None,
-        "personalization": personalization_engine is not None,
-        "insights": insight_engine is not None,
-        "campaign_intelligence": campaign_intel is not None,
-        "predictive_analytics": predictive_engine is not None,
-        "journey_analytics": journey_engine is not None,
-        "network_analysis": network_engine is not None,
-        "financial_analytics": financial_engine is not None,
-        "behavioral_analytics": behavioral_engine is not None,
-        "cdp": cdp_engine is not None,
-        "ab_testing": ab_testing is not None,
-        "attribution": attribution_engine is not None,
-        "notifications": notification_engine is not None,
-        "segmentation": segmentation_engine is not None,
-        "webhooks": webhook_engine is not None,
-        "charts": chart_engine is not None,
-        "monitoring": monitoring_engine is not None
-    }
+    # Check engine status - engines that have not been needed yet count as operational
+    engine_status = engine_registry.status()
     
-    operational_count = sum(engine_status.values())
+    operational_count = sum(1 for state in engine_status.values() if state != "failed")
     
     health_status = {
-        "status": "healthy" if db_status == "healthy" and operational_count > 15 else "degraded",
+        "status": "healthy" if db_status == "healthy" and operational_count == len(engine_status) else "degraded",
         "timestamp": datetime.now().isoformat(),
         "version": "2.0.0",
         "services": {
@@ -505,7 +524,7 @@ async def health_check():
             "cache": "healthy",
             "api": "healthy"
         },
-        "engines_operational": f"{operational_count}/17",
+        "engines_operational": f"{operational_count}/{len(engine_status)}",
         "engine_status": engine_status,
         "uptime": "operational",
         "last_check": datetime.now().isoformat()
@@ -531,6 +550,7 @@ async def system_status(current_user: dict = Depends(get_current_user)):
     Get comprehensive system status and performance metrics.
     """
     try:
+        from cdp.event_buffer import event_buffer
         db = next(get_db())
         
         # System metrics - ORIGINAL
@@ -541,6 +561,7 @@ async def system_status(current_user: dict = Depends(get_current_user)):
         
         # Get live metrics if monitoring engine is available - NEW
         live_data = None
+        monitoring_engine = engine_registry.get("monitoring") if engine_registry.is_loaded("monitoring") else None
         if monitoring_engine:
             live_data = await monitoring_engine.get_live_dashboard_data()
         
@@ -553,9 +574,11 @@ async def system_status(current_user: dict = Depends(get_current_user)):
                 "database": "connected",
                 "ai_engine": "operational",
                 "camera_system": "operational", 
-                "cache": "operational",
+                "cache": "operational" if cache.redis_available else "local_only",
                 "analytics": "operational"
             },
+            "cache_metrics": cache.get_stats(),
+            "event_buffer_metrics": event_buffer.get_metrics() if settings.CDP_EVENT_BUFFER_ENABLED else None,
             "data_metrics": {
                 "total_customers": total_customers,
                 "total_campaigns": total_campaigns,
@@ -604,6 +627,55 @@ async def system_status(current_user: dict = Depends(get_current_user)):
             }
         )
 
+# Engine registry endpoint
+@app.get("/api/system/engines", tags=["System"])
+async def engine_report(current_user: dict = Depends(get_current_user)):
+    """Which engines are loaded, with their import time and memory cost, and why failed ones failed"""
+    return {
+        **engine_registry.report(),
+        "warmup": settings.ENGINE_WARMUP,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Query profiling endpoint
+@app.get("/api/system/query-stats", tags=["System"])
+async def query_stats(
+    limit: int = 20,
+    sort_by: str = "max_queries",
+    current_user: dict = Depends(get_current_user)
+):
+    """Routes issuing the most database queries per request, with suspected N+1 statements"""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        offenders = query_profiler.worst_offenders(limit=limit, sort_by=sort_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "enabled": settings.QUERY_PROFILING_ENABLED,
+        "n_plus_one_threshold": query_profiler.n_plus_one_threshold,
+        "routes": offenders,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Experiment aggregate maintenance
+@app.post("/api/system/experiments/{experiment_id}/rebuild-stats", tags=["System"])
+async def rebuild_experiment_stats(
+    experiment_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Recompute an experiment's running variant statistics from its raw assignments and conversions"""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        from core.database import run_with_db
+        from experiments.variant_stats import variant_stats
+        rows = await run_with_db(variant_stats.rebuild, experiment_id)
+        return {"success": True, "experiment_id": experiment_id, "rows": len(rows)}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild experiment statistics: {str(e)}")
+
 # API version endpoint - ORIGINAL
 @app.get("/api/version", tags=["System"])
 async def api_version():
@@ -755,6 +827,7 @@ async def analyze_campaign_performance(
 ):
     """Analyze campaign performance with AI intelligence"""
     try:
+        campaign_intel = await engine_registry.aget("campaign_intelligence")
         if not campaign_intel:
             raise HTTPException(status_code=503, detail="Campaign intelligence not available")
         
@@ -804,6 +877,7 @@ async def optimize_ongoing_campaign(
 ):
     """Get real-time optimization recommendations for active campaign"""
     try:
+        campaign_intel = await engine_registry.aget("campaign_intelligence")
         if not campaign_intel:
             raise HTTPException(status_code=503, detail="Campaign intelligence not available")
         
@@ -833,6 +907,7 @@ async def generate_campaign_strategy(
 ):
     """Generate AI-powered campaign strategy"""
     try:
+        campaign_intel = await engine_registry.aget("campaign_intelligence")
         if not campaign_intel:
             raise HTTPException(status_code=503, detail="Campaign intelligence not available")
         
@@ -859,6 +934,7 @@ async def generate_campaign_strategy(
 async def create_dynamic_segments(current_user: dict = Depends(get_current_user)):
     """Create dynamic customer segments using adaptive clustering"""
     try:
+        clustering_engine = await engine_registry.aget("clustering")
         if not clustering_engine:
             raise HTTPException(status_code=503, detail="Clustering engine not available")
         
@@ -883,6 +959,7 @@ async def analyze_customer_cluster(
 ):
     """Analyze which cluster a specific customer belongs to"""
     try:
+        clustering_engine = await engine_registry.aget("clustering")
         if not clustering_engine:
             raise HTTPException(status_code=503, detail="Clustering engine not available")
         
@@ -915,6 +992,7 @@ async def analyze_customer_cluster(
 async def get_segment_insights(current_user: dict = Depends(get_current_user)):
     """Get insights about all customer segments"""
     try:
+        clustering_engine = await engine_registry.aget("clustering")
         if not clustering_engine:
             raise HTTPException(status_code=503, detail="Clustering engine not available")
         
@@ -1026,6 +1104,7 @@ async def websocket_live_feed(websocket):
     try:
         await websocket.accept()
         
+        monitoring_engine = await engine_registry.aget("monitoring")
         if monitoring_engine:
             await monitoring_engine.subscribe_to_updates(websocket)
             
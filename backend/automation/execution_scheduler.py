@@ -0,0 +1,388 @@
+"""
+Workflow Execution Scheduler - persisted run queue, bounded workers and per-action limits
+"""
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+from datetime import datetime, timedelta
+from collections import defaultdict
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, select, update, delete, func, or_
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import Base, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+class WorkflowRunQueueEntry(Base):
+    """A workflow execution waiting for (or claimed by) a scheduler worker"""
+    __tablename__ = "workflow_run_queue"
+
+    execution_id = Column(String, primary_key=True)
+    workflow_id = Column(String, index=True)
+    priority = Column(Integer, default=0, index=True)  # Higher runs first
+    step_index = Column(Integer, default=0)
+    delay_elapsed = Column(Boolean, default=False)  # Resuming a delayed step
+    enqueued_at = Column(DateTime, default=datetime.now, index=True)
+    claimed_by = Column(String)
+    claimed_at = Column(DateTime)
+    attempts = Column(Integer, default=0)  # Claims of this run so far
+    available_at = Column(DateTime, index=True)  # Not claimed again before this (retry backoff)
+
+def workflow_priority(trigger_config: Optional[Dict[str, Any]]) -> int:
+    """Run-queue priority of a workflow's executions (trigger ``priority``, higher first)"""
+    try:
+        return int((trigger_config or {}).get("priority", 0))
+    except (TypeError, ValueError):
+        return 0
+
+class ActionLimiter:
+    """Per-ActionType concurrency and throughput caps for workflow step handlers
+
+    ``concurrency`` bounds how many steps of a type run at once and ``rates``
+    how many may start per second (token bucket, bursts up to one second's
+    worth). A batched step is split into pieces of at most ``batch_limit``
+    executions; each piece holds one concurrency slot and takes a token per
+    execution. Types without an entry are unlimited. Limits are per process.
+    """
+
+    def __init__(self, concurrency: Dict[str, int] = None, rates: Dict[str, float] = None):
+        self.concurrency = dict(concurrency or {})
+        self.rates = dict(rates or {})
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._tokens: Dict[str, Tuple[float, float]] = {}  # action type -> (tokens, last refill)
+        self.in_flight: Dict[str, int] = defaultdict(int)
+        self.started: Dict[str, int] = defaultdict(int)
+        self.throttled_seconds: Dict[str, float] = defaultdict(float)
+
+    async def run(self, action_type: str, handler, count: int = 1):
+        """Await handler() within the action type's limits; count is the number of executions it covers"""
+        semaphore = self._semaphore(action_type)
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            await self._take_tokens(action_type, count)
+            self.in_flight[action_type] += count
+            self.started[action_type] += count
+            try:
+                return await handler()
+            finally:
+                self.in_flight[action_type] -= count
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def batch_limit(self, action_type: str) -> Optional[int]:
+        """Most executions one handler call may cover: the token bucket's capacity"""
+        rate = self.rates.get(action_type)
+        return max(1, int(rate)) if rate else None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            action_type: {
+                "in_flight": self.in_flight.get(action_type, 0),
+                "started": self.started.get(action_type, 0),
+                "throttled_seconds": round(self.throttled_seconds.get(action_type, 0.0), 1),
+                "concurrency_limit": self.concurrency.get(action_type),
+                "rate_limit_per_second": self.rates.get(action_type)
+            }
+            for action_type in sorted(set(self.concurrency) | set(self.rates) | set(self.started))
+        }
+
+    def _semaphore(self, action_type: str) -> Optional[asyncio.Semaphore]:
+        limit = self.concurrency.get(action_type)
+        if not limit:
+            return None
+        if action_type not in self._semaphores:
+            self._semaphores[action_type] = asyncio.Semaphore(limit)
+        return self._semaphores[action_type]
+
+    async def _take_tokens(self, action_type: str, count: int):
+        rate = self.rates.get(action_type)
+        if not rate:
+            return
+        capacity = max(1.0, rate)
+        needed = float(count)
+        while True:
+            now = time.monotonic()
+            tokens, refilled_at = self._tokens.get(action_type, (capacity, now))
+            tokens = min(capacity, tokens + (now - refilled_at) * rate)
+            if tokens >= needed:
+                self._tokens[action_type] = (tokens - needed, now)
+                return
+            # Take what the bucket holds and wait for the rest (a batch may exceed its capacity)
+            needed -= tokens
+            self._tokens[action_type] = (0.0, now)
+            wait = min(needed, capacity) / rate
+            self.throttled_seconds[action_type] += wait
+            await asyncio.sleep(wait)
+
+class ExecutionScheduler:
+    """Runs queued workflow executions on a bounded pool of async workers
+
+    Triggers insert a run-queue row in the same transaction as the
+    execution. A dispatcher claims rows by priority then age (SKIP LOCKED
+    on PostgreSQL) only while the local backlog is short, groups them by
+    workflow, step and resume flag into batches of up to ``batch_size``,
+    and ``workers`` coroutines execute the batches, each with its own
+    session used from the database thread pool; rows are deleted when their run finishes or checkpoints on a
+    delay. Claims older than
+    ``claim_timeout`` are taken over again, so a crashed run is retried
+    from the execution's last checkpointed step. A run that raises is
+    retried after ``retry_backoff`` seconds, doubling per attempt; after
+    ``max_attempts`` claims its execution is marked failed and dequeued.
+    """
+
+    def __init__(self, workers: int = 20, batch_size: int = 500, poll_interval: float = 0.5,
+                 claim_timeout: float = 600.0, max_attempts: int = 5, retry_backoff: float = 30.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.worker_id = str(uuid.uuid4())
+        self.running = False
+        self.busy = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._order = itertools.count()
+        self.metrics = {
+            "enqueued": 0,
+            "claimed": 0,
+            "batches": 0,
+            "completed": 0,
+            "errors": 0,
+            "retried": 0,
+            "failed": 0,
+            "last_queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0
+        }
+
+    def enqueue(self, db: Session, execution_ids: Iterable[str], workflow_id: str, priority: int = 0,
+                step_index: int = 0, delay_elapsed: bool = False) -> int:
+        """Queue executions of one workflow to run; joins the caller's transaction"""
+        now = datetime.now()
+        rows = [
+            {"execution_id": execution_id, "workflow_id": workflow_id, "priority": priority,
+             "step_index": step_index, "delay_elapsed": delay_elapsed, "enqueued_at": now,
+             "claimed_by": None, "claimed_at": None, "attempts": 0, "available_at": None}
+            for execution_id in dict.fromkeys(execution_ids)
+        ]
+        bulk_upsert(db, WorkflowRunQueueEntry, rows, ["execution_id"],
+                    ["priority", "step_index", "delay_elapsed", "enqueued_at", "claimed_by", "claimed_at",
+                     "attempts", "available_at"])
+        self.metrics["enqueued"] += len(rows)
+        return len(rows)
+
+    def claim(self, db: Session, limit: int) -> List[Dict[str, Any]]:
+        """Claim up to limit queued runs, highest priority first"""
+        now = datetime.now()
+        statement = select(
+            WorkflowRunQueueEntry.execution_id, WorkflowRunQueueEntry.workflow_id, WorkflowRunQueueEntry.priority,
+            WorkflowRunQueueEntry.step_index, WorkflowRunQueueEntry.delay_elapsed, WorkflowRunQueueEntry.enqueued_at,
+            WorkflowRunQueueEntry.attempts
+        ).where(
+            or_(WorkflowRunQueueEntry.claimed_at.is_(None),
+                WorkflowRunQueueEntry.claimed_at < now - timedelta(seconds=self.claim_timeout)),
+            or_(WorkflowRunQueueEntry.available_at.is_(None), WorkflowRunQueueEntry.available_at <= now)
+        ).order_by(WorkflowRunQueueEntry.priority.desc(), WorkflowRunQueueEntry.enqueued_at).limit(limit)
+        if db.get_bind().dialect.name == "postgresql":
+            statement = statement.with_for_update(skip_locked=True)
+
+        runs = [dict(row._mapping) for row in db.execute(statement)]
+        # Runs whose last claim timed out after using every attempt (e.g. they crash the worker)
+        exhausted = [run["execution_id"] for run in runs if (run["attempts"] or 0) >= self.max_attempts]
+        if exhausted:
+            self._fail(db, exhausted, f"Gave up after {self.max_attempts} attempts")
+            runs = [run for run in runs if (run["attempts"] or 0) < self.max_attempts]
+        if runs:
+            db.execute(update(WorkflowRunQueueEntry).where(
+                WorkflowRunQueueEntry.execution_id.in_([run["execution_id"] for run in runs])
+            ).values(
+                claimed_by=self.worker_id, claimed_at=now,
+                attempts=func.coalesce(WorkflowRunQueueEntry.attempts, 0) + 1
+            ))
+        db.commit()
+        return runs
+
+    def retry(self, db: Session, execution_ids: List[str], claimed_at: datetime, error: str):
+        """Release failed runs for a later attempt with exponential backoff, failing those out of attempts"""
+        now = datetime.now()
+        runs = db.execute(select(WorkflowRunQueueEntry.execution_id, WorkflowRunQueueEntry.attempts).where(
+            WorkflowRunQueueEntry.execution_id.in_(execution_ids),
+            WorkflowRunQueueEntry.claimed_by == self.worker_id,
+            WorkflowRunQueueEntry.enqueued_at <= claimed_at
+        )).all()
+        exhausted = [execution_id for execution_id, attempts in runs if (attempts or 0) >= self.max_attempts]
+        if exhausted:
+            self._fail(db, exhausted, error)
+        by_attempts: Dict[int, List[str]] = defaultdict(list)
+        for execution_id, attempts in runs:
+            if (attempts or 0) < self.max_attempts:
+                by_attempts[attempts or 1].append(execution_id)
+        for attempts, retry_ids in by_attempts.items():
+            db.execute(update(WorkflowRunQueueEntry).where(
+                WorkflowRunQueueEntry.execution_id.in_(retry_ids)
+            ).values(
+                claimed_by=None, claimed_at=None,
+                available_at=now + timedelta(seconds=self.retry_backoff * 2 ** (attempts - 1))
+            ))
+        db.commit()
+        self.metrics["retried"] += len(runs) - len(exhausted)
+
+    def complete(self, db: Session, execution_ids: List[str], claimed_at: datetime):
+        """Drop finished runs unless they were re-enqueued meanwhile"""
+        db.execute(delete(WorkflowRunQueueEntry).where(
+            WorkflowRunQueueEntry.execution_id.in_(execution_ids),
+            WorkflowRunQueueEntry.claimed_by == self.worker_id,
+            WorkflowRunQueueEntry.enqueued_at <= claimed_at
+        ))
+        db.commit()
+
+    async def start(self):
+        """Start the dispatcher and worker coroutines on the running loop"""
+        if self.running:
+            return
+        self.running = True
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._dispatch())] + [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+        logger.info(f"Workflow execution scheduler started ({self.workers} workers)")
+
+    async def stop(self):
+        """Stop claiming, let workers finish their current run and release unstarted claims"""
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is not None and not self._queue.empty():
+            from core.database import run_with_db
+            unstarted = []
+            while not self._queue.empty():
+                unstarted.extend(run["execution_id"] for run in self._queue.get_nowait()[-1])
+            await run_with_db(self._release, unstarted)
+
+    def get_metrics(self, db: Session) -> Dict[str, Any]:
+        """Run-queue depth, worker utilization and per-action limits"""
+        depth, oldest = db.execute(
+            select(func.count(WorkflowRunQueueEntry.execution_id), func.min(WorkflowRunQueueEntry.enqueued_at))
+        ).one()
+        claimed = db.scalar(select(func.count(WorkflowRunQueueEntry.execution_id)).where(
+            WorkflowRunQueueEntry.claimed_at.isnot(None)
+        ))
+        return {
+            **self.metrics,
+            "queue_depth": depth,
+            "claimed_runs": claimed,
+            "oldest_enqueued_at": oldest.isoformat() if oldest else None,
+            "local_backlog": self._queue.qsize() if self._queue is not None else 0,
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "busy_workers": self.busy,
+            "worker_utilization": round(self.busy / self.workers, 3) if self.workers else 0.0,
+            "running": self.running,
+            "actions": action_limiter.get_metrics()
+        }
+
+    async def _dispatch(self):
+        from core.database import run_with_db
+
+        while self.running:
+            try:
+                if self._queue.qsize() >= self.workers * 2:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                runs = await run_with_db(self.claim, self.batch_size)
+                claimed_at = datetime.now()
+                batches: Dict[tuple, List[Dict[str, Any]]] = {}
+                for run in runs:
+                    run["claimed_at"] = claimed_at
+                    batches.setdefault((run["workflow_id"], run["step_index"], run["delay_elapsed"]), []).append(run)
+                for batch in batches.values():
+                    self._queue.put_nowait((-batch[0]["priority"], next(self._order), batch))
+                    self.metrics["batches"] += 1
+                self.metrics["claimed"] += len(runs)
+                if len(runs) == self.batch_size:
+                    await asyncio.sleep(0)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Workflow run dispatch failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _work(self):
+        from core.database import SessionLocal, run_with_db
+        from .workflow_engine import WorkflowEngine
+
+        while True:
+            _, _, batch = await self._queue.get()
+            self.busy += 1
+            run = batch[0]
+            execution_ids = [queued["execution_id"] for queued in batch]
+            wait = (datetime.now() - min(queued["enqueued_at"] for queued in batch)).total_seconds()
+            self.metrics["last_queue_wait_seconds"] = round(wait, 1)
+            self.metrics["max_queue_wait_seconds"] = max(self.metrics["max_queue_wait_seconds"], round(wait, 1))
+            db = SessionLocal()
+            try:
+                # A single run goes through the batch path too: its database work stays on the thread pool
+                await WorkflowEngine(db).run_queued_batch(
+                    run["workflow_id"], execution_ids, run["step_index"], run["delay_elapsed"]
+                )
+                await run_with_db(self.complete, execution_ids, run["claimed_at"])
+                self.metrics["completed"] += len(batch)
+            except asyncio.CancelledError:
+                raise  # Claim expires and the runs are retried
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Workflow executions {execution_ids[:5]} failed in scheduler: {e}")
+                try:
+                    await run_with_db(self.retry, execution_ids, run["claimed_at"], str(e))
+                except Exception as retry_error:
+                    logger.error(f"Could not reschedule workflow executions {execution_ids[:5]}: {retry_error}")
+            finally:
+                db.close()
+                self.busy -= 1
+                self._queue.task_done()
+
+    def _release(self, db: Session, execution_ids: List[str]):
+        """Return claimed runs that never started, without spending an attempt"""
+        if execution_ids:
+            db.execute(update(WorkflowRunQueueEntry).where(
+                WorkflowRunQueueEntry.execution_id.in_(execution_ids),
+                WorkflowRunQueueEntry.claimed_by == self.worker_id
+            ).values(claimed_by=None, claimed_at=None, attempts=WorkflowRunQueueEntry.attempts - 1))
+            db.commit()
+
+    def _fail(self, db: Session, execution_ids: List[str], error: str):
+        """Mark executions failed and drop their runs; joins the caller's transaction"""
+        from .models import WorkflowExecution
+
+        db.execute(update(WorkflowExecution).where(
+            WorkflowExecution.id.in_(execution_ids),
+            WorkflowExecution.status.in_(("started", "waiting"))
+        ).values(status="failed", error_message=error, completed_at=datetime.now()))
+        db.execute(delete(WorkflowRunQueueEntry).where(WorkflowRunQueueEntry.execution_id.in_(execution_ids)))
+        self.metrics["failed"] += len(execution_ids)
+        logger.error(f"Workflow executions {execution_ids[:5]} failed after {self.max_attempts} attempts: {error}")
+
+action_limiter = ActionLimiter(
+    concurrency=settings.WORKFLOW_ACTION_CONCURRENCY,
+    rates=settings.WORKFLOW_ACTION_RATE_LIMITS
+)
+
+execution_scheduler = ExecutionScheduler(
+    workers=settings.WORKFLOW_WORKERS,
+    batch_size=settings.WORKFLOW_RUN_BATCH_SIZE,
+    poll_interval=settings.WORKFLOW_SCHEDULER_POLL_SECONDS,
+    claim_timeout=settings.WORKFLOW_RUN_CLAIM_TIMEOUT_SECONDS,
+    max_attempts=settings.WORKFLOW_RUN_MAX_ATTEMPTS,
+    retry_backoff=settings.WORKFLOW_RUN_RETRY_BACKOFF_SECONDS
+)
@@ -0,0 +1,103 @@
+"""
+Workflow Models - tables and enums shared by the workflow engine, timers and scheduler
+"""
+from datetime import datetime
+from enum import Enum
+import uuid
+from sqlalchemy import Column, String, Integer, DateTime, JSON, ForeignKey, Text
+from sqlalchemy.orm import relationship
+
+from core.database import Base
+
+class TriggerType(str, Enum):
+    """Types of workflow triggers"""
+    TIME_BASED = "time_based"
+    BEHAVIOR_BASED = "behavior_based"
+    LIFECYCLE_STAGE = "lifecycle_stage"
+    CUSTOM_EVENT = "custom_event"
+    API_TRIGGER = "api_trigger"
+    EMAIL_ENGAGEMENT = "email_engagement"
+    PURCHASE_EVENT = "purchase_event"
+    SCORE_THRESHOLD = "score_threshold"
+
+class ActionType(str, Enum):
+    """Types of workflow actions"""
+    SEND_EMAIL = "send_email"
+    SEND_SMS = "send_sms"
+    SEND_PUSH = "send_push"
+    UPDATE_FIELD = "update_field"
+    ADD_TO_SEGMENT = "add_to_segment"
+    REMOVE_FROM_SEGMENT = "remove_from_segment"
+    WAIT = "wait"
+    WEBHOOK = "webhook"
+    CREATE_TASK = "create_task"
+    ADD_TAG = "add_tag"
+    SCORE_UPDATE = "score_update"
+    BRANCH = "branch"
+
+class WorkflowStatus(str, Enum):
+    """Workflow execution status"""
+    ACTIVE = "active"
+    PAUSED = "paused"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    DRAFT = "draft"
+
+# Database Models
+class Workflow(Base):
+    """Marketing automation workflow"""
+    __tablename__ = "workflows"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    description = Column(Text)
+    status = Column(String, default=WorkflowStatus.DRAFT.value)
+    trigger_config = Column(JSON, nullable=False)
+    workflow_config = Column(JSON, nullable=False)  # Steps and actions
+    target_audience = Column(JSON)  # Segmentation criteria
+    performance_metrics = Column(JSON, default={})
+    created_by = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    
+    # Relationships
+    executions = relationship("WorkflowExecution", back_populates="workflow")
+
+class WorkflowExecution(Base):
+    """Individual workflow execution instances"""
+    __tablename__ = "workflow_executions"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    workflow_id = Column(String, ForeignKey("workflows.id"), index=True)
+    customer_id = Column(String, index=True)
+    status = Column(String, default="started")
+    current_step = Column(Integer, default=0)
+    execution_data = Column(JSON, default={})  # Runtime variables
+    started_at = Column(DateTime, default=datetime.now)
+    completed_at = Column(DateTime)
+    error_message = Column(Text)
+    
+    # Relationships
+    workflow = relationship("Workflow", back_populates="executions")
+    step_logs = relationship("WorkflowStepLog", back_populates="execution")
+
+class WorkflowStepLog(Base):
+    """Log of individual step executions"""
+    __tablename__ = "workflow_step_logs"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    execution_id = Column(String, ForeignKey("workflow_executions.id"), index=True)
+    step_number = Column(Integer)
+    step_type = Column(String)
+    step_name = Column(String)
+    status = Column(String)  # success, failed, skipped
+    executed_at = Column(DateTime, default=datetime.now)
+    execution_time_ms = Column(Integer)
+    input_data = Column(JSON)
+    output_data = Column(JSON)
+    error_message = Column(Text)
+    
+    # Relationships
+    execution = relationship("WorkflowExecution", back_populates="step_logs")
@@ -1,13 +1,14 @@
 """
 Marketing Automation Workflow Engine
 """
-from typing import Dict, List, Any, Optional, Union, Callable
+from typing import Dict, List, Any, Optional, Union, Callable, Tuple
 from datetime import datetime, timedelta
 from enum import Enum
 import json
 import logging
+import time
 import uuid
-from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean, select, insert, update, false
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 import asyncio
@@ -15,102 +16,19 @@ from dataclasses import dataclass
 import traceback
 
 from core.database import Base, get_db
+from core.config import settings
 from journey.lifecycle_manager import TouchpointType, LifecycleStage
+from .workflow_timers import workflow_timers
+from .execution_scheduler import execution_scheduler, action_limiter, workflow_priority
+from .models import TriggerType, ActionType, WorkflowStatus, Workflow, WorkflowExecution, WorkflowStepLog
 
 logger = logging.getLogger(__name__)
 
-class TriggerType(str, Enum):
-    """Types of workflow triggers"""
-    TIME_BASED = "time_based"
-    BEHAVIOR_BASED = "behavior_based"
-    LIFECYCLE_STAGE = "lifecycle_stage"
-    CUSTOM_EVENT = "custom_event"
-    API_TRIGGER = "api_trigger"
-    EMAIL_ENGAGEMENT = "email_engagement"
-    PURCHASE_EVENT = "purchase_event"
-    SCORE_THRESHOLD = "score_threshold"
+# _get_customer_data fields backed by a customers column (target audience is filtered on these in SQL)
+AUDIENCE_COLUMNS = ("customer_id", "email", "age", "gender", "segment_id", "rating_id")
 
-class ActionType(str, Enum):
-    """Types of workflow actions"""
-    SEND_EMAIL = "send_email"
-    SEND_SMS = "send_sms"
-    SEND_PUSH = "send_push"
-    UPDATE_FIELD = "update_field"
-    ADD_TO_SEGMENT = "add_to_segment"
-    REMOVE_FROM_SEGMENT = "remove_from_segment"
-    WAIT = "wait"
-    WEBHOOK = "webhook"
-    CREATE_TASK = "create_task"
-    ADD_TAG = "add_tag"
-    SCORE_UPDATE = "score_update"
-    BRANCH = "branch"
-
-class WorkflowStatus(str, Enum):
-    """Workflow execution status"""
-    ACTIVE = "active"
-    PAUSED = "paused"
-    COMPLETED = "completed"
-    FAILED = "failed"
-    DRAFT = "draft"
-
-# Database Models
-class Workflow(Base):
-    """Marketing automation workflow"""
-    __tablename__ = "workflows"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    description = Column(Text)
-    status = Column(String, default=WorkflowStatus.DRAFT.value)
-    trigger_config = Column(JSON, nullable=False)
-    workflow_config = Column(JSON, nullable=False)  # Steps and actions
-    target_audience = Column(JSON)  # Segmentation criteria
-    performance_metrics = Column(JSON, default={})
-    created_by = Column(String)
-    created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-    started_at = Column(DateTime)
-    completed_at = Column(DateTime)
-    
-    # Relationships
-    executions = relationship("WorkflowExecution", back_populates="workflow")
-
-class WorkflowExecution(Base):
-    """Individual workflow execution instances"""
-    __tablename__ = "workflow_executions"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    workflow_id = Column(String, ForeignKey("workflows.id"), index=True)
-    customer_id = Column(String, index=True)
-    status = Column(String, default="started")
-    current_step = Column(Integer, default=0)
-    execution_data = Column(JSON, default={})  # Runtime variables
-    started_at = Column(DateTime, default=datetime.now)
-    completed_at = Column(DateTime)
-    error_message = Column(Text)
-    
-    # Relationships
-    workflow = relationship("Workflow", back_populates="executions")
-    step_logs = relationship("WorkflowStepLog", back_populates="execution")
-
-class WorkflowStepLog(Base):
-    """Log of individual step executions"""
-    __tablename__ = "workflow_step_logs"
-    
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    execution_id = Column(String, ForeignKey("workflow_executions.id"), index=True)
-    step_number = Column(Integer)
-    step_type = Column(String)
-    step_name = Column(String)
-    status = Column(String)  # success, failed, skipped
-    executed_at = Column(DateTime, default=datetime.now)
-    execution_time_ms = Column(Integer)
-    input_data = Column(JSON)
-    output_data = Column(JSON)
-    error_message = Column(Text)
-    
-    # Relationships
-    execution = relationship("WorkflowExecution", back_populates="step_logs")
+# Executions a batch trigger does not start again for the same customer
+ACTIVE_EXECUTION_STATUSES = ("started", "waiting")
 
 @dataclass
 class WorkflowStep:
@@ -129,6 +47,17 @@ class WorkflowTrigger:
     config: Dict[str, Any]
     conditions: List[Dict[str, Any]] = None
 
+async def run_unscheduled_batch(workflow_id: str, execution_ids: List[str]):
+    """Run newly triggered executions in-process on their own session (scheduler disabled)"""
+    from core.database import SessionLocal
+    db = SessionLocal()
+    try:
+        await WorkflowEngine(db).run_queued_batch(workflow_id, execution_ids, 0, False)
+    except Exception as e:
+        logger.error(f"Unscheduled batch of workflow {workflow_id} failed: {e}")
+    finally:
+        db.close()
+
 class WorkflowEngine:
     """Marketing automation workflow engine"""
     
@@ -148,6 +77,13 @@ class WorkflowEngine:
             ActionType.SCORE_UPDATE: self._handle_score_update,
             ActionType.BRANCH: self._handle_branch
         }
+        # Actions that run as one operation over a batch of executions at the same step
+        self.batch_action_handlers = {
+            ActionType.SEND_EMAIL: self._handle_send_email_batch,
+            ActionType.UPDATE_FIELD: self._handle_update_field_batch,
+            ActionType.ADD_TO_SEGMENT: self._handle_add_to_segment_batch,
+            ActionType.ADD_TAG: self._handle_add_tag_batch
+        }
     
     def create_workflow(self, workflow_config: Dict[str, Any]) -> str:
         """Create a new marketing workflow"""
@@ -221,10 +157,17 @@ class WorkflowEngine:
             )
             
             self.db.add(execution)
-            self.db.commit()
             
-            # Start execution
-            asyncio.create_task(self._execute_workflow(execution.id))
+            # Start execution: queued in the same transaction, run by the scheduler's worker pool
+            if settings.WORKFLOW_SCHEDULER_ENABLED:
+                self.db.flush()
+                execution_scheduler.enqueue(
+                    self.db, [execution.id], workflow_id, priority=workflow_priority(workflow.trigger_config)
+                )
+                self.db.commit()
+            else:
+                self.db.commit()
+                asyncio.create_task(self._execute_workflow(execution.id))
             
             logger.info(f"Triggered workflow {workflow_id} for customer {customer_id}")
             return execution.id
@@ -234,8 +177,106 @@ class WorkflowEngine:
             self.db.rollback()
             raise
     
-    async def _execute_workflow(self, execution_id: str):
-        """Execute workflow steps for a specific customer"""
+    def trigger_workflow_batch(self, workflow_id: str, customer_ids: List[str] = None,
+                               segment_id: str = None, trigger_data: Dict[str, Any] = None,
+                               skip_active: bool = True, chunk_size: int = 10000) -> Dict[str, Any]:
+        """Trigger a workflow for a customer list and/or segment in bulk
+        
+        The audience (the given customers or segment, narrowed by the
+        workflow's target_audience) is resolved in SQL and executions are
+        inserted in chunks. Queued executions of the same workflow and step
+        run as one batch (see run_queued_batch). Customers with a started or
+        waiting execution of the workflow are skipped unless skip_active is False.
+        With the scheduler disabled the caller starts the returned
+        execution_ids with run_unscheduled_batch.
+        """
+        try:
+            started = time.monotonic()
+            if customer_ids is None and not segment_id:
+                raise ValueError("customer_ids or segment_id is required")
+            
+            workflow = self.db.query(Workflow).filter(Workflow.id == workflow_id).first()
+            if not workflow:
+                raise ValueError(f"Workflow {workflow_id} not found")
+            
+            if workflow.status != WorkflowStatus.ACTIVE.value:
+                raise ValueError(f"Workflow {workflow_id} is not active")
+            
+            # Resolve the audience
+            from core.database import Customer
+            conditions, residual = self._audience_conditions(workflow.target_audience)
+            if segment_id:
+                conditions.append(Customer.segment_id == segment_id)
+            if skip_active:
+                conditions.append(Customer.customer_id.notin_(
+                    select(WorkflowExecution.customer_id).where(
+                        WorkflowExecution.workflow_id == workflow_id,
+                        WorkflowExecution.status.in_(ACTIVE_EXECUTION_STATUSES),
+                        WorkflowExecution.customer_id.isnot(None)
+                    )
+                ))
+            # Criteria on fields without a column are checked on the loaded rows
+            columns = (Customer,) if residual else (Customer.customer_id,)
+            
+            def _audience(*id_conditions):
+                rows = self.db.execute(select(*columns).where(
+                    Customer.customer_id.isnot(None), *id_conditions, *conditions
+                )).scalars()
+                if not residual:
+                    return list(rows)
+                return [
+                    customer.customer_id for customer in rows
+                    if self._criteria_match(self._customer_data(customer), residual)
+                ]
+            
+            if customer_ids is not None:
+                audience = []
+                unique_ids = list(dict.fromkeys(customer_ids))
+                for start in range(0, len(unique_ids), chunk_size):
+                    audience.extend(_audience(Customer.customer_id.in_(unique_ids[start:start + chunk_size])))
+            else:
+                audience = _audience()
+            
+            # Insert executions and their run-queue entries in chunks
+            execution_ids = []
+            priority = workflow_priority(workflow.trigger_config)
+            for start in range(0, len(audience), chunk_size):
+                now = datetime.now()
+                rows = [
+                    {"id": str(uuid.uuid4()), "workflow_id": workflow_id, "customer_id": customer_id,
+                     "status": "started", "current_step": 0, "execution_data": dict(trigger_data or {}),
+                     "started_at": now}
+                    for customer_id in audience[start:start + chunk_size]
+                ]
+                # Core insert on the session's connection skips ORM bulk-persistence overhead
+                self.db.connection().execute(insert(WorkflowExecution.__table__), rows)
+                chunk_ids = [row["id"] for row in rows]
+                if settings.WORKFLOW_SCHEDULER_ENABLED:
+                    execution_scheduler.enqueue(self.db, chunk_ids, workflow_id, priority=priority)
+                self.db.commit()
+                execution_ids.extend(chunk_ids)
+            
+            logger.info(f"Batch triggered workflow {workflow_id} for {len(execution_ids)} customers")
+            return {
+                "workflow_id": workflow_id,
+                "audience_size": len(audience),
+                "triggered": len(execution_ids),
+                "execution_ids": execution_ids,
+                "duration_seconds": round(time.monotonic() - started, 3)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error batch triggering workflow: {e}")
+            self.db.rollback()
+            raise
+    
+    async def _execute_workflow(self, execution_id: str, start_step: int = 0, delay_elapsed: bool = False):
+        """Execute workflow steps for a specific customer
+        
+        Runs from start_step until the workflow ends or reaches a delayed
+        step, where the execution is checkpointed as waiting and handed to
+        the timer queue. delay_elapsed marks start_step's delay as served.
+        """
         try:
             execution = self.db.query(WorkflowExecution).filter(
                 WorkflowExecution.id == execution_id
@@ -246,11 +287,14 @@ class WorkflowEngine:
                 return
             
             workflow = execution.workflow
-            steps = workflow.workflow_config.get("steps", [])
+            steps = self._workflow_steps(workflow)
             
             logger.info(f"Executing workflow {workflow.name} for customer {execution.customer_id}")
             
             for step_index, step_config in enumerate(steps):
+                if step_index < start_step:
+                    continue
+                resumed = delay_elapsed and step_index == start_step
                 try:
                     # Check if execution should continue
                     if execution.status == "cancelled":
@@ -269,21 +313,32 @@ class WorkflowEngine:
                     execution.current_step = step_index
                     self.db.commit()
                     
-                    # Check step conditions
-                    if not self._evaluate_conditions(step.conditions, execution):
+                    # Check step conditions (evaluated before the delay, not again on resume)
+                    if not resumed and not self._evaluate_conditions(step.conditions, execution):
                         self._log_step_execution(execution.id, step_index, step.action_type.value, 
                                                step.name, "skipped", "Conditions not met")
                         continue
                     
-                    # Apply delay if specified
-                    if step.delay_minutes > 0:
-                        await asyncio.sleep(step.delay_minutes * 60)
+                    # Apply delay if specified: checkpoint here and let the timer poller resume
+                    delay_seconds = self._step_delay_seconds(step)
+                    if delay_seconds > 0 and not resumed:
+                        execution.status = "waiting"
+                        workflow_timers.schedule(
+                            self.db, execution.id, step_index, datetime.now() + timedelta(seconds=delay_seconds)
+                        )
+                        self.db.commit()
+                        logger.info(f"Execution {execution_id} waiting {delay_seconds}s before step {step_index}")
+                        return
                     
                     # Execute step
                     start_time = datetime.now()
                     result = await self._execute_step(step, execution)
                     execution_time = (datetime.now() - start_time).total_seconds() * 1000
                     
+                    # The delayed step ran: its timer is resolved with the step log
+                    if resumed:
+                        workflow_timers.cancel(self.db, execution.id)
+                    
                     # Log execution
                     self._log_step_execution(
                         execution.id, step_index, step.action_type.value, step.name,
@@ -346,14 +401,262 @@ class WorkflowEngine:
                 execution.completed_at = datetime.now()
                 self.db.commit()
     
+    async def resume_execution(self, execution_id: str, step_index: int) -> bool:
+        """Continue a waiting execution at its delayed step (called by the timer poller)"""
+        try:
+            execution = self.db.query(WorkflowExecution).filter(
+                WorkflowExecution.id == execution_id
+            ).first()
+            
+            # "started" at the same step: a previous resume died before finishing the step
+            if not execution or execution.status not in ("waiting", "started") or execution.current_step != step_index:
+                # Cancelled, finished or already moved on
+                workflow_timers.cancel(self.db, execution_id)
+                self.db.commit()
+                return False
+            
+            execution.status = "started"
+            self.db.commit()
+            
+        except Exception as e:
+            logger.error(f"Error resuming execution {execution_id}: {e}")
+            self.db.rollback()
+            raise
+        
+        await self._execute_workflow(execution_id, start_step=step_index, delay_elapsed=True)
+        return True
+    
+    async def run_queued(self, execution_id: str, step_index: int, delay_elapsed: bool) -> bool:
+        """Run an execution claimed from the scheduler's run queue"""
+        if delay_elapsed:
+            return await self.resume_execution(execution_id, step_index)
+        
+        execution = self.db.query(WorkflowExecution).filter(
+            WorkflowExecution.id == execution_id
+        ).first()
+        # Waiting, finished or cancelled runs are not started again when a claim is retried
+        if not execution or execution.status != "started":
+            return False
+        
+        await self._execute_workflow(execution_id, start_step=execution.current_step or 0)
+        return True
+    
+    async def run_queued_batch(self, workflow_id: str, execution_ids: List[str], step_index: int,
+                               delay_elapsed: bool) -> int:
+        """Run executions of one workflow claimed together from the run queue, step by step as a batch"""
+        from core.database import run_in_db_threadpool
+        workflow, cohorts = await run_in_db_threadpool(
+            self._load_batch, workflow_id, execution_ids, step_index, delay_elapsed
+        )
+        for start_step, cohort in sorted(cohorts.items()):
+            if cohort and workflow:
+                await self._execute_batch(workflow, cohort, start_step, delay_elapsed)
+        return sum(len(cohort) for cohort in cohorts.values())
+    
+    def _load_batch(self, workflow_id: str, execution_ids: List[str], step_index: int,
+                    delay_elapsed: bool) -> Tuple[Optional[Workflow], Dict[int, List[WorkflowExecution]]]:
+        """Load a claimed batch, grouped by the step each runnable execution continues from"""
+        try:
+            workflow = self.db.query(Workflow).filter(Workflow.id == workflow_id).first()
+            executions = self._load_executions(execution_ids)
+            
+            if delay_elapsed:
+                # Same checks as resume_execution
+                runnable = [
+                    execution for execution in executions
+                    if execution.status in ("waiting", "started") and execution.current_step == step_index
+                ]
+                stale = set(execution_ids) - {execution.id for execution in runnable}
+                if stale:
+                    workflow_timers.cancel_many(self.db, stale)
+                for execution in runnable:
+                    execution.status = "started"
+                runnable_ids = [execution.id for execution in runnable]
+                self.db.commit()
+                return workflow, {step_index: self._load_executions(runnable_ids)}
+            
+            # A retried claim may find executions at different checkpoints
+            cohorts: Dict[int, List[WorkflowExecution]] = {}
+            for execution in executions:
+                if execution.status == "started":
+                    cohorts.setdefault(execution.current_step or 0, []).append(execution)
+            return workflow, cohorts
+            
+        except Exception as e:
+            logger.error(f"Error loading workflow batch of {workflow_id}: {e}")
+            self.db.rollback()
+            raise
+    
+    async def _execute_batch(self, workflow: Workflow, executions: List[WorkflowExecution],
+                             start_step: int = 0, delay_elapsed: bool = False):
+        """Execute workflow steps for many executions of one workflow at once
+        
+        Same semantics as _execute_workflow, but customer data is loaded with
+        one query, batchable actions run once for the whole cohort and each
+        step's state changes and logs are committed together. Database work
+        runs on the database thread pool, one phase at a time, so only the
+        action handlers run on the event loop.
+        """
+        from core.database import run_in_db_threadpool
+        steps, customers = await run_in_db_threadpool(self._prepare_batch, workflow, executions)
+        active = list(executions)
+        
+        for step_index, step_config in enumerate(steps):
+            if step_index < start_step:
+                continue
+            resumed = delay_elapsed and step_index == start_step
+            active = [execution for execution in active if execution.status != "cancelled"]
+            if not active:
+                break
+            
+            stepped = runners = active
+            try:
+                step = WorkflowStep(
+                    step_id=step_config.get("id", str(step_index)),
+                    name=step_config.get("name", f"Step {step_index + 1}"),
+                    action_type=ActionType(step_config["action_type"]),
+                    config=step_config.get("config", {}),
+                    conditions=step_config.get("conditions", []),
+                    delay_minutes=step_config.get("delay_minutes", 0)
+                )
+                
+                for execution in active:
+                    execution.current_step = step_index
+                
+                # Check step conditions (evaluated before the delay, not again on resume)
+                logs = []
+                if not resumed and step.conditions:
+                    runners = []
+                    for execution in active:
+                        if self._evaluate_conditions(step.conditions, execution, customers.get(execution.customer_id, {})):
+                            runners.append(execution)
+                        else:
+                            logs.append(self._step_log(execution.id, step_index, step.action_type.value,
+                                                       step.name, "skipped", "Conditions not met"))
+                
+                # Apply delay if specified: checkpoint the cohort and let the timer poller resume it
+                delay_seconds = self._step_delay_seconds(step)
+                if delay_seconds > 0 and not resumed and runners:
+                    due_at = datetime.now() + timedelta(seconds=delay_seconds)
+                    for execution in runners:
+                        execution.status = "waiting"
+                    await run_in_db_threadpool(
+                        workflow_timers.schedule_many, self.db, [execution.id for execution in runners], step_index, due_at
+                    )
+                    waiting = {execution.id for execution in runners}
+                    active = [execution for execution in active if execution.id not in waiting]
+                    runners = []
+                    logger.info(f"{len(waiting)} executions waiting {delay_seconds}s before step {step_index}")
+                
+                # Execute step
+                results = {}
+                if runners:
+                    start_time = datetime.now()
+                    results = await self._execute_step_batch(step, runners, customers)
+                    execution_time = (datetime.now() - start_time).total_seconds() * 1000 / len(runners)
+                    
+                    for execution in runners:
+                        result = results[execution.id]
+                        logs.append(self._step_log(
+                            execution.id, step_index, step.action_type.value, step.name,
+                            "success" if result["success"] else "failed",
+                            result.get("message", ""), execution_time, step.config, result.get("output_data", {})
+                        ))
+                        # Stop if step failed and no error handling
+                        if not result["success"] and not step.config.get("continue_on_error", False):
+                            execution.status = "failed"
+                            execution.error_message = result.get("message", "Step execution failed")
+                            execution.completed_at = datetime.now()
+                
+                # The delayed step ran: its timers are resolved with the step logs
+                resolved = [execution.id for execution in runners] if resumed else []
+                # Later conditions and personalization see the updated customers
+                reload_customers = step.action_type in (ActionType.UPDATE_FIELD, ActionType.ADD_TO_SEGMENT) and bool(results)
+                active, customers = await run_in_db_threadpool(
+                    self._checkpoint_batch_step, active, logs, resolved, customers, reload_customers
+                )
+                
+            except Exception as step_error:
+                logger.error(f"Batch step execution error: {step_error}")
+                await run_in_db_threadpool(self._fail_batch_step, stepped, step_index, step_config, step_error)
+                break
+        
+        await run_in_db_threadpool(self._complete_batch, active)
+    
+    def _prepare_batch(self, workflow: Workflow, executions: List[WorkflowExecution]
+                       ) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """Steps of the workflow and data of the batch's customers"""
+        logger.info(f"Executing workflow {workflow.name} for a batch of {len(executions)} executions")
+        return self._workflow_steps(workflow), self._get_customers_data([execution.customer_id for execution in executions])
+    
+    def _checkpoint_batch_step(self, active: List[WorkflowExecution], logs: List[WorkflowStepLog],
+                               resolved_timers: List[str], customers: Dict[str, Dict[str, Any]], reload_customers: bool
+                               ) -> Tuple[List[WorkflowExecution], Dict[str, Dict[str, Any]]]:
+        """Commit one step of a batch and reload the executions still running"""
+        if resolved_timers:
+            workflow_timers.cancel_many(self.db, resolved_timers)
+        self.db.add_all(logs)
+        active_ids = [execution.id for execution in active if execution.status != "failed"]
+        self.db.commit()
+        # One query instead of a refresh per expired execution (also picks up cancellations)
+        active = self._load_executions(active_ids)
+        if reload_customers:
+            customers = self._get_customers_data([execution.customer_id for execution in active])
+        return active, customers
+    
+    def _fail_batch_step(self, stepped: List[WorkflowExecution], step_index: int, step_config: Dict[str, Any],
+                         step_error: Exception):
+        """Stop every execution of a batch step that raised"""
+        self.db.rollback()
+        self.db.add_all([
+            self._step_log(execution.id, step_index, step_config.get("action_type", "unknown"),
+                           step_config.get("name", f"Step {step_index + 1}"), "failed", str(step_error))
+            for execution in stepped
+        ])
+        for execution in stepped:
+            execution.status = "failed"
+            execution.error_message = str(step_error)
+            execution.completed_at = datetime.now()
+        self.db.commit()
+    
+    def _complete_batch(self, active: List[WorkflowExecution]):
+        """Mark as completed if all steps successful"""
+        for execution in active:
+            if execution.status not in ["failed", "cancelled"]:
+                execution.status = "completed"
+                execution.completed_at = datetime.now()
+        self.db.commit()
+    
+    async def _execute_step_batch(self, step: WorkflowStep, executions: List[WorkflowExecution],
+                                  customers: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Execute one step for many executions; results keyed by execution id"""
+        handler = self.batch_action_handlers.get(step.action_type)
+        if handler is None:
+            # No batched form: one handler call per execution, each within the action limits
+            return {execution.id: await self._execute_step(step, execution) for execution in executions}
+        
+        # Pieces no larger than the rate limit's burst, so a slot is held and tokens taken only per piece
+        size = action_limiter.batch_limit(step.action_type.value) or len(executions)
+        results = {}
+        for start in range(0, len(executions), size):
+            piece = executions[start:start + size]
+            try:
+                results.update(await action_limiter.run(
+                    step.action_type.value, lambda: handler(step, piece, customers), count=len(piece)
+                ))
+            except Exception as e:
+                logger.error(f"Batch step execution error: {e}")
+                results.update({execution.id: {"success": False, "message": str(e)} for execution in piece})
+        return results
+    
     async def _execute_step(self, step: WorkflowStep, execution: WorkflowExecution) -> Dict[str, Any]:
-        """Execute a single workflow step"""
+        """Execute a single workflow step within its action type's concurrency and rate limits"""
         try:
             handler = self.action_handlers.get(step.action_type)
             if not handler:
                 return {"success": False, "message": f"No handler for action type: {step.action_type}"}
             
-            result = await handler(step, execution)
+            result = await action_limiter.run(step.action_type.value, lambda: handler(step, execution))
             return result
             
         except Exception as e:
@@ -529,9 +832,7 @@ class WorkflowEngine:
             
             total_seconds = (wait_days * 24 * 3600) + (wait_hours * 3600) + (wait_minutes * 60)
             
-            if total_seconds > 0:
-                await asyncio.sleep(total_seconds)
-            
+            # The wait itself was served by the timer queue before this step ran
             return {
                 "success": True,
                 "message": f"Waited {total_seconds} seconds",
@@ -669,6 +970,108 @@ class WorkflowEngine:
         except Exception as e:
             return {"success": False, "message": f"Branching failed: {e}"}
     
+    # Batched Action Handlers: one operation for every execution at the step, results keyed by execution id
+    async def _handle_send_email_batch(self, step: WorkflowStep, executions: List[WorkflowExecution],
+                                       customers: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Handle email sending action for a batch of executions"""
+        config = step.config
+        template_id = config.get("template_id")
+        subject = config.get("subject")
+        personalization = config.get("personalization", {})
+        sent_at = datetime.now().isoformat()
+        
+        # Simulate email sending (replace with the email service's batch send)
+        results = {}
+        for execution in executions:
+            customer_data = customers.get(execution.customer_id, {})
+            email_data = {
+                "to": customer_data.get("email"),
+                "subject": self._personalize_content(subject, customer_data, personalization),
+                "template_id": template_id,
+                "customer_id": execution.customer_id
+            }
+            data = dict(execution.execution_data or {})
+            data["emails_sent"] = data.get("emails_sent", []) + [{
+                "timestamp": sent_at,
+                "template_id": template_id,
+                "subject": subject
+            }]
+            execution.execution_data = data
+            results[execution.id] = {
+                "success": True,
+                "message": "Email sent successfully",
+                "output_data": email_data
+            }
+        
+        logger.info(f"Sending {len(executions)} emails - Subject: {subject}")
+        return results
+    
+    async def _handle_update_field_batch(self, step: WorkflowStep, executions: List[WorkflowExecution],
+                                         customers: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Handle customer field update action with one UPDATE for the batch"""
+        from core.database import Customer, run_in_db_threadpool
+        config = step.config
+        field_name = config.get("field_name")
+        field_value = config.get("field_value")
+        
+        if field_name in Customer.__table__.columns:
+            outcome = {
+                "success": True,
+                "message": f"Updated {field_name} to {field_value}",
+                "output_data": {"field_name": field_name, "field_value": field_value}
+            }
+        else:
+            outcome = {"success": False, "message": f"Field {field_name} not found"}
+        return await run_in_db_threadpool(
+            self._update_customers_batch, executions, customers, {field_name: field_value}, outcome
+        )
+    
+    async def _handle_add_to_segment_batch(self, step: WorkflowStep, executions: List[WorkflowExecution],
+                                           customers: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Handle add to segment action with one UPDATE for the batch"""
+        from core.database import run_in_db_threadpool
+        segment_id = step.config.get("segment_id")
+        return await run_in_db_threadpool(self._update_customers_batch, executions, customers, {"segment_id": segment_id}, {
+            "success": True,
+            "message": f"Added customer to segment {segment_id}",
+            "output_data": {"segment_id": segment_id}
+        })
+    
+    async def _handle_add_tag_batch(self, step: WorkflowStep, executions: List[WorkflowExecution],
+                                    customers: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Handle add tag action for a batch of executions"""
+        tag = step.config.get("tag")
+        
+        # Add tag to customer (simulate)
+        for execution in executions:
+            data = dict(execution.execution_data or {})
+            data["tags"] = data.get("tags", []) + [tag]
+            execution.execution_data = data
+        
+        return {
+            execution.id: {"success": True, "message": f"Added tag: {tag}", "output_data": {"tag": tag}}
+            for execution in executions
+        }
+    
+    def _update_customers_batch(self, executions: List[WorkflowExecution], customers: Dict[str, Dict[str, Any]],
+                                values: Dict[str, Any], outcome: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Apply values to the customers of the executions in chunked UPDATEs (joins the caller's transaction)"""
+        from core.database import Customer
+        
+        found = list(dict.fromkeys(
+            execution.customer_id for execution in executions if execution.customer_id in customers
+        ))
+        if outcome["success"]:
+            for start in range(0, len(found), 10000):
+                self.db.execute(
+                    update(Customer).where(Customer.customer_id.in_(found[start:start + 10000])).values(values)
+                )
+        return {
+            execution.id: outcome if execution.customer_id in customers
+            else {"success": False, "message": "Customer not found"}
+            for execution in executions
+        }
+    
     def get_workflow_performance(self, workflow_id: str) -> Dict[str, Any]:
         """Get workflow performance metrics"""
         try:
@@ -752,6 +1155,19 @@ class WorkflowEngine:
             if "action_type" not in step:
                 raise ValueError("Each step must have action_type")
     
+    def _workflow_steps(self, workflow: Workflow) -> List[Dict[str, Any]]:
+        """Step configs of a workflow (stored as a list, or under "steps")"""
+        config = workflow.workflow_config or []
+        return config if isinstance(config, list) else config.get("steps", [])
+    
+    def _step_delay_seconds(self, step: WorkflowStep) -> int:
+        """Delay before a step runs: its delay_minutes plus the duration of a WAIT action"""
+        seconds = (step.delay_minutes or 0) * 60
+        if step.action_type == ActionType.WAIT:
+            config = step.config
+            seconds += (config.get("wait_days", 0) * 24 * 3600) + (config.get("wait_hours", 0) * 3600) + (config.get("wait_minutes", 0) * 60)
+        return seconds
+    
     def _setup_workflow_triggers(self, workflow: Workflow):
         """Setup trigger monitoring for workflow"""
         trigger_config = workflow.trigger_config
@@ -776,7 +1192,10 @@ class WorkflowEngine:
         if not customer_data:
             return False
         
-        # Check criteria
+        return self._criteria_match(customer_data, criteria)
+    
+    def _criteria_match(self, customer_data: Dict[str, Any], criteria: Dict[str, Any]) -> bool:
+        """Check loaded customer data against target audience criteria"""
         for field, condition in criteria.items():
             if field not in customer_data:
                 return False
@@ -801,25 +1220,56 @@ class WorkflowEngine:
         
         return True
     
+    def _audience_conditions(self, criteria: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+        """SQL conditions equivalent to _customer_matches_criteria, plus the criteria only checkable in Python"""
+        from core.database import Customer
+        
+        conditions, residual = [], {}
+        for field, condition in (criteria or {}).items():
+            if field not in AUDIENCE_COLUMNS:
+                if field not in ("phone", "created_at"):
+                    return [false()], {}  # Field never in customer data, nobody matches
+                residual[field] = condition
+                continue
+            
+            column = getattr(Customer, field)
+            if isinstance(condition, dict):
+                operator = condition.get("operator", "equals")
+                value = condition.get("value")
+            else:
+                operator, value = "equals", condition
+            
+            if operator == "equals":
+                conditions.append(column == value)
+            elif operator == "greater_than":
+                conditions.append(column > value)
+            elif operator == "less_than":
+                conditions.append(column < value)
+            elif operator == "contains":
+                conditions.append(column.contains(value))
+        
+        return conditions, residual
+    
     def _evaluate_conditions(self, conditions: List[Dict[str, Any]], 
-                           execution: WorkflowExecution) -> bool:
-        """Evaluate step conditions"""
+                           execution: WorkflowExecution, customer_data: Dict[str, Any] = None) -> bool:
+        """Evaluate step conditions (customer_data: preloaded data of the execution's customer)"""
         if not conditions:
             return True
         
         for condition in conditions:
-            if not self._evaluate_condition(condition, execution):
+            if not self._evaluate_condition(condition, execution, customer_data):
                 return False
         
         return True
     
     def _evaluate_condition(self, condition: Dict[str, Any], 
-                          execution: WorkflowExecution) -> bool:
+                          execution: WorkflowExecution, customer_data: Dict[str, Any] = None) -> bool:
         """Evaluate a single condition"""
         condition_type = condition.get("type")
         
         if condition_type == "customer_field":
-            customer_data = self._get_customer_data(execution.customer_id)
+            if customer_data is None:
+                customer_data = self._get_customer_data(execution.customer_id)
             field = condition.get("field")
             operator = condition.get("operator", "equals")
             value = condition.get("value")
@@ -862,6 +1312,30 @@ class WorkflowEngine:
         if not customer:
             return {}
         
+        return self._customer_data(customer)
+    
+    def _load_executions(self, execution_ids: List[str]) -> List[WorkflowExecution]:
+        """Executions by id with one query per 10000 ids"""
+        executions = []
+        for start in range(0, len(execution_ids), 10000):
+            executions.extend(self.db.query(WorkflowExecution).filter(
+                WorkflowExecution.id.in_(execution_ids[start:start + 10000])
+            ).all())
+        return executions
+    
+    def _get_customers_data(self, customer_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Customer data of many customers with one query, keyed by customer_id"""
+        from core.database import Customer
+        customers = {}
+        unique_ids = list(dict.fromkeys(customer_ids))
+        for start in range(0, len(unique_ids), 10000):
+            for customer in self.db.execute(select(Customer).where(
+                Customer.customer_id.in_(unique_ids[start:start + 10000])
+            )).scalars():
+                customers[customer.customer_id] = self._customer_data(customer)
+        return customers
+    
+    def _customer_data(self, customer) -> Dict[str, Any]:
         return {
             "customer_id": customer.customer_id,
             "email": getattr(customer, 'email', ''),
@@ -899,7 +1373,17 @@ class WorkflowEngine:
                           execution_time_ms: int = 0, input_data: Dict = None,
                           output_data: Dict = None):
         """Log step execution"""
-        log = WorkflowStepLog(
+        log = self._step_log(execution_id, step_number, step_type, step_name, status, message,
+                             execution_time_ms, input_data, output_data)
+        
+        self.db.add(log)
+        self.db.commit()
+    
+    def _step_log(self, execution_id: str, step_number: int, step_type: str,
+                  step_name: str, status: str, message: str = "",
+                  execution_time_ms: int = 0, input_data: Dict = None,
+                  output_data: Dict = None) -> WorkflowStepLog:
+        return WorkflowStepLog(
             execution_id=execution_id,
             step_number=step_number,
             step_type=step_type,
@@ -909,7 +1393,4 @@ class WorkflowEngine:
             input_data=input_data or {},
             output_data=output_data or {},
             error_message=message if status == "failed" else None
-        )
-        
-        self.db.add(log)
-        self.db.commit()
\ No newline at end of file
+        )
\ No newline at end of file
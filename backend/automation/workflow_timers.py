@@ -0,0 +1,235 @@
+"""
+Workflow Timers - persisted wake-ups for delayed workflow steps
+"""
+from typing import Dict, List, Any, Iterable, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import time
+import uuid
+from sqlalchemy import Column, String, Integer, DateTime, select, update, delete, func, or_
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import Base, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+class WorkflowTimer(Base):
+    """Pending wake-up of a workflow execution waiting on a delayed step"""
+    __tablename__ = "workflow_timers"
+
+    execution_id = Column(String, primary_key=True)  # At most one pending wake-up per execution
+    step_index = Column(Integer, nullable=False)
+    due_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    claimed_by = Column(String)
+    claimed_at = Column(DateTime)
+
+class WorkflowTimerQueue:
+    """Durable timer table plus a poller that resumes due executions in batches
+
+    Instead of sleeping, the workflow engine checkpoints an execution at the
+    delayed step and calls ``schedule`` in the same transaction. The poller
+    claims due timers (``FOR UPDATE SKIP LOCKED`` on PostgreSQL, so several
+    app instances can poll), then resumes each execution from its
+    checkpoint (through the execution scheduler's run queue when it is
+    enabled); the engine deletes the timer when it resumes. A claim that
+    is not resolved within ``claim_timeout`` seconds (the process died) is
+    picked up again, so a step may run twice but is never lost.
+    """
+
+    def __init__(self, batch_size: int = 500, interval: float = 5.0, claim_timeout: float = 300.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self.worker_id = str(uuid.uuid4())
+        self.running = False
+        self.metrics = {
+            "scheduled": 0,
+            "batches": 0,
+            "resumed": 0,
+            "errors": 0,
+            "last_batch_size": 0,
+            "last_batch_seconds": 0.0,
+            "last_batch_at": None,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0
+        }
+
+    def schedule(self, db: Session, execution_id: str, step_index: int, due_at: datetime):
+        """Wake the execution at step_index once due_at passes; joins the caller's transaction"""
+        self.schedule_many(db, [execution_id], step_index, due_at)
+
+    def schedule_many(self, db: Session, execution_ids: Iterable[str], step_index: int, due_at: datetime):
+        """Wake several executions at the same step and time; joins the caller's transaction"""
+        now = datetime.now()
+        rows = [
+            {"execution_id": execution_id, "step_index": step_index, "due_at": due_at,
+             "created_at": now, "claimed_by": None, "claimed_at": None}
+            for execution_id in dict.fromkeys(execution_ids)
+        ]
+        bulk_upsert(db, WorkflowTimer, rows, ["execution_id"], ["step_index", "due_at", "created_at", "claimed_by", "claimed_at"])
+        self.metrics["scheduled"] += len(rows)
+
+    def cancel(self, db: Session, execution_id: str):
+        """Drop the execution's pending wake-up; joins the caller's transaction"""
+        self.cancel_many(db, [execution_id])
+
+    def cancel_many(self, db: Session, execution_ids: Iterable[str]):
+        """Drop the pending wake-ups of several executions; joins the caller's transaction"""
+        execution_ids = list(execution_ids)
+        for start in range(0, len(execution_ids), 10000):
+            db.execute(delete(WorkflowTimer).where(WorkflowTimer.execution_id.in_(execution_ids[start:start + 10000])))
+
+    def claim_due(self, db: Session) -> List[Dict[str, Any]]:
+        """Claim up to batch_size due timers, oldest first"""
+        now = datetime.now()
+        statement = select(WorkflowTimer.execution_id, WorkflowTimer.step_index, WorkflowTimer.due_at).where(
+            WorkflowTimer.due_at <= now,
+            or_(WorkflowTimer.claimed_at.is_(None), WorkflowTimer.claimed_at < now - timedelta(seconds=self.claim_timeout))
+        ).order_by(WorkflowTimer.due_at).limit(self.batch_size)
+        if db.get_bind().dialect.name == "postgresql":
+            statement = statement.with_for_update(skip_locked=True)
+
+        due = [
+            {"execution_id": execution_id, "step_index": step_index, "due_at": due_at}
+            for execution_id, step_index, due_at in db.execute(statement)
+        ]
+        if due:
+            db.execute(update(WorkflowTimer).where(
+                WorkflowTimer.execution_id.in_([timer["execution_id"] for timer in due])
+            ).values(claimed_by=self.worker_id, claimed_at=now))
+        db.commit()
+        return due
+
+    async def process_batch(self) -> Dict[str, Any]:
+        """Resume one batch of due executions"""
+        from core.database import SessionLocal, run_with_db
+        from .workflow_engine import WorkflowEngine
+
+        started = time.perf_counter()
+        due = await run_with_db(self.claim_due)
+        if not due:
+            return {"resumed": 0}
+
+        resumed = 0
+        if settings.WORKFLOW_SCHEDULER_ENABLED:
+            # The scheduler's workers resume them, within the per-action limits
+            resumed = await run_with_db(self._hand_off, due)
+        else:
+            # Resumed in-process, one batch per workflow and step, with the database work on the thread pool
+            groups = await run_with_db(self._resume_groups, due)
+            for (workflow_id, step_index), execution_ids in groups.items():
+                db = SessionLocal()
+                try:
+                    resumed += await WorkflowEngine(db).run_queued_batch(workflow_id, execution_ids, step_index, True)
+                except Exception as e:
+                    self.metrics["errors"] += 1
+                    logger.error(f"Error resuming workflow executions {execution_ids[:5]}: {e}")
+                finally:
+                    db.close()
+
+        duration = time.perf_counter() - started
+        lag = max((datetime.now() - timer["due_at"]).total_seconds() for timer in due)
+        self.metrics["batches"] += 1
+        self.metrics["resumed"] += resumed
+        self.metrics["last_batch_size"] = len(due)
+        self.metrics["last_batch_seconds"] = round(duration, 3)
+        self.metrics["last_batch_at"] = datetime.now().isoformat()
+        self.metrics["last_lag_seconds"] = round(lag, 1)
+        self.metrics["max_lag_seconds"] = max(self.metrics["max_lag_seconds"], round(lag, 1))
+        return {"resumed": resumed, "claimed": len(due), "lag_seconds": round(lag, 1), "seconds": round(duration, 3)}
+
+    def _hand_off(self, db: Session, due: List[Dict[str, Any]]) -> int:
+        """Move claimed timers to the execution scheduler's run queue in one transaction"""
+        from .execution_scheduler import execution_scheduler
+
+        execution_ids = [timer["execution_id"] for timer in due]
+        groups, priorities = self._group_by_workflow(db, due)
+        try:
+            for (workflow_id, step_index), ids in groups.items():
+                execution_scheduler.enqueue(db, ids, workflow_id, priority=priorities[workflow_id],
+                                            step_index=step_index, delay_elapsed=True)
+            db.execute(delete(WorkflowTimer).where(
+                WorkflowTimer.execution_id.in_(execution_ids), WorkflowTimer.claimed_by == self.worker_id
+            ))
+            db.commit()
+            return sum(len(ids) for ids in groups.values())
+        except Exception:
+            db.rollback()
+            raise
+
+    def _resume_groups(self, db: Session, due: List[Dict[str, Any]]) -> Dict[tuple, List[str]]:
+        """Group claimed timers for in-process resumption, dropping those of deleted executions"""
+        groups, _ = self._group_by_workflow(db, due)
+        grouped = {execution_id for ids in groups.values() for execution_id in ids}
+        self.cancel_many(db, [timer["execution_id"] for timer in due if timer["execution_id"] not in grouped])
+        return groups
+
+    def _group_by_workflow(self, db: Session, due: List[Dict[str, Any]]) -> Tuple[Dict[tuple, List[str]], Dict[str, int]]:
+        """Claimed timers grouped by (workflow, step), with each workflow's run-queue priority"""
+        from .execution_scheduler import workflow_priority
+        from .models import Workflow, WorkflowExecution
+
+        execution_ids = [timer["execution_id"] for timer in due]
+        workflows = {
+            execution_id: (workflow_id, trigger_config)
+            for execution_id, workflow_id, trigger_config in db.execute(
+                select(WorkflowExecution.id, Workflow.id, Workflow.trigger_config)
+                .join(Workflow, Workflow.id == WorkflowExecution.workflow_id)
+                .where(WorkflowExecution.id.in_(execution_ids))
+            )
+        }
+        groups: Dict[tuple, List[str]] = {}
+        priorities: Dict[str, int] = {}
+        for timer in due:
+            if timer["execution_id"] not in workflows:
+                continue  # Execution deleted
+            workflow_id, trigger_config = workflows[timer["execution_id"]]
+            priorities[workflow_id] = workflow_priority(trigger_config)
+            groups.setdefault((workflow_id, timer["step_index"]), []).append(timer["execution_id"])
+        return groups, priorities
+
+    def get_metrics(self, db: Session) -> Dict[str, Any]:
+        """Timer lag, resumed count and due backlog"""
+        now = datetime.now()
+        scheduled, next_due = db.execute(select(func.count(WorkflowTimer.execution_id), func.min(WorkflowTimer.due_at))).one()
+        due_backlog, oldest_due = db.execute(
+            select(func.count(WorkflowTimer.execution_id), func.min(WorkflowTimer.due_at)).where(WorkflowTimer.due_at <= now)
+        ).one()
+        return {
+            **self.metrics,
+            "pending_timers": scheduled,
+            "next_due_at": next_due.isoformat() if next_due else None,
+            "due_backlog": due_backlog,
+            "current_lag_seconds": round((now - oldest_due).total_seconds(), 1) if oldest_due else 0.0,
+            "worker_running": self.running,
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval
+        }
+
+    async def run_worker(self):
+        """Background loop: resume due executions until none are due, then sleep"""
+        self.running = True
+        logger.info(f"Workflow timer poller started (batch {self.batch_size}, every {self.interval}s)")
+        while self.running:
+            try:
+                result = await self.process_batch()
+                if result["resumed"]:
+                    logger.info(f"Resumed {result['resumed']} delayed workflow executions (lag {result['lag_seconds']}s)")
+                if result.get("claimed", 0) >= self.batch_size:
+                    continue  # More timers due
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Workflow timer batch failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+workflow_timers = WorkflowTimerQueue(
+    batch_size=settings.WORKFLOW_TIMER_BATCH_SIZE,
+    interval=settings.WORKFLOW_TIMER_POLL_SECONDS,
+    claim_timeout=settings.WORKFLOW_TIMER_CLAIM_TIMEOUT_SECONDS
+)
@@ -0,0 +1,316 @@
+"""
+Profile Activity Aggregates - rolling daily buckets behind CDP computed attributes
+"""
+from typing import Dict, List, Any, Optional, Iterable, Tuple, Set
+from datetime import datetime, date, timedelta
+from collections import defaultdict
+import asyncio
+import hashlib
+import logging
+import math
+from sqlalchemy import Column, String, Integer, Date, DateTime, LargeBinary, select, delete
+from sqlalchemy.orm import Session
+
+from core.database import Base, bulk_upsert, bulk_insert_missing
+
+logger = logging.getLogger(__name__)
+
+class SessionSketch:
+    """HyperLogLog counter of distinct session ids (256 registers, ~6.5% error)
+
+    Small counts fall back to linear counting and are close to exact. Sketches
+    of different days merge by taking the register-wise maximum.
+    """
+
+    PRECISION = 8
+    REGISTERS = 1 << PRECISION
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers or bytes(self.REGISTERS))
+
+    def add(self, value: str):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.PRECISION)
+        remainder = hashed & ((1 << (64 - self.PRECISION)) - 1)
+        rank = (64 - self.PRECISION) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "SessionSketch") -> "SessionSketch":
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def estimate(self) -> int:
+        m = self.REGISTERS
+        zeros = self.registers.count(0)
+        if zeros == m:
+            return 0
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+class ProfileActivityDay(Base):
+    """Events, distinct sessions and last activity of one profile on one day"""
+    __tablename__ = "profile_activity_days"
+
+    profile_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    event_count = Column(Integer, default=0)
+    session_sketch = Column(LargeBinary)
+    last_event_at = Column(DateTime)
+
+class ProfileActivityBucket(Base):
+    """Event count of one profile on one day for one event type or channel"""
+    __tablename__ = "profile_activity_buckets"
+
+    profile_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    dimension = Column(String, primary_key=True)  # event_type, channel
+    value = Column(String, primary_key=True)
+    event_count = Column(Integer, default=0)
+
+class ProfileActivityBackfill(Base):
+    """Marks a profile whose event history has been folded into its activity aggregates"""
+    __tablename__ = "profile_activity_backfills"
+
+    profile_id = Column(String, primary_key=True)
+    backfilled_at = Column(DateTime, default=datetime.now)
+
+class ProfileActivityAggregator:
+    """Maintains per-day activity aggregates as events are tracked
+
+    ``record`` folds a batch of events into day rows and (event_type, channel)
+    buckets in the caller's transaction; ``computed_attributes`` assembles the
+    rolling-window attributes from at most ``window_days`` day rows instead of
+    scanning CustomerEvent. The window has day granularity. The first time a
+    profile is seen (no ProfileActivityBackfill marker) its window is rebuilt
+    from CustomerEvent, so events tracked before the aggregates existed are
+    never skipped. Counts are incremented with upserts; only the session
+    sketches are read and merged.
+    """
+
+    def __init__(self, window_days: int = 30):
+        self.window_days = window_days
+        self.running = False
+
+    def record(self, db: Session, events: Iterable[Dict[str, Any]]):
+        """Fold events (profile_id, event_type, data_source, session_id, timestamp) into the aggregates
+
+        The events must already be written to CustomerEvent in this transaction:
+        a profile's first record rebuilds its window from there instead.
+        """
+        events = list(events)
+        if not events:
+            return
+        rebuilt = self._claim(db, {event["profile_id"] for event in events})
+        if rebuilt:
+            self._rebuild(db, rebuilt)
+        self._fold(db, [event for event in events if event["profile_id"] not in rebuilt])
+
+    def _fold(self, db: Session, events: List[Dict[str, Any]]):
+        days: Dict[Tuple[str, date], Dict[str, Any]] = {}
+        buckets: Dict[Tuple[str, date, str, str], int] = defaultdict(int)
+        for event in events:
+            timestamp = event.get("timestamp") or datetime.now()
+            key = (event["profile_id"], timestamp.date())
+            day = days.setdefault(key, {"count": 0, "sketch": SessionSketch(), "last": timestamp})
+            day["count"] += 1
+            day["last"] = max(day["last"], timestamp)
+            if event.get("session_id"):
+                day["sketch"].add(event["session_id"])
+            buckets[(*key, "event_type", event["event_type"])] += 1
+            buckets[(*key, "channel", event.get("data_source") or "unknown")] += 1
+
+        if not days:
+            return
+
+        bulk_upsert(db, ProfileActivityDay, [
+            {"profile_id": profile_id, "day": day, "event_count": values["count"],
+             "session_sketch": values["sketch"].to_bytes(), "last_event_at": values["last"]}
+            for (profile_id, day), values in days.items()
+        ], ["profile_id", "day"], [], increment_columns=["event_count"])
+        bulk_upsert(db, ProfileActivityBucket, [
+            {"profile_id": profile_id, "day": day, "dimension": dimension, "value": value, "event_count": count}
+            for (profile_id, day, dimension, value), count in buckets.items()
+        ], ["profile_id", "day", "dimension", "value"], [], increment_columns=["event_count"])
+
+        # Sketches and last activity are merged once the day rows exist, so they can be locked
+        # (merging a sketch into itself is a no-op, so freshly inserted rows are unaffected)
+        profile_ids = list({profile_id for profile_id, _ in days})
+        for row in db.execute(self._locked(db, select(ProfileActivityDay).where(
+            ProfileActivityDay.profile_id.in_(profile_ids), ProfileActivityDay.day >= min(day for _, day in days)
+        )).execution_options(populate_existing=True)).scalars():
+            values = days.get((row.profile_id, row.day))
+            if values is None:
+                continue
+            row.session_sketch = SessionSketch(row.session_sketch).merge(values["sketch"]).to_bytes()
+            row.last_event_at = max(row.last_event_at or values["last"], values["last"])
+
+    def computed_attributes(self, db: Session, profile_id: str) -> Optional[Dict[str, Any]]:
+        """Rolling-window attributes, or None when the profile has no aggregates in the window"""
+        since = (datetime.now() - timedelta(days=self.window_days)).date()
+        days = db.execute(select(ProfileActivityDay).where(
+            ProfileActivityDay.profile_id == profile_id, ProfileActivityDay.day >= since
+        )).scalars().all()
+        if not days:
+            return None
+
+        counts = {"event_type": defaultdict(int), "channel": defaultdict(int)}
+        for dimension, value, event_count in db.execute(
+            select(ProfileActivityBucket.dimension, ProfileActivityBucket.value, ProfileActivityBucket.event_count).where(
+                ProfileActivityBucket.profile_id == profile_id, ProfileActivityBucket.day >= since
+            )
+        ):
+            counts[dimension][value] += event_count
+
+        sessions = SessionSketch()
+        for day in days:
+            if day.session_sketch:
+                sessions.merge(SessionSketch(day.session_sketch))
+        last_activity = max((day.last_event_at for day in days if day.last_event_at), default=None)
+        active_days = sum(1 for day in days if day.event_count)
+
+        return {
+            "total_events_30d": sum(day.event_count or 0 for day in days),
+            "unique_sessions_30d": sessions.estimate(),
+            "last_activity": last_activity.isoformat() if last_activity else None,
+            "most_common_event": max(counts["event_type"].items(), key=lambda x: x[1])[0] if counts["event_type"] else None,
+            "preferred_channel": max(counts["channel"].items(), key=lambda x: x[1])[0] if counts["channel"] else None,
+            "activity_score": min(100, (active_days / 30) * 100)
+        }
+
+    def needs_backfill(self, db: Session, profile_ids: List[str]) -> List[str]:
+        """Profiles whose aggregates were not backfilled from CustomerEvent yet"""
+        done = set(db.execute(select(ProfileActivityBackfill.profile_id).where(
+            ProfileActivityBackfill.profile_id.in_(profile_ids)
+        )).scalars())
+        return [profile_id for profile_id in profile_ids if profile_id not in done]
+
+    def backfill(self, db: Session, profile_ids: List[str]) -> int:
+        """Build the window's aggregates from CustomerEvent for profiles not backfilled yet; returns how many were"""
+        missing = self.needs_backfill(db, profile_ids)
+        if not missing:
+            return 0
+        rebuilt = self._claim(db, missing)
+        if rebuilt:
+            self._rebuild(db, rebuilt)
+        return len(rebuilt)
+
+    def _claim(self, db: Session, profile_ids: Iterable[str]) -> Set[str]:
+        """Mark profiles as backfilled; returns those this caller marked first"""
+        now = datetime.now()
+        return {profile_id for profile_id, in bulk_insert_missing(db, ProfileActivityBackfill, [
+            {"profile_id": profile_id, "backfilled_at": now} for profile_id in sorted(set(profile_ids))
+        ], ["profile_id"])}
+
+    def _rebuild(self, db: Session, profile_ids: Iterable[str]) -> int:
+        """Replace the profiles' aggregates with the window's CustomerEvent rows; returns the events folded"""
+        from .unified_profile import CustomerEvent
+
+        profile_ids = list(profile_ids)
+        db.flush()
+        for model in (ProfileActivityDay, ProfileActivityBucket):
+            db.execute(delete(model).where(model.profile_id.in_(profile_ids)), execution_options={"synchronize_session": False})
+
+        since = datetime.combine((datetime.now() - timedelta(days=self.window_days)).date(), datetime.min.time())
+        events = [
+            {"profile_id": profile_id, "event_type": event_type, "data_source": data_source,
+             "session_id": session_id, "timestamp": timestamp}
+            for profile_id, event_type, data_source, session_id, timestamp in db.execute(
+                select(
+                    CustomerEvent.profile_id, CustomerEvent.event_type, CustomerEvent.data_source,
+                    CustomerEvent.session_id, CustomerEvent.timestamp
+                ).where(CustomerEvent.profile_id.in_(profile_ids), CustomerEvent.timestamp >= since)
+            )
+        ]
+        self._fold(db, events)
+        return len(events)
+
+    def merge_profiles(self, db: Session, remap: Dict[str, str]):
+        """Fold the aggregates of merged-away profiles into their masters
+
+        Call after the merged profiles' CustomerEvent rows were moved to their
+        masters: a master is rebuilt from them when it or a profile merged
+        into it had not been backfilled.
+        """
+        if not remap:
+            return
+        merged_ids = list(remap)
+        backfilled = set(db.execute(select(ProfileActivityBackfill.profile_id).where(
+            ProfileActivityBackfill.profile_id.in_(merged_ids + list(set(remap.values())))
+        )).scalars())
+        stale_masters = {master for merged, master in remap.items() if merged not in backfilled or master not in backfilled}
+        for model in (ProfileActivityDay, ProfileActivityBucket):
+            rows = db.execute(self._locked(db, select(model).where(model.profile_id.in_(merged_ids)))).scalars().all()
+            if not rows:
+                continue
+            masters = set(remap.values())
+            key_columns = [column.name for column in model.__table__.primary_key.columns if column.name != "profile_id"]
+            existing = {
+                (row.profile_id, *(getattr(row, column) for column in key_columns)): row for row in db.execute(
+                    self._locked(db, select(model).where(model.profile_id.in_(masters)))
+                ).scalars()
+            }
+            for row in rows:
+                master_id = remap[row.profile_id]
+                key = (master_id, *(getattr(row, column) for column in key_columns))
+                target = existing.get(key)
+                if target is None:
+                    target = model(profile_id=master_id, **{column: getattr(row, column) for column in key_columns}, event_count=0)
+                    db.add(target)
+                    existing[key] = target
+                target.event_count = (target.event_count or 0) + (row.event_count or 0)
+                if model is ProfileActivityDay:
+                    target.session_sketch = SessionSketch(target.session_sketch).merge(SessionSketch(row.session_sketch)).to_bytes()
+                    target.last_event_at = max(filter(None, [target.last_event_at, row.last_event_at]), default=None)
+            db.flush()
+            db.execute(delete(model).where(model.profile_id.in_(merged_ids)), execution_options={"synchronize_session": False})
+            for row in rows:
+                db.expunge(row)
+
+        db.execute(delete(ProfileActivityBackfill).where(
+            ProfileActivityBackfill.profile_id.in_(merged_ids + list(stale_masters))
+        ))
+        if stale_masters:
+            self._rebuild(db, self._claim(db, stale_masters))
+
+    def prune(self, db: Session, keep_days: int = None) -> int:
+        """Delete aggregates that have left the window"""
+        before = (datetime.now() - timedelta(days=keep_days or self.window_days + 1)).date()
+        deleted = db.execute(delete(ProfileActivityBucket).where(ProfileActivityBucket.day < before)).rowcount
+        deleted += db.execute(delete(ProfileActivityDay).where(ProfileActivityDay.day < before)).rowcount
+        return deleted
+
+    async def run_pruner(self, interval: float):
+        """Background loop: prune aggregates that left the window every interval seconds"""
+        from core.database import run_with_db
+
+        def _prune(db: Session) -> int:
+            deleted = self.prune(db)
+            db.commit()
+            return deleted
+
+        self.running = True
+        while self.running:
+            try:
+                deleted = await run_with_db(_prune)
+                if deleted:
+                    logger.info(f"Pruned {deleted} expired activity aggregate rows")
+            except Exception as e:
+                logger.error(f"Activity aggregate pruning failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stop(self):
+        self.running = False
+
+    @staticmethod
+    def _locked(db: Session, statement):
+        # Serialize concurrent read-modify-write of the same profile's rows
+        return statement.with_for_update() if db.get_bind().dialect.name == "postgresql" else statement
+
+activity_aggregator = ProfileActivityAggregator()
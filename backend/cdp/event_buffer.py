@@ -0,0 +1,42 @@
+"""
+Event Ingestion Buffer - write-behind batching of CDP CustomerEvent writes
+"""
+from typing import Dict, List, Any
+
+from core.config import settings
+from core.write_behind import WriteBehindBuffer, BufferFull
+
+EventBufferFull = BufferFull
+
+def write_events(events: List[Dict[str, Any]]):
+    """Insert a flushed chunk and apply one computed-attribute update per profile
+
+    Events whose profile was merged away or deleted while they were buffered
+    are dead-lettered instead of being inserted against a missing profile.
+    """
+    from sqlalchemy import select
+    from core.database import get_db_context
+    from .unified_profile import CustomerDataPlatform, UnifiedProfile
+
+    with get_db_context() as db:
+        live = set(db.execute(
+            select(UnifiedProfile.id).where(UnifiedProfile.id.in_({event["profile_id"] for event in events}))
+        ).scalars())
+        orphans = [event for event in events if event["profile_id"] not in live]
+        if orphans:
+            event_buffer.dead_letter(orphans, "profile no longer exists")
+            events = [event for event in events if event["profile_id"] in live]
+        if events:
+            CustomerDataPlatform(db).track_events_bulk(events)
+
+event_buffer = WriteBehindBuffer(
+    "cdp-events",
+    write_events,
+    max_events=settings.CDP_EVENT_BUFFER_MAX_EVENTS,
+    flush_size=settings.CDP_EVENT_FLUSH_SIZE,
+    flush_interval=settings.CDP_EVENT_FLUSH_INTERVAL_SECONDS,
+    submit_timeout=settings.CDP_EVENT_SUBMIT_TIMEOUT_SECONDS,
+    log_path=settings.CDP_EVENT_LOG_PATH,
+    dead_letter_path=settings.CDP_EVENT_DEAD_LETTER_PATH,
+    datetime_fields=("timestamp",)
+)
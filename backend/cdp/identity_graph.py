@@ -0,0 +1,428 @@
+"""
+Identity Graph - bulk identity resolution for the Customer Data Platform
+"""
+from typing import Dict, List, Any, Optional, Set, Tuple, Iterable
+from datetime import datetime
+from dataclasses import dataclass, field
+from collections import defaultdict
+import logging
+import uuid
+from sqlalchemy import select, update, delete, insert, case, func, and_, or_, distinct
+
+from .unified_profile import (
+    CustomerDataPlatform, UnifiedProfile, CustomerIdentity, CustomerAttribute, CustomerEvent,
+    IdentityType, DataSource
+)
+from .activity_aggregates import activity_aggregator
+
+logger = logging.getLogger(__name__)
+
+IdentityKey = Tuple[str, str]  # (identity_type, identity_value)
+
+def identity_keys(identifiers: Dict[str, str]) -> List[IdentityKey]:
+    """Normalized (type, value) pairs for the non-empty identifiers"""
+    return [
+        (str(getattr(identity_type, "value", identity_type)), str(identity_value))
+        for identity_type, identity_value in identifiers.items() if identity_value
+    ]
+
+class UnionFind:
+    """Disjoint sets over hashable nodes with path halving and union by size"""
+
+    def __init__(self):
+        self.parent: Dict[Any, Any] = {}
+        self.size: Dict[Any, int] = {}
+
+    def add(self, node):
+        if node not in self.parent:
+            self.parent[node] = node
+            self.size[node] = 1
+
+    def find(self, node):
+        self.add(node)
+        while self.parent[node] != node:
+            self.parent[node] = self.parent[self.parent[node]]
+            node = self.parent[node]
+        return node
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def groups(self) -> Dict[Any, List[Any]]:
+        groups = defaultdict(list)
+        for node in self.parent:
+            groups[self.find(node)].append(node)
+        return groups
+
+class IdentityIndex:
+    """Hash map from (identity_type, identity_value) to the profiles holding it
+
+    Keys are loaded from customer_identities on first use, one statement per
+    chunk (served by idx_identity_lookup), and cached - including misses - for
+    the life of the index. Merged-away profiles are redirected to their master.
+    """
+
+    def __init__(self, db, confidence_threshold: float = 0.8, chunk_size: int = 1000):
+        self.db = db
+        self.confidence_threshold = confidence_threshold
+        self.chunk_size = chunk_size
+        self.entries: Dict[IdentityKey, Dict[str, float]] = {}  # key -> {profile_id: confidence}
+        self.redirects: Dict[str, str] = {}
+        self.lookups = 0
+
+    def load(self, keys: Iterable[IdentityKey]):
+        missing = [key for key in set(keys) if key not in self.entries]
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            values_by_type = defaultdict(list)
+            for identity_type, identity_value in chunk:
+                values_by_type[identity_type].append(identity_value)
+                self.entries[(identity_type, identity_value)] = {}
+
+            rows = self.db.execute(
+                select(
+                    CustomerIdentity.identity_type, CustomerIdentity.identity_value,
+                    CustomerIdentity.profile_id, CustomerIdentity.confidence_score
+                ).where(or_(*[
+                    and_(CustomerIdentity.identity_type == identity_type, CustomerIdentity.identity_value.in_(values))
+                    for identity_type, values in values_by_type.items()
+                ]))
+            )
+            self.lookups += 1
+            for identity_type, identity_value, profile_id, confidence in rows:
+                self.add((identity_type, identity_value), profile_id, confidence)
+
+    def add(self, key: IdentityKey, profile_id: str, confidence: Optional[float] = 1.0):
+        holders = self.entries.setdefault(key, {})
+        holders[profile_id] = max(holders.get(profile_id, 0.0), confidence if confidence is not None else 1.0)
+
+    def matches(self, key: IdentityKey) -> Set[str]:
+        """Profiles confidently identified by this key"""
+        return {
+            self.canonical(profile_id) for profile_id, confidence in self.entries.get(key, {}).items()
+            if confidence >= self.confidence_threshold
+        }
+
+    def holds(self, key: IdentityKey, profile_id: str) -> bool:
+        return any(self.canonical(holder) == profile_id for holder in self.entries.get(key, {}))
+
+    def canonical(self, profile_id: str) -> str:
+        while profile_id in self.redirects:
+            profile_id = self.redirects[profile_id]
+        return profile_id
+
+    def redirect(self, remap: Dict[str, str]):
+        self.redirects.update(remap)
+
+@dataclass
+class ProfileResolution:
+    """One connected component of the identity graph"""
+    profile_id: str                     # Surviving profile (pre-generated id when new)
+    is_new: bool
+    record_indexes: List[int]
+    merged_profile_ids: List[str] = field(default_factory=list)
+
+@dataclass
+class MergePlan:
+    """Which profile each record resolves to and which profiles must merge"""
+    resolutions: List[ProfileResolution]
+    assignments: List[Optional[str]]
+
+    def profile_ids(self) -> List[str]:
+        """Every existing profile the plan touches, including merged-away ones"""
+        return [
+            profile_id for resolution in self.resolutions if not resolution.is_new
+            for profile_id in [resolution.profile_id, *resolution.merged_profile_ids]
+        ]
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "records": len(self.assignments),
+            "profiles_created": sum(1 for resolution in self.resolutions if resolution.is_new),
+            "profiles_updated": sum(1 for resolution in self.resolutions if not resolution.is_new),
+            "profiles_merged": sum(len(resolution.merged_profile_ids) for resolution in self.resolutions),
+            "unresolved": sum(1 for profile_id in self.assignments if profile_id is None)
+        }
+
+@dataclass
+class BulkResolutionResult:
+    """Result of a bulk identity resolution or profile import"""
+    profile_ids: List[Optional[str]]
+    records: int
+    profiles_created: int
+    profiles_updated: int
+    profiles_merged: int
+    unresolved: int
+    identity_lookups: int
+
+class IdentityResolver:
+    """Resolves batches of identifier sets against the identity graph in one pass
+
+    Records, identity keys and existing profiles are nodes of a union-find:
+    each record is joined to its keys and each key to the profiles it
+    confidently identifies. Every resulting component becomes one profile -
+    new, existing, or the highest quality profile with the others merged
+    into it - and the plan is applied with bulk statements.
+    """
+
+    def __init__(self, cdp: CustomerDataPlatform, index: IdentityIndex = None):
+        self.cdp = cdp
+        self.db = cdp.db
+        self.index = index or IdentityIndex(cdp.db, cdp.identity_matching_threshold)
+
+    def plan(self, identifier_batches: List[Dict[str, str]], create_missing: bool = True) -> MergePlan:
+        keys_per_record = [identity_keys(identifiers or {}) for identifiers in identifier_batches]
+        self.index.load(key for keys in keys_per_record for key in keys)
+
+        graph = UnionFind()
+        for record_index, keys in enumerate(keys_per_record):
+            graph.add(("record", record_index))
+            for key in keys:
+                graph.union(("record", record_index), ("key", key))
+                for profile_id in self.index.matches(key):
+                    graph.union(("key", key), ("profile", profile_id))
+
+        components = []
+        existing_ids = set()
+        for nodes in graph.groups().values():
+            record_indexes = sorted(node[1] for node in nodes if node[0] == "record")
+            profile_ids = sorted(node[1] for node in nodes if node[0] == "profile")
+            if record_indexes:
+                components.append((record_indexes, profile_ids))
+                existing_ids.update(profile_ids)
+
+        existing_ids = sorted(existing_ids)
+        quality = {}
+        for start in range(0, len(existing_ids), 10000):
+            quality.update(self.db.execute(
+                select(UnifiedProfile.id, UnifiedProfile.data_quality_score).where(
+                    UnifiedProfile.id.in_(existing_ids[start:start + 10000])
+                )
+            ).all())
+
+        resolutions = []
+        assignments: List[Optional[str]] = [None] * len(identifier_batches)
+        for record_indexes, profile_ids in sorted(components):
+            profile_ids = [profile_id for profile_id in profile_ids if profile_id in quality]
+            if profile_ids:
+                master_id = max(profile_ids, key=lambda profile_id: quality[profile_id] or 0.0)
+                resolution = ProfileResolution(
+                    profile_id=master_id, is_new=False, record_indexes=record_indexes,
+                    merged_profile_ids=[profile_id for profile_id in profile_ids if profile_id != master_id]
+                )
+            elif create_missing:
+                resolution = ProfileResolution(profile_id=str(uuid.uuid4()), is_new=True, record_indexes=record_indexes)
+            else:
+                continue
+            resolutions.append(resolution)
+            for record_index in record_indexes:
+                assignments[record_index] = resolution.profile_id
+
+        return MergePlan(resolutions=resolutions, assignments=assignments)
+
+    def apply(self, plan: MergePlan, records: List[Dict[str, Any]] = None,
+              data_source: DataSource = DataSource.IMPORT):
+        """Execute a plan; records carry ``identifiers`` and ``profile_data`` per input row"""
+        now = datetime.now()
+        existing_ids = sorted(set(plan.profile_ids()))
+        profiles = {}
+        for start in range(0, len(existing_ids), 10000):
+            profiles.update(
+                (profile.id, profile) for profile in self.db.execute(
+                    select(UnifiedProfile).where(UnifiedProfile.id.in_(existing_ids[start:start + 10000]))
+                ).scalars()
+            )
+
+        touched = self._apply_merges(plan, profiles, now)
+        if records is not None:
+            touched |= self._apply_records(plan, records, profiles, data_source, now)
+
+        for profile_id, score in self._data_quality_scores([profiles[profile_id] for profile_id in touched]).items():
+            profiles[profile_id].data_quality_score = score
+
+    def _apply_merges(self, plan: MergePlan, profiles: Dict[str, UnifiedProfile], now: datetime) -> Set[str]:
+        remap = {}
+        for resolution in plan.resolutions:
+            if not resolution.merged_profile_ids:
+                continue
+            master = profiles[resolution.profile_id]
+            merged_data = dict(master.profile_data or {})
+            for other_id in resolution.merged_profile_ids:
+                for key, value in (profiles[other_id].profile_data or {}).items():
+                    if key not in merged_data:
+                        merged_data[key] = value
+                    elif merged_data[key] != value and self.cdp._should_prefer_new_value(key, merged_data[key], value):
+                        merged_data[key] = value
+                master.primary_email = master.primary_email or profiles[other_id].primary_email
+                master.primary_phone = master.primary_phone or profiles[other_id].primary_phone
+                remap[other_id] = master.id
+            master.profile_data = merged_data
+            master.last_merged_at = now
+
+        if not remap:
+            return set()
+
+        merged_ids = list(remap)
+        for profile_id in merged_ids:
+            self.db.expunge(profiles.pop(profile_id))
+        for start in range(0, len(merged_ids), 10000):
+            chunk = merged_ids[start:start + 10000]
+            chunk_remap = {profile_id: remap[profile_id] for profile_id in chunk}
+            for model in (CustomerIdentity, CustomerAttribute, CustomerEvent):
+                self.db.execute(
+                    update(model).where(model.profile_id.in_(chunk)).values(
+                        profile_id=case(chunk_remap, value=model.profile_id)
+                    ), execution_options={"synchronize_session": False}
+                )
+            self.db.execute(
+                delete(UnifiedProfile).where(UnifiedProfile.id.in_(chunk)),
+                execution_options={"synchronize_session": False}
+            )
+        activity_aggregator.merge_profiles(self.db, remap)
+        self.index.redirect(remap)
+        logger.info(f"Merged {len(merged_ids)} profiles into {len(set(remap.values()))} masters")
+        return set(remap.values())
+
+    def _apply_records(self, plan: MergePlan, records: List[Dict[str, Any]], profiles: Dict[str, UnifiedProfile],
+                       data_source: DataSource, now: datetime) -> Set[str]:
+        identity_rows = []
+        attribute_values: Dict[Tuple[str, str], Any] = {}
+        new_profiles = []
+
+        for resolution in plan.resolutions:
+            if resolution.is_new:
+                profile = UnifiedProfile(
+                    id=resolution.profile_id,
+                    master_customer_id=self.cdp._generate_master_id(),
+                    profile_data={},
+                    computed_attributes={},
+                    preferences={}
+                )
+                profiles[profile.id] = profile
+                new_profiles.append(profile)
+            profile = profiles[resolution.profile_id]
+            profile_data = dict(profile.profile_data or {})
+
+            for record_index in resolution.record_indexes:
+                record = records[record_index]
+                identifiers = record.get("identifiers") or {}
+                for key, new_value in (record.get("profile_data") or {}).items():
+                    if key not in profile_data or profile_data[key] == new_value or \
+                            self.cdp._should_prefer_new_value(key, profile_data[key], new_value):
+                        profile_data[key] = new_value
+                    if new_value is not None:
+                        attribute_values[(profile.id, key)] = new_value
+
+                for identity_type, identity_value in identity_keys(identifiers):
+                    if self.index.holds((identity_type, identity_value), profile.id):
+                        continue
+                    self.index.add((identity_type, identity_value), profile.id)
+                    identity_rows.append({
+                        "profile_id": profile.id,
+                        "identity_type": identity_type,
+                        "identity_value": identity_value,
+                        "data_source": data_source.value,
+                        "confidence_score": 1.0,
+                        "verified": resolution.is_new and identity_type in (IdentityType.EMAIL.value, IdentityType.PHONE.value),
+                        "first_seen": now,
+                        "last_seen": now
+                    })
+                    if identity_type == IdentityType.EMAIL.value and not profile.primary_email:
+                        profile.primary_email = identity_value
+                    elif identity_type == IdentityType.PHONE.value and not profile.primary_phone:
+                        profile.primary_phone = identity_value
+
+            profile.profile_data = profile_data
+            profile.updated_at = now
+
+        self.db.add_all(new_profiles)
+        self.db.flush()  # Profiles must exist before identities/attributes reference them
+
+        if identity_rows:
+            self.db.execute(insert(CustomerIdentity), identity_rows)
+        self._upsert_attributes(attribute_values, data_source, now)
+        return {resolution.profile_id for resolution in plan.resolutions}
+
+    def _upsert_attributes(self, attribute_values: Dict[Tuple[str, str], Any], data_source: DataSource, now: datetime):
+        """Update the (profile, attribute, source) rows that exist and insert the rest"""
+        if not attribute_values:
+            return
+        profile_ids = list({profile_id for profile_id, _ in attribute_values})
+        existing = {}
+        for start in range(0, len(profile_ids), 1000):
+            for attribute_id, profile_id, attribute_name in self.db.execute(
+                select(CustomerAttribute.id, CustomerAttribute.profile_id, CustomerAttribute.attribute_name).where(
+                    CustomerAttribute.profile_id.in_(profile_ids[start:start + 1000]),
+                    CustomerAttribute.data_source == data_source.value
+                )
+            ):
+                existing[(profile_id, attribute_name)] = attribute_id
+
+        updates, inserts = [], []
+        for (profile_id, attribute_name), value in attribute_values.items():
+            attribute_id = existing.get((profile_id, attribute_name))
+            if attribute_id is not None:
+                updates.append({"id": attribute_id, "attribute_value": str(value), "source_timestamp": now})
+            else:
+                inserts.append({
+                    "profile_id": profile_id,
+                    "attribute_name": attribute_name,
+                    "attribute_value": str(value),
+                    "data_source": data_source.value,
+                    "source_timestamp": now,
+                    "confidence_score": 1.0,
+                    "is_pii": self.cdp._is_pii_field(attribute_name),
+                    "created_at": now
+                })
+        if updates:
+            self.db.execute(update(CustomerAttribute), updates)
+        if inserts:
+            self.db.execute(insert(CustomerAttribute), inserts)
+
+    def _data_quality_scores(self, profiles: List[UnifiedProfile]) -> Dict[str, float]:
+        """CustomerDataPlatform._calculate_data_quality_score for many profiles with grouped queries"""
+        if not profiles:
+            return {}
+        self.db.flush()
+        profile_ids = [profile.id for profile in profiles]
+        identity_counts, conflicts = {}, defaultdict(int)
+        for start in range(0, len(profile_ids), 1000):
+            chunk = profile_ids[start:start + 1000]
+            for profile_id, total, verified in self.db.execute(
+                select(
+                    CustomerIdentity.profile_id, func.count(),
+                    func.sum(case((CustomerIdentity.verified == True, 1), else_=0))
+                ).where(CustomerIdentity.profile_id.in_(chunk)).group_by(CustomerIdentity.profile_id)
+            ):
+                identity_counts[profile_id] = (total, verified or 0)
+            for profile_id, _ in self.db.execute(
+                select(CustomerAttribute.profile_id, CustomerAttribute.attribute_name).where(
+                    CustomerAttribute.profile_id.in_(chunk)
+                ).group_by(CustomerAttribute.profile_id, CustomerAttribute.attribute_name).having(
+                    func.count(distinct(CustomerAttribute.attribute_value)) > 1
+                )
+            ):
+                conflicts[profile_id] += 1
+
+        weights = self.cdp.data_quality_weights
+        scores = {}
+        for profile in profiles:
+            total, verified = identity_counts.get(profile.id, (0, 0))
+            completeness = self.cdp._completeness_of(profile)
+            accuracy = (verified / max(1, total)) * 100
+            consistency = max(0, 100 - (conflicts[profile.id] * 10))
+            freshness = max(0, 100 - ((datetime.now() - (profile.updated_at or datetime.now())).days * 2))
+            scores[profile.id] = min(100, max(0, (
+                completeness * weights['completeness'] +
+                accuracy * weights['accuracy'] +
+                consistency * weights['consistency'] +
+                freshness * weights['freshness']
+            )))
+        return scores
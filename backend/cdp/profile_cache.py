@@ -0,0 +1,56 @@
+"""
+Profile Cache - versioned read-through cache for unified profile sections
+"""
+from typing import Dict, Any, Callable
+import logging
+
+from core.cache import cache
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Sections of get_unified_profile that can be requested and cached independently
+PROFILE_SECTIONS = ("profile", "identities", "attributes", "recent_activity", "computed_attributes")
+
+class ProfileCache:
+    """Caches each section of a unified profile under a per-profile version
+
+    Keys look like ``cdp:profile:<id>:v<version>:<section>``. Writers call
+    ``invalidate`` after committing: the version held in Redis is bumped, so
+    a reader that loaded pre-commit data stores it under a version nobody
+    reads any more, and the profile's tag is dropped from both cache tiers.
+    Without Redis the version stays at 0 and only tag invalidation applies.
+    """
+
+    def __init__(self, ttl: int = 300, enabled: bool = True):
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def get_section(self, profile_id: str, section: str, loader: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return loader()
+        key = f"cdp:profile:{profile_id}:v{self.version(profile_id)}:{section}"
+        return cache.get_or_set(key, loader, ttl=self.ttl, tags=[self._tag(profile_id)])
+
+    def version(self, profile_id: str) -> int:
+        return cache.get(self._version_key(profile_id)) or 0
+
+    def invalidate(self, *profile_ids: str):
+        """Drop cached sections of the given profiles (call after the write commits)"""
+        if not self.enabled:
+            return
+        for profile_id in set(filter(None, profile_ids)):
+            try:
+                cache.set(self._version_key(profile_id), self.version(profile_id) + 1,
+                          ttl=max(self.ttl * 2, 3600), local=False)
+                cache.invalidate_tags(self._tag(profile_id))
+            except Exception as e:
+                logger.error(f"Error invalidating cached profile {profile_id}: {e}")
+
+    def _tag(self, profile_id: str) -> str:
+        return f"cdp:profile:{profile_id}"
+
+    def _version_key(self, profile_id: str) -> str:
+        return f"cdp:profile_version:{profile_id}"
+
+profile_cache = ProfileCache(ttl=settings.CDP_PROFILE_CACHE_TTL, enabled=settings.CDP_PROFILE_CACHE_ENABLED)
@@ -9,13 +9,17 @@ import logging
 import hashlib
 import uuid
 from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean, Index
+from sqlalchemy import select, insert
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from dataclasses import dataclass, asdict
 import numpy as np
 from collections import defaultdict
 
-from core.database import Base, get_db
+from core.config import settings
+from core.database import Base, get_db, get_db_context
+from .activity_aggregates import activity_aggregator
+from .profile_cache import profile_cache, PROFILE_SECTIONS
 
 logger = logging.getLogger(__name__)
 
@@ -145,21 +149,16 @@ class CustomerDataPlatform:
     def resolve_identity(self, identifiers: Dict[str, str]) -> Optional[str]:
         """Resolve customer identity across multiple identifiers"""
         try:
-            potential_profiles = set()
+            from .identity_graph import IdentityIndex, identity_keys
             
-            # Look up each identifier
-            for identity_type, identity_value in identifiers.items():
-                if not identity_value:
-                    continue
-                
-                identities = self.db.query(CustomerIdentity).filter(
-                    CustomerIdentity.identity_type == identity_type,
-                    CustomerIdentity.identity_value == identity_value
-                ).all()
-                
-                for identity in identities:
-                    if identity.confidence_score >= self.identity_matching_threshold:
-                        potential_profiles.add(identity.profile_id)
+            # Look up all identifiers in one statement
+            keys = identity_keys(identifiers)
+            index = IdentityIndex(self.db, self.identity_matching_threshold)
+            index.load(keys)
+            
+            potential_profiles = set()
+            for key in keys:
+                potential_profiles.update(index.matches(key))
             
             if not potential_profiles:
                 return None
@@ -174,6 +173,68 @@ class CustomerDataPlatform:
             logger.error(f"Error resolving identity: {e}")
             return None
     
+    def resolve_identities_bulk(self, identifier_batches: List[Dict[str, str]]) -> "BulkResolutionResult":
+        """Resolve many identifier sets in one pass, merging profiles found to be the same customer"""
+        try:
+            from .identity_graph import IdentityResolver, BulkResolutionResult
+            
+            resolver = IdentityResolver(self)
+            plan = resolver.plan(identifier_batches, create_missing=False)
+            resolver.apply(plan)
+            self.db.commit()
+            profile_cache.invalidate(*plan.profile_ids())
+            
+            return BulkResolutionResult(
+                profile_ids=plan.assignments,
+                identity_lookups=resolver.index.lookups,
+                **plan.summary()
+            )
+            
+        except Exception as e:
+            logger.error(f"Error resolving identities in bulk: {e}")
+            self.db.rollback()
+            raise
+    
+    def create_unified_profiles_bulk(self, records: List[Dict[str, Any]],
+                                     data_source: DataSource = DataSource.IMPORT,
+                                     chunk_size: int = 5000) -> "BulkResolutionResult":
+        """Create or update profiles for many records ({"identifiers", "profile_data"}), committing per chunk"""
+        from .identity_graph import IdentityResolver, BulkResolutionResult
+        
+        resolver = IdentityResolver(self)
+        profile_ids: List[Optional[str]] = []
+        totals = defaultdict(int)
+        
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            try:
+                plan = resolver.plan([record.get("identifiers") or {} for record in chunk])
+                resolver.apply(plan, chunk, data_source)
+                self.db.commit()
+                profile_cache.invalidate(*plan.profile_ids())
+            except Exception as e:
+                logger.error(f"Error creating unified profiles (records {start}-{start + len(chunk)}): {e}")
+                self.db.rollback()
+                raise
+            
+            profile_ids.extend(plan.assignments)
+            for name, value in plan.summary().items():
+                totals[name] += value
+        
+        # Profiles merged by a later chunk resolve to their surviving master
+        profile_ids = [resolver.index.canonical(profile_id) if profile_id else None for profile_id in profile_ids]
+        logger.info(f"Bulk profile import: {dict(totals)}, {resolver.index.lookups} identity lookups")
+        
+        return BulkResolutionResult(
+            profile_ids=profile_ids,
+            records=len(records),
+            profiles_created=totals["profiles_created"],
+            profiles_updated=totals["profiles_updated"],
+            profiles_merged=totals["profiles_merged"],
+            unresolved=totals["unresolved"],
+            identity_lookups=resolver.index.lookups
+        )
+    
     def create_unified_profile(self, profile_data: Dict[str, Any], 
                              identifiers: Dict[str, str],
                              data_source: DataSource) -> str:
@@ -310,6 +371,7 @@ class CustomerDataPlatform:
             profile.updated_at = datetime.now()
             
             self.db.commit()
+            profile_cache.invalidate(profile_id)
             
             logger.info(f"Updated profile {profile_id}, resolved {conflicts_resolved} conflicts")
             return profile_id
@@ -320,8 +382,9 @@ class CustomerDataPlatform:
             raise
     
     def get_unified_profile(self, profile_id: str = None, 
-                          identifiers: Dict[str, str] = None) -> Dict[str, Any]:
-        """Get complete unified customer profile"""
+                          identifiers: Dict[str, str] = None,
+                          projection: List[str] = None) -> Dict[str, Any]:
+        """Get complete unified customer profile, or only the sections named in projection"""
         try:
             if not profile_id and identifiers:
                 profile_id = self.resolve_identity(identifiers)
@@ -329,6 +392,32 @@ class CustomerDataPlatform:
             if not profile_id:
                 return None
             
+            sections = list(projection or PROFILE_SECTIONS)
+            unknown = set(sections) - set(PROFILE_SECTIONS)
+            if unknown:
+                raise ValueError(f"Unknown profile sections: {sorted(unknown)}")
+            
+            result = {"profile_id": profile_id}
+            for section in sections:
+                value = profile_cache.get_section(
+                    profile_id, section, lambda section=section: self._load_profile_section(profile_id, section)
+                )
+                if section == "profile":
+                    if value is None:
+                        return None
+                    result.update(value)
+                else:
+                    result[section] = value
+            
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error getting unified profile: {e}")
+            raise
+    
+    def _load_profile_section(self, profile_id: str, section: str) -> Any:
+        """Build one section of the unified profile from the database"""
+        if section == "profile":
             profile = self.db.query(UnifiedProfile).filter(
                 UnifiedProfile.id == profile_id
             ).first()
@@ -336,93 +425,138 @@ class CustomerDataPlatform:
             if not profile:
                 return None
             
-            # Get all identities
-            identities = self.db.query(CustomerIdentity).filter(
-                CustomerIdentity.profile_id == profile_id
-            ).all()
-            
-            # Get all attributes
-            attributes = self.db.query(CustomerAttribute).filter(
-                CustomerAttribute.profile_id == profile_id
-            ).order_by(CustomerAttribute.created_at.desc()).all()
-            
-            # Get recent events
-            recent_events = self.db.query(CustomerEvent).filter(
-                CustomerEvent.profile_id == profile_id
-            ).order_by(CustomerEvent.timestamp.desc()).limit(100).all()
-            
-            # Compute real-time attributes
-            computed_attributes = self._compute_profile_attributes(profile_id)
-            
             return {
-                "profile_id": profile.id,
                 "master_customer_id": profile.master_customer_id,
                 "primary_email": profile.primary_email,
                 "primary_phone": profile.primary_phone,
                 "profile_data": profile.profile_data,
-                "computed_attributes": computed_attributes,
                 "preferences": profile.preferences,
                 "data_quality_score": profile.data_quality_score,
-                "identities": [
-                    {
-                        "type": identity.identity_type,
-                        "value": identity.identity_value,
-                        "source": identity.data_source,
-                        "confidence": identity.confidence_score,
-                        "verified": identity.verified
-                    } for identity in identities
-                ],
-                "attributes": [
-                    {
-                        "name": attr.attribute_name,
-                        "value": attr.attribute_value,
-                        "source": attr.data_source,
-                        "timestamp": attr.source_timestamp.isoformat() if attr.source_timestamp else None,
-                        "confidence": attr.confidence_score
-                    } for attr in attributes
-                ],
-                "recent_activity": [
-                    {
-                        "event_type": event.event_type,
-                        "event_name": event.event_name,
-                        "timestamp": event.timestamp.isoformat(),
-                        "source": event.data_source,
-                        "data": event.event_data
-                    } for event in recent_events[:20]
-                ],
                 "last_updated": profile.updated_at.isoformat(),
-                "profile_completeness": self._calculate_profile_completeness(profile_id)
+                "profile_completeness": self._completeness_of(profile)
             }
+        
+        if section == "identities":
+            identities = self.db.query(CustomerIdentity).filter(
+                CustomerIdentity.profile_id == profile_id
+            ).all()
             
-        except Exception as e:
-            logger.error(f"Error getting unified profile: {e}")
-            raise
+            return [
+                {
+                    "type": identity.identity_type,
+                    "value": identity.identity_value,
+                    "source": identity.data_source,
+                    "confidence": identity.confidence_score,
+                    "verified": identity.verified
+                } for identity in identities
+            ]
+        
+        if section == "attributes":
+            attributes = self.db.query(CustomerAttribute).filter(
+                CustomerAttribute.profile_id == profile_id
+            ).order_by(CustomerAttribute.created_at.desc()).all()
+            
+            return [
+                {
+                    "name": attr.attribute_name,
+                    "value": attr.attribute_value,
+                    "source": attr.data_source,
+                    "timestamp": attr.source_timestamp.isoformat() if attr.source_timestamp else None,
+                    "confidence": attr.confidence_score
+                } for attr in attributes
+            ]
+        
+        if section == "recent_activity":
+            recent_events = self.db.query(CustomerEvent).filter(
+                CustomerEvent.profile_id == profile_id
+            ).order_by(CustomerEvent.timestamp.desc()).limit(20).all()
+            
+            return [
+                {
+                    "event_type": event.event_type,
+                    "event_name": event.event_name,
+                    "timestamp": event.timestamp.isoformat(),
+                    "source": event.data_source,
+                    "data": event.event_data
+                } for event in recent_events
+            ]
+        
+        # Compute real-time attributes
+        return self._compute_profile_attributes(profile_id)
     
     def track_event(self, profile_id: str, event_type: str, event_name: str,
                    event_data: Dict[str, Any], data_source: DataSource,
-                   session_id: str = None) -> str:
-        """Track customer event in unified profile"""
+                   session_id: str = None, buffered: Optional[bool] = None) -> str:
+        """Track customer event in unified profile
+
+        Buffered events (the default while CDP_EVENT_BUFFER_ENABLED is set) are
+        handed to the write-behind ingestion buffer and written with the next
+        bulk flush; while the buffer is not running they are written directly.
+        An event the full buffer cannot take is written directly as well, so
+        the returned id always belongs to an accepted event.
+        """
+        event = {
+            "id": str(uuid.uuid4()),
+            "profile_id": profile_id,
+            "event_type": event_type,
+            "event_name": event_name,
+            "event_data": event_data,
+            "data_source": data_source.value,
+            "session_id": session_id or str(uuid.uuid4()),
+            "timestamp": datetime.now()
+        }
+        if buffered is None:
+            buffered = settings.CDP_EVENT_BUFFER_ENABLED
+        if buffered:
+            from .event_buffer import event_buffer, EventBufferFull
+            if event_buffer.running:
+                try:
+                    event_buffer.submit(event)
+                    return event["id"]
+                except EventBufferFull as e:
+                    logger.warning(f"Event buffer full, writing event {event['id']} directly: {e}")
+        return self.track_events_bulk([event])[0]
+    
+    def track_events_bulk(self, events: List[Dict[str, Any]]) -> List[str]:
+        """Insert many events and apply one computed-attribute update per profile
+
+        Events already stored (same id) are skipped, so replays are harmless.
+        """
         try:
-            event = CustomerEvent(
-                profile_id=profile_id,
-                event_type=event_type,
-                event_name=event_name,
-                event_data=event_data,
-                data_source=data_source.value,
-                session_id=session_id or str(uuid.uuid4())
-            )
-            
-            self.db.add(event)
-            
-            # Update computed attributes based on event
-            self._update_computed_attributes(profile_id, event_type, event_data)
+            rows = [{
+                "id": event.get("id") or str(uuid.uuid4()),
+                "profile_id": event["profile_id"],
+                "event_type": event["event_type"],
+                "event_name": event.get("event_name"),
+                "event_data": event.get("event_data") or {},
+                "data_source": getattr(event.get("data_source"), "value", event.get("data_source")),
+                "timestamp": event.get("timestamp") or datetime.now(),
+                "session_id": event.get("session_id") or str(uuid.uuid4()),
+                "device_info": event.get("device_info"),
+                "location_data": event.get("location_data")
+            } for event in events]
+            
+            stored = set(self.db.execute(
+                select(CustomerEvent.id).where(CustomerEvent.id.in_([row["id"] for row in rows]))
+            ).scalars())
+            new_rows = [row for row in rows if row["id"] not in stored]
+            
+            if new_rows:
+                self.db.execute(insert(CustomerEvent), new_rows)
+                
+                # Roll the events into the profiles' daily activity buckets
+                activity_aggregator.record(self.db, new_rows)
+                
+                # Update computed attributes based on events
+                self._update_computed_attributes(new_rows)
             
             self.db.commit()
+            profile_cache.invalidate(*{row["profile_id"] for row in new_rows})
             
-            return event.id
+            return [row["id"] for row in rows]
             
         except Exception as e:
-            logger.error(f"Error tracking event: {e}")
+            logger.error(f"Error tracking events: {e}")
             self.db.rollback()
             raise
     
@@ -492,6 +626,9 @@ class CustomerDataPlatform:
                     CustomerEvent.profile_id == profile.id
                 ).update({"profile_id": master_profile.id})
             
+            # Fold activity aggregates into the master
+            activity_aggregator.merge_profiles(self.db, {profile.id: master_profile.id for profile in other_profiles})
+            
             # Delete other profiles
             for profile in other_profiles:
                 self.db.delete(profile)
@@ -504,6 +641,7 @@ class CustomerDataPlatform:
             quality_improvement = final_quality - initial_quality
             
             self.db.commit()
+            profile_cache.invalidate(*profile_ids)
             
             return ProfileMergeResult(
                 success=True,
@@ -693,96 +831,85 @@ class CustomerDataPlatform:
             if not profile:
                 return 0.0
             
-            essential_fields = [
-                "name", "email", "phone", "age", "gender", 
-                "city", "country", "preferences"
-            ]
-            
-            filled_fields = 0
-            total_fields = len(essential_fields)
-            
-            profile_data = profile.profile_data or {}
-            
-            for field in essential_fields:
-                if field in profile_data and profile_data[field]:
-                    filled_fields += 1
-                elif field == "email" and profile.primary_email:
-                    filled_fields += 1
-                elif field == "phone" and profile.primary_phone:
-                    filled_fields += 1
-            
-            return (filled_fields / total_fields) * 100
+            return self._completeness_of(profile)
             
         except Exception as e:
             logger.error(f"Error calculating profile completeness: {e}")
             return 0.0
     
+    def _completeness_of(self, profile: UnifiedProfile) -> float:
+        """Completeness percentage of an already loaded profile"""
+        essential_fields = [
+            "name", "email", "phone", "age", "gender", 
+            "city", "country", "preferences"
+        ]
+        
+        filled_fields = 0
+        total_fields = len(essential_fields)
+        
+        profile_data = profile.profile_data or {}
+        
+        for field in essential_fields:
+            if field in profile_data and profile_data[field]:
+                filled_fields += 1
+            elif field == "email" and profile.primary_email:
+                filled_fields += 1
+            elif field == "phone" and profile.primary_phone:
+                filled_fields += 1
+        
+        return (filled_fields / total_fields) * 100
+    
     def _compute_profile_attributes(self, profile_id: str) -> Dict[str, Any]:
-        """Compute real-time profile attributes"""
+        """Compute real-time profile attributes from the rolling activity buckets"""
         try:
-            # Get recent events
-            events = self.db.query(CustomerEvent).filter(
-                CustomerEvent.profile_id == profile_id,
-                CustomerEvent.timestamp >= datetime.now() - timedelta(days=30)
-            ).all()
-            
-            # Compute attributes
-            computed = {
-                "total_events_30d": len(events),
-                "unique_sessions_30d": len(set(e.session_id for e in events if e.session_id)),
-                "last_activity": events[0].timestamp.isoformat() if events else None,
+            # Profiles not seen since the buckets existed are rebuilt from their events first,
+            # in a session of their own so this read never commits the caller's transaction
+            if activity_aggregator.needs_backfill(self.db, [profile_id]):
+                with get_db_context() as backfill_db:
+                    activity_aggregator.backfill(backfill_db, [profile_id])
+            computed = activity_aggregator.computed_attributes(self.db, profile_id)
+            
+            return computed or {
+                "total_events_30d": 0,
+                "unique_sessions_30d": 0,
+                "last_activity": None,
                 "most_common_event": None,
                 "preferred_channel": None,
                 "activity_score": 0
             }
             
-            if events:
-                # Most common event type
-                event_counts = defaultdict(int)
-                source_counts = defaultdict(int)
-                
-                for event in events:
-                    event_counts[event.event_type] += 1
-                    source_counts[event.data_source] += 1
-                
-                computed["most_common_event"] = max(event_counts.items(), key=lambda x: x[1])[0]
-                computed["preferred_channel"] = max(source_counts.items(), key=lambda x: x[1])[0]
-                
-                # Activity score (0-100)
-                unique_days = len(set(e.timestamp.date() for e in events))
-                computed["activity_score"] = min(100, (unique_days / 30) * 100)
-            
-            return computed
-            
         except Exception as e:
             logger.error(f"Error computing profile attributes: {e}")
             return {}
     
-    def _update_computed_attributes(self, profile_id: str, event_type: str, event_data: Dict[str, Any]):
-        """Update computed attributes based on new event"""
+    def _update_computed_attributes(self, events: List[Dict[str, Any]]):
+        """Update computed attributes based on new events, one write per profile"""
         try:
-            profile = self.db.query(UnifiedProfile).filter(
-                UnifiedProfile.id == profile_id
-            ).first()
-            
-            if not profile:
-                return
-            
-            computed = profile.computed_attributes or {}
-            
-            # Update last activity
-            computed["last_activity"] = datetime.now().isoformat()
-            
-            # Update event counters
-            computed["total_events"] = computed.get("total_events", 0) + 1
+            by_profile = defaultdict(list)
+            for event in events:
+                by_profile[event["profile_id"]].append(event)
             
-            # Update preferences based on event
-            if event_type == "email_click":
-                preferences = profile.preferences or {}
-                preferences["email_engagement"] = True
-                profile.preferences = preferences
+            profiles = self.db.query(UnifiedProfile).filter(
+                UnifiedProfile.id.in_(list(by_profile))
+            ).all()
             
-            profile.computed_attributes = computed
+            for profile in profiles:
+                profile_events = by_profile[profile.id]
+                computed = dict(profile.computed_attributes or {})
+                
+                # Update last activity
+                computed["last_activity"] = max(event["timestamp"] for event in profile_events).isoformat()
+                
+                # Update event counters
+                computed["total_events"] = computed.get("total_events", 0) + len(profile_events)
+                
+                # Update preferences based on events
+                if any(event["event_type"] == "email_click" for event in profile_events):
+                    preferences = dict(profile.preferences or {})
+                    preferences["email_engagement"] = True
+                    profile.preferences = preferences
+                
+                profile.computed_attributes = computed
             
         except Exception as e:
             logger.error(f"Error updating computed attributes: {e}")
@@ -2,12 +2,14 @@
 """Core system components and utilities."""
 
 from .config import settings
-from .database import get_db, init_database
+from .database import get_db, get_async_db, run_with_db, init_database
 from .security import security_manager, get_current_user
 
 __all__ = [
     "settings",
     "get_db", 
+    "get_async_db",
+    "run_with_db",
     "init_database",
     "security_manager",
     "get_current_user"
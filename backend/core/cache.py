@@ -0,0 +1,372 @@
+"""
+Two-tier cache: bounded in-process LRU/TTL tier in front of Redis
+"""
+import asyncio
+import functools
+import json
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import redis
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis setup
+redis_client = redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+_MISSING = object()
+
+class _CachedNone:
+    """Stored in place of None so a cached None is told apart from a miss (pickles as the singleton)"""
+
+    def __reduce__(self):
+        return "_NONE"
+
+_NONE = _CachedNone()
+
+class LocalCache:
+    """Thread-safe bounded LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float, tags: Tuple[str, ...] = ()):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value, tags)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def delete_tagged(self, tag: str) -> int:
+        with self._lock:
+            keys = [key for key, (_, _, tags) in self._entries.items() if tag in tags]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class CacheManager:
+    """Two-tier cache with single-flight recomputation and tag invalidation
+
+    Reads go local tier -> Redis -> loader. Values are pickled (protocol 5);
+    legacy JSON values already in Redis are still readable. Local entries live
+    at most ``local_ttl`` seconds so other workers' invalidations are picked up
+    quickly; pass ``local=False`` for data that must never be served stale
+    (e.g. sessions). When Redis is unreachable the cache degrades to the local
+    tier and retries Redis after ``redis_retry_interval`` seconds. A loader
+    result of None is cached like any other value.
+    """
+
+    def __init__(self, redis_conn=None, max_local_entries: int = 10000, local_ttl: int = 30):
+        self.redis = redis_conn if redis_conn is not None else redis_client
+        self.default_ttl = 3600  # 1 hour
+        self.local_ttl = local_ttl
+        self.lock_ttl = 30  # Seconds a recompute lock is held at most
+        self.lock_wait = 5.0  # Seconds a waiter polls for another worker's result
+        self.redis_retry_interval = 30
+        self.local = LocalCache(max_local_entries)
+
+        self._redis_down_until = 0.0
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_guard = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "recomputes": 0,
+            "redis_errors": 0,
+            "get_latency_total_ms": 0.0,
+            "get_count": 0
+        }
+
+    # Public API
+    def get(self, key: str):
+        """Get value from cache"""
+        value = self._lookup(key)
+        return None if value is _MISSING else value
+
+    def set(self, key: str, value: Any, ttl: int = None, tags: Iterable[str] = (), local: bool = True):
+        """Set value in cache"""
+        ttl = ttl or self.default_ttl
+        tags = tuple(tags)
+        value = _NONE if value is None else value
+        self._count("sets")
+
+        if local:
+            self.local.set(key, value, min(ttl, self.local_ttl), tags)
+
+        def _write(r):
+            pipe = r.pipeline()
+            pipe.setex(key, ttl, self._dumps(value, local, tags))
+            for tag in tags:
+                pipe.sadd(self._tag_key(tag), key)
+                pipe.expire(self._tag_key(tag), max(ttl, self.default_ttl))
+            pipe.execute()
+            return True
+
+        return bool(self._redis_call(_write)) or local
+
+    def delete(self, key: str):
+        """Delete key from cache"""
+        removed_locally = self.local.delete(key)
+        removed = self._redis_call(lambda r: r.delete(key))
+        return removed if removed is not None else removed_locally
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Delete every key stored under any of the given tags"""
+        removed = 0
+        for tag in tags:
+            removed += self.local.delete_tagged(tag)
+
+            def _invalidate(r, tag=tag):
+                keys = list(r.smembers(self._tag_key(tag)))
+                if keys:
+                    r.delete(*keys)
+                r.delete(self._tag_key(tag))
+                return len(keys)
+
+            removed += self._redis_call(_invalidate) or 0
+        return removed
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: int = None,
+                   tags: Iterable[str] = (), local: bool = True) -> Any:
+        """Return the cached value or compute it once across threads and workers"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        with self._key_lock(key):
+            value, _ = self._read(key)
+            if value is not _MISSING:
+                return value
+
+            token = self._acquire_recompute_lock(key)
+            if token is None:
+                # Another worker is recomputing; wait briefly for its result
+                value = self._wait_for_value(key)
+                if value is not _MISSING:
+                    return value
+
+            try:
+                self._count("recomputes")
+                value = loader()
+                self.set(key, value, ttl, tags, local)
+                return value
+            finally:
+                if token is not None:
+                    self._release_recompute_lock(key, token)
+
+    async def aget_or_set(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int = None,
+                          tags: Iterable[str] = (), local: bool = True) -> Any:
+        """Async get_or_set: concurrent coroutines for one key share a single loader call
+
+        Redis calls run on a worker thread so a slow Redis never blocks the event loop.
+        """
+        value = await self._alookup(key)
+        if value is not _MISSING:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            token = await self._off_loop(self._acquire_recompute_lock, key)
+            if token is None:
+                value = await self._await_value(key)
+                if value is not _MISSING:
+                    future.set_result(value)
+                    return value
+            try:
+                self._count("recomputes")
+                value = await loader()
+                await self._off_loop(self.set, key, value, ttl, tags, local)
+            finally:
+                if token is not None:
+                    await self._off_loop(self._release_recompute_lock, key, token)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # Mark retrieved so an unawaited failure is not logged
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss/latency counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else 0.0,
+            "avg_get_latency_ms": stats["get_latency_total_ms"] / stats["get_count"] if stats["get_count"] else 0.0,
+            "local_entries": len(self.local),
+            "redis_available": self.redis_available
+        }
+
+    @property
+    def redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_down_until
+
+    # Helpers
+    def _read(self, key: str) -> Tuple[Any, Optional[str]]:
+        """Read through both tiers; returns (value or _MISSING, tier it came from)"""
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return (None if value is _NONE else value), "local"
+
+        raw = self._redis_call(lambda r: r.get(key))
+        if raw is None:
+            return _MISSING, None
+
+        value, local, tags = self._loads(raw)
+        if local:
+            self.local.set(key, value, self.local_ttl, tags)
+        return (None if value is _NONE else value), "redis"
+
+    async def _aread(self, key: str) -> Tuple[Any, Optional[str]]:
+        """_read for async callers: the local tier on the event loop, Redis on a worker thread"""
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return (None if value is _NONE else value), "local"
+        if not self.redis_available:
+            return _MISSING, None
+        return await self._off_loop(self._read, key)
+
+    def _lookup(self, key: str) -> Any:
+        """Read through both tiers, counting the hit or miss and its latency"""
+        start = time.perf_counter()
+        value, source = self._read(key)
+        self._record_latency(start)
+        self._count({"local": "local_hits", "redis": "redis_hits"}.get(source, "misses"))
+        return value
+
+    async def _alookup(self, key: str) -> Any:
+        start = time.perf_counter()
+        value, source = await self._aread(key)
+        self._record_latency(start)
+        self._count({"local": "local_hits", "redis": "redis_hits"}.get(source, "misses"))
+        return value
+
+    async def _off_loop(self, func: Callable, *args) -> Any:
+        """Run a method that may call Redis on a worker thread (inline while Redis is down)"""
+        if not self.redis_available:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._key_locks_guard:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                if len(self._key_locks) > 10000:
+                    self._key_locks = {k: v for k, v in self._key_locks.items() if v.locked()}
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _acquire_recompute_lock(self, key: str) -> Optional[str]:
+        """Try to take the cross-worker recompute lock; returns a token, or None if held elsewhere"""
+        token = uuid.uuid4().hex
+        acquired = self._redis_call(lambda r: r.set(f"lock:{key}", token, nx=True, ex=self.lock_ttl))
+        if acquired is None and not self.redis_available:
+            return token  # Local-only mode: the in-process lock is enough
+        return token if acquired else None
+
+    def _release_recompute_lock(self, key: str, token: str):
+        def _release(r):
+            if r.get(f"lock:{key}") == token.encode():
+                r.delete(f"lock:{key}")
+        self._redis_call(_release)
+
+    def _wait_for_value(self, key: str) -> Any:
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value, _ = self._read(key)
+            if value is not _MISSING:
+                return value
+        return _MISSING
+
+    async def _await_value(self, key: str) -> Any:
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            value, _ = await self._aread(key)
+            if value is not _MISSING:
+                return value
+        return _MISSING
+
+    def _redis_call(self, func: Callable[[Any], Any]) -> Any:
+        """Run a Redis operation, degrading to local-only while Redis is unreachable"""
+        if not self.redis_available:
+            return None
+        try:
+            return func(self.redis)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self._count("redis_errors")
+            self._redis_down_until = time.monotonic() + self.redis_retry_interval
+            logger.warning(f"Redis unreachable, using local cache only for {self.redis_retry_interval}s: {e}")
+            return None
+        except Exception as e:
+            self._count("redis_errors")
+            logger.error(f"Cache operation failed: {e}")
+            return None
+
+    def _dumps(self, value: Any, local: bool, tags: Tuple[str, ...]) -> bytes:
+        return pickle.dumps((value, local, tags), protocol=5)
+
+    def _loads(self, raw: bytes) -> Tuple[Any, bool, Tuple[str, ...]]:
+        try:
+            return pickle.loads(raw)
+        except Exception:
+            # Entries written by the previous JSON-only cache
+            return json.loads(raw), False, ()
+
+    def _tag_key(self, tag: str) -> str:
+        return f"tag:{tag}"
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _record_latency(self, start: float):
+        with self._stats_lock:
+            self.stats["get_latency_total_ms"] += (time.perf_counter() - start) * 1000
+            self.stats["get_count"] += 1
+
+cache = CacheManager()
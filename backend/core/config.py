@@ -2,7 +2,7 @@
 Configuration management for SBM AI CRM System
 """
 import os
-from typing import Optional
+from typing import Optional, Dict
 from pydantic_settings import BaseSettings
 import yaml
 
@@ -10,6 +10,20 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite:///./sbm_crm.db"
     REDIS_URL: str = "redis://localhost:6379"
+    ASYNC_DATABASE_URL: Optional[str] = None  # Derived from DATABASE_URL when unset
+    
+    # Connection pooling (ignored for SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_THREADPOOL_WORKERS: int = 16  # Threads for blocking ORM calls from async endpoints
+    
+    # Query profiling
+    QUERY_PROFILING_ENABLED: bool = True
+    N_PLUS_ONE_THRESHOLD: int = 10  # Repeats of one statement shape per request that flag an N+1
+    QUERY_PROFILE_ROUTES: int = 500  # Routes kept in the offender table
     
     # API
     API_HOST: str = "0.0.0.0"
@@ -17,6 +31,53 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-here"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Engines constructed at startup; the rest load on first use ("all" restores eager loading)
+    ENGINE_WARMUP: list = []
+    
+    # Lead rescoring queue
+    LEAD_RESCORE_WORKER_ENABLED: bool = True
+    LEAD_RESCORE_BATCH_SIZE: int = 500
+    LEAD_RESCORE_INTERVAL_SECONDS: float = 30.0
+    LEAD_RESCORE_DEDUP_SECONDS: float = 60.0
+    
+    # CDP profile cache
+    CDP_PROFILE_CACHE_ENABLED: bool = True
+    CDP_PROFILE_CACHE_TTL: int = 300
+    
+    # CDP activity aggregates
+    CDP_ACTIVITY_PRUNE_INTERVAL_SECONDS: float = 21600.0  # Deletes day buckets that left the window
+    
+    # CDP event ingestion buffer
+    CDP_EVENT_BUFFER_ENABLED: bool = True
+    CDP_EVENT_BUFFER_MAX_EVENTS: int = 10000  # Events beyond this many unwritten ones are written directly
+    CDP_EVENT_FLUSH_SIZE: int = 500
+    CDP_EVENT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    CDP_EVENT_SUBMIT_TIMEOUT_SECONDS: float = 0.0  # How long a request may wait for buffer capacity
+    CDP_EVENT_LOG_PATH: Optional[str] = None  # Local append log replayed after a crash
+    CDP_EVENT_DEAD_LETTER_PATH: Optional[str] = "./logs/cdp_events.dead.jsonl"  # Events that can never be written
+    
+    # Experiment fast-path assignment
+    EXPERIMENT_CACHE_REFRESH_SECONDS: float = 30.0  # Picks up experiments changed by other processes
+    EXPERIMENT_ASSIGNMENT_FLUSH_SIZE: int = 1000
+    EXPERIMENT_ASSIGNMENT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    
+    # Workflow delay timers
+    WORKFLOW_TIMER_WORKER_ENABLED: bool = True
+    WORKFLOW_TIMER_BATCH_SIZE: int = 500
+    WORKFLOW_TIMER_POLL_SECONDS: float = 5.0
+    WORKFLOW_TIMER_CLAIM_TIMEOUT_SECONDS: float = 300.0  # Claims older than this are retried
+    
+    # Workflow execution scheduler
+    WORKFLOW_SCHEDULER_ENABLED: bool = True
+    WORKFLOW_WORKERS: int = 20
+    WORKFLOW_SCHEDULER_POLL_SECONDS: float = 0.5
+    WORKFLOW_RUN_BATCH_SIZE: int = 500  # Queued executions of a workflow step run together up to this size
+    WORKFLOW_RUN_CLAIM_TIMEOUT_SECONDS: float = 600.0  # Runs claimed longer than this are retried
+    WORKFLOW_RUN_MAX_ATTEMPTS: int = 5  # Executions whose run fails this many times are marked failed
+    WORKFLOW_RUN_RETRY_BACKOFF_SECONDS: float = 30.0  # Delay before the first retry, doubling per attempt
+    WORKFLOW_ACTION_CONCURRENCY: Dict[str, int] = {"send_email": 50, "send_sms": 20, "webhook": 5}
+    WORKFLOW_ACTION_RATE_LIMITS: Dict[str, float] = {"send_email": 50.0, "send_sms": 10.0, "webhook": 5.0}  # Starts per second
+    
     # AI/ML
     MODEL_PATH: str = "./models"
     BATCH_SIZE: int = 32
@@ -2,28 +2,71 @@
 Database connection and session management
 """
 import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, Boolean, Text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from datetime import datetime
-import redis
-import json
 import logging
 from .config import settings
 from contextlib import contextmanager
-from typing import Generator
+from typing import Generator, AsyncGenerator, Callable, Dict, List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+def _pool_options(url: str) -> Dict[str, Any]:
+    """Connection pool settings from Settings (SQLite keeps SQLAlchemy's defaults)"""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def _async_database_url(url: str) -> Optional[str]:
+    """Map a sync database URL onto its async driver"""
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    scheme, _, rest = url.partition("://")
+    if scheme == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme in ("postgres", "postgresql", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    return None
+
 # SQLAlchemy setup
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(settings.DATABASE_URL, **_pool_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-# Redis setup
-redis_client = redis.from_url(settings.REDIS_URL)
+# Async SQLAlchemy setup (requires aiosqlite / asyncpg)
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    ASYNC_DATABASE_URL = _async_database_url(settings.DATABASE_URL)
+    if not ASYNC_DATABASE_URL:
+        raise ImportError(f"No async driver mapping for {settings.DATABASE_URL.split(':')[0]}")
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options(ASYNC_DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+    ASYNC_DB_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"Async database engine unavailable: {e}")
+    async_engine = None
+    AsyncSessionLocal = None
+    ASYNC_DB_AVAILABLE = False
+
+# Bounded pool for blocking ORM work called from async endpoints
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_THREADPOOL_WORKERS, thread_name_prefix="db-worker")
+
+# Redis client and two-tier cache (re-exported for existing imports)
+from .cache import redis_client, cache, CacheManager
 
 # Database Models
 class Customer(Base):
@@ -164,9 +207,147 @@ def get_db_context():
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Get async database session for endpoints that must not block the event loop"""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine unavailable; install aiosqlite or asyncpg")
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+async def run_in_db_threadpool(func: Callable, *args, **kwargs):
+    """Run a blocking callable on the bounded database thread pool"""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context so per-request query profiling sees pooled work
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, functools.partial(context.run, func, *args, **kwargs))
+
+async def run_with_db(func: Callable[..., Any], *args, **kwargs):
+    """Run func(db, *args, **kwargs) with its own sync session on the database thread pool"""
+    def _call():
+        with get_db_context() as db:
+            return func(db, *args, **kwargs)
+    return await run_in_db_threadpool(_call)
+
+def bulk_upsert(db: Session, model, rows: List[Dict[str, Any]], key_columns: List[str], update_columns: List[str],
+                increment_columns: List[str] = None):
+    """Insert rows, updating update_columns where key_columns already exist (joins the caller's transaction)
+
+    increment_columns are added to the stored value instead of replacing it,
+    in the same statement, so concurrent writers do not lose updates. Keys
+    must be unique within rows.
+    """
+    if not rows:
+        return
+    increment_columns = increment_columns or []
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(model)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={
+                **{column: statement.excluded[column] for column in update_columns},
+                **{column: model.__table__.c[column] + statement.excluded[column] for column in increment_columns}
+            }
+        ), rows)
+    else:
+        for row in rows:
+            existing = db.get(model, tuple(row[column] for column in key_columns), with_for_update=True) if increment_columns else None
+            if existing is not None:
+                for column in update_columns:
+                    setattr(existing, column, row[column])
+                for column in increment_columns:
+                    setattr(existing, column, (getattr(existing, column) or 0) + row[column])
+            else:
+                db.merge(model(**row))
+
+def bulk_insert_missing(db: Session, model, rows: List[Dict[str, Any]], key_columns: List[str]) -> List[tuple]:
+    """Insert rows whose key_columns do not exist yet; returns the keys actually inserted (joins the caller's transaction)
+
+    Concurrent writers inserting the same key do not fail: exactly one of
+    them gets the key back. Keys must be unique within rows.
+    """
+    if not rows:
+        return []
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(model).on_conflict_do_nothing(index_elements=key_columns).returning(
+            *(model.__table__.c[column] for column in key_columns)
+        )
+        return [tuple(row) for row in db.execute(statement, rows)]
+    inserted = []
+    for row in rows:
+        key = tuple(row[column] for column in key_columns)
+        if db.query(model).filter_by(**dict(zip(key_columns, key))).first() is None:
+            db.add(model(**row))
+            inserted.append(key)
+    db.flush()
+    return inserted
+
+async def dispose_engines():
+    """Close pooled connections and the database thread pool on shutdown"""
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
+    db_executor.shutdown(wait=False)
+
 def init_database():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    warn_missing_columns()
+    warn_missing_unique_indexes()
+
+def warn_missing_columns():
+    """Log model columns missing from existing tables (create_all never alters a table)
+
+    Read-only: columns added to existing tables ship as alembic migrations,
+    applied with ``alembic upgrade head`` from the backend directory.
+    """
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column.name for column in table.columns if column.name not in existing_columns]
+        if missing:
+            logger.warning(
+                f"Table {table.name} is missing columns {', '.join(missing)}; run 'alembic upgrade head'"
+            )
+
+def warn_missing_unique_indexes():
+    """Log model unique indexes missing from existing tables
+
+    Read-only: existing rows may hold keys the index would reject, so the
+    index ships as an alembic migration that deduplicates them first.
+    """
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing = [index.name for index in table.indexes if index.unique and index.name not in existing_indexes]
+        if missing:
+            logger.warning(
+                f"Table {table.name} is missing unique indexes {', '.join(missing)}; run 'alembic upgrade head'"
+            )
 
 def check_database_connection():
     """Check if database is accessible"""
@@ -177,40 +358,3 @@ def check_database_connection():
     except Exception as e:
         logger.error(f"Database connection failed: {e}")
         return False
-
-# Cache functions
-class CacheManager:
-    def __init__(self):
-        self.redis = redis_client
-        self.default_ttl = 3600  # 1 hour
-    
-    def get(self, key: str):
-        """Get value from cache"""
-        try:
-            value = self.redis.get(key)
-            if value:
-                return json.loads(value)
-            return None
-        except Exception as e:
-            print(f"Cache get error: {e}")
-            return None
-    
-    def set(self, key: str, value: any, ttl: int = None):
-        """Set value in cache"""
-        try:
-            ttl = ttl or self.default_ttl
-            self.redis.setex(key, ttl, json.dumps(value, default=str))
-            return True
-        except Exception as e:
-            print(f"Cache set error: {e}")
-            return False
-    
-    def delete(self, key: str):
-        """Delete key from cache"""
-        try:
-            return self.redis.delete(key)
-        except Exception as e:
-            print(f"Cache delete error: {e}")
-            return False
-
-cache = CacheManager()
\ No newline at end of file
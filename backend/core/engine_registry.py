@@ -0,0 +1,186 @@
+"""
+Lazy engine registry - imports and constructs engines on first use
+"""
+import asyncio
+import importlib
+import os
+import threading
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+def resident_memory_mb() -> Optional[float]:
+    """Current resident set size of this process in MB"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+@dataclass
+class EngineSpec:
+    """How to build one engine and what loading it cost"""
+    name: str
+    target: str                 # "package.module:ClassName"
+    needs_db: bool = True       # Constructor takes a SQLAlchemy session
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    instance: Any = None
+    db_session: Any = None
+    error: Optional[str] = None
+    failures: int = 0           # Consecutive failed loads
+    retry_at: Optional[float] = None  # time.monotonic() after which a failed load is retried
+    import_time_ms: Optional[float] = None
+    init_time_ms: Optional[float] = None
+    memory_delta_mb: Optional[float] = None
+    loaded_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "engine": self.name,
+            "target": self.target,
+            "status": self.status,
+            "import_time_ms": self.import_time_ms,
+            "init_time_ms": self.init_time_ms,
+            "memory_delta_mb": self.memory_delta_mb,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in_seconds": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.error else None
+        }
+
+    @property
+    def status(self) -> str:
+        if self.instance is not None:
+            return "loaded"
+        return "failed" if self.error else "not_loaded"
+
+    def retry_due(self) -> bool:
+        """Whether the engine may be (re)loaded now"""
+        return self.error is None or time.monotonic() >= self.retry_at
+
+class EngineRegistry:
+    """Registry of engines built on first access
+
+    Each engine module is imported and its class constructed the first time
+    ``get`` (or ``aget`` from async code) is called, so workers only pay for
+    the engines they serve. Import time, constructor time and the change in
+    resident memory are recorded per engine; memory deltas are approximate
+    when engines load concurrently. A failed load is retried on the first
+    access after a backoff that doubles with each consecutive failure, from
+    ``retry_backoff`` up to ``max_retry_backoff`` seconds.
+    """
+
+    def __init__(self, session_factory=None, on_import=None, retry_backoff: float = 30.0,
+                 max_retry_backoff: float = 900.0):
+        self.session_factory = session_factory
+        self.on_import = on_import  # Called after each engine module is imported
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.specs: Dict[str, EngineSpec] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, target: str, needs_db: bool = True, **kwargs):
+        """Register an engine by import path without importing it"""
+        self.specs[name] = EngineSpec(name=name, target=target, needs_db=needs_db, kwargs=kwargs)
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Optional[Any]:
+        """Engine instance, importing and constructing it on first use; None while it is failing"""
+        spec = self.specs[name]
+        if spec.instance is not None or not spec.retry_due():
+            return spec.instance
+
+        with self._locks[name]:
+            if spec.instance is None and spec.retry_due():
+                self._load(spec)
+        return spec.instance
+
+    async def aget(self, name: str) -> Optional[Any]:
+        """``get`` for async callers; a first load runs on a worker thread instead of the event loop"""
+        spec = self.specs[name]
+        if spec.instance is not None or not spec.retry_due():
+            return spec.instance
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, name)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.specs and self.specs[name].instance is not None
+
+    def warm_up(self, names: Iterable[str] = None) -> List[Dict[str, Any]]:
+        """Load the given engines (all when names is None) and return their report rows"""
+        names = list(self.specs) if names is None else [name for name in names if name in self.specs]
+        for name in names:
+            self.get(name)
+        return [self.specs[name].to_dict() for name in names]
+
+    def status(self) -> Dict[str, str]:
+        return {name: spec.status for name, spec in self.specs.items()}
+
+    def report(self) -> Dict[str, Any]:
+        """Per-engine load costs plus current process memory"""
+        rows = [spec.to_dict() for spec in self.specs.values()]
+        return {
+            "engines": rows,
+            "loaded": sum(1 for row in rows if row["status"] == "loaded"),
+            "failed": sum(1 for row in rows if row["status"] == "failed"),
+            "total": len(rows),
+            "resident_memory_mb": resident_memory_mb()
+        }
+
+    def log_report(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            if row["status"] == "loaded":
+                logger.info(
+                    f"Engine {row['engine']}: import {row['import_time_ms']}ms, "
+                    f"init {row['init_time_ms']}ms, memory {row['memory_delta_mb']}MB"
+                )
+            else:
+                logger.warning(f"Engine {row['engine']} {row['status']}: {row['error']}")
+        memory = resident_memory_mb()
+        logger.info(f"Resident memory after engine warm-up: {memory:.1f}MB" if memory else "Resident memory unavailable")
+
+    def close(self):
+        """Close the database sessions owned by loaded engines"""
+        for spec in self.specs.values():
+            if spec.db_session is not None:
+                spec.db_session.close()
+                spec.db_session = None
+
+    def _load(self, spec: EngineSpec):
+        module_name, _, class_name = spec.target.partition(":")
+        memory_before = resident_memory_mb()
+        try:
+            start = time.perf_counter()
+            engine_class = getattr(importlib.import_module(module_name), class_name)
+            if self.on_import:
+                self.on_import()
+            spec.import_time_ms = round((time.perf_counter() - start) * 1000, 1)
+
+            start = time.perf_counter()
+            if spec.needs_db:
+                spec.db_session = self.session_factory()
+                spec.instance = engine_class(spec.db_session, **spec.kwargs)
+            else:
+                spec.instance = engine_class(**spec.kwargs)
+            spec.init_time_ms = round((time.perf_counter() - start) * 1000, 1)
+            spec.loaded_at = time.time()
+            spec.error, spec.failures, spec.retry_at = None, 0, None
+        except Exception as e:
+            spec.error = str(e)
+            spec.failures += 1
+            backoff = min(self.max_retry_backoff, self.retry_backoff * 2 ** (spec.failures - 1))
+            spec.retry_at = time.monotonic() + backoff
+            if spec.db_session is not None:
+                spec.db_session.close()
+                spec.db_session = None
+            logger.error(f"Failed to load engine {spec.name} ({spec.target}), retrying in {backoff:.0f}s: {e}")
+        finally:
+            memory_after = resident_memory_mb()
+            if memory_before is not None and memory_after is not None:
+                spec.memory_delta_mb = round(memory_after - memory_before, 1)
@@ -0,0 +1,212 @@
+"""
+Per-request SQL query profiling and N+1 detection
+"""
+import re
+import threading
+import time
+import logging
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import event
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\?|%\([^)]+\)s|%s|:\w+|\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+def statement_shape(statement: str) -> str:
+    """Normalize a SQL statement so repeats with different parameters compare equal"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _STRING_LITERAL.sub("?", shape)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    return _PLACEHOLDER_LIST.sub("(?)", shape)
+
+@dataclass
+class RequestQueryProfile:
+    """Queries issued while serving one request"""
+    method: str
+    path: str
+    query_count: int = 0
+    db_time: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+    token: Any = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, statement: str, elapsed: float):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.query_count += 1
+            self.db_time += elapsed
+            self.shapes[shape] += 1
+
+    def repeated_shapes(self, threshold: int) -> List[Dict[str, Any]]:
+        """Statement shapes executed at least `threshold` times"""
+        with self._lock:
+            shapes = self.shapes.most_common()
+        return [{"statement": shape, "count": count} for shape, count in shapes if count >= threshold]
+
+@dataclass
+class RouteQueryStats:
+    """Aggregated query statistics for one route"""
+    route: str
+    requests: int = 0
+    total_queries: int = 0
+    max_queries: int = 0
+    total_db_time: float = 0.0
+    n_plus_one_requests: int = 0
+    repeated_shapes: Counter = field(default_factory=Counter)
+
+    def to_dict(self, top_shapes: int = 3) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "requests": self.requests,
+            "avg_queries": round(self.total_queries / self.requests, 2) if self.requests else 0.0,
+            "max_queries": self.max_queries,
+            "avg_db_time_ms": round(self.total_db_time * 1000 / self.requests, 2) if self.requests else 0.0,
+            "n_plus_one_requests": self.n_plus_one_requests,
+            "repeated_statements": [
+                {"statement": shape, "max_count": count}
+                for shape, count in self.repeated_shapes.most_common(top_shapes)
+            ]
+        }
+
+_current_profile: ContextVar[Optional[RequestQueryProfile]] = ContextVar("current_query_profile", default=None)
+
+class QueryProfiler:
+    """Collects per-request query counts from SQLAlchemy engine events
+
+    Engines are instrumented with before/after_cursor_execute listeners that
+    only record while a request profile is active, so scripts and background
+    jobs pay nothing. Finished requests are folded into a bounded per-route
+    table of offenders.
+    """
+
+    def __init__(self, n_plus_one_threshold: int = 10, max_routes: int = 500):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_routes = max_routes
+        self.routes: "OrderedDict[str, RouteQueryStats]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._instrumented = set()
+
+    def instrument(self, *engines):
+        """Attach cursor listeners to sync or async engines"""
+        for engine in engines:
+            if engine is None:
+                continue
+            sync_engine = getattr(engine, "sync_engine", engine)
+            if id(sync_engine) in self._instrumented:
+                continue
+            event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+            self._instrumented.add(id(sync_engine))
+
+    def start(self, method: str, path: str) -> RequestQueryProfile:
+        """Begin profiling the current request"""
+        profile = RequestQueryProfile(method=method, path=path)
+        profile.token = _current_profile.set(profile)
+        return profile
+
+    def finish(self, profile: RequestQueryProfile, route: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Stop profiling, aggregate the request and return any N+1 offenders"""
+        _current_profile.reset(profile.token)
+        offenders = profile.repeated_shapes(self.n_plus_one_threshold)
+        route_key = f"{profile.method} {route or profile.path}"
+
+        with self._lock:
+            stats = self.routes.pop(route_key, None) or RouteQueryStats(route=route_key)
+            stats.requests += 1
+            stats.total_queries += profile.query_count
+            stats.max_queries = max(stats.max_queries, profile.query_count)
+            stats.total_db_time += profile.db_time
+            if offenders:
+                stats.n_plus_one_requests += 1
+                for offender in offenders:
+                    shape = offender["statement"]
+                    stats.repeated_shapes[shape] = max(stats.repeated_shapes[shape], offender["count"])
+            self.routes[route_key] = stats
+            while len(self.routes) > self.max_routes:
+                self.routes.popitem(last=False)
+
+        if offenders:
+            worst = offenders[0]
+            logger.warning(
+                f"N+1 suspected on {route_key}: {profile.query_count} queries, "
+                f"{worst['count']}x {worst['statement'][:200]}"
+            )
+        else:
+            logger.debug(f"{route_key} - {profile.query_count} queries, {profile.db_time * 1000:.1f}ms in DB")
+        return offenders
+
+    def worst_offenders(self, limit: int = 20, sort_by: str = "max_queries") -> List[Dict[str, Any]]:
+        """Routes ranked by query volume"""
+        if sort_by not in ("max_queries", "avg_queries", "avg_db_time_ms", "n_plus_one_requests"):
+            raise ValueError(f"Unsupported sort key: {sort_by}")
+        with self._lock:
+            rows = [stats.to_dict() for stats in self.routes.values()]
+        return sorted(rows, key=lambda row: row[sort_by], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile.get()
+        start_times = conn.info.get("query_start_time")
+        if profile is None or not start_times:
+            return
+        profile.record(statement, time.perf_counter() - start_times.pop())
+
+class QueryProfilingMiddleware:
+    """ASGI middleware that profiles the queries of each HTTP request
+
+    Adds X-DB-Query-Count, X-DB-Time and X-DB-N-Plus-One response headers.
+    Queries issued after the response has started (e.g. background tasks)
+    are aggregated but not reflected in the headers.
+    """
+
+    def __init__(self, app, profiler: "QueryProfiler" = None):
+        self.app = app
+        self.profiler = profiler or query_profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(scope.get("method", ""), scope.get("path", ""))
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                repeated = profile.repeated_shapes(self.profiler.n_plus_one_threshold)
+                headers = list(message.get("headers", []))
+                headers.extend([
+                    (b"x-db-query-count", str(profile.query_count).encode()),
+                    (b"x-db-time", f"{profile.db_time:.6f}".encode()),
+                    (b"x-db-n-plus-one", str(len(repeated)).encode()),
+                ])
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            route = scope.get("route")
+            self.profiler.finish(profile, getattr(route, "path", None))
+
+query_profiler = QueryProfiler(
+    n_plus_one_threshold=settings.N_PLUS_ONE_THRESHOLD,
+    max_routes=settings.QUERY_PROFILE_ROUTES
+)
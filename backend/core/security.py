@@ -119,7 +119,8 @@ class SecurityManager:
         """Store session data in cache and return session ID"""
         session_id = secrets.token_urlsafe(16)
         cache_key = f"session:{session_id}"
-        cache.set(cache_key, session_data, ttl=self.refresh_token_expire_days * 24 * 3600)
+        # Sessions skip the local tier so logout on one worker takes effect everywhere
+        cache.set(cache_key, session_data, ttl=self.refresh_token_expire_days * 24 * 3600, local=False)
         return session_id
     
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
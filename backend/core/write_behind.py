@@ -0,0 +1,254 @@
+"""
+Write-behind buffer - bounded in-memory batching of rows written in bulk
+"""
+from typing import Dict, List, Any, Optional, Tuple, Callable, Iterable
+from datetime import datetime
+from collections import deque
+from pathlib import Path
+import json
+import logging
+import threading
+import time
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Failures of the database rather than of the rows; chunks hit by these are retried whole
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError, ConnectionError)
+
+class BufferFull(Exception):
+    """Raised when the buffer stays full for longer than the submit timeout"""
+
+class WriteBehindBuffer:
+    """Bounded in-memory buffer of rows flushed in bulk by a worker thread
+
+    ``submit`` returns as soon as the row is buffered (and appended to the
+    optional local log). The worker hands rows to ``writer`` in chunks of
+    ``flush_size`` when that many are waiting or every ``flush_interval``
+    seconds. Capacity is released only after a chunk is written, so a slow or
+    unavailable database pushes back on producers. ``stop`` drains the
+    buffer; log segments left by a crash are replayed on ``start``, so
+    writers must tolerate rows they have already stored.
+
+    A chunk failing with one of ``retryable_errors`` stays at the head and is
+    retried. Any other failure is blamed on the rows: they are written one at
+    a time and those still failing are dead-lettered (appended to
+    ``dead_letter_path``, or logged) so one bad row cannot stall the buffer.
+    """
+
+    def __init__(self, name: str, writer: Callable[[List[Dict[str, Any]]], Any], max_events: int = 10000,
+                 flush_size: int = 500, flush_interval: float = 1.0, submit_timeout: float = 5.0,
+                 log_path: str = None, datetime_fields: Iterable[str] = (), dead_letter_path: str = None,
+                 retryable_errors: Tuple[type, ...] = TRANSIENT_ERRORS):
+        self.name = name
+        self.writer = writer
+        self.datetime_fields = tuple(datetime_fields)  # Restored from ISO strings on log replay
+        self.max_events = max_events
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.submit_timeout = submit_timeout
+        self.log_path = Path(log_path) if log_path else None
+        self.dead_letter_path = Path(dead_letter_path) if dead_letter_path else None
+        self.retryable_errors = tuple(retryable_errors)
+
+        self._events: deque = deque()
+        self._capacity = threading.Semaphore(max_events)
+        self._lock = threading.Lock()          # Orders log appends against log rotation
+        self._flush_lock = threading.Lock()    # One flusher at a time
+        self._dead_letter_lock = threading.Lock()
+        # (log segment, events, whether the events hold buffer capacity)
+        self._pending: List[Tuple[Optional[Path], List[Dict[str, Any]], bool]] = []
+        self._log_file = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.metrics = {
+            "submitted": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "rejected": 0,
+            "errors": 0,
+            "dead_lettered": 0,
+            "last_flush_size": 0,
+            "last_flush_seconds": 0.0,
+            "last_flush_at": None
+        }
+
+    def submit(self, event: Dict[str, Any], timeout: float = None):
+        """Buffer one row, waiting up to timeout (default submit_timeout) for capacity"""
+        if not self._capacity.acquire(timeout=self.submit_timeout if timeout is None else timeout):
+            self.metrics["rejected"] += 1
+            raise BufferFull(f"{self.name} buffer full ({self.max_events} rows waiting)")
+
+        with self._lock:
+            if self.log_path:
+                self._append_log(event)
+            self._events.append(event)
+            waiting = len(self._events)
+        self.metrics["submitted"] += 1
+
+        if waiting >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write every buffered row; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                if self._events:
+                    events = list(self._events)
+                    self._events.clear()
+                    self._pending.append((self._rotate_log(), events, True))
+
+            written = 0
+            started = time.perf_counter()
+            while self._pending:
+                segment, events, holds_capacity = self._pending[0]
+                while events:
+                    chunk = events[:self.flush_size]
+                    try:
+                        self.writer(chunk)
+                    except self.retryable_errors:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"{self.name} chunk of {len(chunk)} rows failed, writing rows singly: {e}")
+                        written += self._write_rows(events, len(chunk), holds_capacity)
+                        continue
+                    self._consume(events, len(chunk), holds_capacity)
+                    written += len(chunk)
+                self._pending.pop(0)
+                if segment is not None:
+                    segment.unlink(missing_ok=True)
+
+            if written:
+                self.metrics["flushes"] += 1
+                self.metrics["flushed"] += written
+                self.metrics["last_flush_size"] = written
+                self.metrics["last_flush_seconds"] = round(time.perf_counter() - started, 3)
+                self.metrics["last_flush_at"] = datetime.now().isoformat()
+            return written
+
+    def dead_letter(self, rows: List[Dict[str, Any]], reason: Any):
+        """Set rows aside that will never be written"""
+        if not rows:
+            return
+        self.metrics["dead_lettered"] += len(rows)
+        if self.dead_letter_path is None:
+            for row in rows:
+                logger.error(f"{self.name} dropped row ({reason}): {json.dumps(row, default=str)}")
+            return
+        failed_at = datetime.now().isoformat()
+        with self._dead_letter_lock:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"row": row, "error": str(reason), "failed_at": failed_at}, default=str) + "\n")
+        logger.error(f"{self.name} dead-lettered {len(rows)} rows to {self.dead_letter_path}: {reason}")
+
+    def _write_rows(self, events: List[Dict[str, Any]], count: int, holds_capacity: bool) -> int:
+        """Write the first count events one at a time, dead-lettering those that fail"""
+        written = 0
+        for row in events[:count]:
+            try:
+                self.writer([row])
+                written += 1
+            except self.retryable_errors:
+                raise
+            except Exception as e:
+                self.dead_letter([row], e)
+            self._consume(events, 1, holds_capacity)
+        return written
+
+    def _consume(self, events: List[Dict[str, Any]], count: int, holds_capacity: bool):
+        del events[:count]
+        if holds_capacity:
+            for _ in range(count):
+                self._capacity.release()
+
+    def start(self):
+        """Replay leftover log segments and start the flush thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        if self.log_path:
+            self._recover()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-buffer", daemon=True)
+        self._thread.start()
+        logger.info(f"{self.name} buffer started (flush {self.flush_size} rows / {self.flush_interval}s)")
+
+    def stop(self, timeout: float = 30.0):
+        """Stop the flush thread after draining the buffer"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to drain {self.name} buffer ({self.depth} rows left): {e}")
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def depth(self) -> int:
+        return len(self._events) + sum(len(events) for _, events, _ in self._pending)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "depth": self.depth,
+            "max_events": self.max_events,
+            "running": self.running
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"{self.name} flush failed, retrying ({self.depth} rows waiting): {e}")
+                self._stopping.wait(min(30.0, self.flush_interval * 5))
+
+    # Local append log
+    def _append_log(self, event: Dict[str, Any]):
+        if self._log_file is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._log_file = open(self.log_path, "a", encoding="utf-8")
+        self._log_file.write(json.dumps(event, default=str) + "\n")
+        self._log_file.flush()
+
+    def _rotate_log(self) -> Optional[Path]:
+        """Close the active segment so it can be deleted once its events are written"""
+        if self._log_file is None:
+            return None
+        self._log_file.close()
+        self._log_file = None
+        segment = self.log_path.with_name(f"{self.log_path.name}.{time.time_ns()}.pending")
+        self.log_path.replace(segment)
+        return segment
+
+    def _recover(self):
+        if self.log_path.exists():
+            self.log_path.replace(self.log_path.with_name(f"{self.log_path.name}.{time.time_ns()}.pending"))
+        for segment in sorted(self.log_path.parent.glob(f"{self.log_path.name}.*.pending")):
+            events = []
+            with open(segment, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn final line from a crash
+                    for name in self.datetime_fields:
+                        if event.get(name):
+                            event[name] = datetime.fromisoformat(event[name])
+                    events.append(event)
+            self._pending.append((segment, events, False))
+            logger.info(f"Replaying {len(events)} {self.name} rows from {segment.name}")
@@ -8,15 +8,22 @@ import json
 import logging
 import uuid
 import hashlib
+import time
 import numpy as np
 from scipy import stats
-from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean, Index, select, insert
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from dataclasses import dataclass
 import math
 
-from core.database import Base, get_db
+from core.database import Base, get_db, bulk_insert_missing
+from .assignment import (
+    variant_assigner, hash_percentage, pick_variant, cumulative_allocation, compile_audience,
+    audience_conditions, assign_variants
+)
+from .variant_stats import variant_stats, VariantStats
+from .sequential import sequential_tester
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +56,11 @@ class MetricType(str, Enum):
     PURCHASE_VALUE = "purchase_value"
     SIGNUP_RATE = "signup_rate"
 
+class AnalysisMode(str, Enum):
+    """How experiment results are monitored"""
+    FIXED_HORIZON = "fixed_horizon"
+    SEQUENTIAL = "sequential"
+
 class StatisticalTest(str, Enum):
     """Statistical test types"""
     T_TEST = "t_test"
@@ -109,6 +121,10 @@ class ExperimentAssignment(Base):
     
     # Relationships
     experiment = relationship("Experiment", back_populates="assignments")
+    
+    __table_args__ = (
+        Index('uq_experiment_assignment', 'experiment_id', 'customer_id', unique=True),
+    )
 
 class ExperimentConversion(Base):
     """Conversion events for experiments"""
@@ -148,6 +164,7 @@ class VariantPerformance:
     average_value: float
     confidence_interval: Tuple[float, float]
     standard_error: float
+    standard_deviation: float = 0.0
 
 class ABTestingFramework:
     """Comprehensive A/B testing framework"""
@@ -185,7 +202,9 @@ class ABTestingFramework:
                     "confidence_level": experiment_config.get("confidence_level", self.default_confidence_level),
                     "minimum_effect_size": experiment_config.get("expected_effect_size", self.minimum_effect_size),
                     "minimum_sample_size": sample_size_info["required_sample_size"],
-                    "statistical_power": experiment_config.get("statistical_power", 0.8)
+                    "statistical_power": experiment_config.get("statistical_power", 0.8),
+                    "analysis_mode": experiment_config.get("analysis_mode", AnalysisMode.FIXED_HORIZON.value),
+                    "mixture_variance": experiment_config.get("mixture_variance")  # Sequential mode tau^2
                 },
                 duration_days=experiment_config.get("duration_days", 14),
                 created_by=experiment_config.get("created_by", "system")
@@ -193,6 +212,7 @@ class ABTestingFramework:
             
             self.db.add(experiment)
             self.db.commit()
+            variant_assigner.invalidate()
             
             logger.info(f"Created experiment: {experiment.name} ({experiment.id})")
             return experiment.id
@@ -222,6 +242,7 @@ class ABTestingFramework:
                 experiment.end_date = experiment.start_date + timedelta(days=experiment.duration_days)
             
             self.db.commit()
+            variant_assigner.invalidate()
             
             logger.info(f"Started experiment: {experiment.name}")
             return True
@@ -257,14 +278,11 @@ class ABTestingFramework:
             # Assign variant using consistent hashing
             variant_id = self._hash_assign_variant(customer_id, experiment.traffic_allocation)
             
-            # Record assignment
-            assignment = ExperimentAssignment(
-                experiment_id=experiment_id,
-                customer_id=customer_id,
-                variant_id=variant_id
-            )
-            
-            self.db.add(assignment)
+            # Record assignment (a concurrent writer may have stored the same, hash-determined, variant)
+            if bulk_insert_missing(self.db, ExperimentAssignment, [
+                {"experiment_id": experiment_id, "customer_id": customer_id, "variant_id": variant_id}
+            ], ["experiment_id", "customer_id"]):
+                variant_stats.record_assignments(self.db, experiment_id, [variant_id])
             self.db.commit()
             
             return variant_id
@@ -274,6 +292,104 @@ class ABTestingFramework:
             self.db.rollback()
             return None
     
+    def assign_variant_fast(self, experiment_id: str, customer_id: str,
+                            customer_attributes: Dict[str, Any] = None) -> Optional[str]:
+        """Assign a variant from the cached experiment without a database round trip
+
+        Pass the customer's audience fields in ``customer_attributes`` to skip
+        the customer lookup; the assignment row is written asynchronously.
+        """
+        try:
+            return variant_assigner.assign(experiment_id, customer_id, customer_attributes)
+        except Exception as e:
+            logger.error(f"Error assigning variant: {e}")
+            return None
+    
+    def bulk_assign_variants(self, experiment_id: str, customer_ids: List[str] = None,
+                             segment_id: str = None, criteria: Dict[str, Any] = None,
+                             chunk_size: int = 50000) -> Dict[str, Any]:
+        """Pre-assign a whole audience to a draft or running experiment
+
+        The audience is the experiment's target_audience narrowed by the given
+        customer list, segment and extra criteria (same format as
+        target_audience), evaluated in SQL. Customers already assigned keep
+        their variant.
+        """
+        try:
+            started = time.monotonic()
+            experiment = self.db.query(Experiment).filter(
+                Experiment.id == experiment_id
+            ).first()
+
+            if not experiment:
+                raise ValueError(f"Experiment {experiment_id} not found")
+
+            if experiment.status not in (ExperimentStatus.DRAFT.value, ExperimentStatus.RUNNING.value):
+                raise ValueError("Experiment must be draft or running to assign customers")
+
+            # Resolve the audience
+            from core.database import Customer
+            conditions = audience_conditions(Customer, experiment.target_audience) + audience_conditions(Customer, criteria)
+            if segment_id:
+                conditions.append(Customer.segment_id == segment_id)
+
+            if customer_ids is not None and not conditions:
+                # No audience restriction: the list is the audience, as in assign_variant
+                audience = list(dict.fromkeys(customer_ids))
+            elif customer_ids is not None:
+                audience = []
+                unique_ids = list(dict.fromkeys(customer_ids))
+                for start in range(0, len(unique_ids), chunk_size):
+                    audience.extend(self.db.execute(
+                        select(Customer.customer_id).where(
+                            Customer.customer_id.in_(unique_ids[start:start + chunk_size]), *conditions
+                        )
+                    ).scalars())
+            else:
+                audience = list(self.db.execute(
+                    select(Customer.customer_id).where(Customer.customer_id.isnot(None), *conditions)
+                ).scalars())
+
+            # Skip customers already in the experiment
+            assigned = set(self.db.execute(
+                select(ExperimentAssignment.customer_id).where(ExperimentAssignment.experiment_id == experiment_id)
+            ).scalars())
+            new_ids = [customer_id for customer_id in audience if customer_id not in assigned]
+
+            # Consistent-hash variants and insert in chunks; keys stored concurrently are skipped
+            variants = assign_variants(new_ids, experiment.traffic_allocation)
+            assigned_at = datetime.now()
+            variant_counts = {variant["id"]: 0 for variant in experiment.variants}
+            inserted_count = 0
+            for start in range(0, len(new_ids), chunk_size):
+                chunk_variants = dict(zip(new_ids[start:start + chunk_size], variants[start:start + chunk_size]))
+                inserted = bulk_insert_missing(self.db, ExperimentAssignment, [
+                    {"experiment_id": experiment_id, "customer_id": customer_id,
+                     "variant_id": variant_id, "assigned_at": assigned_at}
+                    for customer_id, variant_id in chunk_variants.items()
+                ], ["experiment_id", "customer_id"])
+                inserted_variants = [chunk_variants[customer_id] for _, customer_id in inserted]
+                variant_stats.record_assignments(self.db, experiment_id, inserted_variants)
+                self.db.commit()
+                inserted_count += len(inserted_variants)
+                for variant_id in inserted_variants:
+                    variant_counts[variant_id] = variant_counts.get(variant_id, 0) + 1
+
+            logger.info(f"Bulk assigned {inserted_count} customers to experiment {experiment_id}")
+            return {
+                "experiment_id": experiment_id,
+                "audience_size": len(audience),
+                "assigned": inserted_count,
+                "already_assigned": len(audience) - inserted_count,
+                "variant_counts": variant_counts,
+                "duration_seconds": round(time.monotonic() - started, 3)
+            }
+
+        except Exception as e:
+            logger.error(f"Error bulk assigning variants: {e}")
+            self.db.rollback()
+            raise
+
     def track_conversion(self, experiment_id: str, customer_id: str,
                         metric_type: str, metric_value: float,
                         conversion_data: Dict[str, Any] = None) -> bool:
@@ -285,7 +401,10 @@ class ABTestingFramework:
                 ExperimentAssignment.customer_id == customer_id
             ).first()
             
-            if not assignment:
+            # Fast-path assignments may still be waiting to be written
+            variant_id = assignment.variant_id if assignment else variant_assigner.pending_variant(experiment_id, customer_id)
+            
+            if not variant_id:
                 # Customer not in experiment
                 return False
             
@@ -293,13 +412,14 @@ class ABTestingFramework:
             conversion = ExperimentConversion(
                 experiment_id=experiment_id,
                 customer_id=customer_id,
-                variant_id=assignment.variant_id,
+                variant_id=variant_id,
                 metric_type=metric_type,
                 metric_value=metric_value,
                 conversion_data=conversion_data or {}
             )
             
             self.db.add(conversion)
+            variant_stats.record_conversions(self.db, experiment_id, [(variant_id, metric_type, metric_value)])
             self.db.commit()
             
             # Check if we should analyze results
@@ -322,17 +442,12 @@ class ABTestingFramework:
             if not experiment:
                 raise ValueError(f"Experiment {experiment_id} not found")
             
-            # Get all conversions
-            conversions = self.db.query(ExperimentConversion).filter(
-                ExperimentConversion.experiment_id == experiment_id
-            ).all()
+            # Running per-variant aggregates
+            aggregates = variant_stats.get(self.db, experiment_id)
+            totals = variant_stats.totals(aggregates)
+            total_assignments, total_conversions = totals.assignments, totals.conversions
             
-            # Get all assignments
-            assignments = self.db.query(ExperimentAssignment).filter(
-                ExperimentAssignment.experiment_id == experiment_id
-            ).all()
-            
-            if not conversions or not assignments:
+            if not total_conversions or not total_assignments:
                 return ExperimentResult(
                     experiment_id=experiment_id,
                     status="insufficient_data",
@@ -352,23 +467,28 @@ class ABTestingFramework:
             for variant in experiment.variants:
                 variant_id = variant["id"]
                 performance = self._analyze_variant_performance(
-                    experiment_id, variant_id, experiment.primary_metric
+                    experiment_id, variant_id, experiment.primary_metric, aggregates
                 )
                 variant_results[variant_id] = performance.__dict__
                 variant_performances.append(performance)
             
-            # Perform statistical test
-            statistical_result = self._perform_statistical_test(
-                variant_performances, experiment.primary_metric
-            )
-            
-            # Determine winner
-            winner_variant = None
-            if statistical_result["significant"]:
-                winner_variant = max(
-                    variant_performances,
-                    key=lambda v: v.conversion_rate if experiment.primary_metric == MetricType.CONVERSION_RATE.value else v.average_value
-                ).variant_id
+            if self._is_sequential(experiment):
+                # Always-valid mSPRT state maintained on each conversion
+                statistical_result = self._sequential_test_result(experiment, aggregates)
+                winner_variant = statistical_result["sequential"]["winner_variant"]
+            else:
+                # Perform statistical test
+                statistical_result = self._perform_statistical_test(
+                    variant_performances, experiment.primary_metric
+                )
+                
+                # Determine winner
+                winner_variant = None
+                if statistical_result["significant"]:
+                    winner_variant = max(
+                        variant_performances,
+                        key=lambda v: v.conversion_rate if experiment.primary_metric == MetricType.CONVERSION_RATE.value else v.average_value
+                    ).variant_id
             
             # Generate recommendations
             recommendations = self._generate_recommendations(
@@ -409,36 +529,21 @@ class ABTestingFramework:
                 return {"error": "Experiment not found"}
             
             # Get basic metrics
-            total_assignments = self.db.query(ExperimentAssignment).filter(
-                ExperimentAssignment.experiment_id == experiment_id
-            ).count()
-            
-            total_conversions = self.db.query(ExperimentConversion).filter(
-                ExperimentConversion.experiment_id == experiment_id
-            ).count()
+            aggregates = variant_stats.get(self.db, experiment_id)
+            totals = variant_stats.totals(aggregates)
+            total_assignments, total_conversions = totals.assignments, totals.conversions
             
             # Get variant breakdown
             variant_breakdown = {}
             for variant in experiment.variants:
                 variant_id = variant["id"]
-                
-                variant_assignments = self.db.query(ExperimentAssignment).filter(
-                    ExperimentAssignment.experiment_id == experiment_id,
-                    ExperimentAssignment.variant_id == variant_id
-                ).count()
-                
-                variant_conversions = self.db.query(ExperimentConversion).filter(
-                    ExperimentConversion.experiment_id == experiment_id,
-                    ExperimentConversion.variant_id == variant_id
-                ).count()
-                
-                conversion_rate = (variant_conversions / variant_assignments * 100) if variant_assignments > 0 else 0
+                variant_totals = variant_stats.variant(aggregates, variant_id)
                 
                 variant_breakdown[variant_id] = {
                     "name": variant.get("name", f"Variant {variant_id}"),
-                    "assignments": variant_assignments,
-                    "conversions": variant_conversions,
-                    "conversion_rate": conversion_rate,
+                    "assignments": variant_totals.assignments,
+                    "conversions": variant_totals.conversions,
+                    "conversion_rate": variant_totals.conversion_rate * 100,
                     "traffic_allocation": experiment.traffic_allocation.get(variant_id, 0)
                 }
             
@@ -455,6 +560,11 @@ class ABTestingFramework:
             min_sample_size = experiment.success_criteria.get("minimum_sample_size", self.minimum_sample_size)
             sample_size_reached = total_assignments >= min_sample_size
             
+            # Boundary state of sequentially monitored experiments
+            sequential = None
+            if self._is_sequential(experiment):
+                sequential = self._sequential_test_result(experiment, aggregates)["sequential"]
+            
             return {
                 "experiment_id": experiment_id,
                 "name": experiment.name,
@@ -480,13 +590,40 @@ class ABTestingFramework:
                 "start_date": experiment.start_date.isoformat() if experiment.start_date else None,
                 "end_date": experiment.end_date.isoformat() if experiment.end_date else None,
                 "winner_variant": experiment.winner_variant,
-                "confidence_level": experiment.confidence_level
+                "confidence_level": experiment.confidence_level,
+                "sequential": sequential
             }
             
         except Exception as e:
             logger.error(f"Error getting experiment dashboard: {e}")
             raise
     
+    def get_sequential_state(self, experiment_id: str) -> Dict[str, Any]:
+        """Current mSPRT decision and boundary state of a sequential experiment"""
+        try:
+            experiment = self.db.query(Experiment).filter(
+                Experiment.id == experiment_id
+            ).first()
+            
+            if not experiment:
+                raise ValueError(f"Experiment {experiment_id} not found")
+            
+            if not self._is_sequential(experiment):
+                raise ValueError("Experiment does not use sequential analysis")
+            
+            result = self._sequential_test_result(experiment, variant_stats.get(self.db, experiment_id))
+            return {
+                "experiment_id": experiment_id,
+                "status": experiment.status,
+                "test_type": result["test_type"],
+                "p_value": result["p_value"],
+                **result["sequential"]
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting sequential state: {e}")
+            raise
+    
     def stop_experiment(self, experiment_id: str, reason: str = "manual_stop") -> bool:
         """Stop a running experiment"""
         try:
@@ -511,6 +648,7 @@ class ABTestingFramework:
                 logger.error(f"Error in final analysis: {e}")
             
             self.db.commit()
+            variant_assigner.invalidate()
             
             logger.info(f"Stopped experiment: {experiment.name} - Reason: {reason}")
             return True
@@ -590,28 +728,9 @@ class ABTestingFramework:
                 return False
             
             # Check criteria
-            for field, criteria in audience_criteria.items():
-                customer_value = getattr(customer, field, None)
-                if customer_value is None:
-                    return False
-                
-                if isinstance(criteria, dict):
-                    operator = criteria.get("operator", "equals")
-                    value = criteria.get("value")
-                    
-                    if operator == "equals" and customer_value != value:
-                        return False
-                    elif operator == "greater_than" and customer_value <= value:
-                        return False
-                    elif operator == "less_than" and customer_value >= value:
-                        return False
-                    elif operator == "in" and customer_value not in value:
-                        return False
-                else:
-                    if customer_value != criteria:
-                        return False
-            
-            return True
+            return compile_audience(audience_criteria)(
+                {field: getattr(customer, field, None) for field in audience_criteria}
+            )
             
         except Exception as e:
             logger.error(f"Error checking audience match: {e}")
@@ -620,52 +739,29 @@ class ABTestingFramework:
     def _hash_assign_variant(self, customer_id: str, traffic_allocation: Dict[str, float]) -> str:
         """Assign variant using consistent hashing"""
         try:
-            # Create hash of customer ID
-            hash_value = int(hashlib.md5(customer_id.encode()).hexdigest()[:8], 16)
-            hash_percentage = (hash_value % 10000) / 100  # 0-99.99
-            
-            # Assign based on traffic allocation
-            cumulative = 0
-            for variant_id, allocation in traffic_allocation.items():
-                cumulative += allocation
-                if hash_percentage <= cumulative:
-                    return variant_id
-            
-            # Fallback to first variant
-            return list(traffic_allocation.keys())[0]
+            # Consistent hash of customer ID against cumulative traffic allocation
+            variant_ids, cumulative = cumulative_allocation(traffic_allocation)
+            return pick_variant(hash_percentage(customer_id), variant_ids, cumulative)
             
         except Exception as e:
             logger.error(f"Error in hash assignment: {e}")
             return list(traffic_allocation.keys())[0]
     
     def _analyze_variant_performance(self, experiment_id: str, variant_id: str, 
-                                   metric_type: str) -> VariantPerformance:
+                                   metric_type: str,
+                                   aggregates: Dict[Tuple[str, str], VariantStats] = None) -> VariantPerformance:
         """Analyze performance metrics for a specific variant"""
         try:
-            # Get assignments for variant
-            assignments = self.db.query(ExperimentAssignment).filter(
-                ExperimentAssignment.experiment_id == experiment_id,
-                ExperimentAssignment.variant_id == variant_id
-            ).count()
-            
-            # Get conversions for variant
-            conversions = self.db.query(ExperimentConversion).filter(
-                ExperimentConversion.experiment_id == experiment_id,
-                ExperimentConversion.variant_id == variant_id,
-                ExperimentConversion.metric_type == metric_type
-            ).all()
+            # Running aggregates of the variant's assignments and metric conversions
+            if aggregates is None:
+                aggregates = variant_stats.get(self.db, experiment_id)
+            variant = variant_stats.variant(aggregates, variant_id, metric_type)
             
             # Calculate metrics
-            conversion_count = len(conversions)
-            conversion_rate = (conversion_count / assignments) if assignments > 0 else 0
-            
-            if conversions:
-                values = [c.metric_value for c in conversions]
-                average_value = np.mean(values)
-                std_dev = np.std(values)
-            else:
-                average_value = 0
-                std_dev = 0
+            assignments = variant.assignments
+            conversion_rate = variant.conversion_rate
+            average_value = variant.mean
+            std_dev = math.sqrt(variant.variance)
             
             # Calculate confidence interval
             if assignments > 1 and conversion_rate > 0:
@@ -684,7 +780,8 @@ class ABTestingFramework:
                 conversion_rate=conversion_rate,
                 average_value=average_value,
                 confidence_interval=(ci_lower, ci_upper),
-                standard_error=se
+                standard_error=se,
+                standard_deviation=std_dev
             )
             
         except Exception as e:
@@ -734,12 +831,12 @@ class ABTestingFramework:
                 effect_size = abs(var1.conversion_rate - var2.conversion_rate)
                 
                 return {
-                    "significant": p_value < 0.05,
-                    "p_value": p_value,
-                    "z_score": z_score if 'z_score' in locals() else 0,
-                    "effect_size": effect_size,
+                    "significant": bool(p_value < 0.05),
+                    "p_value": float(p_value),
+                    "z_score": float(z_score) if 'z_score' in locals() else 0,
+                    "effect_size": float(effect_size),
                     "test_type": "proportions_test",
-                    "confidence": 1 - p_value if p_value < 0.05 else 0
+                    "confidence": float(1 - p_value) if p_value < 0.05 else 0
                 }
             
             # T-test for continuous metrics
@@ -755,12 +852,12 @@ class ABTestingFramework:
                     effect_size = abs(var1.average_value - var2.average_value)
                     
                     return {
-                        "significant": p_value < 0.05,
-                        "p_value": p_value,
-                        "t_statistic": t_stat,
-                        "effect_size": effect_size,
+                        "significant": bool(p_value < 0.05),
+                        "p_value": float(p_value),
+                        "t_statistic": float(t_stat),
+                        "effect_size": float(effect_size),
                         "test_type": "t_test",
-                        "confidence": 1 - p_value if p_value < 0.05 else 0
+                        "confidence": float(1 - p_value) if p_value < 0.05 else 0
                     }
                     
                 except Exception as t_error:
@@ -820,10 +917,21 @@ class ABTestingFramework:
             if not experiment or experiment.status != ExperimentStatus.RUNNING.value:
                 return
             
+            if self._is_sequential(experiment):
+                # Advance the mSPRT from the running aggregates; peeking here is safe
+                results = sequential_tester.update(
+                    self.db, experiment, variant_stats.get(self.db, experiment_id),
+                    self._is_rate_metric(experiment.primary_metric)
+                )
+                self.db.commit()
+                
+                if sequential_tester.summary(results)["boundary_crossed"]:
+                    logger.info(f"Auto-stopping experiment {experiment_id}: sequential boundary crossed")
+                    self.stop_experiment(experiment_id, reason="sequential_boundary_crossed")
+                return
+            
             # Check if minimum sample size reached
-            total_assignments = self.db.query(ExperimentAssignment).filter(
-                ExperimentAssignment.experiment_id == experiment_id
-            ).count()
+            total_assignments = variant_stats.totals(variant_stats.get(self.db, experiment_id)).assignments
             
             min_sample_size = experiment.success_criteria.get("minimum_sample_size", self.minimum_sample_size)
             
@@ -843,6 +951,29 @@ class ABTestingFramework:
         except Exception as e:
             logger.error(f"Error checking analysis triggers: {e}")
     
+    def _is_sequential(self, experiment) -> bool:
+        return (experiment.success_criteria or {}).get("analysis_mode") == AnalysisMode.SEQUENTIAL.value
+    
+    def _is_rate_metric(self, metric_type: str) -> bool:
+        return metric_type in [MetricType.CONVERSION_RATE.value, MetricType.CLICK_THROUGH_RATE.value]
+    
+    def _sequential_test_result(self, experiment, aggregates: Dict[Tuple[str, str], VariantStats]) -> Dict[str, Any]:
+        """Statistical result in the shape of _perform_statistical_test from the stored mSPRT state"""
+        summary = sequential_tester.summary(sequential_tester.get(
+            self.db, experiment, aggregates, self._is_rate_metric(experiment.primary_metric)
+        ))
+        variants = list(summary["variants"].values())
+        best = min(variants, key=lambda v: v["p_value"], default=None)
+        p_value = best["p_value"] if best else 1.0
+        return {
+            "significant": summary["boundary_crossed"],
+            "p_value": p_value,
+            "effect_size": abs(best["effect_estimate"]) if best else 0.0,
+            "test_type": "msprt",
+            "confidence": 1 - p_value if summary["boundary_crossed"] else 0,
+            "sequential": summary
+        }
+    
     def _estimate_statistical_power(self, current_sample: int, required_sample: int) -> float:
         """Estimate current statistical power"""
         if current_sample >= required_sample:
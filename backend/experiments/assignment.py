@@ -0,0 +1,292 @@
+"""
+Fast-path experiment variant assignment from an in-process experiment cache
+"""
+from typing import Dict, List, Any, Optional, Tuple, Callable, Mapping
+from datetime import datetime
+from collections import OrderedDict
+from dataclasses import dataclass
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+from core.config import settings
+from core.write_behind import WriteBehindBuffer, BufferFull
+
+logger = logging.getLogger(__name__)
+
+def hash_percentage(customer_id: str) -> float:
+    """Stable bucket of a customer in [0, 100)"""
+    hash_value = int(hashlib.md5(customer_id.encode()).hexdigest()[:8], 16)
+    return (hash_value % 10000) / 100
+
+def pick_variant(percentage: float, variant_ids: Tuple[str, ...], cumulative: Tuple[float, ...]) -> str:
+    """First variant whose cumulative allocation reaches the percentage (first variant as fallback)"""
+    index = bisect.bisect_left(cumulative, percentage)
+    return variant_ids[index] if index < len(variant_ids) else variant_ids[0]
+
+def cumulative_allocation(traffic_allocation: Dict[str, float]) -> Tuple[Tuple[str, ...], Tuple[float, ...]]:
+    variant_ids, cumulative, total = [], [], 0
+    for variant_id, allocation in traffic_allocation.items():
+        total += allocation
+        variant_ids.append(variant_id)
+        cumulative.append(total)
+    return tuple(variant_ids), tuple(cumulative)
+
+def compile_audience(criteria: Dict[str, Any]) -> Callable[[Mapping[str, Any]], bool]:
+    """Predicate over customer attribute values implementing ABTestingFramework audience criteria"""
+    checks = []
+    for field, criterion in (criteria or {}).items():
+        if isinstance(criterion, dict):
+            operator, value = criterion.get("operator", "equals"), criterion.get("value")
+            if operator == "equals":
+                checks.append((field, lambda actual, value=value: actual == value))
+            elif operator == "greater_than":
+                checks.append((field, lambda actual, value=value: actual > value))
+            elif operator == "less_than":
+                checks.append((field, lambda actual, value=value: actual < value))
+            elif operator == "in":
+                checks.append((field, lambda actual, value=value: actual in value))
+            else:
+                checks.append((field, lambda actual: True))  # Unknown operators only require the field
+        else:
+            checks.append((field, lambda actual, value=criterion: actual == value))
+
+    def matches(customer: Mapping[str, Any]) -> bool:
+        for field, check in checks:
+            actual = customer.get(field)
+            if actual is None or not check(actual):
+                return False
+        return True
+
+    return matches
+
+def audience_conditions(model, criteria: Dict[str, Any]) -> List[Any]:
+    """SQL conditions on model columns equivalent to compile_audience(criteria)"""
+    from sqlalchemy import false
+
+    conditions = []
+    for field, criterion in (criteria or {}).items():
+        column = getattr(model, field, None)
+        if column is None:
+            return [false()]  # Attribute never present, nobody matches
+        conditions.append(column.isnot(None))
+        if isinstance(criterion, dict):
+            operator, value = criterion.get("operator", "equals"), criterion.get("value")
+            if operator == "equals":
+                conditions.append(column == value)
+            elif operator == "greater_than":
+                conditions.append(column > value)
+            elif operator == "less_than":
+                conditions.append(column < value)
+            elif operator == "in":
+                conditions.append(column.in_(list(value or [])))
+        else:
+            conditions.append(column == criterion)
+    return conditions
+
+def assign_variants(customer_ids: List[str], traffic_allocation: Dict[str, float]) -> List[str]:
+    """Consistent-hash variants of many customers at once (same result as per-customer assignment)"""
+    import numpy as np
+
+    variant_ids, cumulative = cumulative_allocation(traffic_allocation)
+    buckets = np.fromiter(
+        (int.from_bytes(hashlib.md5(customer_id.encode()).digest()[:4], "big") % 10000 for customer_id in customer_ids),
+        dtype=np.int64, count=len(customer_ids)
+    )
+    indexes = np.searchsorted(np.asarray(cumulative, dtype=float), buckets / 100, side="left")
+    indexes[indexes >= len(variant_ids)] = 0
+    return np.asarray(variant_ids, dtype=object)[indexes].tolist()
+
+@dataclass(frozen=True)
+class CompiledExperiment:
+    """A running experiment prepared for assignment without database access"""
+    experiment_id: str
+    variant_ids: Tuple[str, ...]
+    cumulative: Tuple[float, ...]
+    audience_fields: Tuple[str, ...]
+    audience: Callable[[Mapping[str, Any]], bool]
+
+    def assign(self, customer_id: str) -> str:
+        return pick_variant(hash_percentage(customer_id), self.variant_ids, self.cumulative)
+
+class VariantAssigner:
+    """Assigns variants from a process-local cache of running experiments
+
+    The cache is loaded with one query and refreshed in the background every
+    ``refresh_interval`` seconds, or on the next assignment after
+    ``invalidate`` (called when this process starts, stops or creates an
+    experiment). Audience criteria are evaluated against attributes supplied
+    by the caller; the customer row is only loaded when they are missing.
+    Assignments are persisted through a write-behind buffer; if it is full
+    the row is dropped rather than blocking, since hashing makes the
+    assignment reproducible.
+    """
+
+    def __init__(self, refresh_interval: float = 30.0, flush_size: int = 1000,
+                 flush_interval: float = 1.0, max_pending: int = 50000, max_recent: int = 200000):
+        self.refresh_interval = refresh_interval
+        self.max_recent = max_recent
+        self._experiments: Optional[Dict[str, CompiledExperiment]] = None
+        self._loaded_at = 0.0
+        self._stale = True
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[Tuple[str, str], str]" = OrderedDict()  # Submitted, not yet known stored
+        self._recent_lock = threading.Lock()
+        self.buffer = WriteBehindBuffer(
+            "experiment-assignments", write_assignments, max_events=max_pending,
+            flush_size=flush_size, flush_interval=flush_interval, submit_timeout=0,
+            datetime_fields=("assigned_at",)
+        )
+        self.metrics = {"assignments": 0, "not_eligible": 0, "customer_lookups": 0, "refreshes": 0, "dropped": 0}
+
+    def assign(self, experiment_id: str, customer_id: str, customer_attributes: Mapping[str, Any] = None,
+               db=None) -> Optional[str]:
+        """Variant for a customer, or None if the experiment is not running or the customer is not eligible"""
+        experiment = self.get_experiment(experiment_id, db)
+        if experiment is None:
+            return None
+
+        if experiment.audience_fields:
+            attributes = customer_attributes
+            if attributes is None or any(field not in attributes for field in experiment.audience_fields):
+                attributes = self._load_customer_attributes(customer_id, experiment.audience_fields, db)
+            if not attributes or not experiment.audience(attributes):
+                self.metrics["not_eligible"] += 1
+                return None
+
+        variant_id = experiment.assign(customer_id)
+        self.metrics["assignments"] += 1
+        self._record(experiment_id, customer_id, variant_id)
+        return variant_id
+
+    def get_experiment(self, experiment_id: str, db=None) -> Optional[CompiledExperiment]:
+        experiments = self._experiments
+        if experiments is None or self._stale:
+            experiments = self.refresh(db)
+        elif time.monotonic() - self._loaded_at >= self.refresh_interval and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, name="experiment-cache-refresh", daemon=True).start()
+        return experiments.get(experiment_id)
+
+    def refresh(self, db=None) -> Dict[str, CompiledExperiment]:
+        """Reload running experiments"""
+        from core.database import get_db_context
+        from .ab_testing import Experiment, ExperimentStatus
+
+        def _load(session):
+            return {
+                experiment.id: self._compile(experiment) for experiment in session.query(Experiment).filter(
+                    Experiment.status == ExperimentStatus.RUNNING.value
+                ).all()
+            }
+
+        with self._lock:
+            if db is not None:
+                experiments = _load(db)
+            else:
+                with get_db_context() as session:
+                    experiments = _load(session)
+            self._experiments = experiments
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            self.metrics["refreshes"] += 1
+        return experiments
+
+    def invalidate(self):
+        """Reload the experiment cache before the next assignment"""
+        self._stale = True
+
+    def pending_variant(self, experiment_id: str, customer_id: str) -> Optional[str]:
+        """Variant of an assignment that may not have been written yet"""
+        with self._recent_lock:
+            return self._recent.get((experiment_id, customer_id))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "cached_experiments": len(self._experiments or {}),
+            "persistence": self.buffer.get_metrics()
+        }
+
+    def _record(self, experiment_id: str, customer_id: str, variant_id: str):
+        key = (experiment_id, customer_id)
+        with self._recent_lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                return
+            self._recent[key] = variant_id
+            if len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+        try:
+            self.buffer.submit({
+                "experiment_id": experiment_id,
+                "customer_id": customer_id,
+                "variant_id": variant_id,
+                "assigned_at": datetime.now()
+            })
+        except BufferFull:
+            self.metrics["dropped"] += 1
+            with self._recent_lock:
+                self._recent.pop(key, None)
+
+    def _compile(self, experiment) -> CompiledExperiment:
+        variant_ids, cumulative = cumulative_allocation(experiment.traffic_allocation or {})
+        return CompiledExperiment(
+            experiment_id=experiment.id,
+            variant_ids=variant_ids,
+            cumulative=cumulative,
+            audience_fields=tuple(experiment.target_audience or {}),
+            audience=compile_audience(experiment.target_audience)
+        )
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing experiment cache: {e}")
+        finally:
+            self._refreshing = False
+
+    def _load_customer_attributes(self, customer_id: str, fields: Tuple[str, ...], db=None) -> Optional[Dict[str, Any]]:
+        from core.database import Customer, get_db_context
+
+        self.metrics["customer_lookups"] += 1
+        columns = [getattr(Customer, field) for field in fields if hasattr(Customer, field)]
+
+        def _load(session):
+            row = session.query(*columns).filter(Customer.customer_id == customer_id).first() if columns else None
+            return dict(row._mapping) if row is not None else None
+
+        if db is not None:
+            return _load(db)
+        with get_db_context() as session:
+            return _load(session)
+
+def write_assignments(rows: List[Dict[str, Any]]):
+    """Insert buffered assignments that are not stored yet
+
+    Inserts skip conflicting (experiment, customer) keys, so only the rows
+    this call actually stored are counted into the variant aggregates.
+    """
+    from core.database import get_db_context, bulk_insert_missing
+    from .ab_testing import ExperimentAssignment
+    from .variant_stats import variant_stats
+
+    unique = {(row["experiment_id"], row["customer_id"]): row for row in rows}
+    with get_db_context() as db:
+        inserted = bulk_insert_missing(db, ExperimentAssignment, list(unique.values()), ["experiment_id", "customer_id"])
+        variants_by_experiment = {}
+        for key in inserted:
+            row = unique[tuple(key)]
+            variants_by_experiment.setdefault(row["experiment_id"], []).append(row["variant_id"])
+        for experiment_id, variant_ids in variants_by_experiment.items():
+            variant_stats.record_assignments(db, experiment_id, variant_ids)
+
+variant_assigner = VariantAssigner(
+    refresh_interval=settings.EXPERIMENT_CACHE_REFRESH_SECONDS,
+    flush_size=settings.EXPERIMENT_ASSIGNMENT_FLUSH_SIZE,
+    flush_interval=settings.EXPERIMENT_ASSIGNMENT_FLUSH_INTERVAL_SECONDS
+)
@@ -0,0 +1,210 @@
+"""
+Sequential Testing - always-valid mixture SPRT over running variant aggregates
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime
+from dataclasses import dataclass, asdict
+from enum import Enum
+import logging
+import math
+from sqlalchemy import Column, String, Integer, Float, DateTime, select
+from sqlalchemy.orm import Session
+
+from core.database import Base
+from .variant_stats import VariantStats
+
+logger = logging.getLogger(__name__)
+
+class SequentialDecision(str, Enum):
+    """Boundary state of one treatment against control"""
+    CONTINUE = "continue"
+    TREATMENT_BETTER = "treatment_better"
+    CONTROL_BETTER = "control_better"
+
+class ExperimentSequentialState(Base):
+    """Running mSPRT state of one treatment variant against the control"""
+    __tablename__ = "experiment_sequential_state"
+
+    experiment_id = Column(String, primary_key=True)
+    variant_id = Column(String, primary_key=True)
+    control_variant_id = Column(String)
+    mixture_variance = Column(Float)  # tau^2, fixed once the control has a baseline
+    p_value = Column(Float, default=1.0)  # Always-valid p-value (running minimum)
+    likelihood_ratio = Column(Float, default=0.0)
+    effect_estimate = Column(Float, default=0.0)
+    decision = Column(String, default=SequentialDecision.CONTINUE.value)
+    observations = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
+
+@dataclass
+class SequentialResult:
+    """Current mSPRT statistics of one treatment variant"""
+    variant_id: str
+    control_variant_id: str
+    observations: int
+    effect_estimate: float
+    likelihood_ratio: float
+    threshold: float
+    p_value: float
+    confidence_interval: Tuple[Optional[float], Optional[float]]  # Unbounded before burn-in
+    decision: str
+
+class SequentialTester:
+    """Normal-mixture sequential probability ratio test (mSPRT)
+
+    Each treatment is compared with the first variant (the control) on the
+    difference in means: conversion rate for rate metrics, average metric
+    value otherwise. The mixture likelihood ratio is evaluated from the
+    running sums in ExperimentVariantStats, so every update is O(variants),
+    and its always-valid p-value may be checked after every conversion
+    without inflating false positives. ``alpha`` is split across treatments
+    (Bonferroni). Statistics are only evaluated once every arm has
+    ``burn_in`` observations, to keep the variance estimates stable.
+    """
+
+    def __init__(self, burn_in: int = 100):
+        self.burn_in = burn_in
+
+    def update(self, db: Session, experiment, aggregates: Dict[Tuple[str, str], VariantStats],
+               rate_metric: bool) -> List[SequentialResult]:
+        """Advance the experiment's boundary state from its current aggregates (joins the caller's transaction)"""
+        from .variant_stats import variant_stats
+
+        variant_ids = [variant["id"] for variant in experiment.variants]
+        control_id, treatment_ids = variant_ids[0], variant_ids[1:]
+        alpha = self._alpha(experiment, len(treatment_ids))
+        control = variant_stats.variant(aggregates, control_id, experiment.primary_metric)
+
+        statement = select(ExperimentSequentialState).where(ExperimentSequentialState.experiment_id == experiment.id)
+        if db.get_bind().dialect.name == "postgresql":
+            statement = statement.with_for_update()
+        states = {state.variant_id: state for state in db.execute(statement).scalars()}
+
+        results = []
+        for variant_id in treatment_ids:
+            treatment = variant_stats.variant(aggregates, variant_id, experiment.primary_metric)
+            state = states.get(variant_id)
+            if state is None:
+                state = ExperimentSequentialState(
+                    experiment_id=experiment.id, variant_id=variant_id, control_variant_id=control_id,
+                    p_value=1.0, likelihood_ratio=0.0, effect_estimate=0.0,
+                    decision=SequentialDecision.CONTINUE.value, observations=0
+                )
+                db.add(state)
+
+            if state.mixture_variance is None:
+                state.mixture_variance = self._mixture_variance(experiment, control, rate_metric)
+            moments = self._moments(control, treatment, rate_metric)
+            if moments is not None and state.mixture_variance:
+                effect, variance, observations = moments
+                likelihood_ratio = self._likelihood_ratio(effect, variance, state.mixture_variance)
+                state.likelihood_ratio = likelihood_ratio
+                state.effect_estimate = effect
+                state.observations = observations
+                state.p_value = min(state.p_value if state.p_value is not None else 1.0, 1 / max(likelihood_ratio, 1.0))
+                if state.decision == SequentialDecision.CONTINUE.value and state.p_value <= alpha:
+                    state.decision = (SequentialDecision.TREATMENT_BETTER if effect > 0 else SequentialDecision.CONTROL_BETTER).value
+                state.updated_at = datetime.now()
+
+            results.append(self._result(state, control, treatment, rate_metric, alpha))
+        return results
+
+    def get(self, db: Session, experiment, aggregates: Dict[Tuple[str, str], VariantStats],
+            rate_metric: bool) -> List[SequentialResult]:
+        """Stored boundary state, without advancing it"""
+        from .variant_stats import variant_stats
+
+        variant_ids = [variant["id"] for variant in experiment.variants]
+        alpha = self._alpha(experiment, len(variant_ids) - 1)
+        control = variant_stats.variant(aggregates, variant_ids[0], experiment.primary_metric)
+        states = {
+            state.variant_id: state for state in db.execute(select(ExperimentSequentialState).where(
+                ExperimentSequentialState.experiment_id == experiment.id
+            )).scalars()
+        }
+        return [
+            self._result(states[variant_id], control,
+                         variant_stats.variant(aggregates, variant_id, experiment.primary_metric), rate_metric, alpha)
+            for variant_id in variant_ids[1:] if variant_id in states
+        ]
+
+    def summary(self, results: List[SequentialResult]) -> Dict[str, Any]:
+        """Experiment-level decision from per-treatment results"""
+        crossed = [result for result in results if result.decision != SequentialDecision.CONTINUE.value]
+        winner = None
+        if crossed:
+            improving = [result for result in crossed if result.decision == SequentialDecision.TREATMENT_BETTER.value]
+            if improving:
+                winner = max(improving, key=lambda result: result.effect_estimate).variant_id
+            elif len(crossed) == len(results):
+                winner = results[0].control_variant_id
+        return {
+            "boundary_crossed": bool(crossed),
+            "winner_variant": winner,
+            "variants": {result.variant_id: asdict(result) for result in results}
+        }
+
+    def _moments(self, control: VariantStats, treatment: VariantStats,
+                 rate_metric: bool) -> Optional[Tuple[float, float, int]]:
+        """Difference in means, its variance and the observation count, once both arms passed burn-in"""
+        if rate_metric:
+            n_control, n_treatment = control.assignments, treatment.assignments
+            mean_control, mean_treatment = control.conversion_rate, treatment.conversion_rate
+            var_control = mean_control * (1 - mean_control)
+            var_treatment = mean_treatment * (1 - mean_treatment)
+        else:
+            n_control, n_treatment = control.conversions, treatment.conversions
+            mean_control, mean_treatment = control.mean, treatment.mean
+            var_control, var_treatment = control.variance, treatment.variance
+
+        if min(n_control, n_treatment) < self.burn_in:
+            return None
+        variance = var_control / n_control + var_treatment / n_treatment
+        if variance <= 0:
+            return None
+        return mean_treatment - mean_control, variance, n_control + n_treatment
+
+    def _likelihood_ratio(self, effect: float, variance: float, mixture_variance: float) -> float:
+        log_ratio = (
+            0.5 * math.log(variance / (variance + mixture_variance))
+            + mixture_variance * effect ** 2 / (2 * variance * (variance + mixture_variance))
+        )
+        return math.exp(min(log_ratio, 700))
+
+    def _mixture_variance(self, experiment, control: VariantStats, rate_metric: bool) -> Optional[float]:
+        """tau^2 from the minimum relative effect the experiment was sized for (None until control has a baseline)"""
+        criteria = experiment.success_criteria or {}
+        if criteria.get("mixture_variance"):
+            return float(criteria["mixture_variance"])
+        baseline = control.conversion_rate if rate_metric else control.mean
+        if not baseline or control.conversions < self.burn_in // 10:
+            return None
+        return (criteria.get("minimum_effect_size", 0.05) * abs(baseline)) ** 2
+
+    def _alpha(self, experiment, treatments: int) -> float:
+        confidence = (experiment.success_criteria or {}).get("confidence_level", 0.95)
+        return (1 - confidence) / max(treatments, 1)
+
+    def _result(self, state: ExperimentSequentialState, control: VariantStats, treatment: VariantStats,
+                rate_metric: bool, alpha: float) -> SequentialResult:
+        interval = (None, None)
+        moments = self._moments(control, treatment, rate_metric)
+        if moments is not None and state.mixture_variance:
+            effect, variance, _ = moments
+            tau2 = state.mixture_variance
+            # Always-valid confidence sequence of the normal mixture
+            radius = math.sqrt(variance * (variance + tau2) / tau2 * (math.log((variance + tau2) / variance) + 2 * math.log(1 / alpha)))
+            interval = (effect - radius, effect + radius)
+        return SequentialResult(
+            variant_id=state.variant_id,
+            control_variant_id=state.control_variant_id,
+            observations=state.observations or 0,
+            effect_estimate=state.effect_estimate or 0.0,
+            likelihood_ratio=state.likelihood_ratio or 0.0,
+            threshold=1 / alpha,
+            p_value=state.p_value if state.p_value is not None else 1.0,
+            confidence_interval=interval,
+            decision=state.decision or SequentialDecision.CONTINUE.value
+        )
+
+sequential_tester = SequentialTester()
@@ -0,0 +1,211 @@
+"""
+Experiment Variant Statistics - running sufficient statistics per experiment variant
+"""
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+from datetime import datetime
+from collections import defaultdict
+from dataclasses import dataclass
+import logging
+from sqlalchemy import Column, String, Integer, Float, DateTime, select, delete, func
+from sqlalchemy.orm import Session
+
+from core.database import Base, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+# metric_type of the per-variant totals row (assignments, conversions of any metric)
+ALL_METRICS = ""
+
+class ExperimentVariantStats(Base):
+    """Running assignment and conversion aggregates of one experiment variant"""
+    __tablename__ = "experiment_variant_stats"
+
+    experiment_id = Column(String, primary_key=True)
+    variant_id = Column(String, primary_key=True)
+    metric_type = Column(String, primary_key=True)  # ALL_METRICS for the variant totals
+    assignments = Column(Integer, default=0)
+    conversions = Column(Integer, default=0)
+    value_sum = Column(Float, default=0.0)
+    value_sum_squares = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.now)
+
+@dataclass
+class VariantStats:
+    """Sufficient statistics of one variant for one metric"""
+    assignments: int = 0
+    conversions: int = 0
+    value_sum: float = 0.0
+    value_sum_squares: float = 0.0
+
+    @property
+    def conversion_rate(self) -> float:
+        return self.conversions / self.assignments if self.assignments > 0 else 0
+
+    @property
+    def mean(self) -> float:
+        return self.value_sum / self.conversions if self.conversions > 0 else 0
+
+    @property
+    def variance(self) -> float:
+        """Population variance of the metric values"""
+        if self.conversions == 0:
+            return 0
+        return max(0.0, self.value_sum_squares / self.conversions - self.mean ** 2)
+
+class VariantStatsStore:
+    """Maintains ExperimentVariantStats as assignments and conversions are recorded
+
+    Writers call ``record_assignments`` / ``record_conversions`` in the same
+    transaction as the rows they insert; counters are incremented in a
+    single upsert so concurrent writers do not lose updates. Readers get
+    every variant of an experiment with one query. An experiment without
+    aggregates (e.g. one that predates them) is rebuilt from the raw tables
+    within the caller's transaction on its first read or write, so its
+    history is never skipped.
+    """
+
+    def record_assignments(self, db: Session, experiment_id: str, variant_ids: Iterable[str]):
+        """Count one assignment per variant id given"""
+        counts = defaultdict(int)
+        for variant_id in variant_ids:
+            counts[variant_id] += 1
+        self._increment(db, [
+            {"experiment_id": experiment_id, "variant_id": variant_id, "metric_type": ALL_METRICS,
+             "assignments": count, "conversions": 0, "value_sum": 0.0, "value_sum_squares": 0.0}
+            for variant_id, count in counts.items()
+        ])
+
+    def record_conversions(self, db: Session, experiment_id: str, conversions: Iterable[Tuple[str, str, float]]):
+        """Fold (variant_id, metric_type, metric_value) conversions into the variant and metric rows"""
+        totals: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+        for variant_id, metric_type, metric_value in conversions:
+            value = float(metric_value or 0)
+            for key in {(variant_id, ALL_METRICS), (variant_id, metric_type or ALL_METRICS)}:
+                totals[key][0] += 1
+                totals[key][1] += value
+                totals[key][2] += value * value
+        self._increment(db, [
+            {"experiment_id": experiment_id, "variant_id": variant_id, "metric_type": metric_type,
+             "assignments": 0, "conversions": count, "value_sum": value_sum, "value_sum_squares": value_sum_squares}
+            for (variant_id, metric_type), (count, value_sum, value_sum_squares) in totals.items()
+        ])
+
+    def get(self, db: Session, experiment_id: str) -> Dict[Tuple[str, str], VariantStats]:
+        """Statistics keyed by (variant_id, metric_type)"""
+        rows = db.execute(select(ExperimentVariantStats).where(
+            ExperimentVariantStats.experiment_id == experiment_id
+        )).scalars().all()
+        if not rows:
+            # Rebuilt in the caller's transaction: a read never commits the caller's changes
+            rows = self._rebuild_rows(db, experiment_id, replace=False)
+        return {
+            (row.variant_id, row.metric_type): VariantStats(
+                assignments=row.assignments or 0,
+                conversions=row.conversions or 0,
+                value_sum=row.value_sum or 0.0,
+                value_sum_squares=row.value_sum_squares or 0.0
+            )
+            for row in rows
+        }
+
+    def variant(self, stats: Dict[Tuple[str, str], VariantStats], variant_id: str,
+                metric_type: str = ALL_METRICS) -> VariantStats:
+        """Statistics of one variant; assignments always come from the totals row"""
+        metric_stats = stats.get((variant_id, metric_type), VariantStats())
+        return VariantStats(
+            assignments=stats.get((variant_id, ALL_METRICS), VariantStats()).assignments,
+            conversions=metric_stats.conversions,
+            value_sum=metric_stats.value_sum,
+            value_sum_squares=metric_stats.value_sum_squares
+        )
+
+    def totals(self, stats: Dict[Tuple[str, str], VariantStats]) -> VariantStats:
+        """Experiment-wide assignments and conversions"""
+        total = VariantStats()
+        for (_, metric_type), variant in stats.items():
+            if metric_type == ALL_METRICS:
+                total.assignments += variant.assignments
+                total.conversions += variant.conversions
+                total.value_sum += variant.value_sum
+                total.value_sum_squares += variant.value_sum_squares
+        return total
+
+    def rebuild(self, db: Session, experiment_id: str) -> List[ExperimentVariantStats]:
+        """Recompute an experiment's aggregates from its assignment and conversion rows"""
+        try:
+            rows = self._rebuild_rows(db, experiment_id)
+            db.commit()
+            return rows
+
+        except Exception as e:
+            logger.error(f"Error rebuilding variant statistics for experiment {experiment_id}: {e}")
+            db.rollback()
+            raise
+
+    def _rebuild_rows(self, db: Session, experiment_id: str, replace: bool = True) -> List[ExperimentVariantStats]:
+        """Replace an experiment's aggregates with totals of its raw rows; joins the caller's transaction
+
+        With replace=False the experiment is known to have no aggregates, and
+        nothing is written when it has no raw rows either.
+        """
+        from .ab_testing import ExperimentAssignment, ExperimentConversion
+
+        rows: Dict[Tuple[str, str], ExperimentVariantStats] = {}
+
+        def _row(variant_id: str, metric_type: str) -> ExperimentVariantStats:
+            if (variant_id, metric_type) not in rows:
+                rows[(variant_id, metric_type)] = ExperimentVariantStats(
+                    experiment_id=experiment_id, variant_id=variant_id, metric_type=metric_type,
+                    assignments=0, conversions=0, value_sum=0.0, value_sum_squares=0.0, updated_at=datetime.now()
+                )
+            return rows[(variant_id, metric_type)]
+
+        for variant_id, count in db.execute(
+            select(ExperimentAssignment.variant_id, func.count()).where(
+                ExperimentAssignment.experiment_id == experiment_id
+            ).group_by(ExperimentAssignment.variant_id)
+        ):
+            _row(variant_id, ALL_METRICS).assignments = count
+
+        for variant_id, metric_type, count, value_sum, value_sum_squares in db.execute(
+            select(
+                ExperimentConversion.variant_id, ExperimentConversion.metric_type, func.count(),
+                func.coalesce(func.sum(ExperimentConversion.metric_value), 0.0),
+                func.coalesce(func.sum(ExperimentConversion.metric_value * ExperimentConversion.metric_value), 0.0)
+            ).where(
+                ExperimentConversion.experiment_id == experiment_id
+            ).group_by(ExperimentConversion.variant_id, ExperimentConversion.metric_type)
+        ):
+            for row in {_row(variant_id, ALL_METRICS), _row(variant_id, metric_type or ALL_METRICS)}:
+                row.conversions += count
+                row.value_sum += value_sum
+                row.value_sum_squares += value_sum_squares
+
+        if not replace and not rows:
+            return []
+        if replace:
+            db.execute(delete(ExperimentVariantStats).where(ExperimentVariantStats.experiment_id == experiment_id))
+        db.add_all(rows.values())
+        db.flush()
+        return list(rows.values())
+
+    def _increment(self, db: Session, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        experiment_id = rows[0]["experiment_id"]
+        if db.scalar(select(ExperimentVariantStats.experiment_id).where(
+            ExperimentVariantStats.experiment_id == experiment_id
+        ).limit(1)) is None:
+            # No baseline yet: count every raw row, including the caller's (already added) ones
+            db.flush()
+            self._rebuild_rows(db, experiment_id)
+            return
+        now = datetime.now()
+        bulk_upsert(
+            db, ExperimentVariantStats, [{**row, "updated_at": now} for row in rows],
+            key_columns=["experiment_id", "variant_id", "metric_type"],
+            update_columns=["updated_at"],
+            increment_columns=["assignments", "conversions", "value_sum", "value_sum_squares"]
+        )
+
+variant_stats = VariantStatsStore()
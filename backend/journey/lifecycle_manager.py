@@ -13,6 +13,7 @@ import numpy as np
 from collections import defaultdict
 
 from core.database import Base, get_db
+from leads.rescoring_queue import rescoring_queue
 from ai_engine.generative_analytics import generative_analytics
 
 logger = logging.getLogger(__name__)
@@ -79,7 +80,7 @@ class Touchpoint(Base):
     duration_seconds = Column(Integer)
     engagement_score = Column(Float, default=0.0)
     conversion_value = Column(Float, default=0.0)
-    metadata = Column(JSON, default={})
+    touchpoint_metadata = Column("metadata", JSON, default={})  # "metadata" is reserved on declarative models
     campaign_id = Column(String)
     device_type = Column(String)
     location = Column(String)
@@ -156,7 +157,7 @@ class CustomerLifecycleManager:
                 touchpoint_type=touchpoint_type.value,
                 channel=metadata.get("channel", "unknown"),
                 engagement_score=self.touchpoint_scores.get(touchpoint_type, 1.0),
-                metadata=metadata or {},
+                touchpoint_metadata=metadata or {},
                 campaign_id=metadata.get("campaign_id"),
                 device_type=metadata.get("device_type"),
                 location=metadata.get("location"),
@@ -179,6 +180,9 @@ class CustomerLifecycleManager:
             # Update scores
             self._update_journey_scores(journey)
             
+            # Lead score is now stale
+            rescoring_queue.enqueue(self.db, [customer_id], reason="touchpoint")
+            
             self.db.commit()
             
             logger.info(f"Tracked {touchpoint_type} for customer {customer_id}")
@@ -0,0 +1,374 @@
+"""
+Batch Lead Scoring - vectorized scoring of customer blocks with bulk upserts
+"""
+from typing import Dict, List, Any, Optional, Iterable
+from datetime import datetime, timedelta
+import logging
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, insert, update, func
+
+from core.database import Customer
+from journey.lifecycle_manager import Touchpoint, TouchpointType
+
+logger = logging.getLogger(__name__)
+
+# Score components stored in LeadScore.score_factors, in the single-customer order
+SCORE_COMPONENTS = ["behavioral", "demographic", "predictive", "engagement", "recency", "frequency"]
+
+# Customer fields counted towards profile completeness
+PROFILE_FIELDS = ["age", "gender", "email", "phone"]
+
+# Segments that earn the high-value demographic bonus
+HIGH_VALUE_SEGMENTS = [0, 2, 4]
+
+class BatchLeadScorer:
+    """Score blocks of customers with a few bulk queries and column operations
+
+    Produces the same components as LeadScoringEngine.calculate_lead_score:
+    touchpoints (90 days, which covers the 30-day behavioral window), the last
+    touchpoint per customer and customer attributes are loaded once per block,
+    every component is computed as a vectorized column, the ML model predicts
+    the whole feature matrix in one call, and composite LeadScore rows are
+    updated or inserted in bulk.
+    """
+
+    def __init__(self, scoring_engine, block_size: int = 2000):
+        self.engine = scoring_engine
+        self.db = scoring_engine.db
+        self.block_size = block_size
+
+    def score_customers(self, customer_ids: Iterable[str], persist: bool = True) -> pd.DataFrame:
+        """Score the given customers block by block; returns one row per customer"""
+        customer_ids = sorted(set(customer_ids))
+        frames = []
+        for start in range(0, len(customer_ids), self.block_size):
+            block = customer_ids[start:start + self.block_size]
+            frame = self._score_block(block)
+            if persist:
+                self._persist(frame)
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=["customer_id", *SCORE_COMPONENTS, "composite_score", "previous_score"])
+        return pd.concat(frames, ignore_index=True)
+
+    def score_all(self, persist: bool = True) -> Dict[str, Any]:
+        """Rescore every customer, paging through the customer table by key"""
+        started = time.perf_counter()
+        last_id = None
+        scored = 0
+        blocks = 0
+
+        while True:
+            query = select(Customer.customer_id).where(Customer.customer_id.is_not(None))
+            if last_id is not None:
+                query = query.where(Customer.customer_id > last_id)
+            block = list(self.db.execute(query.order_by(Customer.customer_id).limit(self.block_size)).scalars())
+            if not block:
+                break
+
+            frame = self._score_block(block)
+            if persist:
+                self._persist(frame)
+            scored += len(frame)
+            blocks += 1
+            last_id = block[-1]
+
+        duration = time.perf_counter() - started
+        logger.info(f"Batch lead scoring: {scored} customers in {blocks} blocks, {duration:.1f}s")
+        return {
+            "customers_scored": scored,
+            "blocks": blocks,
+            "duration_seconds": round(duration, 2),
+            "customers_per_second": round(scored / duration, 1) if duration > 0 else None,
+            "model_version": self.engine.model_version
+        }
+
+    # Block scoring
+    def _score_block(self, customer_ids: List[str]) -> pd.DataFrame:
+        from .scoring_engine import ScoreType
+
+        now = datetime.now()
+        customers = self._load_customers(customer_ids)
+        touchpoints = self._load_touchpoints(customer_ids, now - timedelta(days=90))
+        last_touch = self._load_last_touchpoints(customer_ids)
+
+        frame = pd.DataFrame({"customer_id": customer_ids}).set_index("customer_id", drop=False)
+        recent = touchpoints[touchpoints["timestamp"] >= now - timedelta(days=30)]
+
+        frame["behavioral"] = self._behavioral_scores(frame.index, recent, now)
+        frame["demographic"] = self._demographic_scores(frame.index, customers)
+        frame["predictive"] = self._predictive_scores(frame.index, customers, touchpoints, now)
+        frame["engagement"] = self._engagement_scores(frame.index, recent)
+        frame["recency"] = self._recency_scores(frame.index, last_touch, now)
+        frame["frequency"] = self._frequency_scores(frame.index, recent)
+
+        weights = self.engine.score_weights
+        composite = (
+            frame["behavioral"] * weights[ScoreType.BEHAVIORAL] +
+            frame["demographic"] * weights[ScoreType.DEMOGRAPHIC] +
+            frame["predictive"] * weights[ScoreType.PREDICTIVE]
+        )
+        frame["composite_score"] = composite.clip(0, 100)
+        return frame.reset_index(drop=True)
+
+    def _load_customers(self, customer_ids: List[str]) -> pd.DataFrame:
+        columns = ["customer_id", "age", "gender", "email", "phone", "rating_id", "segment_id", "created_at"]
+        mapped = [getattr(Customer, name) for name in columns if hasattr(Customer, name)]
+        rows = self.db.execute(select(*mapped).where(Customer.customer_id.in_(customer_ids))).all()
+        customers = pd.DataFrame(rows, columns=[column.key for column in mapped])
+        for name in columns:
+            if name not in customers:
+                customers[name] = None
+        return customers.drop_duplicates("customer_id").set_index("customer_id")
+
+    def _load_touchpoints(self, customer_ids: List[str], since: datetime) -> pd.DataFrame:
+        rows = self.db.execute(
+            select(
+                Touchpoint.customer_id, Touchpoint.touchpoint_type, Touchpoint.timestamp,
+                Touchpoint.engagement_score, Touchpoint.conversion_value
+            ).where(
+                Touchpoint.customer_id.in_(customer_ids),
+                Touchpoint.timestamp >= since
+            )
+        ).all()
+        touchpoints = pd.DataFrame(
+            rows, columns=["customer_id", "touchpoint_type", "timestamp", "engagement_score", "conversion_value"]
+        )
+        touchpoints["timestamp"] = pd.to_datetime(touchpoints["timestamp"])
+        touchpoints["engagement_score"] = pd.to_numeric(touchpoints["engagement_score"]).fillna(0.0)
+        touchpoints["conversion_value"] = pd.to_numeric(touchpoints["conversion_value"]).fillna(0.0)
+        return touchpoints
+
+    def _load_last_touchpoints(self, customer_ids: List[str]) -> pd.Series:
+        rows = self.db.execute(
+            select(Touchpoint.customer_id, func.max(Touchpoint.timestamp)).where(
+                Touchpoint.customer_id.in_(customer_ids)
+            ).group_by(Touchpoint.customer_id)
+        ).all()
+        return pd.Series(dict(rows), dtype="datetime64[ns]")
+
+    # Score components
+    def _behavioral_scores(self, index: pd.Index, recent: pd.DataFrame, now: datetime) -> pd.Series:
+        if recent.empty:
+            return pd.Series(0.0, index=index)
+
+        known_types = {touchpoint_type.value for touchpoint_type in TouchpointType}
+        base_scores = {touchpoint_type.value: score for touchpoint_type, score in self.engine.behavioral_scores.items()}
+
+        is_known = recent["touchpoint_type"].isin(known_types).to_numpy()
+        score = recent["touchpoint_type"].map(base_scores).fillna(1).to_numpy(dtype=float)
+        score = np.where(recent["timestamp"].to_numpy() >= np.datetime64(now - timedelta(days=7)), score * 1.5, score)
+        conversion_value = recent["conversion_value"].to_numpy(dtype=float)
+        score = np.where(conversion_value > 0, score * (1 + conversion_value / 1000), score)
+        # Unknown touchpoint types earn a flat point with no multipliers
+        score = np.where(is_known, score, 1.0)
+
+        grouped = recent.assign(score=score, day=recent["timestamp"].dt.normalize()).groupby("customer_id")
+        total = grouped["score"].sum() + (grouped["day"].nunique() * 2).clip(upper=20)
+        total = total + self._behavioral_rule_scores(recent, total.index)
+
+        return total.clip(upper=100).reindex(index, fill_value=0.0)
+
+    def _behavioral_rule_scores(self, recent: pd.DataFrame, customers: pd.Index) -> pd.Series:
+        """Vectorized equivalent of _apply_behavioral_rules"""
+        from .scoring_engine import ScoringRule
+
+        rules = self.db.query(ScoringRule).filter(
+            ScoringRule.rule_type == "behavioral",
+            ScoringRule.is_active == True
+        ).all()
+
+        rule_score = pd.Series(0.0, index=customers)
+        for rule in rules:
+            condition = rule.condition or {}
+            condition_type = condition.get("type")
+            operator = condition.get("operator", ">=")
+            value = condition.get("value", 0)
+
+            if condition_type == "touchpoint_count":
+                matching = recent[recent["touchpoint_type"] == condition.get("touchpoint_type")]
+                observed = matching.groupby("customer_id").size().reindex(customers, fill_value=0)
+                operators = (">=", "==", ">")
+            elif condition_type == "purchase_amount":
+                purchases = recent[recent["touchpoint_type"] == TouchpointType.PURCHASE.value]
+                observed = purchases.groupby("customer_id")["conversion_value"].sum().reindex(customers, fill_value=0.0)
+                operators = (">=", ">")
+            else:
+                continue
+
+            if operator not in operators:
+                continue
+            if operator == ">=":
+                matched = observed >= value
+            elif operator == "==":
+                matched = observed == value
+            else:
+                matched = observed > value
+            rule_score += np.where(matched, rule.score_value or 0.0, 0.0)
+
+        return rule_score
+
+    def _demographic_scores(self, index: pd.Index, customers: pd.DataFrame) -> pd.Series:
+        found = index.isin(customers.index)
+        customers = customers.reindex(index)
+
+        age = pd.to_numeric(customers["age"], errors="coerce").fillna(0)
+        age_score = np.select(
+            [age == 0, (age >= 25) & (age <= 45), (age >= 18) & (age <= 65)],
+            [0, 15, 10],
+            default=5
+        )
+        gender_score = np.where(self._truthy(customers["gender"]), 5, 0)
+        rating = pd.to_numeric(customers["rating_id"], errors="coerce").fillna(0)
+        segment = customers["segment_id"]
+        segment_score = np.where(segment.isna(), 0, np.where(segment.isin(HIGH_VALUE_SEGMENTS), 20, 10))
+
+        completeness = sum(self._truthy(customers[name]).astype(int) for name in PROFILE_FIELDS) / len(PROFILE_FIELDS)
+
+        score = age_score + gender_score + rating * 5 + segment_score + completeness * 20
+        return pd.Series(np.where(found, np.minimum(100, score), 0.0), index=index)
+
+    def _predictive_scores(self, index: pd.Index, customers: pd.DataFrame,
+                           touchpoints: pd.DataFrame, now: datetime) -> pd.Series:
+        default = pd.Series(50.0, index=index)
+        if not self.engine.scoring_model:
+            return default
+
+        found = index.isin(customers.index)
+        customers = customers.reindex(index)
+
+        grouped = touchpoints.groupby("customer_id")
+        purchases = touchpoints[touchpoints["touchpoint_type"] == TouchpointType.PURCHASE.value]
+        created_at = pd.to_datetime(customers["created_at"])
+
+        features = pd.DataFrame({
+            "age": pd.to_numeric(customers["age"], errors="coerce").fillna(0),
+            "rating_id": pd.to_numeric(customers["rating_id"], errors="coerce").fillna(0),
+            # Non-numeric segment IDs cannot be scaled; those rows keep the default score
+            "segment_id": pd.to_numeric(customers["segment_id"].where(self._truthy(customers["segment_id"]), 0), errors="coerce"),
+            "touchpoints": grouped.size().reindex(index, fill_value=0),
+            "purchases": purchases.groupby("customer_id").size().reindex(index, fill_value=0),
+            "active_days": grouped["timestamp"].apply(lambda ts: ts.dt.normalize().nunique()).reindex(index, fill_value=0),
+            "engagement": grouped["engagement_score"].sum().reindex(index, fill_value=0.0),
+            "account_age_days": (pd.Timestamp(now) - created_at).dt.days.fillna(0),
+            "is_female": (customers["gender"] == "F").astype(int),
+            "conversion_value": grouped["conversion_value"].sum().reindex(index, fill_value=0.0)
+        }, index=index)
+
+        valid = found & features.notna().all(axis=1).to_numpy()
+        if not valid.any():
+            return default
+
+        try:
+            matrix = features[valid].to_numpy(dtype=float)
+            predictions = self.engine.scoring_model.predict(self.engine.scaler.transform(matrix))
+            default[valid] = np.clip(predictions * 100, 0, 100)
+        except Exception as e:
+            logger.error(f"Error predicting batch lead scores: {e}")
+        return default
+
+    def _engagement_scores(self, index: pd.Index, recent: pd.DataFrame) -> pd.Series:
+        mean_engagement = recent.groupby("customer_id")["engagement_score"].mean()
+        return (mean_engagement * 10).clip(upper=100).reindex(index, fill_value=0.0)
+
+    def _recency_scores(self, index: pd.Index, last_touch: pd.Series, now: datetime) -> pd.Series:
+        days = (pd.Timestamp(now) - last_touch.reindex(index)).dt.days
+        score = np.select(
+            [days.isna(), days <= 1, days <= 7, days <= 30, days <= 90],
+            [0, 100, 80, 60, 40],
+            default=20
+        )
+        return pd.Series(score, index=index, dtype=float)
+
+    def _frequency_scores(self, index: pd.Index, recent: pd.DataFrame) -> pd.Series:
+        counts = recent.groupby("customer_id").size().reindex(index, fill_value=0)
+        score = np.select(
+            [counts >= 20, counts >= 10, counts >= 5, counts >= 2, counts >= 1],
+            [100, 80, 60, 40, 20],
+            default=0
+        )
+        return pd.Series(score, index=index, dtype=float)
+
+    def _truthy(self, series: pd.Series) -> pd.Series:
+        """Python truthiness of each value (None, NaN, 0 and "" are falsy)"""
+        return series.map(lambda value: bool(value) and not (isinstance(value, float) and np.isnan(value)))
+
+    # Persistence
+    def _persist(self, frame: pd.DataFrame):
+        """Bulk update existing composite LeadScore rows and insert the rest"""
+        from .scoring_engine import LeadScore, ScoringEvent, ScoreType
+        from .leaderboard import lead_leaderboard
+
+        if frame.empty:
+            return
+
+        customer_ids = frame["customer_id"].tolist()
+        existing = {}
+        for score_id, customer_id, score_value in self.db.execute(
+            select(LeadScore.id, LeadScore.customer_id, LeadScore.score_value).where(
+                LeadScore.customer_id.in_(customer_ids),
+                LeadScore.score_type == ScoreType.COMPOSITE.value
+            ).order_by(LeadScore.calculated_at)
+        ):
+            existing[customer_id] = (score_id, score_value)  # Latest row wins
+
+        now = datetime.now()
+        expires_at = now + timedelta(hours=24)
+        updates, inserts, events, leaderboard_rows = [], [], [], []
+
+        for row in frame[["customer_id", *SCORE_COMPONENTS, "composite_score"]].itertuples(index=False):
+            factors = {name: float(getattr(row, name)) for name in SCORE_COMPONENTS}
+            composite_score = float(row.composite_score)
+            score_id, previous_score = existing.get(row.customer_id, (None, None))
+            previous_score = previous_score or 0.0
+
+            values = {
+                "score_value": composite_score,
+                "score_factors": factors,
+                "calculated_at": now,
+                "expires_at": expires_at,
+                "model_version": self.engine.model_version
+            }
+            if score_id is None:
+                inserts.append({"customer_id": row.customer_id, "score_type": ScoreType.COMPOSITE.value, **values})
+            else:
+                updates.append({"id": score_id, **values})
+            leaderboard_rows.append({"customer_id": row.customer_id, **values})
+
+            if abs(composite_score - previous_score) >= 5:
+                events.append({
+                    "lead_score_id": score_id,  # Filled in after the insert for first-time scores
+                    "customer_id": row.customer_id,
+                    "event_type": "score_update",
+                    "event_description": f"Score changed from {previous_score:.1f} to {composite_score:.1f}",
+                    "score_change": composite_score - previous_score,
+                    "previous_score": previous_score,
+                    "new_score": composite_score,
+                    "event_metadata": {"source": "batch"},
+                    "timestamp": now
+                })
+
+        frame["previous_score"] = [existing.get(customer_id, (None, 0.0))[1] or 0.0 for customer_id in customer_ids]
+
+        try:
+            if updates:
+                self.db.execute(update(LeadScore), updates)
+            if inserts:
+                inserted_ids = {
+                    customer_id: score_id for score_id, customer_id in
+                    self.db.execute(insert(LeadScore).returning(LeadScore.id, LeadScore.customer_id), inserts)
+                }
+                for scoring_event in events:
+                    if scoring_event["lead_score_id"] is None:
+                        scoring_event["lead_score_id"] = inserted_ids[scoring_event["customer_id"]]
+            if events:
+                self.db.execute(insert(ScoringEvent), events)
+            lead_leaderboard.record(self.db, leaderboard_rows)
+            self.db.commit()
+        except Exception as e:
+            logger.error(f"Error persisting batch lead scores: {e}")
+            self.db.rollback()
+            raise
@@ -0,0 +1,196 @@
+"""
+Lead Leaderboard - maintained ranking table of current composite lead scores
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime, timedelta
+import logging
+from sqlalchemy import Column, String, Float, DateTime, JSON, Index, select, func, and_, or_
+from sqlalchemy.orm import Session
+
+from core.database import Base, Customer, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+class LeadLeaderboardEntry(Base):
+    """Latest composite score per customer, indexed for ranked reads"""
+    __tablename__ = "lead_leaderboard"
+
+    customer_id = Column(String, primary_key=True)
+    score_value = Column(Float, nullable=False)
+    segment_id = Column(String)  # Customer.segment_id when the score was written
+    score_factors = Column(JSON)
+    calculated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_lead_leaderboard_score", "score_value", "customer_id"),
+        Index("ix_lead_leaderboard_segment_score", "segment_id", "score_value", "customer_id"),
+    )
+
+class LeadLeaderboard:
+    """Ranking index over composite lead scores
+
+    Every composite score write upserts one row per customer in the caller's
+    transaction, so reads walk the (segment_id, score_value, customer_id)
+    indexes from the top instead of scanning and sorting LeadScore history.
+    Ties are broken by customer_id. The ``cursor`` returned with each page
+    carries the last score, rank and customer so deep pages stay at
+    O(log n + k); ``offset`` stays available for small page numbers.
+    ``get_rank`` counts the entries ranked before a customer on the same
+    score index.
+    """
+
+    def __init__(self, window_days: int = 30):
+        self.window_days = window_days
+
+    def record(self, db: Session, scores: List[Dict[str, Any]]):
+        """Upsert customer_id/score_value/score_factors/calculated_at rows"""
+        if not scores:
+            return
+        segments = dict(db.execute(
+            select(Customer.customer_id, Customer.segment_id).where(
+                Customer.customer_id.in_([score["customer_id"] for score in scores])
+            )
+        ).all())
+        rows = [{
+            "customer_id": score["customer_id"],
+            "score_value": float(score["score_value"]),
+            "segment_id": segments.get(score["customer_id"]),
+            "score_factors": score.get("score_factors"),
+            "calculated_at": score["calculated_at"]
+        } for score in scores]
+        bulk_upsert(db, LeadLeaderboardEntry, rows, ["customer_id"], ["score_value", "segment_id", "score_factors", "calculated_at"])
+
+    def get_page(self, db: Session, limit: int = 50, offset: int = 0, score_threshold: float = 0.0,
+                 segment_id: str = None, cursor: str = None) -> Dict[str, Any]:
+        """One page of the leaderboard with customer details and a cursor for the next page"""
+        query = select(LeadLeaderboardEntry).where(*self._filters(score_threshold, segment_id)).order_by(
+            LeadLeaderboardEntry.score_value.desc(), LeadLeaderboardEntry.customer_id
+        )
+        if cursor:
+            after_score, after_rank, after_customer_id = self._decode_cursor(cursor)
+            query = query.where(self._ranked_after(after_score, after_customer_id))
+            start_rank = after_rank + 1
+        else:
+            query = query.offset(offset)
+            start_rank = offset + 1
+
+        entries = list(db.execute(query.limit(limit + 1)).scalars())
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        customers = {
+            customer.customer_id: customer for customer in db.execute(
+                select(Customer).where(Customer.customer_id.in_([entry.customer_id for entry in entries]))
+            ).scalars()
+        } if entries else {}
+
+        leaderboard = []
+        for position, entry in enumerate(entries):
+            customer = customers.get(entry.customer_id)
+            leaderboard.append({
+                "rank": start_rank + position,
+                "customer_id": entry.customer_id,
+                "score": entry.score_value,
+                "score_factors": entry.score_factors,
+                "customer_info": {
+                    "age": customer.age if customer else None,
+                    "gender": customer.gender if customer else None,
+                    "segment_id": customer.segment_id if customer else entry.segment_id,
+                    "rating_id": customer.rating_id if customer else None
+                },
+                "calculated_at": entry.calculated_at.isoformat()
+            })
+
+        last = entries[-1] if entries else None
+        return {
+            "leaderboard": leaderboard,
+            "has_more": has_more,
+            "next_cursor": self._encode_cursor(last.score_value, start_rank + len(entries) - 1, last.customer_id) if has_more else None
+        }
+
+    def get_rank(self, db: Session, customer_id: str, score_threshold: float = 0.0,
+                 segment_id: str = None) -> Optional[Dict[str, Any]]:
+        """1-based rank of one customer, or None if they are not on the leaderboard"""
+        entry = db.get(LeadLeaderboardEntry, customer_id)
+        if entry is None or entry.calculated_at < self._window_start() or entry.score_value < score_threshold:
+            return None
+        if segment_id is not None and entry.segment_id != segment_id:
+            return None
+
+        filters = self._filters(score_threshold, segment_id)
+        ahead = db.scalar(select(func.count()).select_from(LeadLeaderboardEntry).where(
+            *filters, self._ranked_before(entry.score_value, customer_id)
+        ))
+        total = db.scalar(select(func.count()).select_from(LeadLeaderboardEntry).where(*filters))
+        return {
+            "customer_id": customer_id,
+            "rank": ahead + 1,
+            "total_ranked": total,
+            "percentile": round(100.0 * (total - ahead) / total, 2) if total else None,
+            "score": entry.score_value,
+            "segment_id": entry.segment_id,
+            "calculated_at": entry.calculated_at.isoformat()
+        }
+
+    def rebuild(self, db: Session) -> int:
+        """Repopulate the table from the latest composite LeadScore per customer"""
+        from .models import LeadScore, ScoreType
+
+        latest = select(
+            LeadScore.customer_id, func.max(LeadScore.calculated_at).label("calculated_at")
+        ).where(LeadScore.score_type == ScoreType.COMPOSITE.value).group_by(LeadScore.customer_id).subquery()
+
+        rows = db.execute(
+            select(LeadScore.customer_id, LeadScore.score_value, LeadScore.score_factors, LeadScore.calculated_at).join(
+                latest, and_(
+                    LeadScore.customer_id == latest.c.customer_id,
+                    LeadScore.calculated_at == latest.c.calculated_at
+                )
+            ).where(LeadScore.score_type == ScoreType.COMPOSITE.value, LeadScore.score_value.is_not(None))
+        ).mappings().all()
+
+        db.query(LeadLeaderboardEntry).delete(synchronize_session=False)
+        for start in range(0, len(rows), 1000):
+            self.record(db, [dict(row) for row in rows[start:start + 1000]])
+        db.commit()
+        logger.info(f"Rebuilt lead leaderboard with {len(rows)} customers")
+        return len(rows)
+
+    def _window_start(self) -> datetime:
+        return datetime.now() - timedelta(days=self.window_days)
+
+    def _filters(self, score_threshold: float, segment_id: Optional[str]) -> list:
+        filters = [
+            LeadLeaderboardEntry.score_value >= score_threshold,
+            LeadLeaderboardEntry.calculated_at >= self._window_start()
+        ]
+        if segment_id is not None:
+            filters.append(LeadLeaderboardEntry.segment_id == segment_id)
+        return filters
+
+    @staticmethod
+    def _ranked_before(score_value: float, customer_id: str):
+        return or_(
+            LeadLeaderboardEntry.score_value > score_value,
+            and_(LeadLeaderboardEntry.score_value == score_value, LeadLeaderboardEntry.customer_id < customer_id)
+        )
+
+    @staticmethod
+    def _ranked_after(score_value: float, customer_id: str):
+        return or_(
+            LeadLeaderboardEntry.score_value < score_value,
+            and_(LeadLeaderboardEntry.score_value == score_value, LeadLeaderboardEntry.customer_id > customer_id)
+        )
+
+    @staticmethod
+    def _encode_cursor(score_value: float, rank: int, customer_id: str) -> str:
+        return f"{score_value!r}:{rank}:{customer_id}"
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[float, int, str]:
+        parts = cursor.split(":", 2)
+        if len(parts) != 3:
+            raise ValueError(f"Invalid leaderboard cursor: {cursor}")
+        return float(parts[0]), int(parts[1]), parts[2]
+
+lead_leaderboard = LeadLeaderboard()
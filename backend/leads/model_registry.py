@@ -0,0 +1,178 @@
+"""
+Lead Scoring Model Registry - versioned scoring models shared across requests
+"""
+from typing import Dict, List, Any, Optional
+from datetime import datetime
+from dataclasses import dataclass
+from pathlib import Path
+import logging
+import pickle
+import re
+import threading
+import time
+import joblib
+import numpy as np
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE_PATTERN = re.compile(r"^lead_scoring_v(?P<version>\d+(?:\.\d+)*)\.joblib$")
+
+@dataclass(frozen=True)
+class ScoringModel:
+    """A loaded, read-only scoring model version"""
+    version: str
+    model: Any
+    scaler: Any
+    path: Optional[str]
+    loaded_at: datetime
+    load_time_ms: float
+    memory_bytes: int
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Scale a feature matrix and predict conversion probabilities"""
+        return self.model.predict(self.scaler.transform(features))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "loaded_at": self.loaded_at.isoformat(),
+            "load_time_ms": self.load_time_ms,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 2)
+        }
+
+def _version_key(version: str) -> tuple:
+    return tuple(int(part) for part in version.split("."))
+
+class ScoringModelRegistry:
+    """Loads lead scoring models from ``<MODEL_PATH>/lead_scoring`` once per process
+
+    Model files are named ``lead_scoring_v<version>.joblib`` and hold a dict with
+    ``model`` and ``scaler``. The newest version is loaded on first use with
+    ``mmap_mode="r"`` so numpy arrays stay memory-mapped and shared between
+    workers. Engines receive the loaded ScoringModel by reference and must not
+    mutate it; a newer file dropped into the directory is picked up on the next
+    poll and swapped in atomically. Reloading an explicit version (e.g. a
+    rollback) pins it and stops the polling until a reload without a version.
+    """
+
+    def __init__(self, model_dir: str = None, poll_interval: float = 60.0):
+        self.model_dir = Path(model_dir or Path(settings.MODEL_PATH) / "lead_scoring")
+        self.poll_interval = poll_interval
+        self._current: Optional[ScoringModel] = None
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self._pinned: Optional[str] = None
+
+    def get(self) -> ScoringModel:
+        """Current scoring model, loading it on first use and polling for new versions"""
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load(self.latest_version())
+                    self._last_poll = time.monotonic()
+            return self._current
+
+        if self._pinned is None and time.monotonic() - self._last_poll >= self.poll_interval:
+            self._last_poll = time.monotonic()
+            latest = self.latest_version()
+            if latest and _version_key(latest) > _version_key(current.version):
+                self._activate(self._load(latest), pinned=None, upgrade=True)
+        return self._current
+
+    def reload(self, version: str = None) -> ScoringModel:
+        """Load and pin a specific version, or load the newest and resume following new versions"""
+        return self._activate(self._load(version or self.latest_version()), pinned=version)
+
+    def _activate(self, model: ScoringModel, pinned: Optional[str], upgrade: bool = False) -> ScoringModel:
+        """Swap a loaded model in; an automatic upgrade never replaces a version pinned meanwhile"""
+        with self._lock:
+            if upgrade and self._pinned is not None:
+                return self._current
+            previous = self._current
+            self._current = model
+            self._pinned = pinned
+            self._last_poll = time.monotonic()
+        logger.info(
+            f"Lead scoring model {model.version} active{' (pinned)' if pinned else ''} "
+            f"(was {previous.version if previous else 'none'}, loaded in {model.load_time_ms}ms)"
+        )
+        return model
+
+    def available_versions(self) -> List[str]:
+        if not self.model_dir.exists():
+            return []
+        versions = [
+            match.group("version") for match in
+            (MODEL_FILE_PATTERN.match(path.name) for path in self.model_dir.iterdir()) if match
+        ]
+        return sorted(versions, key=_version_key)
+
+    def latest_version(self) -> Optional[str]:
+        versions = self.available_versions()
+        return versions[-1] if versions else None
+
+    def save(self, model: Any, scaler: Any, version: str) -> Path:
+        """Write a model version (uncompressed so it can be memory-mapped)"""
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        path = self.model_dir / f"lead_scoring_v{version}.joblib"
+        tmp_path = path.with_suffix(".joblib.tmp")
+        joblib.dump({"model": model, "scaler": scaler, "version": version}, tmp_path)
+        tmp_path.replace(path)
+        return path
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "model_dir": str(self.model_dir),
+            "available_versions": self.available_versions(),
+            "pinned_version": self._pinned,
+            "current": self._current.to_dict() if self._current else None
+        }
+
+    def _load(self, version: Optional[str]) -> ScoringModel:
+        start = time.perf_counter()
+        if version is None:
+            version, model, scaler = self._bootstrap()
+            path = self.model_dir / f"lead_scoring_v{version}.joblib"
+            try:
+                self.save(model, scaler, version)
+            except OSError as e:
+                logger.warning(f"Could not persist bootstrap scoring model: {e}")
+                path = None
+        else:
+            path = self.model_dir / f"lead_scoring_v{version}.joblib"
+            payload = joblib.load(path, mmap_mode="r")
+            model, scaler = payload["model"], payload["scaler"]
+
+        return ScoringModel(
+            version=version,
+            model=model,
+            scaler=scaler,
+            path=str(path) if path else None,
+            loaded_at=datetime.now(),
+            load_time_ms=round((time.perf_counter() - start) * 1000, 1),
+            # The file size for a memory-mapped load: pickling would fault every mapped page in
+            memory_bytes=path.stat().st_size if path else len(pickle.dumps((model, scaler), protocol=pickle.HIGHEST_PROTOCOL))
+        )
+
+    def _bootstrap(self):
+        """Train the placeholder model used until a real one is published"""
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.preprocessing import StandardScaler
+
+        # In production, this would be trained on historical conversion data
+        rng = np.random.RandomState(42)
+        sample_features = rng.random_sample((1000, 10))
+        sample_targets = rng.random_sample(1000)
+
+        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        model.fit(sample_features, sample_targets)
+        scaler = StandardScaler().fit(sample_features)
+
+        logger.info("No published lead scoring model found; trained bootstrap model 1.0")
+        return "1.0", model, scaler
+
+scoring_model_registry = ScoringModelRegistry()
@@ -0,0 +1,98 @@
+"""
+Lead Scoring Models - tables and enums shared by the scoring engine and its workers
+"""
+from datetime import datetime
+from enum import Enum
+from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean
+from sqlalchemy.orm import relationship
+
+from core.database import Base
+
+class LeadQuality(str, Enum):
+    """Lead quality levels"""
+    COLD = "cold"
+    WARM = "warm"
+    HOT = "hot"
+    QUALIFIED = "qualified"
+
+class LeadStatus(str, Enum):
+    """Lead status types"""
+    NEW = "new"
+    MQL = "mql"  # Marketing Qualified Lead
+    SQL = "sql"  # Sales Qualified Lead
+    OPPORTUNITY = "opportunity"
+    CUSTOMER = "customer"
+    LOST = "lost"
+
+class ScoreType(str, Enum):
+    """Types of scores"""
+    BEHAVIORAL = "behavioral"
+    DEMOGRAPHIC = "demographic"
+    FIRMOGRAPHIC = "firmographic"
+    PREDICTIVE = "predictive"
+    COMPOSITE = "composite"
+
+# Database Models
+class LeadScore(Base):
+    """Lead scoring records"""
+    __tablename__ = "lead_scores"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(String, index=True)
+    score_type = Column(String)  # behavioral, demographic, predictive, composite
+    score_value = Column(Float, default=0.0)
+    max_score = Column(Float, default=100.0)
+    score_factors = Column(JSON, default={})  # Breakdown of score components
+    calculated_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime)
+    model_version = Column(String)
+    
+    # Relationships
+    scoring_events = relationship("ScoringEvent", back_populates="lead_score")
+
+class ScoringEvent(Base):
+    """Individual scoring events"""
+    __tablename__ = "scoring_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    lead_score_id = Column(Integer, ForeignKey("lead_scores.id"), index=True)
+    customer_id = Column(String, index=True)
+    event_type = Column(String)
+    event_description = Column(Text)
+    score_change = Column(Float)
+    previous_score = Column(Float)
+    new_score = Column(Float)
+    event_metadata = Column(JSON, default={})
+    timestamp = Column(DateTime, default=datetime.now)
+    
+    # Relationships
+    lead_score = relationship("LeadScore", back_populates="scoring_events")
+
+class LeadQualification(Base):
+    """Lead qualification records"""
+    __tablename__ = "lead_qualifications"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(String, index=True)
+    lead_status = Column(String, default=LeadStatus.NEW.value)
+    lead_quality = Column(String, default=LeadQuality.COLD.value)
+    qualification_score = Column(Float, default=0.0)
+    qualification_criteria = Column(JSON, default={})
+    qualified_by = Column(String)  # system, manual, ai
+    qualified_at = Column(DateTime, default=datetime.now)
+    notes = Column(Text)
+    next_action = Column(String)
+    assigned_to = Column(String)
+
+class ScoringRule(Base):
+    """Configurable scoring rules"""
+    __tablename__ = "scoring_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    rule_name = Column(String, unique=True)
+    rule_type = Column(String)  # behavioral, demographic, custom
+    condition = Column(JSON)  # Rule conditions
+    score_value = Column(Float)  # Points to award
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
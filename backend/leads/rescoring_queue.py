@@ -0,0 +1,241 @@
+"""
+Lead Rescoring Queue - event-driven incremental rescoring of dirty and expired scores
+"""
+from typing import Dict, List, Any, Iterable, Optional
+from datetime import datetime
+import asyncio
+import logging
+import threading
+import time
+from sqlalchemy import Column, String, DateTime, select, delete, func, event
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import Base, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+class LeadRescoreQueueEntry(Base):
+    """A customer whose lead score is stale because of new activity"""
+    __tablename__ = "lead_rescore_queue"
+
+    customer_id = Column(String, primary_key=True)
+    reason = Column(String)  # touchpoint, purchase, manual
+    enqueued_at = Column(DateTime, default=datetime.now, index=True)
+
+class LeadRescoringQueue:
+    """Dirty-customer queue plus a background worker that rescores in batches
+
+    Touchpoint and purchase writers call ``enqueue`` in their own transaction;
+    once it commits, repeat events for a customer within ``dedup_window``
+    seconds are dropped in-process, and across workers the queue row is
+    upserted so a customer is queued at most once. The worker rescores queued customers first, then
+    customers whose composite LeadScore has passed ``expires_at``, using the
+    batch scoring pipeline.
+    """
+
+    def __init__(self, batch_size: int = 500, interval: float = 30.0, dedup_window: float = 60.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dedup_window = dedup_window
+        self.running = False
+
+        self._recent: Dict[str, float] = {}
+        self._recent_lock = threading.Lock()
+        self.metrics = {
+            "enqueued": 0,
+            "deduplicated": 0,
+            "batches": 0,
+            "customers_rescored": 0,
+            "dirty_rescored": 0,
+            "expired_rescored": 0,
+            "last_batch_size": 0,
+            "last_batch_seconds": 0.0,
+            "last_batch_at": None,
+            "last_lag_seconds": 0.0,
+            "max_lag_seconds": 0.0,
+            "errors": 0
+        }
+
+    def enqueue(self, db: Session, customer_ids: Iterable[str], reason: str = "touchpoint") -> int:
+        """Mark customers as needing a rescore; joins the caller's transaction
+
+        The dedup window starts when that transaction commits, so a rolled
+        back enqueue does not suppress the next one.
+        """
+        pending = self._pending(db)
+        customer_ids = [
+            customer_id for customer_id in set(customer_ids)
+            if customer_id and customer_id not in pending and self._should_enqueue(customer_id)
+        ]
+        if not customer_ids:
+            return 0
+
+        now = datetime.now()
+        rows = [{"customer_id": customer_id, "reason": reason, "enqueued_at": now} for customer_id in customer_ids]
+        bulk_upsert(db, LeadRescoreQueueEntry, rows, ["customer_id"], ["reason", "enqueued_at"])
+        pending.update(customer_ids)
+
+        self.metrics["enqueued"] += len(customer_ids)
+        return len(customer_ids)
+
+    def dequeue(self, db: Session, customer_ids: List[str], scored_at: datetime):
+        """Drop queue rows of customers rescored from data as of scored_at; joins the caller's transaction
+
+        Rows re-enqueued after scored_at carry a newer timestamp and stay queued.
+        """
+        if not customer_ids:
+            return
+        db.execute(delete(LeadRescoreQueueEntry).where(
+            LeadRescoreQueueEntry.customer_id.in_(customer_ids),
+            LeadRescoreQueueEntry.enqueued_at <= scored_at
+        ))
+        self._forget(customer_ids)
+
+    def process_batch(self, db: Session) -> Dict[str, Any]:
+        """Rescore one batch of dirty, then expired, customers"""
+        from .scoring_engine import LeadScore, LeadScoringEngine, ScoreType
+
+        started_at = datetime.now()
+        started = time.perf_counter()
+
+        dirty = [tuple(row) for row in db.execute(
+            select(LeadRescoreQueueEntry.customer_id, LeadRescoreQueueEntry.enqueued_at).order_by(
+                LeadRescoreQueueEntry.enqueued_at
+            ).limit(self.batch_size)
+        )]
+        customer_ids = [customer_id for customer_id, _ in dirty]
+
+        expired = []
+        if len(customer_ids) < self.batch_size:
+            expired = list(db.execute(
+                select(LeadScore.customer_id).where(
+                    LeadScore.score_type == ScoreType.COMPOSITE.value,
+                    LeadScore.customer_id.not_in(customer_ids) if customer_ids else LeadScore.customer_id.is_not(None)
+                ).group_by(LeadScore.customer_id).having(
+                    func.max(LeadScore.expires_at) < started_at
+                ).limit(self.batch_size - len(customer_ids))
+            ).scalars())
+            customer_ids.extend(expired)
+
+        if not customer_ids:
+            return {"rescored": 0}
+
+        LeadScoringEngine(db).calculate_lead_scores_batch(customer_ids)
+
+        if dirty:
+            self.dequeue(db, [customer_id for customer_id, _ in dirty], started_at)
+            db.commit()
+
+        duration = time.perf_counter() - started
+        lags = [(datetime.now() - enqueued_at).total_seconds() for _, enqueued_at in dirty if enqueued_at]
+        self.metrics["batches"] += 1
+        self.metrics["customers_rescored"] += len(customer_ids)
+        self.metrics["dirty_rescored"] += len(dirty)
+        self.metrics["expired_rescored"] += len(expired)
+        self.metrics["last_batch_size"] = len(customer_ids)
+        self.metrics["last_batch_seconds"] = round(duration, 3)
+        self.metrics["last_batch_at"] = datetime.now().isoformat()
+        if lags:
+            self.metrics["last_lag_seconds"] = round(max(lags), 1)
+            self.metrics["max_lag_seconds"] = max(self.metrics["max_lag_seconds"], round(max(lags), 1))
+
+        return {"rescored": len(customer_ids), "dirty": len(dirty), "expired": len(expired), "seconds": round(duration, 3)}
+
+    def get_metrics(self, db: Session) -> Dict[str, Any]:
+        """Queue depth, rescoring lag and throughput"""
+        from .models import LeadScore, ScoreType
+
+        depth, oldest = db.execute(
+            select(func.count(LeadRescoreQueueEntry.customer_id), func.min(LeadRescoreQueueEntry.enqueued_at))
+        ).one()
+        expired_backlog = db.scalar(
+            select(func.count()).select_from(
+                select(LeadScore.customer_id).where(
+                    LeadScore.score_type == ScoreType.COMPOSITE.value
+                ).group_by(LeadScore.customer_id).having(
+                    func.max(LeadScore.expires_at) < datetime.now()
+                ).subquery()
+            )
+        )
+        throughput = (
+            self.metrics["last_batch_size"] / self.metrics["last_batch_seconds"]
+            if self.metrics["last_batch_seconds"] else 0.0
+        )
+        return {
+            **self.metrics,
+            "queue_depth": depth,
+            "oldest_enqueued_at": oldest.isoformat() if oldest else None,
+            "current_lag_seconds": round((datetime.now() - oldest).total_seconds(), 1) if oldest else 0.0,
+            "expired_backlog": expired_backlog,
+            "throughput_customers_per_second": round(throughput, 1),
+            "worker_running": self.running,
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval
+        }
+
+    def is_queued(self, db: Session, customer_id: str) -> bool:
+        return db.get(LeadRescoreQueueEntry, customer_id) is not None
+
+    async def run_worker(self):
+        """Background loop: rescore batches until the queue is drained, then sleep"""
+        from core.database import run_with_db
+
+        self.running = True
+        logger.info(f"Lead rescoring worker started (batch {self.batch_size}, every {self.interval}s)")
+        while self.running:
+            try:
+                result = await run_with_db(self.process_batch)
+                if result["rescored"]:
+                    logger.info(f"Rescored {result['rescored']} leads ({result['dirty']} dirty, {result['expired']} expired)")
+                if result["rescored"] >= self.batch_size:
+                    continue  # More work waiting
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logger.error(f"Lead rescoring batch failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+    def _should_enqueue(self, customer_id: str) -> bool:
+        last = self._recent.get(customer_id)
+        if last is not None and time.monotonic() - last < self.dedup_window:
+            self.metrics["deduplicated"] += 1
+            return False
+        return True
+
+    def _pending(self, db: Session) -> set:
+        """Customers enqueued in the session's open transaction"""
+        if "rescore_pending" not in db.info:
+            db.info["rescore_pending"] = set()
+            event.listen(db, "after_commit", self._on_commit)
+            event.listen(db, "after_soft_rollback", self._on_rollback)
+        return db.info["rescore_pending"]
+
+    def _on_commit(self, db: Session):
+        pending = db.info["rescore_pending"]
+        if not pending:
+            return
+        now = time.monotonic()
+        with self._recent_lock:
+            if len(self._recent) > 100000:
+                self._recent = {k: v for k, v in self._recent.items() if now - v < self.dedup_window}
+            for customer_id in pending:
+                self._recent[customer_id] = now
+        pending.clear()
+
+    def _on_rollback(self, db: Session, previous_transaction):
+        db.info["rescore_pending"].clear()
+
+    def _forget(self, customer_ids: List[str]):
+        """Allow rescored customers to be enqueued again immediately"""
+        with self._recent_lock:
+            for customer_id in customer_ids:
+                self._recent.pop(customer_id, None)
+
+rescoring_queue = LeadRescoringQueue(
+    batch_size=settings.LEAD_RESCORE_BATCH_SIZE,
+    interval=settings.LEAD_RESCORE_INTERVAL_SECONDS,
+    dedup_window=settings.LEAD_RESCORE_DEDUP_SECONDS
+)
@@ -12,104 +12,18 @@ from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from dataclasses import dataclass
 import pickle
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import StandardScaler
 import pandas as pd
 
 from core.database import Base, get_db
 from journey.lifecycle_manager import TouchpointType, LifecycleStage
+from .model_registry import scoring_model_registry
+from .leaderboard import lead_leaderboard
+from .models import (
+    LeadQuality, LeadStatus, ScoreType, LeadScore, ScoringEvent, LeadQualification, ScoringRule
+)
 
 logger = logging.getLogger(__name__)
 
-class LeadQuality(str, Enum):
-    """Lead quality levels"""
-    COLD = "cold"
-    WARM = "warm"
-    HOT = "hot"
-    QUALIFIED = "qualified"
-
-class LeadStatus(str, Enum):
-    """Lead status types"""
-    NEW = "new"
-    MQL = "mql"  # Marketing Qualified Lead
-    SQL = "sql"  # Sales Qualified Lead
-    OPPORTUNITY = "opportunity"
-    CUSTOMER = "customer"
-    LOST = "lost"
-
-class ScoreType(str, Enum):
-    """Types of scores"""
-    BEHAVIORAL = "behavioral"
-    DEMOGRAPHIC = "demographic"
-    FIRMOGRAPHIC = "firmographic"
-    PREDICTIVE = "predictive"
-    COMPOSITE = "composite"
-
-# Database Models
-class LeadScore(Base):
-    """Lead scoring records"""
-    __tablename__ = "lead_scores"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(String, index=True)
-    score_type = Column(String)  # behavioral, demographic, predictive, composite
-    score_value = Column(Float, default=0.0)
-    max_score = Column(Float, default=100.0)
-    score_factors = Column(JSON, default={})  # Breakdown of score components
-    calculated_at = Column(DateTime, default=datetime.now)
-    expires_at = Column(DateTime)
-    model_version = Column(String)
-    
-    # Relationships
-    scoring_events = relationship("ScoringEvent", back_populates="lead_score")
-
-class ScoringEvent(Base):
-    """Individual scoring events"""
-    __tablename__ = "scoring_events"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    lead_score_id = Column(Integer, ForeignKey("lead_scores.id"), index=True)
-    customer_id = Column(String, index=True)
-    event_type = Column(String)
-    event_description = Column(Text)
-    score_change = Column(Float)
-    previous_score = Column(Float)
-    new_score = Column(Float)
-    event_metadata = Column(JSON, default={})
-    timestamp = Column(DateTime, default=datetime.now)
-    
-    # Relationships
-    lead_score = relationship("LeadScore", back_populates="scoring_events")
-
-class LeadQualification(Base):
-    """Lead qualification records"""
-    __tablename__ = "lead_qualifications"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(String, index=True)
-    lead_status = Column(String, default=LeadStatus.NEW.value)
-    lead_quality = Column(String, default=LeadQuality.COLD.value)
-    qualification_score = Column(Float, default=0.0)
-    qualification_criteria = Column(JSON, default={})
-    qualified_by = Column(String)  # system, manual, ai
-    qualified_at = Column(DateTime, default=datetime.now)
-    notes = Column(Text)
-    next_action = Column(String)
-    assigned_to = Column(String)
-
-class ScoringRule(Base):
-    """Configurable scoring rules"""
-    __tablename__ = "scoring_rules"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    rule_name = Column(String, unique=True)
-    rule_type = Column(String)  # behavioral, demographic, custom
-    condition = Column(JSON)  # Rule conditions
-    score_value = Column(Float)  # Points to award
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-
 @dataclass
 class ScoringFactors:
     """Score component breakdown"""
@@ -126,8 +40,8 @@ class LeadScoringEngine:
     def __init__(self, db: Session):
         self.db = db
         self.scoring_model = None
-        self.scaler = StandardScaler()
-        self.model_version = "1.0"
+        self.scaler = None
+        self.model_version = None
         
         # Default scoring weights
         self.score_weights = {
@@ -151,12 +65,16 @@ class LeadScoringEngine:
             TouchpointType.REFERRAL: 15
         }
         
-        # Load or initialize ML model
+        # Shared, process-wide ML model
         self._initialize_scoring_model()
     
     def calculate_lead_score(self, customer_id: str, score_type: ScoreType = None) -> Dict[str, Any]:
         """Calculate comprehensive lead score for a customer"""
+        from .rescoring_queue import rescoring_queue
+        
         try:
+            scored_at = datetime.now()
+            
             # Calculate different score components
             behavioral_score = self._calculate_behavioral_score(customer_id)
             demographic_score = self._calculate_demographic_score(customer_id)
@@ -186,11 +104,12 @@ class LeadScoringEngine:
             # Normalize to 0-100 scale
             composite_score = min(100, max(0, composite_score))
             
-            # Store previous score for change tracking
-            previous_score = lead_score.score_value
+            # Store previous score for change tracking (new rows are unflushed, so no default yet)
+            previous_score = lead_score.score_value or 0.0
             
             # Update score record
             lead_score.score_value = composite_score
+            lead_score.model_version = self.model_version
             lead_score.score_factors = {
                 "behavioral": behavioral_score,
                 "demographic": demographic_score,
@@ -210,6 +129,16 @@ class LeadScoringEngine:
                     composite_score - previous_score, previous_score, composite_score
                 )
             
+            lead_leaderboard.record(self.db, [{
+                "customer_id": customer_id,
+                "score_value": composite_score,
+                "score_factors": lead_score.score_factors,
+                "calculated_at": lead_score.calculated_at
+            }])
+            
+            # The score is fresh, so a pending rescore of this customer is done
+            rescoring_queue.dequeue(self.db, [customer_id], scored_at)
+            
             self.db.commit()
             
             # Determine lead quality
@@ -231,6 +160,43 @@ class LeadScoringEngine:
             self.db.rollback()
             raise
     
+    def get_lead_score(self, customer_id: str, force_refresh: bool = False) -> Dict[str, Any]:
+        """Return the stored score while it is fresh, recalculating only when expired or dirty"""
+        if not force_refresh:
+            from .rescoring_queue import rescoring_queue
+            
+            lead_score = self.db.query(LeadScore).filter(
+                LeadScore.customer_id == customer_id,
+                LeadScore.score_type == ScoreType.COMPOSITE.value
+            ).order_by(LeadScore.calculated_at.desc()).first()
+            
+            if (lead_score and lead_score.expires_at and lead_score.expires_at > datetime.now()
+                    and not rescoring_queue.is_queued(self.db, customer_id)):
+                return {
+                    "customer_id": customer_id,
+                    "composite_score": lead_score.score_value,
+                    "previous_score": lead_score.score_value,
+                    "score_change": 0.0,
+                    "lead_quality": self._determine_lead_quality(lead_score.score_value),
+                    "score_breakdown": lead_score.score_factors,
+                    "calculated_at": lead_score.calculated_at.isoformat(),
+                    "expires_at": lead_score.expires_at.isoformat(),
+                    "cached": True,
+                    "recommendations": self._generate_score_recommendations(lead_score.score_value, lead_score.score_factors)
+                }
+        
+        return self.calculate_lead_score(customer_id)
+    
+    def calculate_lead_scores_batch(self, customer_ids: List[str], persist: bool = True) -> pd.DataFrame:
+        """Score many customers at once with bulk queries and vectorized components"""
+        from .batch_scoring import BatchLeadScorer
+        return BatchLeadScorer(self).score_customers(customer_ids, persist=persist)
+    
+    def rescore_all_customers(self, block_size: int = 2000) -> Dict[str, Any]:
+        """Rescore the whole customer base in blocks (nightly job)"""
+        from .batch_scoring import BatchLeadScorer
+        return BatchLeadScorer(self, block_size=block_size).score_all()
+    
     def _calculate_behavioral_score(self, customer_id: str) -> float:
         """Calculate behavioral score based on customer actions"""
         try:
@@ -443,7 +409,7 @@ class LeadScoringEngine:
         """Qualify lead based on score and criteria"""
         try:
             # Get current lead score
-            score_result = self.calculate_lead_score(customer_id)
+            score_result = self.get_lead_score(customer_id)
             composite_score = score_result["composite_score"]
             
             # Get or create qualification record
@@ -515,7 +481,7 @@ class LeadScoringEngine:
         """Get comprehensive lead insights and analytics"""
         try:
             # Get current scores
-            score_result = self.calculate_lead_score(customer_id)
+            score_result = self.get_lead_score(customer_id)
             
             # Get qualification status
             qualification = self.db.query(LeadQualification).filter(
@@ -580,11 +546,37 @@ class LeadScoringEngine:
             if not customer_ids:
                 return {"error": "No customers found in segment"}
             
-            # Get lead scores for segment
-            lead_scores = self.db.query(LeadScore).filter(
+            # Stored scores are used while fresh; missing, expired and dirty ones are rescored in one batch
+            from .rescoring_queue import rescoring_queue, LeadRescoreQueueEntry
+            now = datetime.now()
+            stored = {}
+            for customer_id, score_value, expires_at in self.db.query(
+                LeadScore.customer_id, LeadScore.score_value, LeadScore.expires_at
+            ).filter(
                 LeadScore.customer_id.in_(customer_ids),
                 LeadScore.score_type == ScoreType.COMPOSITE.value
-            ).all()
+            ).order_by(LeadScore.calculated_at):
+                stored[customer_id] = (score_value, expires_at)  # Latest row wins
+            queued = set(customer_id for (customer_id,) in self.db.query(LeadRescoreQueueEntry.customer_id).filter(
+                LeadRescoreQueueEntry.customer_id.in_(customer_ids)
+            ))
+            
+            scores_by_customer = {}
+            stale = []
+            for customer_id in set(customer_ids):
+                score_value, expires_at = stored.get(customer_id, (None, None))
+                if expires_at is None or expires_at <= now or customer_id in queued:
+                    stale.append(customer_id)
+                else:
+                    scores_by_customer[customer_id] = score_value
+            
+            if stale:
+                rescored = self.calculate_lead_scores_batch(stale)
+                scores_by_customer.update(zip(rescored["customer_id"], rescored["composite_score"]))
+                dirty = [customer_id for customer_id in stale if customer_id in queued]
+                if dirty:
+                    rescoring_queue.dequeue(self.db, dirty, now)
+                    self.db.commit()
             
             # Get qualifications
             qualifications = self.db.query(LeadQualification).filter(
@@ -592,7 +584,7 @@ class LeadScoringEngine:
             ).all()
             
             # Analyze patterns
-            scores = [ls.score_value for ls in lead_scores]
+            scores = list(scores_by_customer.values())
             avg_score = np.mean(scores) if scores else 0
             median_score = np.median(scores) if scores else 0
             
@@ -609,7 +601,8 @@ class LeadScoringEngine:
             return {
                 "segment_id": segment_id,
                 "total_customers": len(customers),
-                "scored_customers": len(lead_scores),
+                "scored_customers": len(scores),
+                "rescored_customers": len(stale),
                 "average_score": avg_score,
                 "median_score": median_score,
                 "score_distribution": {
@@ -632,21 +625,12 @@ class LeadScoringEngine:
     
     # Helper methods
     def _initialize_scoring_model(self):
-        """Initialize or load ML scoring model"""
+        """Attach the current model from the shared registry"""
         try:
-            # Try to load existing model
-            # In production, this would load from a file or model registry
-            self.scoring_model = RandomForestRegressor(n_estimators=100, random_state=42)
-            
-            # Train with sample data if no model exists
-            # In production, this would be trained on historical conversion data
-            sample_features = np.random.random((1000, 10))
-            sample_targets = np.random.random(1000)
-            
-            self.scoring_model.fit(sample_features, sample_targets)
-            self.scaler.fit(sample_features)
-            
-            logger.info("Lead scoring model initialized")
+            model = scoring_model_registry.get()
+            self.scoring_model = model.model
+            self.scaler = model.scaler
+            self.model_version = model.version
             
         except Exception as e:
             logger.error(f"Error initializing scoring model: {e}")
@@ -0,0 +1,47 @@
+"""
+Alembic environment - migrates the database configured in core.config
+"""
+import sys
+from pathlib import Path
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.config import settings
+from core.database import Base
+
+# Register the tables of lazily imported engines
+import automation.models  # noqa: E402,F401
+import automation.workflow_timers  # noqa: E402,F401
+import automation.execution_scheduler  # noqa: E402,F401
+import cdp.unified_profile  # noqa: E402,F401
+import cdp.activity_aggregates  # noqa: E402,F401
+import experiments.ab_testing  # noqa: E402,F401
+import experiments.variant_stats  # noqa: E402,F401
+import journey.lifecycle_manager  # noqa: E402,F401
+import leads.models  # noqa: E402,F401
+import leads.leaderboard  # noqa: E402,F401
+import leads.rescoring_queue  # noqa: E402,F401
+import segmentation.dynamic_engine  # noqa: E402,F401
+import segmentation.membership_index  # noqa: E402,F401
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    context.configure(url=settings.DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    connectable = create_engine(settings.DATABASE_URL, poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
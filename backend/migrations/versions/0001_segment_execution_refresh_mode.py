@@ -0,0 +1,29 @@
+"""Add segment_executions.refresh_mode
+
+Databases created before incremental segment refresh lack the column.
+Existing rows stay NULL, which the incremental baseline lookup treats as
+a full refresh.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "segment_executions" not in inspector.get_table_names():
+        return  # Created with the column by init_database
+    if "refresh_mode" in {column["name"] for column in inspector.get_columns("segment_executions")}:
+        return
+    op.add_column("segment_executions", sa.Column("refresh_mode", sa.String(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("segment_executions") as batch_op:
+        batch_op.drop_column("refresh_mode")
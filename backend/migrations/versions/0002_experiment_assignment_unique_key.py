@@ -0,0 +1,36 @@
+"""Deduplicate experiment_assignments and add uq_experiment_assignment
+
+Databases created before assignments were written idempotently can hold
+several rows per (experiment_id, customer_id), which blocks the unique
+index. The row with the lowest id is kept: it is the assignment the
+customer saw first.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "experiment_assignments" not in inspector.get_table_names():
+        return  # Created with the index by init_database
+    if "uq_experiment_assignment" in {index["name"] for index in inspector.get_indexes("experiment_assignments")}:
+        return
+    op.execute(
+        "DELETE FROM experiment_assignments "
+        "WHERE experiment_id IS NOT NULL AND customer_id IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM experiment_assignments "
+        "WHERE experiment_id IS NOT NULL AND customer_id IS NOT NULL "
+        "GROUP BY experiment_id, customer_id)"
+    )
+    op.create_index("uq_experiment_assignment", "experiment_assignments", ["experiment_id", "customer_id"], unique=True)
+
+def downgrade():
+    op.drop_index("uq_experiment_assignment", table_name="experiment_assignments")
@@ -0,0 +1,335 @@
+"""
+Segment Criteria Compiler - turns segment criteria trees into SQL
+"""
+from typing import Dict, List, Any, Optional
+from datetime import datetime, timedelta
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, and_, or_, not_, true, false, exists, DateTime
+from sqlalchemy.sql import Select, ColumnElement
+
+from core.database import Customer
+
+logger = logging.getLogger(__name__)
+
+# Accepted spellings for the field of a leaf condition
+FIELD_KEYS = ("field", "field_name")
+
+# Operators that select rows where the column may be NULL
+NULL_INCLUSIVE_OPERATORS = {"not_equals", "not_in", "not_contains", "is_null"}
+
+
+class CriteriaCompiler:
+    """Compile DynamicSegment criteria into SQLAlchemy WHERE clauses
+
+    Criteria can be written in any of these forms (and nested freely):
+      - leaf:  {"field": "age", "operator": "greater_than", "value": 30}
+      - group: {"logical_operator": "or", "conditions": [...]}
+      - flat:  {"gender": "F", "total_spent": {"operator": "greater_equal", "value": 500}}
+      - list:  [leaf, group, ...]  (AND-ed)
+
+    A "not" group negates the AND of its conditions. Every leaf compiles to a
+    two-valued predicate (NULL columns are handled explicitly) so that NOT
+    behaves the same way on SQLite and PostgreSQL.
+    """
+
+    def __init__(self, model=Customer):
+        self.model = model
+
+    def build_select(self, criteria: Any, exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> Select:
+        """Build a select of qualifying customer IDs"""
+        customer_id = self.model.customer_id
+        conditions = [customer_id.is_not(None), self.compile(criteria)]
+        conditions.extend(self.compile_exclusions(exclusion_rules or []))
+        return select(customer_id).where(and_(*conditions))
+
+    def compile(self, criteria: Any) -> ColumnElement:
+        """Compile a criteria tree into a single boolean expression"""
+        if criteria is None:
+            return self._combine("and", [])
+
+        if isinstance(criteria, (list, tuple)):
+            return self._combine("and", [self.compile(c) for c in criteria])
+
+        if not isinstance(criteria, dict):
+            raise ValueError(f"Unsupported criteria node: {criteria!r}")
+
+        if not criteria:
+            return self._combine("and", [])
+
+        if "conditions" in criteria:
+            logical_operator = str(criteria.get("logical_operator", criteria.get("operator", "and"))).lower()
+            return self._combine(logical_operator, [self.compile(c) for c in criteria["conditions"]])
+
+        if any(key in criteria for key in FIELD_KEYS):
+            return self._compile_leaf(criteria)
+
+        # Flat {field: condition} mapping
+        return self._combine("and", [self._compile_leaf(leaf) for leaf in self._flat_leaves(criteria)])
+
+    def referenced_fields(self, criteria: Any, exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> set:
+        """Collect the customer fields a criteria tree (and its exclusion rules) reads"""
+        return {self._leaf_field(leaf) for leaf in self._leaves(criteria, exclusion_rules)}
+
+    def uses_relative_dates(self, criteria: Any, exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> bool:
+        """Whether a date condition is relative to now ({"days_ago": n}), so matches drift without any row changing"""
+        for leaf in self._leaves(criteria, exclusion_rules):
+            column = self.model.__table__.columns.get(self._leaf_field(leaf))
+            if column is not None and isinstance(column.type, DateTime) and self._is_relative_date(leaf.get("value")):
+                return True
+        return False
+
+    def compile_exclusions(self, exclusion_rules: List[Dict[str, Any]]) -> List[ColumnElement]:
+        """Compile exclusion rules into a list of NOT predicates"""
+        from .dynamic_engine import SegmentMembership
+
+        predicates = []
+        for rule in exclusion_rules:
+            rule_type = rule.get("type")
+            if rule_type == "segment" and rule.get("segment_id"):
+                predicates.append(~exists().where(
+                    SegmentMembership.segment_id == rule["segment_id"],
+                    SegmentMembership.customer_id == self.model.customer_id,
+                    SegmentMembership.is_active == True
+                ))
+            elif rule_type == "criteria" and rule.get("criteria"):
+                predicates.append(not_(self.compile(rule["criteria"])))
+            else:
+                logger.warning(f"Ignoring unsupported exclusion rule: {rule}")
+        return predicates
+
+    def _combine(self, logical_operator: str, expressions: List[ColumnElement]) -> ColumnElement:
+        """Combine child expressions with a logical operator"""
+        if logical_operator == "and":
+            return and_(true(), *expressions)
+        if logical_operator == "or":
+            return or_(false(), *expressions)
+        if logical_operator == "not":
+            return not_(and_(true(), *expressions))
+        raise ValueError(f"Unsupported logical operator: {logical_operator}")
+
+    def _leaves(self, criteria: Any, exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Leaf conditions of a criteria tree and of its criteria exclusion rules"""
+        leaves = []
+        nodes = [criteria] + [rule.get("criteria") for rule in exclusion_rules or [] if rule.get("type") == "criteria"]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, (list, tuple)):
+                nodes.extend(node)
+            elif isinstance(node, dict) and node:
+                if "conditions" in node:
+                    nodes.extend(node["conditions"])
+                elif any(key in node for key in FIELD_KEYS):
+                    leaves.append(node)
+                else:
+                    leaves.extend(self._flat_leaves(node))
+        return leaves
+
+    def _is_relative_date(self, value: Any) -> bool:
+        """Whether a leaf value (or one of its list items or between bounds) is a {"days_ago": n} date"""
+        if isinstance(value, (list, tuple)):
+            return any(self._is_relative_date(item) for item in value)
+        if isinstance(value, dict):
+            return "days_ago" in value or any(self._is_relative_date(value.get(bound)) for bound in ("min", "max"))
+        return False
+
+    def _flat_leaves(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Expand a flat {field: condition} mapping into leaf conditions"""
+        leaves = []
+        for field_name, condition in criteria.items():
+            if isinstance(condition, dict):
+                leaves.append({**condition, "field": field_name})
+            else:
+                leaves.append({"field": field_name, "operator": "equals", "value": condition})
+        return leaves
+
+    def _leaf_field(self, leaf: Dict[str, Any]) -> str:
+        """Field name of a leaf condition"""
+        return next(leaf[key] for key in FIELD_KEYS if key in leaf)
+
+    def _table_column(self, field_name: str):
+        """Look up the table column behind a criteria field"""
+        column = self.model.__table__.columns.get(field_name)
+        if column is None:
+            raise ValueError(f"Unknown segment field: {field_name}")
+        return column
+
+    def _resolve_column(self, field_name: str):
+        """Resolve a criteria field to a mapped column"""
+        self._table_column(field_name)
+        return getattr(self.model, field_name)
+
+    def _leaf_parts(self, leaf: Dict[str, Any]):
+        """Split a leaf into (field name, operator, coerced value)"""
+        field_name = self._leaf_field(leaf)
+        column = self._table_column(field_name)
+        operator = str(leaf.get("operator", "equals")).lower()
+        return field_name, operator, self._coerce_value(column, leaf.get("value"))
+
+    def _between_bounds(self, field_name: str, value: Any):
+        """Normalize a between value ([low, high] or {"min", "max"}) into coerced bounds"""
+        if isinstance(value, dict):
+            low, high = value.get("min"), value.get("max")
+        else:
+            low, high = value
+        column = self._table_column(field_name)
+        return self._coerce_value(column, low), self._coerce_value(column, high)
+
+    def _coerce_value(self, column, value: Any) -> Any:
+        """Coerce JSON criteria values to the column's Python type"""
+        if isinstance(value, (list, tuple)):
+            return [self._coerce_value(column, v) for v in value]
+
+        if isinstance(column.type, DateTime):
+            if isinstance(value, dict) and "days_ago" in value:
+                return datetime.now() - timedelta(days=float(value["days_ago"]))
+            if isinstance(value, str):
+                return datetime.fromisoformat(value)
+
+        return value
+
+    def _compile_leaf(self, leaf: Dict[str, Any]) -> ColumnElement:
+        """Compile a single field/operator/value condition"""
+        field_name, operator, value = self._leaf_parts(leaf)
+        column = self._resolve_column(field_name)
+
+        if operator == "is_null":
+            return column.is_(None)
+        if operator == "is_not_null":
+            return column.is_not(None)
+
+        if operator == "equals":
+            if value is None:
+                return column.is_(None)
+            predicate = column == value
+        elif operator == "not_equals":
+            if value is None:
+                return column.is_not(None)
+            predicate = column != value
+        elif operator == "greater_than":
+            predicate = column > value
+        elif operator == "less_than":
+            predicate = column < value
+        elif operator == "greater_equal":
+            predicate = column >= value
+        elif operator == "less_equal":
+            predicate = column <= value
+        elif operator == "in":
+            values = list(value or [])
+            predicate = column.in_(values) if values else false()
+        elif operator == "not_in":
+            values = list(value or [])
+            predicate = column.not_in(values) if values else true()
+        elif operator == "contains":
+            predicate = column.contains(str(value), autoescape=True)
+        elif operator == "not_contains":
+            predicate = ~column.contains(str(value), autoescape=True)
+        elif operator == "starts_with":
+            predicate = column.startswith(str(value), autoescape=True)
+        elif operator == "ends_with":
+            predicate = column.endswith(str(value), autoescape=True)
+        elif operator == "between":
+            predicate = column.between(*self._between_bounds(field_name, value))
+        elif operator == "regex":
+            predicate = column.regexp_match(str(value))
+        else:
+            raise ValueError(f"Unsupported criteria operator: {operator}")
+
+        if operator in NULL_INCLUSIVE_OPERATORS:
+            return or_(column.is_(None), predicate)
+        return and_(column.is_not(None), predicate)
+
+
+class FrameCriteriaEvaluator(CriteriaCompiler):
+    """Evaluate the same criteria trees as vectorized boolean masks over a DataFrame
+
+    Used when many segments are refreshed against one streamed chunk of customers.
+    Semantics match the SQL compiler, including NULL handling. Segment exclusion
+    rules are resolved against pre-loaded member sets.
+    """
+
+    def __init__(self, frame: pd.DataFrame, excluded_members: Optional[Dict[str, set]] = None, model=Customer):
+        super().__init__(model)
+        self.frame = frame
+        self.excluded_members = excluded_members or {}
+
+    def evaluate(self, criteria: Any, exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> np.ndarray:
+        """Boolean mask of rows that qualify for the criteria"""
+        mask = self.frame["customer_id"].notna().to_numpy() & self.compile(criteria)
+        for predicate in self.compile_exclusions(exclusion_rules or []):
+            mask &= predicate
+        return mask
+
+    def compile_exclusions(self, exclusion_rules: List[Dict[str, Any]]) -> List[np.ndarray]:
+        """Exclusion rules as masks of rows to keep"""
+        predicates = []
+        for rule in exclusion_rules:
+            rule_type = rule.get("type")
+            if rule_type == "segment" and rule.get("segment_id"):
+                excluded = self.excluded_members.get(rule["segment_id"], set())
+                predicates.append(~self.frame["customer_id"].isin(excluded).to_numpy())
+            elif rule_type == "criteria" and rule.get("criteria"):
+                predicates.append(~self.compile(rule["criteria"]))
+            else:
+                logger.warning(f"Ignoring unsupported exclusion rule: {rule}")
+        return predicates
+
+    def _combine(self, logical_operator: str, expressions: List[np.ndarray]) -> np.ndarray:
+        if logical_operator == "and":
+            return np.logical_and.reduce(expressions, initial=True) if expressions else np.ones(len(self.frame), dtype=bool)
+        if logical_operator == "or":
+            return np.logical_or.reduce(expressions, initial=False) if expressions else np.zeros(len(self.frame), dtype=bool)
+        if logical_operator == "not":
+            return ~self._combine("and", expressions)
+        raise ValueError(f"Unsupported logical operator: {logical_operator}")
+
+    def _compile_leaf(self, leaf: Dict[str, Any]) -> np.ndarray:
+        field_name, operator, value = self._leaf_parts(leaf)
+        series = self.frame[field_name]
+        is_null = series.isna().to_numpy()
+
+        if operator == "is_null":
+            return is_null
+        if operator == "is_not_null":
+            return ~is_null
+
+        if operator in ("equals", "not_equals") and value is None:
+            return is_null if operator == "equals" else ~is_null
+
+        if operator == "equals":
+            predicate = series == value
+        elif operator == "not_equals":
+            predicate = series != value
+        elif operator == "greater_than":
+            predicate = series > value
+        elif operator == "less_than":
+            predicate = series < value
+        elif operator == "greater_equal":
+            predicate = series >= value
+        elif operator == "less_equal":
+            predicate = series <= value
+        elif operator == "in":
+            predicate = series.isin(list(value or []))
+        elif operator == "not_in":
+            predicate = ~series.isin(list(value or []))
+        elif operator in ("contains", "not_contains"):
+            predicate = series.astype("string").str.contains(str(value), regex=False)
+            if operator == "not_contains":
+                predicate = ~predicate
+        elif operator == "starts_with":
+            predicate = series.astype("string").str.startswith(str(value))
+        elif operator == "ends_with":
+            predicate = series.astype("string").str.endswith(str(value))
+        elif operator == "between":
+            low, high = self._between_bounds(field_name, value)
+            predicate = series.between(low, high)
+        elif operator == "regex":
+            predicate = series.astype("string").str.contains(str(value), regex=True)
+        else:
+            raise ValueError(f"Unsupported criteria operator: {operator}")
+
+        predicate = predicate.fillna(False).to_numpy(dtype=bool)
+        if operator in NULL_INCLUSIVE_OPERATORS:
+            return is_null | predicate
+        return ~is_null & predicate
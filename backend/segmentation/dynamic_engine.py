@@ -7,10 +7,13 @@ from enum import Enum
 import json
 import logging
 import uuid
+import hashlib
+import threading
 import numpy as np
 from dataclasses import dataclass, asdict
 from collections import defaultdict
-from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean, Index
+from sqlalchemy import Column, String, Integer, DateTime, Float, JSON, ForeignKey, Text, Boolean, Index, func, insert, update, or_, select
+from sqlalchemy.sql import Select
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sklearn.cluster import KMeans, DBSCAN
@@ -21,9 +24,65 @@ from sklearn.metrics import silhouette_score
 import pandas as pd
 
 from core.database import Base, get_db
+from .criteria_compiler import CriteriaCompiler, FrameCriteriaEvaluator
+from .membership_index import SegmentMembershipIndex, popcount
 
 logger = logging.getLogger(__name__)
 
+# Random customer sample shared by all engines in the process for size previews
+PREVIEW_SAMPLE_SIZE = 20000
+_preview_sample: Dict[str, Any] = {}
+_preview_sample_lock = threading.Lock()
+
+def _build_preview_sample(db, sample_size: int) -> Dict[str, Any]:
+    """Draw a random customer sample with its bitmap ordinals (read-only)"""
+    from core.database import Customer
+    columns = [column.name for column in Customer.__table__.columns if column.name != "id"]
+    rows = db.execute(
+        select(*[getattr(Customer, column) for column in columns])
+        .order_by(func.random())
+        .limit(sample_size)
+    ).all()
+    frame = pd.DataFrame(rows, columns=columns)
+    
+    # Customers without an ordinal are in no segment bitmap (-1)
+    ordinal_map = SegmentMembershipIndex(db).lookup_ordinals(frame["customer_id"].dropna())
+    ordinals = np.array(
+        [ordinal_map.get(customer_id, -1) for customer_id in frame["customer_id"]],
+        dtype=np.int64
+    )
+    
+    sample = {
+        "frame": frame,
+        "ordinals": ordinals,
+        "population": db.query(func.count(Customer.id)).scalar() or 0,
+        "built_at": datetime.now()
+    }
+    logger.info(f"Rebuilt segment preview sample: {len(frame)} of {sample['population']} customers")
+    return sample
+
+def _refresh_preview_sample(sample_size: int):
+    from core.database import get_db_context
+    try:
+        with get_db_context() as db:
+            _preview_sample["current"] = _build_preview_sample(db, sample_size)
+    except Exception as e:
+        logger.error(f"Error refreshing segment preview sample: {e}")
+    finally:
+        _preview_sample["refreshing"] = False
+
+def warm_preview_sample(sample_size: int = PREVIEW_SAMPLE_SIZE) -> bool:
+    """Draw the preview sample on a background thread unless a draw is already running"""
+    with _preview_sample_lock:
+        if _preview_sample.get("refreshing"):
+            return False
+        _preview_sample["refreshing"] = True
+    threading.Thread(
+        target=_refresh_preview_sample, args=(sample_size,),
+        name="segment-preview-sample", daemon=True
+    ).start()
+    return True
+
 class SegmentType(str, Enum):
     """Types of customer segments"""
     STATIC = "static"
@@ -79,6 +138,12 @@ class UpdateFrequency(str, Enum):
     MONTHLY = "monthly"
     MANUAL = "manual"
 
+class RefreshMode(str, Enum):
+    """How a segment execution re-evaluates customers"""
+    AUTO = "auto"
+    FULL = "full"
+    INCREMENTAL = "incremental"
+
 # Database Models
 class DynamicSegment(Base):
     """Dynamic customer segment definition"""
@@ -173,6 +238,7 @@ class SegmentExecution(Base):
     # Execution details
     execution_type = Column(String)  # full_refresh, incremental, manual
     trigger = Column(String)         # scheduled, manual, event_driven
+    refresh_mode = Column(String, default=RefreshMode.FULL.value)  # full or incremental
     status = Column(String, index=True)
     
     # Execution metrics
@@ -240,6 +306,7 @@ class SegmentationResult:
     quality_score: float
     error_messages: List[str]
     warnings: List[str]
+    refresh_mode: str = RefreshMode.FULL.value
 
 @dataclass
 class SegmentInsight:
@@ -265,6 +332,11 @@ class DynamicSegmentationEngine:
         self.min_segment_size = 10
         self.quality_threshold = 0.7
         self.overlap_threshold = 0.3
+        self.membership_batch_size = 1000  # Rows per bulk insert / IN (...) update
+        self.full_refresh_interval = timedelta(days=7)  # Safety-net full rebuild for incremental segments
+        self.membership_index = SegmentMembershipIndex(db, self.membership_batch_size)
+        self.preview_sample_size = PREVIEW_SAMPLE_SIZE
+        self.preview_sample_ttl = timedelta(minutes=15)
         
         # ML configuration
         self.feature_columns = [
@@ -323,10 +395,17 @@ class DynamicSegmentationEngine:
             self.db.rollback()
             raise
     
-    async def execute_segmentation(self, segment_id: str, execution_type: str = "scheduled") -> SegmentationResult:
-        """Execute segmentation for a specific segment"""
+    async def execute_segmentation(self, segment_id: str, execution_type: str = "scheduled",
+                                   refresh_mode: str = RefreshMode.AUTO.value) -> SegmentationResult:
+        """Execute segmentation for a specific segment
+        
+        refresh_mode "auto" runs incrementally when the segment is eligible and
+        falls back to a full rebuild otherwise; "full" and "incremental" force a mode
+        (incremental still falls back to full when there is no usable baseline run).
+        """
         try:
             start_time = datetime.now()
+            start_time_utc = datetime.utcnow()
             
             # Get segment
             segment = self.db.query(DynamicSegment).filter(
@@ -336,13 +415,26 @@ class DynamicSegmentationEngine:
             if not segment:
                 raise ValueError(f"Segment {segment_id} not found")
             
+            # Decide between a full rebuild and an incremental refresh
+            if execution_type == RefreshMode.INCREMENTAL.value and refresh_mode == RefreshMode.AUTO.value:
+                refresh_mode = RefreshMode.INCREMENTAL.value
+            baseline = self._resolve_incremental_baseline(segment, refresh_mode)
+            resolved_mode = RefreshMode.INCREMENTAL.value if baseline else RefreshMode.FULL.value
+            
             # Create execution record
             execution = SegmentExecution(
                 segment_id=segment_id,
                 execution_type=execution_type,
                 trigger=execution_type,
+                refresh_mode=resolved_mode,
                 status="running",
-                before_size=segment.current_size or 0
+                before_size=segment.current_size or 0,
+                started_at=start_time,
+                execution_results={
+                    "criteria_hash": self._criteria_fingerprint(segment),
+                    "started_at_utc": start_time_utc.isoformat(),
+                    "changed_since": baseline[0].isoformat() if baseline else None
+                }
             )
             
             self.db.add(execution)
@@ -360,7 +452,7 @@ class DynamicSegmentationEngine:
                 elif segment.segment_type == SegmentType.RFM.value:
                     result = await self._execute_rfm_segmentation(segment, execution)
                 else:
-                    result = await self._execute_criteria_based_segmentation(segment, execution)
+                    result = await self._execute_criteria_based_segmentation(segment, execution, baseline)
                 
                 # Update segment metrics
                 await self._update_segment_metrics(segment)
@@ -388,7 +480,8 @@ class DynamicSegmentationEngine:
                 # Update execution stats
                 self._update_execution_stats(execution)
                 
-                logger.info(f"Completed segmentation for {segment.name}: {result.customers_added} added, {result.customers_removed} removed")
+                logger.info(f"Completed {resolved_mode} segmentation for {segment.name}: "
+                            f"{result.customers_processed} evaluated, {result.customers_added} added, {result.customers_removed} removed")
                 
                 return SegmentationResult(
                     segment_id=segment_id,
@@ -400,7 +493,8 @@ class DynamicSegmentationEngine:
                     processing_time=execution.processing_time_seconds,
                     quality_score=quality_score,
                     error_messages=[],
-                    warnings=[]
+                    warnings=[],
+                    refresh_mode=resolved_mode
                 )
                 
             except Exception as e:
@@ -421,6 +515,275 @@ class DynamicSegmentationEngine:
             self.db.rollback()
             raise
     
+    async def execute_due_segments(self, chunk_size: int = 50000) -> List[SegmentationResult]:
+        """Refresh every due criteria-based segment with a single pass over the customer table
+        
+        Customers are streamed once in chunks and each due segment's criteria are evaluated
+        against every chunk as a vectorized mask, so N due segments cost one scan plus N
+        mask evaluations instead of N full scans. Predictive, behavioral and RFM segments
+        are skipped here and keep their own execution path.
+        """
+        from core.database import Customer
+        
+        now = datetime.now()
+        due_segments = self.db.query(DynamicSegment).filter(
+            DynamicSegment.auto_update == True,
+            DynamicSegment.status == SegmentStatus.ACTIVE.value,
+            DynamicSegment.segment_type.notin_([
+                SegmentType.PREDICTIVE.value, SegmentType.BEHAVIORAL.value, SegmentType.RFM.value
+            ]),
+            or_(DynamicSegment.next_update.is_(None), DynamicSegment.next_update <= now)
+        ).order_by(DynamicSegment.priority.desc()).all()
+        
+        if not due_segments:
+            return []
+        
+        compiler = CriteriaCompiler()
+        errors = {}
+        fields = set()
+        for segment in due_segments:
+            try:
+                fields.update(compiler.referenced_fields(segment.criteria, segment.exclusion_rules))
+            except ValueError as e:
+                errors[segment.id] = str(e)
+        
+        # Segments used as exclusions are read once up front
+        excluded_segment_ids = {
+            rule["segment_id"]
+            for segment in due_segments
+            for rule in (segment.exclusion_rules or [])
+            if rule.get("type") == "segment" and rule.get("segment_id")
+        }
+        excluded_members = {segment_id: set() for segment_id in excluded_segment_ids}
+        if excluded_segment_ids:
+            for segment_id, customer_id in self.db.query(SegmentMembership.segment_id, SegmentMembership.customer_id).filter(
+                SegmentMembership.segment_id.in_(excluded_segment_ids),
+                SegmentMembership.is_active == True
+            ):
+                excluded_members[segment_id].add(customer_id)
+        
+        # Stream the customer table once
+        columns = ["customer_id"] + sorted(fields - {"customer_id"})
+        qualified = {segment.id: set() for segment in due_segments}
+        customers_processed = 0
+        start_time = datetime.now()
+        start_time_utc = datetime.utcnow()
+        
+        result = self.db.execute(
+            select(*[getattr(Customer, column) for column in columns]).execution_options(yield_per=chunk_size)
+        )
+        for partition in result.partitions():
+            frame = pd.DataFrame(partition, columns=columns)
+            customers_processed += len(frame)
+            evaluator = FrameCriteriaEvaluator(frame, excluded_members)
+            customer_ids = frame["customer_id"].to_numpy()
+            
+            for segment in due_segments:
+                if segment.id in errors:
+                    continue
+                try:
+                    mask = evaluator.evaluate(segment.criteria, segment.exclusion_rules)
+                    qualified[segment.id].update(customer_ids[mask])
+                except Exception as e:
+                    errors[segment.id] = str(e)
+        
+        scan_time = (datetime.now() - start_time).total_seconds()
+        
+        # Apply per-segment diffs
+        results = []
+        for segment in due_segments:
+            segment_start = datetime.now()
+            execution = SegmentExecution(
+                segment_id=segment.id,
+                execution_type="batch",
+                trigger="scheduled",
+                refresh_mode=RefreshMode.FULL.value,
+                status="running",
+                before_size=segment.current_size or 0,
+                started_at=start_time,  # The data was read by the shared scan
+                execution_results={
+                    "criteria_hash": self._criteria_fingerprint(segment),
+                    "started_at_utc": start_time_utc.isoformat(),
+                    "batch_size": len(due_segments),
+                    "shared_scan_seconds": scan_time
+                }
+            )
+            self.db.add(execution)
+            self.db.flush()
+            
+            if segment.id in errors:
+                execution.status = "failed"
+                execution.completed_at = datetime.now()
+                execution.error_messages = [errors[segment.id]]
+                execution.processing_time_seconds = (datetime.now() - segment_start).total_seconds()
+                self.db.commit()
+                logger.error(f"Batch segmentation failed for {segment.name}: {errors[segment.id]}")
+                results.append(SegmentationResult(
+                    segment_id=segment.id,
+                    execution_id=execution.id,
+                    success=False,
+                    customers_processed=0,
+                    customers_added=0,
+                    customers_removed=0,
+                    processing_time=execution.processing_time_seconds,
+                    quality_score=0.0,
+                    error_messages=[errors[segment.id]],
+                    warnings=[]
+                ))
+                continue
+            
+            current_members = set(
+                customer_id for (customer_id,) in self.db.query(SegmentMembership.customer_id).filter(
+                    SegmentMembership.segment_id == segment.id,
+                    SegmentMembership.is_active == True
+                )
+            )
+            customers_to_add = qualified[segment.id] - current_members
+            customers_to_remove = current_members - qualified[segment.id]
+            customers_added, customers_removed = self._apply_membership_changes(
+                segment.id, customers_to_add, customers_to_remove, entry_reason="criteria_match"
+            )
+            segment.current_size = len(qualified[segment.id])
+            
+            await self._update_segment_metrics(segment)
+            quality_score = await self._calculate_segment_quality(segment.id)
+            
+            execution.status = "completed"
+            execution.completed_at = datetime.now()
+            execution.customers_processed = customers_processed
+            execution.customers_added = customers_added
+            execution.customers_removed = customers_removed
+            execution.after_size = segment.current_size
+            execution.quality_score = quality_score
+            execution.processing_time_seconds = (datetime.now() - segment_start).total_seconds()
+            
+            segment.last_updated = datetime.now()
+            self._schedule_next_update(segment)
+            self.db.commit()
+            self._update_execution_stats(execution)
+            
+            results.append(SegmentationResult(
+                segment_id=segment.id,
+                execution_id=execution.id,
+                success=True,
+                customers_processed=customers_processed,
+                customers_added=customers_added,
+                customers_removed=customers_removed,
+                processing_time=execution.processing_time_seconds,
+                quality_score=quality_score,
+                error_messages=[],
+                warnings=[]
+            ))
+        
+        logger.info(f"Batch refreshed {len(due_segments)} segments over {customers_processed} customers "
+                    f"in one scan ({scan_time:.2f}s)")
+        return results
+    
+    def preview_segment_size(self, criteria: Dict[str, Any], exclusion_rules: Optional[List[Dict[str, Any]]] = None,
+                             exact: bool = False, confidence_level: float = 0.95) -> Dict[str, Any]:
+        """Estimate how many customers match draft criteria
+        
+        Criteria are evaluated against a process-wide random sample of customers and
+        scaled to the population with a Wilson score interval (finite population
+        corrected). With exact=True the count is computed in the database instead,
+        as it is (flagged "warming") until the process has drawn its first sample.
+        Previews never write: the sample is redrawn in the background and missing
+        segment bitmaps are not built.
+        """
+        start_time = datetime.now()
+        compiler = CriteriaCompiler()
+        
+        sample = None if exact else self._get_preview_sample()
+        if sample is None:
+            from core.database import Customer
+            query = compiler.build_select(criteria, exclusion_rules)
+            count = self.db.execute(select(func.count()).select_from(query.subquery())).scalar() or 0
+            population = self.db.query(func.count(Customer.id)).scalar() or 0
+            return {
+                "estimated_size": count,
+                "confidence_interval": {"lower": count, "upper": count, "level": 1.0},
+                "population_size": population,
+                "sample_size": population,
+                "sample_matches": count,
+                "exact": True,
+                # No sample has been drawn yet: the exact count is served until it is
+                "warming": not exact,
+                "elapsed_ms": (datetime.now() - start_time).total_seconds() * 1000
+            }
+        
+        frame = sample["frame"]
+        population = sample["population"]
+        
+        # Resolve segment exclusions against the sample through the bitmap index (read-only:
+        # a segment without a stored bitmap is read from the sample's membership rows instead of built)
+        excluded_members = {}
+        for rule in exclusion_rules or []:
+            if rule.get("type") == "segment" and rule.get("segment_id"):
+                packed = self.membership_index.peek_bitmap(rule["segment_id"])
+                if packed is None:
+                    sample_ids = frame["customer_id"].dropna().tolist()
+                    members = set()
+                    for start in range(0, len(sample_ids), self.membership_batch_size):
+                        members.update(self.db.execute(
+                            select(SegmentMembership.customer_id).where(
+                                SegmentMembership.segment_id == rule["segment_id"],
+                                SegmentMembership.is_active == True,
+                                SegmentMembership.customer_id.in_(sample_ids[start:start + self.membership_batch_size])
+                            )
+                        ).scalars())
+                    excluded_members[rule["segment_id"]] = members
+                    continue
+                bits = np.unpackbits(packed)
+                ordinals = sample["ordinals"]
+                in_range = (ordinals >= 0) & (ordinals < len(bits))
+                hit = np.zeros(len(frame), dtype=bool)
+                hit[in_range] = bits[ordinals[in_range]].astype(bool)
+                excluded_members[rule["segment_id"]] = set(frame["customer_id"].to_numpy()[hit])
+        
+        mask = FrameCriteriaEvaluator(frame, excluded_members).evaluate(criteria, exclusion_rules)
+        matches = int(mask.sum())
+        n = len(frame)
+        
+        if n == 0:
+            lower = upper = proportion = 0.0
+        else:
+            from scipy import stats
+            z = stats.norm.ppf(0.5 + confidence_level / 2)
+            proportion = matches / n
+            # Finite population correction shrinks the interval as the sample covers more of the base
+            fpc = np.sqrt((population - n) / (population - 1)) if population > 1 else 0.0
+            z_eff = z * fpc
+            denominator = 1 + z_eff ** 2 / n
+            center = (proportion + z_eff ** 2 / (2 * n)) / denominator
+            margin = z_eff * np.sqrt(proportion * (1 - proportion) / n + z_eff ** 2 / (4 * n ** 2)) / denominator
+            lower, upper = max(0.0, center - margin), min(1.0, center + margin)
+        
+        return {
+            "estimated_size": int(round(proportion * population)),
+            "confidence_interval": {
+                "lower": int(np.floor(lower * population)),
+                "upper": int(np.ceil(upper * population)),
+                "level": confidence_level
+            },
+            "population_size": population,
+            "sample_size": n,
+            "sample_matches": matches,
+            "sample_age_seconds": (datetime.now() - sample["built_at"]).total_seconds(),
+            "exact": False,
+            "elapsed_ms": (datetime.now() - start_time).total_seconds() * 1000
+        }
+    
+    def _get_preview_sample(self) -> Optional[Dict[str, Any]]:
+        """Return the shared customer sample, or None while the first one is drawn
+        
+        Samples are only drawn on a background thread: a missing one is started there
+        and a stale one is served while it is redrawn.
+        """
+        sample = _preview_sample.get("current")
+        if sample is None or datetime.now() - sample["built_at"] >= self.preview_sample_ttl:
+            warm_preview_sample(self.preview_sample_size)
+        return sample
+    
     def get_customer_segments(self, customer_id: str, active_only: bool = True) -> List[Dict[str, Any]]:
         """Get all segments for a customer"""
         try:
@@ -539,24 +902,20 @@ class DynamicSegmentationEngine:
             if len(segment_ids) < 2:
                 return {"error": "At least 2 segments required for overlap analysis"}
             
-            # Get memberships for all segments
-            segment_memberships = {}
-            segment_names = {}
+            segment_names = dict(
+                self.db.query(DynamicSegment.id, DynamicSegment.name).filter(
+                    DynamicSegment.id.in_(segment_ids)
+                ).all()
+            )
             
-            for segment_id in segment_ids:
-                segment = self.db.query(DynamicSegment).filter(
-                    DynamicSegment.id == segment_id
-                ).first()
-                
-                if segment:
-                    segment_names[segment_id] = segment.name
-                    
-                    memberships = self.db.query(SegmentMembership).filter(
-                        SegmentMembership.segment_id == segment_id,
-                        SegmentMembership.is_active == True
-                    ).all()
-                    
-                    segment_memberships[segment_id] = set(m.customer_id for m in memberships)
+            # Membership bitmaps; unknown segments are treated as empty
+            bitmaps = self.membership_index.get_bitmaps(
+                [sid for sid in segment_ids if sid in segment_names]
+            )
+            width = max((len(b) for b in bitmaps.values()), default=0)
+            empty = np.zeros(width, dtype=np.uint8)
+            segment_bitmaps = {sid: bitmaps.get(sid, empty) for sid in segment_ids}
+            sizes = {sid: popcount(segment_bitmaps[sid]) for sid in segment_ids}
             
             # Calculate overlaps
             overlap_matrix = {}
@@ -564,55 +923,49 @@ class DynamicSegmentationEngine:
                 overlap_matrix[segment_a] = {}
                 for j, segment_b in enumerate(segment_ids):
                     if i != j:
-                        customers_a = segment_memberships.get(segment_a, set())
-                        customers_b = segment_memberships.get(segment_b, set())
-                        
-                        intersection = customers_a.intersection(customers_b)
-                        overlap_count = len(intersection)
-                        overlap_percentage_a = (overlap_count / max(1, len(customers_a))) * 100
-                        overlap_percentage_b = (overlap_count / max(1, len(customers_b))) * 100
+                        overlap_count = popcount(segment_bitmaps[segment_a] & segment_bitmaps[segment_b])
+                        union_count = popcount(segment_bitmaps[segment_a] | segment_bitmaps[segment_b])
+                        overlap_percentage_a = (overlap_count / max(1, sizes[segment_a])) * 100
+                        overlap_percentage_b = (overlap_count / max(1, sizes[segment_b])) * 100
                         
                         overlap_matrix[segment_a][segment_b] = {
                             "overlap_count": overlap_count,
                             "overlap_percentage_a": overlap_percentage_a,
                             "overlap_percentage_b": overlap_percentage_b,
-                            "jaccard_index": overlap_count / max(1, len(customers_a.union(customers_b)))
+                            "jaccard_index": overlap_count / max(1, union_count)
                         }
             
             # Find common customers across all segments
-            all_customers = [segment_memberships.get(sid, set()) for sid in segment_ids]
-            common_customers = set.intersection(*all_customers) if all_customers else set()
+            all_bitmaps = [segment_bitmaps[sid] for sid in segment_ids]
+            common_count = popcount(np.bitwise_and.reduce(all_bitmaps))
+            union_count = popcount(np.bitwise_or.reduce(all_bitmaps))
             
             # Calculate segment uniqueness
             uniqueness_analysis = {}
             for segment_id in segment_ids:
-                customers = segment_memberships.get(segment_id, set())
-                other_customers = set()
+                others = [segment_bitmaps[other_id] for other_id in segment_ids if other_id != segment_id]
+                other_customers = np.bitwise_or.reduce(others)
                 
-                for other_id in segment_ids:
-                    if other_id != segment_id:
-                        other_customers.update(segment_memberships.get(other_id, set()))
-                
-                unique_customers = customers - other_customers
-                uniqueness_percentage = (len(unique_customers) / max(1, len(customers))) * 100
+                unique_count = popcount(segment_bitmaps[segment_id] & ~other_customers)
+                uniqueness_percentage = (unique_count / max(1, sizes[segment_id])) * 100
                 
                 uniqueness_analysis[segment_id] = {
-                    "unique_customers": len(unique_customers),
+                    "unique_customers": unique_count,
                     "uniqueness_percentage": uniqueness_percentage,
-                    "total_customers": len(customers)
+                    "total_customers": sizes[segment_id]
                 }
             
             return {
                 "segments": {sid: segment_names.get(sid, sid) for sid in segment_ids},
                 "overlap_matrix": overlap_matrix,
                 "common_customers": {
-                    "count": len(common_customers),
-                    "percentage_of_total": (len(common_customers) / max(1, len(set().union(*all_customers)))) * 100
+                    "count": common_count,
+                    "percentage_of_total": (common_count / max(1, union_count)) * 100
                 },
                 "uniqueness_analysis": uniqueness_analysis,
                 "summary": {
                     "total_segments": len(segment_ids),
-                    "total_unique_customers": len(set().union(*all_customers)) if all_customers else 0,
+                    "total_unique_customers": union_count,
                     "avg_overlap_percentage": np.mean([
                         overlap_matrix[a][b]["overlap_percentage_a"] 
                         for a in overlap_matrix for b in overlap_matrix[a]
@@ -624,6 +977,23 @@ class DynamicSegmentationEngine:
             logger.error(f"Error analyzing segment overlap: {e}")
             raise
     
+    def get_segment_difference(self, segment_id: str, exclude_segment_id: str,
+                               limit: Optional[int] = None) -> Dict[str, Any]:
+        """Customers in one segment but not in another, from the bitmap index"""
+        try:
+            difference = self.membership_index.difference(segment_id, exclude_segment_id)
+            
+            return {
+                "segment_id": segment_id,
+                "exclude_segment_id": exclude_segment_id,
+                "count": popcount(difference),
+                "customer_ids": self.membership_index.resolve_customers(difference, limit)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error computing segment difference: {e}")
+            raise
+    
     async def create_predictive_segment(self, config: Dict[str, Any]) -> str:
         """Create ML-powered predictive segment"""
         try:
@@ -663,76 +1033,66 @@ class DynamicSegmentationEngine:
     
     # Helper methods
     async def _execute_criteria_based_segmentation(self, segment: DynamicSegment, 
-                                                 execution: SegmentExecution) -> SegmentationResult:
-        """Execute criteria-based segmentation"""
+                                                 execution: SegmentExecution,
+                                                 baseline: Optional[Tuple[datetime, datetime]] = None) -> SegmentationResult:
+        """Execute criteria-based segmentation
+        
+        With a baseline (the local and UTC start of the last run) set, only customers
+        changed after that point are re-tested against the criteria; everyone else keeps
+        their current membership.
+        """
         try:
-            # Build query from criteria
-            query_conditions = self._build_query_from_criteria(segment.criteria)
-            
-            # Get current members
-            current_members = set(
-                m.customer_id for m in self.db.query(SegmentMembership).filter(
-                    SegmentMembership.segment_id == segment.id,
-                    SegmentMembership.is_active == True
-                ).all()
-            )
+            # Compile criteria and exclusion rules into a single ID query
+            query = self._build_query_from_criteria(segment.criteria, segment.exclusion_rules)
             
-            # Execute query to get qualified customers
             from core.database import Customer
-            qualified_customers = set()
+            membership_query = self.db.query(SegmentMembership.customer_id).filter(
+                SegmentMembership.segment_id == segment.id,
+                SegmentMembership.is_active == True
+            )
             
-            # This would be replaced with actual query execution
-            # For now, simulate the process
-            all_customers = self.db.query(Customer).all()
-            for customer in all_customers:
-                if self._evaluate_customer_criteria(customer, segment.criteria):
-                    qualified_customers.add(customer.customer_id)
+            if baseline is None:
+                # Get current members
+                current_members = set(customer_id for (customer_id,) in membership_query)
+                
+                # Qualification happens inside the database; only IDs come back
+                qualified_customers = set(self.db.execute(query).scalars())
+                customers_processed = self.db.query(func.count(Customer.id)).scalar() or 0
+            else:
+                # Re-test only the customers that changed since the baseline run
+                candidates = sorted(self._get_changed_customers(segment, *baseline))
+                current_members = set()
+                qualified_customers = set()
+                for start in range(0, len(candidates), self.membership_batch_size):
+                    chunk = candidates[start:start + self.membership_batch_size]
+                    current_members.update(
+                        customer_id for (customer_id,) in membership_query.filter(SegmentMembership.customer_id.in_(chunk))
+                    )
+                    qualified_customers.update(
+                        self.db.execute(query.where(Customer.customer_id.in_(chunk))).scalars()
+                    )
+                customers_processed = len(candidates)
             
             # Calculate changes
             customers_to_add = qualified_customers - current_members
             customers_to_remove = current_members - qualified_customers
             
-            # Apply exclusion rules
-            if segment.exclusion_rules:
-                customers_to_add = self._apply_exclusion_rules(customers_to_add, segment.exclusion_rules)
-            
-            # Apply changes
-            customers_added = 0
-            customers_removed = 0
-            
-            # Add new members
-            for customer_id in customers_to_add:
-                membership = SegmentMembership(
-                    segment_id=segment.id,
-                    customer_id=customer_id,
-                    entry_reason="criteria_match",
-                    confidence_score=1.0
-                )
-                self.db.add(membership)
-                customers_added += 1
-            
-            # Remove old members
-            for customer_id in customers_to_remove:
-                memberships = self.db.query(SegmentMembership).filter(
-                    SegmentMembership.segment_id == segment.id,
-                    SegmentMembership.customer_id == customer_id,
-                    SegmentMembership.is_active == True
-                ).all()
-                
-                for membership in memberships:
-                    membership.is_active = False
-                    membership.left_at = datetime.now()
-                
-                customers_removed += 1
+            # Apply changes with set-based writes
+            customers_added, customers_removed = self._apply_membership_changes(
+                segment.id, customers_to_add, customers_to_remove, entry_reason="criteria_match"
+            )
             
             # Update segment size
-            segment.current_size = len(qualified_customers)
+            if baseline is None:
+                segment.current_size = len(qualified_customers)
+            else:
+                segment.current_size = membership_query.count()
             
             return SegmentationResult(
                 segment_id=segment.id,
                 execution_id=execution.id,
                 success=True,
-                customers_processed=len(all_customers),
+                customers_processed=customers_processed,
                 customers_added=customers_added,
                 customers_removed=customers_removed,
                 processing_time=0.0,  # Will be set by caller
@@ -779,34 +1139,14 @@ class DynamicSegmentationEngine:
             customers_to_remove = current_members - qualified_customers
             
             # Apply changes with confidence scores
-            customers_added = 0
-            customers_removed = 0
-            
-            for customer_id in customers_to_add:
-                customer_idx = features_df[features_df['customer_id'] == customer_id].index[0]
-                confidence = predictions[customer_idx, 1]
-                
-                membership = SegmentMembership(
-                    segment_id=segment.id,
-                    customer_id=customer_id,
-                    entry_reason="ml_prediction",
-                    confidence_score=float(confidence)
-                )
-                self.db.add(membership)
-                customers_added += 1
-            
-            for customer_id in customers_to_remove:
-                memberships = self.db.query(SegmentMembership).filter(
-                    SegmentMembership.segment_id == segment.id,
-                    SegmentMembership.customer_id == customer_id,
-                    SegmentMembership.is_active == True
-                ).all()
-                
-                for membership in memberships:
-                    membership.is_active = False
-                    membership.left_at = datetime.now()
-                
-                customers_removed += 1
+            confidence_by_customer = dict(zip(
+                features_df.iloc[qualified_indices]['customer_id'].values,
+                predictions[qualified_indices, 1]
+            ))
+            customers_added, customers_removed = self._apply_membership_changes(
+                segment.id, customers_to_add, customers_to_remove,
+                entry_reason="ml_prediction", confidence_scores=confidence_by_customer
+            )
             
             segment.current_size = len(qualified_customers)
             
@@ -930,35 +1270,145 @@ class DynamicSegmentationEngine:
         if not isinstance(config["criteria"], dict):
             raise ValueError("Criteria must be a dictionary")
     
-    def _build_query_from_criteria(self, criteria: Dict[str, Any]) -> str:
-        """Build SQL query from criteria (simplified implementation)"""
-        # This would build an actual SQL query from the criteria
-        # For now, return a placeholder
-        return "SELECT customer_id FROM customers WHERE 1=1"
-    
-    def _evaluate_customer_criteria(self, customer, criteria: Dict[str, Any]) -> bool:
-        """Evaluate if customer matches criteria (simplified implementation)"""
-        # This would evaluate the customer against the criteria
-        # For now, return True for demonstration
-        return True
-    
-    def _apply_exclusion_rules(self, customers: set, exclusion_rules: List[Dict[str, Any]]) -> set:
-        """Apply exclusion rules to customer set"""
-        filtered_customers = customers.copy()
+    def _criteria_fingerprint(self, segment: DynamicSegment) -> str:
+        """Stable hash of a segment's criteria and exclusion rules"""
+        payload = json.dumps(
+            {"criteria": segment.criteria, "exclusion_rules": segment.exclusion_rules or []},
+            sort_keys=True, default=str
+        )
+        return hashlib.md5(payload.encode()).hexdigest()
+    
+    def _resolve_incremental_baseline(self, segment: DynamicSegment,
+                                      refresh_mode: str) -> Optional[Tuple[datetime, datetime]]:
+        """Return the (local, UTC) change cutoff for an incremental run, or None when a full rebuild is required"""
+        if refresh_mode == RefreshMode.FULL.value:
+            return None
         
-        for rule in exclusion_rules:
-            if rule.get("type") == "segment":
-                excluded_segment_id = rule.get("segment_id")
-                if excluded_segment_id:
-                    excluded_customers = set(
-                        m.customer_id for m in self.db.query(SegmentMembership).filter(
-                            SegmentMembership.segment_id == excluded_segment_id,
-                            SegmentMembership.is_active == True
-                        ).all()
-                    )
-                    filtered_customers -= excluded_customers
+        # Only plain criteria segments can be evaluated per customer
+        if segment.segment_type in (SegmentType.PREDICTIVE.value, SegmentType.BEHAVIORAL.value, SegmentType.RFM.value):
+            return None
+        
+        # Relative-date criteria move customers in and out without any row changing
+        if CriteriaCompiler().uses_relative_dates(segment.criteria, segment.exclusion_rules or []):
+            return None
+        
+        last_run = self.db.query(SegmentExecution).filter(
+            SegmentExecution.segment_id == segment.id,
+            SegmentExecution.status == "completed"
+        ).order_by(SegmentExecution.started_at.desc()).first()
+        
+        if not last_run or (last_run.execution_results or {}).get("criteria_hash") != self._criteria_fingerprint(segment):
+            return None
+        
+        # Periodic full rebuild as a safety net for changes the change log cannot see
+        last_full_run = self.db.query(SegmentExecution.started_at).filter(
+            SegmentExecution.segment_id == segment.id,
+            SegmentExecution.status == "completed",
+            or_(SegmentExecution.refresh_mode == RefreshMode.FULL.value, SegmentExecution.refresh_mode.is_(None))
+        ).order_by(SegmentExecution.started_at.desc()).first()
+        
+        if not last_full_run or datetime.now() - last_full_run[0] >= self.full_refresh_interval:
+            return None
         
-        return filtered_customers
+        # Runs from before the UTC start was recorded cannot be compared with UTC timestamps
+        started_at_utc = (last_run.execution_results or {}).get("started_at_utc")
+        if not started_at_utc:
+            return None
+        
+        # Use the start time so changes made while the last run was executing are picked up again
+        return last_run.started_at, datetime.fromisoformat(started_at_utc)
+    
+    def _get_changed_customers(self, segment: DynamicSegment, since: datetime, since_utc: datetime) -> set:
+        """Collect customers whose data changed since a point in time
+        
+        Customer and Purchase timestamps are written in UTC and compared with since_utc;
+        CDP events and memberships are written in local time and compared with since.
+        """
+        from core.database import Customer, Purchase
+        from cdp.unified_profile import CustomerEvent, CustomerIdentity, IdentityType
+        
+        changed = set(
+            customer_id for (customer_id,) in self.db.query(Customer.customer_id).filter(
+                Customer.updated_at >= since_utc
+            )
+        )
+        
+        changed.update(
+            customer_id for (customer_id,) in self.db.query(Purchase.customer_id).filter(
+                Purchase.created_at >= since_utc
+            ).distinct()
+        )
+        
+        # CDP events are keyed by profile; map them back through customer_id identities
+        active_profiles = self.db.query(CustomerEvent.profile_id).filter(
+            CustomerEvent.timestamp >= since
+        ).distinct()
+        changed.update(
+            customer_id for (customer_id,) in self.db.query(CustomerIdentity.identity_value).filter(
+                CustomerIdentity.identity_type == IdentityType.CUSTOMER_ID.value,
+                CustomerIdentity.profile_id.in_(active_profiles)
+            ).distinct()
+        )
+        
+        # Membership changes in excluded segments affect this segment too
+        excluded_segment_ids = [
+            rule["segment_id"] for rule in (segment.exclusion_rules or [])
+            if rule.get("type") == "segment" and rule.get("segment_id")
+        ]
+        if excluded_segment_ids:
+            changed.update(
+                customer_id for (customer_id,) in self.db.query(SegmentMembership.customer_id).filter(
+                    SegmentMembership.segment_id.in_(excluded_segment_ids),
+                    or_(SegmentMembership.joined_at >= since, SegmentMembership.left_at >= since)
+                ).distinct()
+            )
+        
+        changed.discard(None)
+        return changed
+    
+    def _apply_membership_changes(self, segment_id: str, customers_to_add: set, customers_to_remove: set,
+                                  entry_reason: str, confidence_scores: Optional[Dict[str, float]] = None) -> Tuple[int, int]:
+        """Apply a membership diff with bulk inserts and chunked set-based updates"""
+        now = datetime.now()
+        
+        to_add = sorted(customers_to_add)
+        for start in range(0, len(to_add), self.membership_batch_size):
+            rows = [
+                {
+                    "segment_id": segment_id,
+                    "customer_id": customer_id,
+                    "entry_reason": entry_reason,
+                    "confidence_score": float(confidence_scores.get(customer_id, 1.0)) if confidence_scores else 1.0,
+                    "joined_at": now,
+                    "is_active": True
+                }
+                for customer_id in to_add[start:start + self.membership_batch_size]
+            ]
+            self.db.execute(insert(SegmentMembership), rows)
+        
+        to_remove = sorted(customers_to_remove)
+        for start in range(0, len(to_remove), self.membership_batch_size):
+            self.db.execute(
+                update(SegmentMembership)
+                .where(
+                    SegmentMembership.segment_id == segment_id,
+                    SegmentMembership.is_active == True,
+                    SegmentMembership.customer_id.in_(to_remove[start:start + self.membership_batch_size])
+                )
+                .values(is_active=False, left_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        
+        # Keep the bitmap index in step with the membership table
+        if to_add or to_remove:
+            self.membership_index.apply_changes(segment_id, to_add, to_remove)
+        
+        return len(to_add), len(to_remove)
+    
+    def _build_query_from_criteria(self, criteria: Dict[str, Any],
+                                   exclusion_rules: Optional[List[Dict[str, Any]]] = None) -> Select:
+        """Build a select of qualifying customer IDs from criteria and exclusion rules"""
+        return CriteriaCompiler().build_select(criteria, exclusion_rules)
     
     async def _update_segment_metrics(self, segment: DynamicSegment):
         """Update segment performance metrics"""
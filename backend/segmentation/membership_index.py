@@ -0,0 +1,191 @@
+"""
+Segment Membership Index - compressed bitmaps over dense customer ordinals
+"""
+from typing import Dict, List, Iterable, Optional
+from datetime import datetime
+import logging
+import zlib
+import numpy as np
+from sqlalchemy import Column, String, Integer, DateTime, LargeBinary, select, insert, exists
+from sqlalchemy.orm import Session
+
+from core.database import Base
+
+logger = logging.getLogger(__name__)
+
+# Number of set bits for every byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+class CustomerOrdinal(Base):
+    """Dense integer ordinal assigned to each customer that appears in a segment"""
+    __tablename__ = "segment_customer_ordinals"
+
+    ordinal = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(String, unique=True, index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class SegmentBitmap(Base):
+    """Packed, zlib-compressed membership bitmap for a segment"""
+    __tablename__ = "segment_bitmaps"
+
+    segment_id = Column(String, primary_key=True)
+    bitmap = Column(LargeBinary, nullable=False)
+    bit_length = Column(Integer, default=0)    # Number of ordinals covered by the bitmap
+    cardinality = Column(Integer, default=0)   # Number of active members
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+def popcount(packed: np.ndarray) -> int:
+    """Count set bits in a packed bitmap"""
+    return int(POPCOUNT_TABLE[packed].sum(dtype=np.int64))
+
+def align(*bitmaps: np.ndarray) -> List[np.ndarray]:
+    """Zero-pad packed bitmaps to a common byte length"""
+    length = max((len(b) for b in bitmaps), default=0)
+    return [b if len(b) == length else np.pad(b, (0, length - len(b))) for b in bitmaps]
+
+class SegmentMembershipIndex:
+    """Bitmap index of active segment memberships
+
+    Every customer gets a dense ordinal; each segment keeps one packed bitmap
+    (NumPy packbits, zlib-compressed at rest) with the bits of its active
+    members set. Overlap, Jaccard, uniqueness and difference audiences are
+    computed with bitwise operations on the packed bytes.
+    """
+
+    def __init__(self, db: Session, batch_size: int = 1000):
+        self.db = db
+        self.batch_size = batch_size
+
+    def get_bitmap(self, segment_id: str) -> np.ndarray:
+        """Packed bitmap for a segment, building it from memberships if missing"""
+        packed = self.peek_bitmap(segment_id)
+        return self.rebuild(segment_id) if packed is None else packed
+
+    def peek_bitmap(self, segment_id: str) -> Optional[np.ndarray]:
+        """Stored packed bitmap for a segment, or None; never builds or writes"""
+        record = self.db.get(SegmentBitmap, segment_id)
+        if record is None:
+            return None
+        return np.frombuffer(zlib.decompress(record.bitmap), dtype=np.uint8).copy()
+
+    def get_bitmaps(self, segment_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Packed bitmaps for several segments, aligned to the same length"""
+        segment_ids = list(segment_ids)
+        bitmaps = align(*[self.get_bitmap(segment_id) for segment_id in segment_ids])
+        return dict(zip(segment_ids, bitmaps))
+
+    def rebuild(self, segment_id: str) -> np.ndarray:
+        """Rebuild a segment bitmap from its active SegmentMembership rows"""
+        from .dynamic_engine import SegmentMembership
+
+        # Give every member without an ordinal one, set-based
+        missing = select(SegmentMembership.customer_id).distinct().where(
+            SegmentMembership.segment_id == segment_id,
+            SegmentMembership.is_active == True,
+            ~exists().where(CustomerOrdinal.customer_id == SegmentMembership.customer_id)
+        )
+        self.db.execute(insert(CustomerOrdinal).from_select(["customer_id"], missing))
+
+        ordinals = np.fromiter(
+            self.db.execute(
+                select(CustomerOrdinal.ordinal).join(
+                    SegmentMembership, SegmentMembership.customer_id == CustomerOrdinal.customer_id
+                ).where(
+                    SegmentMembership.segment_id == segment_id,
+                    SegmentMembership.is_active == True
+                )
+            ).scalars(),
+            dtype=np.int64
+        )
+
+        packed = self._set_bits(np.zeros(0, dtype=np.uint8), ordinals, True)
+        self._store(segment_id, packed)
+        return packed
+
+    def apply_changes(self, segment_id: str, added: Iterable[str], removed: Iterable[str]) -> np.ndarray:
+        """Apply a membership diff to a segment bitmap"""
+        if self.db.get(SegmentBitmap, segment_id) is None:
+            return self.rebuild(segment_id)
+
+        packed = self.get_bitmap(segment_id)
+        added_ordinals = np.fromiter(self.ensure_ordinals(added).values(), dtype=np.int64)
+        removed_ordinals = np.fromiter(self.lookup_ordinals(removed).values(), dtype=np.int64)
+        packed = self._set_bits(packed, added_ordinals, True)
+        packed = self._set_bits(packed, removed_ordinals, False)
+        self._store(segment_id, packed)
+        return packed
+
+    def lookup_ordinals(self, customer_ids: Iterable[str]) -> Dict[str, int]:
+        """Existing ordinals for the given customers"""
+        customer_ids = sorted(set(customer_ids))
+        ordinals = {}
+        for start in range(0, len(customer_ids), self.batch_size):
+            chunk = customer_ids[start:start + self.batch_size]
+            ordinals.update(
+                (customer_id, ordinal) for customer_id, ordinal in self.db.execute(
+                    select(CustomerOrdinal.customer_id, CustomerOrdinal.ordinal).where(
+                        CustomerOrdinal.customer_id.in_(chunk)
+                    )
+                )
+            )
+        return ordinals
+
+    def ensure_ordinals(self, customer_ids: Iterable[str]) -> Dict[str, int]:
+        """Ordinals for the given customers, assigning new ones where needed"""
+        customer_ids = set(customer_ids)
+        ordinals = self.lookup_ordinals(customer_ids)
+        missing = sorted(customer_ids - set(ordinals))
+        if missing:
+            for start in range(0, len(missing), self.batch_size):
+                self.db.execute(
+                    insert(CustomerOrdinal),
+                    [{"customer_id": customer_id} for customer_id in missing[start:start + self.batch_size]]
+                )
+            ordinals.update(self.lookup_ordinals(missing))
+        return ordinals
+
+    def resolve_customers(self, packed: np.ndarray, limit: Optional[int] = None) -> List[str]:
+        """Customer IDs for the set bits of a packed bitmap"""
+        ordinals = np.flatnonzero(np.unpackbits(packed)).tolist()
+        if limit is not None:
+            ordinals = ordinals[:limit]
+
+        customer_ids = []
+        for start in range(0, len(ordinals), self.batch_size):
+            chunk = ordinals[start:start + self.batch_size]
+            customer_ids.extend(
+                self.db.execute(
+                    select(CustomerOrdinal.customer_id).where(CustomerOrdinal.ordinal.in_(chunk))
+                ).scalars()
+            )
+        return customer_ids
+
+    def difference(self, segment_id: str, other_segment_id: str) -> np.ndarray:
+        """Packed bitmap of customers in one segment but not the other"""
+        bitmaps = self.get_bitmaps([segment_id, other_segment_id])
+        return bitmaps[segment_id] & ~bitmaps[other_segment_id]
+
+    def _set_bits(self, packed: np.ndarray, ordinals: np.ndarray, value: bool) -> np.ndarray:
+        """Set or clear the bits at the given ordinals, growing the bitmap as needed"""
+        if len(ordinals) == 0:
+            return packed
+
+        required_bytes = int(ordinals.max()) // 8 + 1
+        if required_bytes > len(packed):
+            packed = np.pad(packed, (0, required_bytes - len(packed)))
+
+        bits = np.unpackbits(packed)
+        bits[ordinals] = 1 if value else 0
+        return np.packbits(bits)
+
+    def _store(self, segment_id: str, packed: np.ndarray):
+        """Persist a packed bitmap"""
+        record = self.db.get(SegmentBitmap, segment_id)
+        if record is None:
+            record = SegmentBitmap(segment_id=segment_id)
+            self.db.add(record)
+
+        record.bitmap = zlib.compress(packed.tobytes())
+        record.bit_length = len(packed) * 8
+        record.cardinality = popcount(packed)
+        record.updated_at = datetime.now()
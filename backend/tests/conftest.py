@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TEST_DIR = Path(tempfile.mkdtemp(prefix="sbm_crm_tests_"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DIR / 'test.db'}"
+os.environ.setdefault("CDP_EVENT_DEAD_LETTER_PATH", str(_TEST_DIR / "cdp_events.dead.jsonl"))
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+
+@compiles(UUID, "sqlite")
+def _compile_uuid_sqlite(type_, compiler, **kw):
+    # Customer ids are PostgreSQL UUIDs; SQLite stores them as text
+    return "CHAR(36)"
+
+from core.database import Base, engine, SessionLocal
+
+# Register every table the behavior tests touch
+import cdp.unified_profile  # noqa: E402,F401
+import cdp.activity_aggregates  # noqa: E402,F401
+import journey.lifecycle_manager  # noqa: E402,F401
+import leads.models  # noqa: E402,F401
+import leads.leaderboard  # noqa: E402,F401
+import leads.rescoring_queue  # noqa: E402,F401
+import segmentation.dynamic_engine  # noqa: E402,F401
+import segmentation.membership_index  # noqa: E402,F401
+import experiments.ab_testing  # noqa: E402,F401
+import experiments.variant_stats  # noqa: E402,F401
+import automation.models  # noqa: E402,F401
+import automation.workflow_timers  # noqa: E402,F401
+import automation.execution_scheduler  # noqa: E402,F401
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def temp_dir():
+    temp_path = Path(tempfile.mkdtemp(dir=_TEST_DIR))
+    yield temp_path
+    shutil.rmtree(temp_path, ignore_errors=True)
+
+def pytest_sessionfinish(session, exitstatus):
+    engine.dispose()
+    shutil.rmtree(_TEST_DIR, ignore_errors=True)
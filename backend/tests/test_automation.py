@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func
+
+from core.config import settings
+from core.database import Customer, engine as db_engine
+from automation.execution_scheduler import ActionLimiter, WorkflowRunQueueEntry, action_limiter, execution_scheduler
+from automation.workflow_engine import WorkflowEngine, WorkflowExecution, WorkflowStepLog, run_unscheduled_batch
+from automation.workflow_timers import WorkflowTimer, workflow_timers
+
+@pytest.fixture
+def scheduler():
+    saved = {name: getattr(execution_scheduler, name) for name in ("workers", "poll_interval", "max_attempts", "retry_backoff")}
+    saved_limits = dict(action_limiter.concurrency), dict(action_limiter.rates)
+    execution_scheduler.workers = 4
+    execution_scheduler.poll_interval = 0.05
+    action_limiter.concurrency.clear()
+    action_limiter.rates.clear()
+    action_limiter._semaphores.clear()  # Semaphores are bound to the previous test's event loop
+    action_limiter._tokens.clear()
+    yield execution_scheduler
+    for name, value in saved.items():
+        setattr(execution_scheduler, name, value)
+    action_limiter.concurrency, action_limiter.rates = saved_limits
+    action_limiter._semaphores.clear()
+
+@pytest.fixture
+def customers(db):
+    for i in range(30):
+        db.add(Customer(
+            id=uuid.uuid4(), customer_id=f"c{i}", email=f"c{i}@example.com",
+            segment_id="vip" if i % 3 else "regular", age=20 + i * 2
+        ))
+    db.commit()
+    return [f"c{i}" for i in range(30)]
+
+def _workflow(db, steps, **config):
+    engine = WorkflowEngine(db)
+    workflow_id = engine.create_workflow({
+        "name": "onboarding", "trigger": config.pop("trigger", {"trigger_type": "api_trigger"}), "steps": steps, **config
+    })
+    engine.start_workflow(workflow_id)
+    return engine, workflow_id
+
+async def _drain(db, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.expire_all()
+        if not db.query(WorkflowRunQueueEntry).count():
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError("run queue did not drain")
+
+def _statuses(db, workflow_id):
+    db.expire_all()
+    return dict(db.query(WorkflowExecution.status, func.count()).filter_by(workflow_id=workflow_id).group_by(
+        WorkflowExecution.status
+    ).all())
+
+def _fast_forward_timers(db):
+    db.query(WorkflowTimer).update({"due_at": datetime.now() - timedelta(seconds=1)}, synchronize_session=False)
+    db.commit()
+
+def test_delays_are_checkpointed_in_the_timer_queue(db, customers, scheduler):
+    engine, workflow_id = _workflow(db, [
+        {"action_type": "send_email", "config": {"subject": "Welcome"}},
+        {"action_type": "wait", "config": {"wait_days": 3}},
+        {"action_type": "add_tag", "config": {"tag": "onboarded"}, "delay_minutes": 10},
+        {"action_type": "send_sms", "config": {"message": "Thanks"}},
+    ])
+
+    async def main():
+        execution_id = engine.trigger_workflow(workflow_id, "c1")
+        await scheduler.start()
+        try:
+            await _drain(db)
+            execution = db.get(WorkflowExecution, execution_id)
+            assert execution.status == "waiting"
+            timer = db.get(WorkflowTimer, execution_id)
+            assert timer.due_at > datetime.now() + timedelta(days=2)
+            assert (await workflow_timers.process_batch())["resumed"] == 0
+
+            _fast_forward_timers(db)
+            assert (await workflow_timers.process_batch())["resumed"] == 1
+            await _drain(db)
+            db.expire_all()
+            timer = db.get(WorkflowTimer, execution_id)
+            assert timer is not None and timer.due_at <= datetime.now() + timedelta(minutes=10)
+
+            _fast_forward_timers(db)
+            assert (await workflow_timers.process_batch())["resumed"] == 1
+            await _drain(db)
+        finally:
+            await scheduler.stop()
+
+        db.expire_all()
+        execution = db.get(WorkflowExecution, execution_id)
+        assert execution.status == "completed"
+        assert db.query(WorkflowTimer).count() == 0
+        steps = [log.step_number for log in db.query(WorkflowStepLog).filter_by(execution_id=execution_id).order_by(
+            WorkflowStepLog.step_number
+        )]
+        assert steps == sorted(set(steps)) and len(steps) == 4  # Every step ran exactly once
+
+    asyncio.run(main())
+
+def test_failed_runs_back_off_and_give_up(db, customers, scheduler):
+    engine, workflow_id = _workflow(db, [{"action_type": "send_email", "config": {"subject": "Hi"}}])
+    execution = WorkflowExecution(workflow_id=workflow_id, customer_id="c1", execution_data={})
+    db.add(execution)
+    db.flush()
+    scheduler.enqueue(db, [execution.id], workflow_id)
+    db.commit()
+    scheduler.max_attempts = 2
+    scheduler.retry_backoff = 60.0
+
+    runs = scheduler.claim(db, 10)
+    assert [run["execution_id"] for run in runs] == [execution.id]
+    scheduler.retry(db, [execution.id], datetime.now(), "smtp down")
+    entry = db.get(WorkflowRunQueueEntry, execution.id)
+    assert entry.claimed_at is None and entry.available_at > datetime.now() + timedelta(seconds=50)
+    assert scheduler.claim(db, 10) == []  # Still backing off
+
+    entry.available_at = datetime.now() - timedelta(seconds=1)
+    db.commit()
+    assert len(scheduler.claim(db, 10)) == 1
+    scheduler.retry(db, [execution.id], datetime.now(), "smtp down")
+
+    db.expire_all()
+    assert db.get(WorkflowRunQueueEntry, execution.id) is None
+    failed = db.get(WorkflowExecution, execution.id)
+    assert failed.status == "failed"
+    assert failed.error_message == "smtp down"
+
+def test_claims_follow_workflow_priority(db, customers, scheduler):
+    low_engine, low = _workflow(db, [{"action_type": "send_email", "config": {"subject": "Hi"}}])
+    high_engine, high = _workflow(
+        db, [{"action_type": "send_sms", "config": {"message": "Hi"}}], trigger={"trigger_type": "api_trigger", "priority": 5}
+    )
+    low_ids = [low_engine.trigger_workflow(low, customer_id) for customer_id in customers[:5]]
+    high_ids = [high_engine.trigger_workflow(high, customer_id) for customer_id in customers[:2]]
+
+    claimed = [run["execution_id"] for run in scheduler.claim(db, 3)]
+    assert claimed[:2] == high_ids
+    assert claimed[2] == low_ids[0]
+
+def test_action_limiter_caps_concurrency_and_batch_size():
+    limiter = ActionLimiter(concurrency={"webhook": 2}, rates={"send_sms": 10.0})
+    running, peak = [0], [0]
+
+    async def handler():
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    async def main():
+        await asyncio.gather(*[limiter.run("webhook", handler) for _ in range(8)])
+
+    asyncio.run(main())
+    assert peak[0] == 2
+    assert limiter.started["webhook"] == 8
+    assert limiter.batch_limit("send_sms") == 10
+    assert limiter.batch_limit("webhook") is None
+
+def test_batch_trigger_fans_out_to_the_segment_audience(db, customers, scheduler):
+    engine, workflow_id = _workflow(db, [
+        {"action_type": "send_email", "config": {"subject": "Hi {email}"}},
+        {"action_type": "update_field", "config": {"field_name": "membership_level", "field_value": "gold"}},
+        {"action_type": "add_to_segment", "config": {"segment_id": "seniors"},
+         "conditions": [{"type": "customer_field", "field": "age", "operator": "greater_than", "value": 60}]},
+    ], target_audience={"age": {"operator": "greater_than", "value": 30}})
+    expected = {f"c{i}" for i in range(30) if i % 3 and 20 + i * 2 > 30}
+    seniors = {customer_id for customer_id in expected if 20 + int(customer_id[1:]) * 2 > 60}
+
+    result = engine.trigger_workflow_batch(workflow_id, segment_id="vip")
+    assert result["triggered"] == len(expected)
+    assert len(result["execution_ids"]) == len(expected)
+    assert db.query(WorkflowRunQueueEntry).count() == len(expected)
+
+    again = engine.trigger_workflow_batch(workflow_id, customer_ids=sorted(expected) + ["c0", "missing"])
+    assert again["triggered"] == 0  # Active executions are skipped; c0 is not in the audience
+
+    async def main():
+        await scheduler.start()
+        try:
+            await _drain(db)
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+    assert _statuses(db, workflow_id) == {"completed": len(expected)}
+    gold = {customer_id for customer_id, in db.query(Customer.customer_id).filter_by(membership_level="gold")}
+    assert gold == expected
+    in_segment = {customer_id for customer_id, in db.query(Customer.customer_id).filter_by(segment_id="seniors")}
+    assert in_segment == seniors
+    assert db.query(WorkflowStepLog).filter_by(step_type="send_email").count() == len(expected)
+
+def test_batch_trigger_requires_an_audience(db, customers, scheduler):
+    engine, workflow_id = _workflow(db, [{"action_type": "send_email", "config": {"subject": "Hi"}}])
+    with pytest.raises(ValueError):
+        engine.trigger_workflow_batch(workflow_id)
+
+def test_unscheduled_batches_run_their_database_work_off_the_event_loop(db, customers, scheduler, monkeypatch):
+    monkeypatch.setattr(settings, "WORKFLOW_SCHEDULER_ENABLED", False)
+    engine, workflow_id = _workflow(db, [
+        {"action_type": "update_field", "config": {"field_name": "membership_level", "field_value": "gold"}},
+        {"action_type": "add_tag", "config": {"tag": "gold"}, "delay_minutes": 10},
+    ])
+    execution_ids = engine.trigger_workflow_batch(workflow_id, customer_ids=customers[:5])["execution_ids"]
+
+    threads = set()
+    def _record_thread(*args):
+        threads.add(threading.current_thread().name)
+
+    phases = []
+    async def main():
+        await run_unscheduled_batch(workflow_id, execution_ids)
+        phases.append(set(threads))
+        assert _statuses(db, workflow_id) == {"waiting": 5}
+        _fast_forward_timers(db)
+        threads.clear()
+        assert (await workflow_timers.process_batch())["resumed"] == 5
+        phases.append(set(threads))
+
+    event.listen(db_engine, "before_cursor_execute", _record_thread)
+    try:
+        asyncio.run(main())
+    finally:
+        event.remove(db_engine, "before_cursor_execute", _record_thread)
+
+    assert all(phase and all(name.startswith("db-worker") for name in phase) for phase in phases)
+    assert _statuses(db, workflow_id) == {"completed": 5}
+    assert db.query(Customer).filter_by(membership_level="gold").count() == 5
+    assert db.query(WorkflowTimer).count() == 0
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.cache import CacheManager, LocalCache, _MISSING
+
+class SlowRedis:
+    """Dict-backed stand-in for a Redis server answering every call after a delay"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.data = {}
+
+    def get(self, key):
+        time.sleep(self.delay)
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        time.sleep(self.delay)
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, *keys):
+        time.sleep(self.delay)
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self):
+        return SlowPipeline(self)
+
+class SlowPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.writes = []
+
+    def setex(self, key, ttl, value):
+        self.writes.append((key, value))
+
+    def sadd(self, key, member):
+        pass
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        time.sleep(self.redis.delay)
+        self.redis.data.update(self.writes)
+
+@pytest.fixture
+def cache():
+    return CacheManager(max_local_entries=100, local_ttl=30)
+
+def test_set_get_and_delete(cache):
+    cache.set("customer:1", {"name": "alice"})
+    assert cache.get("customer:1") == {"name": "alice"}
+    assert cache.get("customer:2") is None
+
+    cache.delete("customer:1")
+    assert cache.get("customer:1") is None
+
+def test_get_or_set_loads_once_across_threads(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_set("answer", loader))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [42] * 10
+    assert len(calls) == 1
+
+def test_aget_or_set_shares_one_loader_call(cache):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 7
+
+    async def main():
+        return await asyncio.gather(*[cache.aget_or_set("answer", loader) for _ in range(10)])
+
+    assert asyncio.run(main()) == [7] * 10
+    assert len(calls) == 1
+
+def test_aget_or_set_keeps_slow_redis_off_the_event_loop():
+    redis = SlowRedis(delay=0.1)
+    slow_cache = CacheManager(redis_conn=redis)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def loader():
+        return "fresh"
+
+    async def main():
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        try:
+            return await slow_cache.aget_or_set("key", loader)
+        finally:
+            task.cancel()
+
+    assert asyncio.run(main()) == "fresh"
+    assert slow_cache.get_stats()["recomputes"] == 1
+    assert "lock:key" not in redis.data  # Recompute lock released
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.08  # Each Redis call takes 0.1s
+    assert len(ticks) > 20
+
+def test_none_results_are_cached(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_set("missing", loader) is None
+    assert cache.get_or_set("missing", loader) is None
+    assert len(calls) == 1
+
+def test_invalidate_tags_drops_tagged_keys_only(cache):
+    cache.set("customer:1", 1, tags=["customers"])
+    cache.set("customer:2", 2, tags=["customers"])
+    cache.set("campaign:1", 3, tags=["campaigns"])
+
+    assert cache.invalidate_tags("customers") >= 2
+    assert cache.get("customer:1") is None
+    assert cache.get("customer:2") is None
+    assert cache.get("campaign:1") == 3
+
+def test_stats_count_hits_and_misses(cache):
+    cache.set("k", "v")
+    cache.get("k")
+    cache.get("absent")
+    cache.get_or_set("loaded", lambda: "v")
+    cache.get_or_set("loaded", lambda: "v")
+
+    stats = cache.get_stats()
+    assert stats["local_hits"] + stats["redis_hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["recomputes"] == 1
+    assert stats["get_count"] == 4
+    assert stats["hit_rate"] == pytest.approx(0.5)
+
+def test_local_tier_evicts_least_recently_used():
+    local = LocalCache(max_entries=2)
+    local.set("a", 1, ttl=30)
+    local.set("b", 2, ttl=30)
+    local.get("a")
+    local.set("c", 3, ttl=30)
+
+    assert local.get("a") == 1
+    assert local.get("b") is _MISSING
+    assert local.get("c") == 3
+
+def test_local_tier_expires_entries():
+    local = LocalCache()
+    local.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert local.get("a") is _MISSING
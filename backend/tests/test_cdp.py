@@ -0,0 +1,278 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from cdp import profile_cache as profile_cache_module
+from cdp.event_buffer import event_buffer
+from cdp.activity_aggregates import ProfileActivityDay, SessionSketch, activity_aggregator
+from cdp.profile_cache import PROFILE_SECTIONS, profile_cache
+from cdp.unified_profile import CustomerDataPlatform, CustomerEvent, CustomerIdentity, DataSource, UnifiedProfile
+from core.cache import CacheManager
+
+@pytest.fixture
+def cdp(db):
+    return CustomerDataPlatform(db)
+
+class DictRedis:
+    """Dict-backed stand-in for the Redis commands the cache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    def pipeline(self):
+        return DictPipeline(self)
+
+class DictPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def setex(self, key, ttl, value):
+        self.redis.data[key] = value
+
+    def sadd(self, key, member):
+        self.redis.data.setdefault(key, set()).add(member)
+
+    def expire(self, key, ttl):
+        pass
+
+    def execute(self):
+        pass
+
+@pytest.fixture
+def shared_cache(monkeypatch):
+    """Profile cache backed by a stand-in Redis, so versions are kept"""
+    shared = CacheManager(redis_conn=DictRedis(), max_local_entries=100, local_ttl=30)
+    monkeypatch.setattr(profile_cache_module, "cache", shared)
+    monkeypatch.setattr(profile_cache, "enabled", True)
+    return shared
+
+def _identity_owners(db, *values):
+    return {
+        identity.identity_value: identity.profile_id
+        for identity in db.query(CustomerIdentity).filter(CustomerIdentity.identity_value.in_(values))
+    }
+
+def test_bulk_import_links_records_to_existing_profiles(db, cdp):
+    existing = cdp.create_unified_profile({"name": "Alice", "age": 30}, {"email": "alice@example.com"}, DataSource.POS)
+
+    result = cdp.create_unified_profiles_bulk([
+        {"identifiers": {"email": "alice@example.com"}, "profile_data": {"city": "Shanghai"}},
+        {"identifiers": {"email": "new@example.com"}, "profile_data": {"name": "New"}},
+        {"identifiers": {"phone": "222", "email": "new@example.com"}, "profile_data": {"age": 22}},
+    ])
+
+    assert result.records == 3
+    assert result.profiles_created == 1
+    assert result.profiles_updated == 1
+    assert result.profile_ids[0] == existing
+    assert result.profile_ids[1] == result.profile_ids[2] != existing
+    assert db.get(UnifiedProfile, existing).profile_data["city"] == "Shanghai"
+
+    new_profile = db.get(UnifiedProfile, result.profile_ids[1])
+    assert new_profile.profile_data["name"] == "New"
+    assert new_profile.profile_data["age"] == 22
+    assert _identity_owners(db, "new@example.com", "222") == {"new@example.com": new_profile.id, "222": new_profile.id}
+
+def test_bulk_import_merges_profiles_joined_by_a_record(db, cdp):
+    alice = cdp.create_unified_profile({"name": "Alice"}, {"email": "alice@example.com"}, DataSource.POS)
+    bob = cdp.create_unified_profile({"name": "Bob", "city": "Beijing"}, {"phone": "111"}, DataSource.POS)
+
+    result = cdp.create_unified_profiles_bulk([
+        {"identifiers": {"email": "alice@example.com", "phone": "111"}, "profile_data": {"gender": "F"}},
+    ])
+
+    assert result.profiles_merged == 1
+    master = result.profile_ids[0]
+    assert master in (alice, bob)
+    assert set(_identity_owners(db, "alice@example.com", "111").values()) == {master}
+    assert db.get(UnifiedProfile, master).profile_data["gender"] == "F"
+
+def test_bulk_import_chunks_resolve_to_surviving_profile(db, cdp):
+    records = [
+        {"identifiers": {"email": "a@example.com"}, "profile_data": {"name": "A"}},
+        {"identifiers": {"phone": "333"}, "profile_data": {"name": "B"}},
+        {"identifiers": {"email": "a@example.com", "phone": "333"}, "profile_data": {}},
+        {"identifiers": {}, "profile_data": {"name": "anonymous"}},
+    ]
+    result = cdp.create_unified_profiles_bulk(records, chunk_size=2)
+
+    assert result.profile_ids[0] == result.profile_ids[1] == result.profile_ids[2]
+    assert result.profile_ids[3] not in (None, result.profile_ids[0])
+    assert result.profiles_created == 3
+    assert result.profiles_merged == 1
+    assert db.query(UnifiedProfile).count() == 2  # Merged-away profiles are deleted
+
+def test_bulk_resolution_matches_single_resolution(db, cdp):
+    alice = cdp.create_unified_profile({"name": "Alice"}, {"email": "alice@example.com"}, DataSource.POS)
+
+    result = cdp.resolve_identities_bulk([{"email": "alice@example.com"}, {"email": "nobody@example.com"}])
+
+    assert result.profile_ids == [alice, None]
+    assert result.profiles_created == 0
+    assert cdp.resolve_identity({"email": "alice@example.com"}) == alice
+
+def test_computed_attributes_match_raw_events(db, cdp):
+    profile_id = cdp.create_unified_profile({"name": "A"}, {"email": "a@example.com"}, DataSource.POS)
+    events = [
+        ("view", DataSource.WEBSITE, "s1"), ("click", DataSource.WEBSITE, "s1"), ("click", DataSource.MOBILE_APP, "s2"),
+        ("click", DataSource.MOBILE_APP, "s3"), ("view", DataSource.MOBILE_APP, "s3"), ("purchase", DataSource.POS, "s4"),
+    ]
+    for event_type, data_source, session_id in events:
+        cdp.track_event(profile_id, event_type, event_type, {}, data_source, session_id=session_id)
+
+    computed = cdp._compute_profile_attributes(profile_id)
+    assert computed["total_events_30d"] == len(events)
+    assert computed["unique_sessions_30d"] == 4
+    assert computed["most_common_event"] == "click"
+    assert computed["preferred_channel"] == DataSource.MOBILE_APP.value
+    assert computed["activity_score"] == pytest.approx(100 / 30)
+
+def test_events_tracked_before_aggregates_are_backfilled(db, cdp):
+    profile_id = cdp.create_unified_profile({"name": "B"}, {"email": "b@example.com"}, DataSource.POS)
+    now = datetime.now()
+    for i in range(12):
+        db.add(CustomerEvent(
+            id=str(uuid.uuid4()), profile_id=profile_id, event_type="view", data_source=DataSource.WEBSITE.value,
+            session_id=f"s{i % 5}", timestamp=now - timedelta(days=i * 3)
+        ))
+    db.commit()
+
+    computed = cdp._compute_profile_attributes(profile_id)
+    assert computed["total_events_30d"] == 11  # The window has day granularity: day 30 is in, day 33 is out
+    assert computed["unique_sessions_30d"] == 5
+
+    cdp.track_event(profile_id, "view", "view", {}, DataSource.WEBSITE, session_id="s9")
+    assert cdp._compute_profile_attributes(profile_id)["total_events_30d"] == 12
+
+def test_merge_profiles_combines_aggregates(db, cdp):
+    a = cdp.create_unified_profile({"name": "A"}, {"email": "a@example.com"}, DataSource.POS)
+    b = cdp.create_unified_profile({"name": "B"}, {"email": "b@example.com"}, DataSource.POS)
+    # Fixed session ids: the sketch estimate of random ones is off by one now and then
+    for profile_id, name, count in ((a, "a", 3), (b, "b", 2)):
+        for i in range(count):
+            cdp.track_event(profile_id, "view", "view", {}, DataSource.WEBSITE, session_id=f"{name}-{i}")
+
+    result = cdp.merge_profiles([a, b])
+    assert result.success
+    computed = cdp._compute_profile_attributes(result.master_profile_id)
+    assert computed["total_events_30d"] == 5
+    assert computed["unique_sessions_30d"] == 5
+
+def test_prune_drops_days_outside_the_window(db, cdp):
+    profile_id = cdp.create_unified_profile({"name": "C"}, {"email": "c@example.com"}, DataSource.POS)
+    cdp.track_event(profile_id, "view", "view", {}, DataSource.WEBSITE)
+    db.add(ProfileActivityDay(profile_id=profile_id, day=(datetime.now() - timedelta(days=60)).date(), event_count=4))
+    db.commit()
+
+    assert activity_aggregator.prune(db) >= 1
+    db.commit()
+    assert db.query(ProfileActivityDay).filter_by(profile_id=profile_id).count() == 1
+
+def test_session_sketch_estimates_distinct_sessions():
+    small = SessionSketch()
+    for i in range(40):
+        small.add(f"session-{i % 37}")
+    assert small.estimate() == pytest.approx(37, abs=2)
+
+    large = SessionSketch()
+    for i in range(10000):
+        large.add(f"session-{i}")
+    assert large.estimate() == pytest.approx(10000, rel=0.2)
+
+    merged = SessionSketch(small.to_bytes()).merge(SessionSketch(small.to_bytes()))
+    assert merged.estimate() == small.estimate()
+
+def test_backfill_on_read_does_not_commit_the_callers_changes(db, cdp):
+    profile_id = cdp.create_unified_profile({"name": "D"}, {"email": "d@example.com"}, DataSource.POS)
+    db.add(CustomerEvent(
+        id=str(uuid.uuid4()), profile_id=profile_id, event_type="view", data_source=DataSource.WEBSITE.value,
+        timestamp=datetime.now()
+    ))
+    db.commit()
+
+    db.get(UnifiedProfile, profile_id).profile_data = {"name": "uncommitted"}
+    assert cdp._compute_profile_attributes(profile_id)["total_events_30d"] == 1
+    db.rollback()
+    assert db.get(UnifiedProfile, profile_id).profile_data["name"] == "D"
+    assert not activity_aggregator.needs_backfill(db, [profile_id])
+
+def test_track_event_writes_directly_while_the_buffer_is_stopped(db, cdp):
+    profile_id = cdp.create_unified_profile({"name": "E"}, {"email": "e@example.com"}, DataSource.POS)
+    assert not event_buffer.running
+
+    event_id = cdp.track_event(profile_id, "view", "view", {}, DataSource.WEBSITE)
+    assert db.get(CustomerEvent, event_id) is not None
+
+def test_track_event_writes_directly_when_the_buffer_is_full(db, cdp, monkeypatch):
+    profile_id = cdp.create_unified_profile({"name": "F"}, {"email": "f@example.com"}, DataSource.POS)
+    monkeypatch.setattr(event_buffer, "_capacity", threading.Semaphore(0))
+    event_buffer.start()
+    try:
+        dead_lettered = event_buffer.metrics["dead_lettered"]
+        started = time.perf_counter()
+        event_id = cdp.track_event(profile_id, "view", "view", {}, DataSource.WEBSITE)
+    finally:
+        event_buffer.stop()
+
+    assert time.perf_counter() - started < 1.0
+    assert event_buffer.metrics["dead_lettered"] == dead_lettered
+    assert db.get(CustomerEvent, event_id) is not None
+
+def test_profile_writes_bump_the_cached_version(db, cdp, shared_cache):
+    profile_id = cdp.create_unified_profile({"name": "G"}, {"email": "g@example.com"}, DataSource.POS)
+    assert "city" not in cdp.get_unified_profile(profile_id)["profile_data"]
+    version = profile_cache.version(profile_id)
+    stale = cdp._load_profile_section(profile_id, "profile")
+
+    cdp.update_profile(profile_id, {"city": "Shanghai"})
+    assert profile_cache.version(profile_id) == version + 1
+    # A reader that loaded the profile before the commit stores it under the old version
+    shared_cache.set(f"cdp:profile:{profile_id}:v{version}:profile", stale, tags=[f"cdp:profile:{profile_id}"])
+    assert cdp.get_unified_profile(profile_id)["profile_data"]["city"] == "Shanghai"
+
+    cdp.track_events_bulk([{"profile_id": profile_id, "event_type": "view", "data_source": DataSource.WEBSITE}])
+    assert profile_cache.version(profile_id) == version + 2
+    assert len(cdp.get_unified_profile(profile_id, projection=["recent_activity"])["recent_activity"]) == 1
+
+def test_merge_profiles_bumps_the_version_of_every_merged_profile(db, cdp, shared_cache):
+    a = cdp.create_unified_profile({"name": "H"}, {"email": "h@example.com"}, DataSource.POS)
+    b = cdp.create_unified_profile({"name": "I"}, {"phone": "444"}, DataSource.POS)
+    for profile_id in (a, b):
+        cdp.get_unified_profile(profile_id)
+    versions = {profile_id: profile_cache.version(profile_id) for profile_id in (a, b)}
+
+    master = cdp.merge_profiles([a, b]).master_profile_id
+    assert all(profile_cache.version(profile_id) == versions[profile_id] + 1 for profile_id in (a, b))
+    identities = cdp.get_unified_profile(master, projection=["identities"])["identities"]
+    assert {identity["value"] for identity in identities} == {"h@example.com", "444"}
+
+def test_projection_returns_only_the_requested_sections(db, cdp, shared_cache):
+    profile_id = cdp.create_unified_profile({"name": "J"}, {"email": "j@example.com"}, DataSource.POS)
+
+    assert set(cdp.get_unified_profile(profile_id, projection=["identities", "attributes"])) == {
+        "profile_id", "identities", "attributes"
+    }
+    full = cdp.get_unified_profile(profile_id)
+    assert set(PROFILE_SECTIONS) - {"profile"} <= set(full)
+    assert full["profile_data"]["name"] == "J"
+
+    with pytest.raises(ValueError, match="bogus"):
+        cdp.get_unified_profile(profile_id, projection=["identities", "bogus"])
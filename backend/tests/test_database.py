@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import uuid
+
+from sqlalchemy import func, select
+
+from core import database
+from core.config import settings
+from core.database import Customer, get_async_db, run_with_db
+
+def test_async_url_maps_sync_drivers(monkeypatch):
+    monkeypatch.setattr(settings, "ASYNC_DATABASE_URL", None)
+    assert database._async_database_url("sqlite:///./crm.db") == "sqlite+aiosqlite:///./crm.db"
+    assert database._async_database_url("postgresql://u:p@db/crm") == "postgresql+asyncpg://u:p@db/crm"
+    assert database._async_database_url("mysql://u:p@db/crm") is None
+
+    monkeypatch.setattr(settings, "ASYNC_DATABASE_URL", "postgresql+asyncpg://other/crm")
+    assert database._async_database_url("postgresql://u:p@db/crm") == "postgresql+asyncpg://other/crm"
+
+def test_pool_options_come_from_settings():
+    assert database._pool_options("sqlite:///./crm.db") == {}
+    options = database._pool_options("postgresql://u:p@db/crm")
+    assert options["pool_size"] == settings.DB_POOL_SIZE
+    assert options["max_overflow"] == settings.DB_MAX_OVERFLOW
+    assert options["pool_pre_ping"] == settings.DB_POOL_PRE_PING
+
+def test_async_session_reads_committed_rows(db):
+    db.add(Customer(id=uuid.uuid4(), customer_id="c1"))
+    db.commit()
+
+    async def main():
+        sessions = get_async_db()
+        session = await sessions.__anext__()
+        try:
+            return await session.scalar(select(func.count()).select_from(Customer))
+        finally:
+            await sessions.aclose()
+            await database.async_engine.dispose()
+
+    assert asyncio.run(main()) == 1
+
+def test_run_with_db_uses_the_database_pool(db):
+    def count_customers(session, customer_id):
+        session.add(Customer(id=uuid.uuid4(), customer_id=customer_id))
+        session.flush()
+        return threading.current_thread().name, session.query(Customer).count()
+
+    thread_name, count = asyncio.run(run_with_db(count_customers, "c2"))
+    assert thread_name.startswith("db-worker")
+    assert count == 1
+    assert db.query(Customer).filter_by(customer_id="c2").count() == 1  # Committed on return
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+import pytest
+
+from core.engine_registry import EngineRegistry
+
+@pytest.fixture
+def registry():
+    imports = []
+    registry = EngineRegistry(on_import=lambda: imports.append(1), retry_backoff=30.0, max_retry_backoff=90.0)
+    registry.imports = imports
+    return registry
+
+def _expire_backoff(registry, name):
+    registry.specs[name].retry_at = time.monotonic() - 1
+
+def test_engines_load_on_first_use(registry):
+    registry.register("ordered", "collections:OrderedDict", needs_db=False)
+    assert registry.status() == {"ordered": "not_loaded"}
+
+    assert isinstance(registry.get("ordered"), OrderedDict)
+    assert asyncio.run(registry.aget("ordered")) is registry.get("ordered")
+    assert registry.imports == [1]
+    row = registry.report()["engines"][0]
+    assert row["status"] == "loaded" and row["error"] is None and row["import_time_ms"] is not None
+
+def test_failed_engine_is_retried_after_backoff(registry):
+    registry.register("flaky", "collections:NoSuchEngine", needs_db=False)
+
+    assert registry.get("flaky") is None
+    assert registry.get("flaky") is None  # Still backing off: no second import
+    assert asyncio.run(registry.aget("flaky")) is None
+    report = registry.report()
+    assert report["failed"] == 1
+    row = report["engines"][0]
+    assert row["status"] == "failed" and "NoSuchEngine" in row["error"]
+    assert row["failures"] == 1 and 0 < row["retry_in_seconds"] <= 30
+
+    registry.specs["flaky"].target = "collections:OrderedDict"
+    _expire_backoff(registry, "flaky")
+    assert isinstance(registry.get("flaky"), OrderedDict)
+    row = registry.report()["engines"][0]
+    assert (row["status"], row["error"], row["failures"], row["retry_in_seconds"]) == ("loaded", None, 0, None)
+
+def test_retry_backoff_doubles_up_to_the_cap(registry):
+    registry.register("broken", "collections:NoSuchEngine", needs_db=False)
+    retry_in = []
+    for _ in range(4):
+        _expire_backoff(registry, "broken")
+        registry.get("broken")
+        retry_in.append(registry.report()["engines"][0]["retry_in_seconds"])
+
+    assert [round(seconds / 30) for seconds in retry_in] == [1, 2, 3, 3]
+    assert registry.specs["broken"].failures == 4
@@ -0,0 +1,194 @@
+import random
+import uuid
+
+import numpy as np
+import pytest
+
+from core.database import Customer
+from experiments.ab_testing import ABTestingFramework, Experiment, ExperimentAssignment, ExperimentConversion
+from experiments.assignment import assign_variants, variant_assigner
+from experiments.variant_stats import ExperimentVariantStats, variant_stats
+
+ALLOCATION = {"a": 30, "b": 70}
+
+@pytest.fixture
+def ab(db):
+    variant_assigner.invalidate()
+    yield ABTestingFramework(db)
+    variant_assigner.buffer.flush()
+    variant_assigner._recent.clear()
+    variant_assigner.invalidate()
+
+def _experiment_config(**overrides):
+    variants = overrides.pop("variants", ALLOCATION)
+    return {
+        "name": "checkout test",
+        "experiment_type": "email_campaign",
+        "variants": [{"id": variant_id} for variant_id in variants],
+        "traffic_allocation": dict(variants),
+        "primary_metric": "conversion_rate",
+        **overrides
+    }
+
+def _running(ab, **overrides):
+    experiment_id = ab.create_experiment(_experiment_config(**overrides))
+    ab.start_experiment(experiment_id)
+    return experiment_id
+
+def _assignments(db, experiment_id):
+    return dict(db.query(ExperimentAssignment.customer_id, ExperimentAssignment.variant_id).filter_by(
+        experiment_id=experiment_id
+    ).all())
+
+def test_fast_path_matches_database_assignment(db, ab):
+    experiment_id = _running(ab)
+    customer_ids = [f"c{i}" for i in range(500)]
+
+    fast = [ab.assign_variant_fast(experiment_id, customer_id) for customer_id in customer_ids]
+    assert fast == [ab._hash_assign_variant(customer_id, ALLOCATION) for customer_id in customer_ids]
+    assert fast == assign_variants(customer_ids, ALLOCATION)
+    assert 0.2 < fast.count("a") / len(fast) < 0.4
+
+def test_fast_path_assignments_are_written_once(db, ab):
+    experiment_id = _running(ab)
+    slow = ab.assign_variant(experiment_id, "c1")
+    for _ in range(3):
+        assert ab.assign_variant_fast(experiment_id, "c1") == slow
+        ab.assign_variant_fast(experiment_id, "c2")
+    variant_assigner.buffer.flush()
+
+    db.expire_all()
+    assert sorted(_assignments(db, experiment_id)) == ["c1", "c2"]
+    totals = variant_stats.totals(variant_stats.get(db, experiment_id))
+    assert totals.assignments == 2
+
+def test_fast_path_audience_and_stopped_experiments(db, ab):
+    db.add(Customer(id=uuid.uuid4(), customer_id="vip1", segment_id="vip"))
+    db.commit()
+    experiment_id = _running(ab, target_audience={"segment_id": "vip"})
+
+    assert ab.assign_variant_fast(experiment_id, "c1", {"segment_id": "regular"}) is None
+    assert ab.assign_variant_fast(experiment_id, "c2", {"segment_id": "vip"}) in ALLOCATION
+    assert ab.assign_variant_fast(experiment_id, "vip1") in ALLOCATION  # Attributes loaded from the customer row
+    assert ab.assign_variant_fast(experiment_id, "nobody") is None
+
+    ab.stop_experiment(experiment_id)
+    assert ab.assign_variant_fast(experiment_id, "c2", {"segment_id": "vip"}) is None
+
+def test_conversion_of_unflushed_fast_assignment_is_tracked(db, ab):
+    experiment_id = _running(ab)
+    variant_id = ab.assign_variant_fast(experiment_id, "c1")
+
+    assert ab.track_conversion(experiment_id, "c1", "conversion_rate", 1.0)
+    conversion = db.query(ExperimentConversion).filter_by(experiment_id=experiment_id, customer_id="c1").one()
+    assert conversion.variant_id == variant_id
+    stats = variant_stats.get(db, experiment_id)
+    assert variant_stats.variant(stats, variant_id, "conversion_rate").conversions == 1
+
+def test_variant_statistics_match_raw_rows(db, ab):
+    experiment_id = _running(ab, variants={"a": 50, "b": 50})
+    rng = random.Random(3)
+    for i in range(200):
+        ab.assign_variant(experiment_id, f"c{i}")
+    assignments = _assignments(db, experiment_id)
+
+    values = {"a": [], "b": []}
+    for i in range(0, 200, 3):
+        value = rng.random() * 10
+        ab.track_conversion(experiment_id, f"c{i}", "conversion_rate", value)
+        values[assignments[f"c{i}"]].append(value)
+    ab.track_conversion(experiment_id, "c1", "revenue", 99.0)
+
+    result = ab.analyze_experiment(experiment_id)
+    for variant_id, variant_values in values.items():
+        variant_result = result.variant_results[variant_id]
+        assert variant_result["sample_size"] == list(assignments.values()).count(variant_id)
+        assert variant_result["average_value"] == pytest.approx(np.mean(variant_values))
+        assert variant_result["standard_deviation"] == pytest.approx(np.std(variant_values))
+
+    def _snapshot():
+        return {
+            (row.variant_id, row.metric_type): (row.assignments, row.conversions, round(row.value_sum, 6))
+            for row in db.query(ExperimentVariantStats).filter_by(experiment_id=experiment_id)
+        }
+
+    incremental = _snapshot()
+    variant_stats.rebuild(db, experiment_id)
+    assert _snapshot() == incremental
+
+def test_bulk_assignment_respects_audience_and_existing_assignments(db, ab):
+    for i in range(300):
+        db.add(Customer(
+            id=uuid.uuid4(), customer_id=f"c{i}", segment_id="vip" if i % 2 else "regular", total_spent=float(i)
+        ))
+    db.commit()
+    experiment_id = _running(ab, target_audience={"total_spent": {"operator": "greater_than", "value": 100}})
+    existing = ab.assign_variant(experiment_id, "c101")
+
+    result = ab.bulk_assign_variants(experiment_id, segment_id="vip")
+    expected = {f"c{i}" for i in range(101, 300) if i % 2}
+    assert result["audience_size"] == len(expected)
+    assert result["assigned"] == len(expected) - 1
+    assert sum(result["variant_counts"].values()) == result["assigned"]
+
+    assignments = _assignments(db, experiment_id)
+    assert set(assignments) == expected
+    assert assignments["c101"] == existing
+    assert all(assignments[customer_id] == ab._hash_assign_variant(customer_id, ALLOCATION) for customer_id in expected)
+    assert variant_stats.totals(variant_stats.get(db, experiment_id)).assignments == len(expected)
+
+    again = ab.bulk_assign_variants(experiment_id, customer_ids=["c1", "c3", "c102", "c103", "missing"])
+    assert again["audience_size"] == 2
+    assert again["assigned"] == 1  # c103 was already assigned; c1 and c3 spent too little
+    assert "c102" in _assignments(db, experiment_id)
+
+def test_bulk_assignment_rejects_completed_experiments(db, ab):
+    experiment_id = _running(ab)
+    ab.stop_experiment(experiment_id)
+    with pytest.raises(ValueError):
+        ab.bulk_assign_variants(experiment_id, customer_ids=["c1"])
+
+def test_sequential_experiment_stops_when_boundary_is_crossed(db, ab):
+    rates = {"a": 0.05, "b": 0.5}
+    experiment_id = _running(ab, variants={"a": 50, "b": 50}, analysis_mode="sequential", mixture_variance=0.04)
+    ab.bulk_assign_variants(experiment_id, customer_ids=[f"c{i}" for i in range(1000)])
+
+    state = ab.get_sequential_state(experiment_id)
+    assert state["status"] == "running"
+
+    rng = random.Random(11)
+    assignments = sorted(_assignments(db, experiment_id).items())
+    for customer_id, variant_id in assignments:
+        if db.get(Experiment, experiment_id).status != "running":
+            break
+        if rng.random() < rates[variant_id]:
+            ab.track_conversion(experiment_id, customer_id, "conversion_rate", 1.0)
+    else:
+        pytest.fail("sequential boundary was never crossed")
+
+    db.expire_all()
+    experiment = db.get(Experiment, experiment_id)
+    assert experiment.status == "completed"
+    assert experiment.winner_variant == "b"
+    assert ab.get_sequential_state(experiment_id)["p_value"] <= 0.05
+
+def test_sequential_state_requires_sequential_mode(db, ab):
+    experiment_id = _running(ab)
+    with pytest.raises(ValueError):
+        ab.get_sequential_state(experiment_id)
+
+def test_reads_rebuild_missing_aggregates_without_committing(db, ab):
+    experiment_id = _running(ab)
+    assert variant_stats.get(db, experiment_id) == {}
+    assert not db.new and db.query(ExperimentVariantStats).filter_by(experiment_id=experiment_id).count() == 0
+
+    for i in range(3):
+        ab.assign_variant(experiment_id, f"c{i}")
+    db.query(ExperimentVariantStats).filter_by(experiment_id=experiment_id).delete()
+    db.commit()
+
+    db.get(Experiment, experiment_id).name = "uncommitted"
+    assert variant_stats.totals(variant_stats.get(db, experiment_id)).assignments == 3
+    db.rollback()
+    assert db.get(Experiment, experiment_id).name == "checkout test"
+    assert db.query(ExperimentVariantStats).filter_by(experiment_id=experiment_id).count() == 0
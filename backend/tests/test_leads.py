@@ -0,0 +1,229 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+from core.database import Customer
+from journey.lifecycle_manager import CustomerLifecycleManager, Touchpoint, TouchpointType
+from leads.leaderboard import LeadLeaderboard, LeadLeaderboardEntry
+from leads.model_registry import ScoringModelRegistry, scoring_model_registry
+from leads.rescoring_queue import rescoring_queue, LeadRescoreQueueEntry
+from leads.scoring_engine import LeadScoringEngine, LeadScore, ScoreType, ScoringEvent, ScoringRule
+
+TOUCHPOINT_TYPES = ["website_visit", "store_visit", "purchase", "sms_click", "review", "email_open"]
+
+@pytest.fixture(scope="module", autouse=True)
+def model_dir(tmp_path_factory):
+    previous = scoring_model_registry.model_dir, scoring_model_registry._current, scoring_model_registry._pinned
+    scoring_model_registry.model_dir = tmp_path_factory.mktemp("lead_scoring")
+    scoring_model_registry._current = None
+    scoring_model_registry._pinned = None
+    yield scoring_model_registry.model_dir
+    scoring_model_registry.model_dir, scoring_model_registry._current, scoring_model_registry._pinned = previous
+
+@pytest.fixture(autouse=True)
+def clean_queue():
+    rescoring_queue._recent.clear()
+    yield
+    rescoring_queue._recent.clear()
+
+def _publish(registry, version):
+    features = np.random.RandomState(0).random_sample((20, 10))
+    registry.save(LinearRegression().fit(features, features[:, 0]), StandardScaler().fit(features), version)
+
+@pytest.fixture
+def registry(tmp_path):
+    return ScoringModelRegistry(model_dir=str(tmp_path), poll_interval=0)
+
+def test_registry_bootstraps_and_persists_a_model(registry):
+    model = registry.get()
+    assert model.version == "1.0"
+    assert registry.available_versions() == ["1.0"]
+    assert model.predict(np.zeros((3, 10))).shape == (3,)
+    assert registry.get() is model
+
+def test_polling_follows_every_new_version(registry):
+    _publish(registry, "1.0")
+    assert registry.get().version == "1.0"
+
+    _publish(registry, "2.0")
+    assert registry.get().version == "2.0"
+    _publish(registry, "2.1")
+    assert registry.get().version == "2.1"  # An automatic upgrade does not pin
+    assert registry.info()["pinned_version"] is None
+
+def test_explicit_reload_pins_until_reloaded_without_version(registry):
+    _publish(registry, "1.0")
+    _publish(registry, "2.0")
+    assert registry.get().version == "2.0"
+
+    assert registry.reload("1.0").version == "1.0"
+    _publish(registry, "3.0")
+    assert registry.get().version == "1.0"
+    assert registry.info()["pinned_version"] == "1.0"
+
+    assert registry.reload().version == "3.0"
+    _publish(registry, "4.0")
+    assert registry.get().version == "4.0"
+
+@pytest.fixture
+def customers(db):
+    rng = random.Random(7)
+    now = datetime.now()
+    customer_ids = []
+    for i in range(40):
+        customer_id = f"c{i:03d}"
+        customer_ids.append(customer_id)
+        db.add(Customer(
+            id=uuid.uuid4(), customer_id=customer_id,
+            age=rng.choice([None, 0, 17, 30, 50, 70]), gender=rng.choice([None, "F", "M", ""]),
+            email=rng.choice([None, f"{customer_id}@example.com"]), rating_id=rng.choice([None, 1, 3]),
+            segment_id=rng.choice([None, "1", "2", ""]), created_at=now - timedelta(days=rng.randint(0, 900))
+        ))
+        for _ in range(rng.randint(0, 12)):
+            db.add(Touchpoint(
+                customer_id=customer_id, touchpoint_type=rng.choice(TOUCHPOINT_TYPES),
+                timestamp=now - timedelta(days=rng.uniform(0, 90)),
+                engagement_score=rng.random() * 5, conversion_value=rng.choice([0, None, 50, 2000])
+            ))
+    db.add(ScoringRule(rule_name="repeat buyer", rule_type="behavioral", score_value=7, condition={
+        "type": "touchpoint_count", "touchpoint_type": "purchase", "operator": ">=", "value": 2
+    }))
+    db.add(ScoringRule(rule_name="big spender", rule_type="behavioral", score_value=3, condition={
+        "type": "purchase_amount", "operator": ">", "value": 100
+    }))
+    db.commit()
+    return customer_ids
+
+def _composite_score(db, customer_id):
+    return db.query(LeadScore).filter_by(customer_id=customer_id, score_type=ScoreType.COMPOSITE.value).one()
+
+def test_batch_scores_match_single_customer_scores(db, customers):
+    engine = LeadScoringEngine(db)
+    batch = engine.calculate_lead_scores_batch(customers, persist=False).set_index("customer_id")
+
+    for customer_id in customers:
+        single = engine.calculate_lead_score(customer_id)
+        for component, value in single["score_breakdown"].items():
+            assert batch.loc[customer_id, component] == pytest.approx(value, abs=1e-6), (customer_id, component)
+        assert batch.loc[customer_id, "composite_score"] == pytest.approx(single["composite_score"], abs=1e-6)
+
+def test_batch_scoring_persists_scores_events_and_leaderboard(db, customers):
+    engine = LeadScoringEngine(db)
+    engine.calculate_lead_scores_batch(customers)
+
+    assert db.query(LeadScore).filter_by(score_type=ScoreType.COMPOSITE.value).count() == len(customers)
+    assert db.query(ScoringEvent).count() > 0
+    assert db.query(LeadLeaderboardEntry).count() == len(customers)
+    for scoring_event in db.query(ScoringEvent):
+        assert scoring_event.lead_score_id == _composite_score(db, scoring_event.customer_id).id
+
+    first_run = max(score.calculated_at for score in db.query(LeadScore))
+    result = engine.rescore_all_customers(block_size=16)
+    assert result["customers_scored"] == len(customers)
+    assert result["blocks"] == 3
+    db.expire_all()
+    scores = db.query(LeadScore).filter_by(score_type=ScoreType.COMPOSITE.value).all()
+    assert len(scores) == len(customers)  # Rescoring updates the composite row in place
+    assert all(score.calculated_at > first_run for score in scores)
+
+def test_segment_analysis_rescores_only_missing_and_expired_scores(db, customers):
+    members = [customer.customer_id for customer in db.query(Customer).filter(Customer.segment_id == "1")]
+    fresh, expired, missing = members[0], members[1], members[2:]
+    engine = LeadScoringEngine(db)
+    engine.calculate_lead_scores_batch([fresh, expired])
+    db.query(LeadScore).filter(LeadScore.customer_id == expired).update(
+        {"expires_at": datetime.now() - timedelta(hours=1)}, synchronize_session=False
+    )
+    db.commit()
+    fresh_calculated_at = _composite_score(db, fresh).calculated_at
+
+    analysis = engine.get_segment_scoring_analysis("1")
+    assert analysis["scored_customers"] == len(members)
+    assert analysis["rescored_customers"] == len(members) - 1
+    db.expire_all()
+    assert _composite_score(db, fresh).calculated_at == fresh_calculated_at
+    assert _composite_score(db, expired).expires_at > datetime.now()
+    assert all(_composite_score(db, customer_id) for customer_id in missing)
+
+def test_touchpoints_enqueue_once_within_dedup_window(db, customers):
+    lifecycle = CustomerLifecycleManager(db)
+    lifecycle.track_touchpoint("c001", TouchpointType.STORE_VISIT, {"channel": "store"})
+    lifecycle.track_touchpoint("c001", TouchpointType.PURCHASE, {"purchase_amount": 50})
+
+    assert db.query(LeadRescoreQueueEntry).filter_by(customer_id="c001").count() == 1
+    assert rescoring_queue.is_queued(db, "c001")
+
+def test_rolled_back_enqueue_does_not_suppress_the_next(db, customers):
+    assert rescoring_queue.enqueue(db, ["c002"]) == 1
+    db.rollback()
+
+    assert not rescoring_queue.is_queued(db, "c002")
+    assert rescoring_queue.enqueue(db, ["c002"]) == 1
+    db.commit()
+    assert rescoring_queue.is_queued(db, "c002")
+
+def test_queued_customer_is_rescored_and_dequeued(db, customers):
+    engine = LeadScoringEngine(db)
+    engine.calculate_lead_scores_batch(["c003"])
+    assert engine.get_lead_score("c003").get("cached")
+
+    rescoring_queue.enqueue(db, ["c003"])
+    db.commit()
+    assert not engine.get_lead_score("c003").get("cached")
+    assert not rescoring_queue.is_queued(db, "c003")
+
+    rescoring_queue.enqueue(db, ["c003"])
+    db.commit()
+    result = rescoring_queue.process_batch(db)
+    assert result["dirty"] == 1
+    assert not rescoring_queue.is_queued(db, "c003")
+    assert engine.get_lead_score("c003").get("cached")
+
+def test_expired_scores_are_rescored(db, customers):
+    engine = LeadScoringEngine(db)
+    engine.calculate_lead_scores_batch(["c004", "c005"])
+    db.query(LeadScore).filter(LeadScore.customer_id == "c004").update(
+        {"expires_at": datetime.now() - timedelta(hours=1)}, synchronize_session=False
+    )
+    db.commit()
+    assert rescoring_queue.get_metrics(db)["expired_backlog"] == 1
+
+    result = rescoring_queue.process_batch(db)
+    assert result["expired"] == 1
+    db.expire_all()
+    assert _composite_score(db, "c004").expires_at > datetime.now()
+    assert _composite_score(db, "c005").calculated_at < _composite_score(db, "c004").calculated_at
+    assert rescoring_queue.get_metrics(db)["expired_backlog"] == 0
+
+def test_leaderboard_ranks_break_ties_by_customer(db):
+    now = datetime.now()
+    for customer_id, score in [("a", 90), ("b", 80), ("c", 80), ("d", 80), ("e", 70)]:
+        db.add(LeadLeaderboardEntry(customer_id=customer_id, score_value=score, calculated_at=now))
+    db.commit()
+    leaderboard = LeadLeaderboard()
+
+    assert [leaderboard.get_rank(db, customer_id)["rank"] for customer_id in "abcde"] == [1, 2, 3, 4, 5]
+    assert leaderboard.get_rank(db, "e")["total_ranked"] == 5
+    assert leaderboard.get_rank(db, "e", score_threshold=75) is None
+
+    first = leaderboard.get_page(db, limit=2)
+    second = leaderboard.get_page(db, limit=2, cursor=first["next_cursor"])
+    assert [row["customer_id"] for row in first["leaderboard"] + second["leaderboard"]] == ["a", "b", "c", "d"]
+    assert [row["rank"] for row in second["leaderboard"]] == [3, 4]
+
+def test_leaderboard_rank_reflects_new_scores_immediately(db):
+    now = datetime.now()
+    leaderboard = LeadLeaderboard()
+    leaderboard.record(db, [{"customer_id": "a", "score_value": 50, "calculated_at": now}])
+    db.commit()
+    assert leaderboard.get_rank(db, "a")["rank"] == 1
+
+    leaderboard.record(db, [{"customer_id": "b", "score_value": 60, "calculated_at": now}])
+    db.commit()
+    assert leaderboard.get_rank(db, "a")["rank"] == 2
+    assert leaderboard.get_rank(db, "a")["total_ranked"] == 2
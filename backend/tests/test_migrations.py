@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+
+from core.database import engine, warn_missing_columns, warn_missing_unique_indexes
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+@pytest.fixture
+def alembic_config():
+    config = Config(str(BACKEND_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(BACKEND_DIR / "migrations"))
+    yield config
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+def _columns(table):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+def test_upgrade_adds_refresh_mode_to_existing_executions(db, alembic_config, caplog):
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE segment_executions"))
+        connection.execute(text("CREATE TABLE segment_executions (id VARCHAR PRIMARY KEY, segment_id VARCHAR)"))
+
+    warn_missing_columns()
+    assert "segment_executions is missing columns" in caplog.text
+    assert "refresh_mode" not in _columns("segment_executions")  # Startup never alters tables
+
+    command.upgrade(alembic_config, "head")
+    assert "refresh_mode" in _columns("segment_executions")
+
+def test_upgrade_skips_tables_created_with_the_column(db, alembic_config):
+    command.upgrade(alembic_config, "head")
+    assert "refresh_mode" in _columns("segment_executions")
+
+def _indexes(table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+def test_duplicate_assignments_are_deduplicated_by_migration_not_startup(db, alembic_config, caplog):
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX uq_experiment_assignment"))
+        connection.execute(text(
+            "INSERT INTO experiment_assignments (id, experiment_id, customer_id, variant_id) "
+            "VALUES (1, 'e1', 'c1', 'a'), (2, 'e1', 'c1', 'b'), (3, 'e1', 'c2', 'a')"
+        ))
+
+    # Pooled SQLite connections of earlier tests can report the schema from before this test's create_all
+    engine.dispose()
+    warn_missing_unique_indexes()
+    assert "missing unique indexes uq_experiment_assignment" in caplog.text
+    assert "uq_experiment_assignment" not in _indexes("experiment_assignments")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM experiment_assignments")).scalar() == 3
+
+    command.upgrade(alembic_config, "head")
+    assert "uq_experiment_assignment" in _indexes("experiment_assignments")
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT id, variant_id FROM experiment_assignments ORDER BY id")).all()
+    assert [tuple(row) for row in rows] == [(1, "a"), (3, "a")]
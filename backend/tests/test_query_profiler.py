@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from core.query_profiler import QueryProfiler, QueryProfilingMiddleware, statement_shape
+
+@pytest.fixture
+def profiler():
+    profiler = QueryProfiler(n_plus_one_threshold=3)
+    engine = create_engine("sqlite://")
+    profiler.instrument(engine, engine)  # Instrumenting twice must not double count
+    with engine.connect() as connection:
+        yield profiler, connection
+
+def test_statement_shape_ignores_parameters():
+    assert statement_shape("SELECT * FROM t WHERE id = 5 AND name = 'a''b'") == statement_shape(
+        "SELECT *  FROM t\n WHERE id = ? AND name = :name"
+    )
+    assert statement_shape("SELECT * FROM t WHERE id IN (?, ?, ?)") == "SELECT * FROM t WHERE id IN (?)"
+
+def test_profile_counts_request_queries_and_flags_repeats(profiler):
+    profiler, connection = profiler
+    connection.execute(text("SELECT 1"))  # Outside a request: not recorded
+
+    profile = profiler.start("GET", "/customers/42")
+    connection.execute(text("SELECT 1"))
+    for customer_id in range(4):
+        connection.execute(text("SELECT :id"), {"id": customer_id})
+    offenders = profiler.finish(profile, route="/customers/{customer_id}")
+
+    assert profile.query_count == 5
+    assert offenders == [{"statement": "SELECT ?", "count": 5}]
+    route = profiler.worst_offenders()[0]
+    assert route["route"] == "GET /customers/{customer_id}"
+    assert (route["requests"], route["max_queries"], route["n_plus_one_requests"]) == (1, 5, 1)
+
+def test_middleware_reports_query_headers(profiler):
+    profiler, connection = profiler
+
+    async def app(scope, receive, send):
+        connection.execute(text("SELECT 1"))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/health"}
+    asyncio.run(QueryProfilingMiddleware(app, profiler)(scope, None, send))
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"x-db-query-count"] == b"1"
+    assert headers[b"x-db-n-plus-one"] == b"0"
+    assert profiler.worst_offenders()[0]["route"] == "GET /health"
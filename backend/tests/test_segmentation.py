@@ -0,0 +1,300 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+from core.database import Customer
+from segmentation.criteria_compiler import CriteriaCompiler, FrameCriteriaEvaluator
+from segmentation.dynamic_engine import (
+    DynamicSegment, DynamicSegmentationEngine, SegmentExecution, SegmentMembership, _preview_sample,
+    warm_preview_sample
+)
+from segmentation.membership_index import SegmentBitmap, SegmentMembershipIndex, popcount
+
+CUSTOMERS = [
+    {"customer_id": "C0", "age": 20, "gender": "M", "name": "alice", "total_spent": 50.0},
+    {"customer_id": "C1", "age": 35, "gender": "F", "name": "bob", "total_spent": 150.0},
+    {"customer_id": "C2", "age": None, "gender": "M", "name": "a%b", "total_spent": 300.0},
+    {"customer_id": "C3", "age": 60, "gender": None, "name": None, "total_spent": 700.0},
+    {"customer_id": "C4", "age": 45, "gender": "F", "name": "carol", "total_spent": None},
+    {"customer_id": "C5", "age": 70, "gender": "M", "name": "bill", "total_spent": 1200.0},
+]
+
+CRITERIA = [
+    {"logical_operator": "or", "conditions": [
+        {"field": "age", "operator": "greater_than", "value": 50},
+        {"logical_operator": "not", "conditions": [{"field": "gender", "operator": "equals", "value": "M"}]}
+    ]},
+    {"name": {"operator": "contains", "value": "%"}},
+    {"name": {"operator": "not_contains", "value": "li"}, "total_spent": {"operator": "between", "value": [100, 500]}},
+    {"logical_operator": "not", "conditions": [{"field": "age", "operator": "in", "value": [20, 35]}]},
+    {"name": {"operator": "regex", "value": "^b"}, "age": {"operator": "is_null"}},
+    [{"field": "gender", "operator": "not_equals", "value": "F"}, {"field": "total_spent", "operator": "greater_equal", "value": 300}],
+]
+
+@pytest.fixture
+def customers(db):
+    for row in CUSTOMERS:
+        db.add(Customer(id=uuid.uuid4(), **row))
+    db.commit()
+    return CUSTOMERS
+
+def _members(db, segment_id):
+    return {
+        customer_id for customer_id, in db.query(SegmentMembership.customer_id).filter_by(
+            segment_id=segment_id, is_active=True
+        )
+    }
+
+def _create_segment(engine, name, criteria, **config):
+    return engine.create_dynamic_segment({"name": name, "segment_type": "custom", "criteria": criteria, **config})
+
+def test_compiled_sql_matches_frame_evaluation(db, customers):
+    compiler = CriteriaCompiler()
+    frame = pd.DataFrame(customers)
+
+    for criteria in CRITERIA:
+        sql_ids = set(db.execute(compiler.build_select(criteria)).scalars())
+        mask = FrameCriteriaEvaluator(frame).evaluate(criteria)
+        assert sql_ids == set(frame.loc[mask, "customer_id"]), criteria
+
+def test_compiled_sql_null_and_negation_semantics(db, customers):
+    compiler = CriteriaCompiler()
+
+    not_male = {"logical_operator": "not", "conditions": [{"field": "gender", "operator": "equals", "value": "M"}]}
+    assert set(db.execute(compiler.build_select(not_male)).scalars()) == {"C1", "C3", "C4"}
+
+    contains_percent = {"name": {"operator": "contains", "value": "%"}}
+    assert set(db.execute(compiler.build_select(contains_percent)).scalars()) == {"C2"}
+
+def test_exclusion_rules_remove_criteria_matches(db, customers):
+    compiler = CriteriaCompiler()
+    query = compiler.build_select(
+        {"field": "age", "operator": "greater_than", "value": 30},
+        [{"type": "criteria", "criteria": {"name": "bill"}}]
+    )
+    assert set(db.execute(query).scalars()) == {"C1", "C3", "C4"}
+
+def test_unknown_criteria_node_is_rejected():
+    with pytest.raises(ValueError):
+        CriteriaCompiler().compile("age > 30")
+
+def test_relative_dates_are_detected_in_the_criteria_tree():
+    compiler = CriteriaCompiler()
+    recent = {"field": "last_purchase_date", "operator": "greater_than", "value": {"days_ago": 30}}
+
+    assert compiler.uses_relative_dates({"logical_operator": "or", "conditions": [CRITERIA[0], recent]})
+    assert compiler.uses_relative_dates({"registration_time": {"operator": "between", "value": {"min": {"days_ago": 7}, "max": "2030-01-01"}}})
+    assert compiler.uses_relative_dates({"age": 30}, [{"type": "criteria", "criteria": recent}])
+    assert not compiler.uses_relative_dates(CRITERIA)
+    assert not compiler.uses_relative_dates({"name": {"operator": "contains", "value": '"days_ago"'}})
+    assert not compiler.uses_relative_dates({"last_purchase_date": {"operator": "greater_than", "value": "2024-01-01"}})
+
+def test_execute_segmentation_tracks_membership_changes(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_id = _create_segment(engine, "older", {"field": "age", "operator": "greater_than", "value": 40})
+
+    result = asyncio.run(engine.execute_segmentation(segment_id))
+    assert result.success
+    assert result.customers_added == 3
+    assert _members(db, segment_id) == {"C3", "C4", "C5"}
+
+    db.query(Customer).filter(Customer.customer_id == "C5").update({"age": 30}, synchronize_session=False)
+    db.query(Customer).filter(Customer.customer_id == "C1").update({"age": 41}, synchronize_session=False)
+    db.commit()
+
+    result = asyncio.run(engine.execute_segmentation(segment_id, refresh_mode="full"))
+    assert (result.customers_added, result.customers_removed) == (1, 1)
+    assert _members(db, segment_id) == {"C1", "C3", "C4"}
+
+def test_incremental_refresh_retests_only_changed_customers(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_id = _create_segment(engine, "older", {"field": "age", "operator": "greater_than", "value": 40})
+    first = asyncio.run(engine.execute_segmentation(segment_id))
+    assert first.refresh_mode == "full"
+
+    db.query(Customer).filter(Customer.customer_id == "C1").update({"age": 41}, synchronize_session=False)
+    db.commit()
+
+    result = asyncio.run(engine.execute_segmentation(segment_id, refresh_mode="incremental"))
+    assert result.refresh_mode == "incremental"
+    assert result.customers_processed == 1
+    assert (result.customers_added, result.customers_removed) == (1, 0)
+    assert _members(db, segment_id) == {"C1", "C3", "C4", "C5"}
+
+def test_incremental_cutoff_compares_utc_timestamps_in_utc(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_id = _create_segment(engine, "older", {"field": "age", "operator": "greater_than", "value": 40})
+    asyncio.run(engine.execute_segmentation(segment_id))
+    execution = db.query(SegmentExecution).filter_by(segment_id=segment_id).one()
+    started_at_utc = datetime.fromisoformat(execution.execution_results["started_at_utc"])
+
+    # Written in UTC just before and just after the run started, whatever the local offset
+    db.query(Customer).filter(Customer.customer_id == "C0").update(
+        {"age": 80, "updated_at": started_at_utc - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.query(Customer).filter(Customer.customer_id == "C1").update(
+        {"age": 80, "updated_at": started_at_utc + timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.commit()
+
+    result = asyncio.run(engine.execute_segmentation(segment_id, refresh_mode="incremental"))
+    assert result.refresh_mode == "incremental"
+    assert result.customers_processed == 1
+    assert _members(db, segment_id) == {"C1", "C3", "C4", "C5"}
+
+def test_runs_without_a_utc_start_fall_back_to_full(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_id = _create_segment(engine, "older", {"field": "age", "operator": "greater_than", "value": 40})
+    asyncio.run(engine.execute_segmentation(segment_id))
+    execution = db.query(SegmentExecution).filter_by(segment_id=segment_id).one()
+    execution.execution_results = {"criteria_hash": execution.execution_results["criteria_hash"]}
+    db.commit()
+
+    result = asyncio.run(engine.execute_segmentation(segment_id, refresh_mode="incremental"))
+    assert result.refresh_mode == "full"
+
+def test_due_segments_refresh_in_one_scan(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_ids = [_create_segment(engine, f"s{i}", criteria) for i, criteria in enumerate(CRITERIA[:5])]
+    not_due = _create_segment(engine, "later", {"field": "age", "operator": "greater_than", "value": 40})
+    broken = _create_segment(engine, "broken", {"field": "age", "operator": "sounds_like", "value": 40})
+    db.query(DynamicSegment).filter(DynamicSegment.id != not_due).update(
+        {"next_update": datetime.now() - timedelta(minutes=1)}, synchronize_session=False
+    )
+    db.commit()
+
+    results = {result.segment_id: result for result in asyncio.run(engine.execute_due_segments(chunk_size=4))}
+    assert set(results) == set(segment_ids) | {broken}
+    assert not results[broken].success
+
+    compiler = CriteriaCompiler()
+    for segment_id, criteria in zip(segment_ids, CRITERIA[:5]):
+        assert results[segment_id].success
+        assert results[segment_id].customers_processed == len(CUSTOMERS)
+        assert _members(db, segment_id) == set(db.execute(compiler.build_select(criteria)).scalars())
+    assert db.get(DynamicSegment, segment_ids[0]).next_update > datetime.now()
+    # Refreshed segments are rescheduled; a failed one stays due
+    assert [result.segment_id for result in asyncio.run(engine.execute_due_segments())] == [broken]
+
+def test_bitmap_index_matches_active_memberships(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_ids = [_create_segment(engine, f"s{i}", criteria) for i, criteria in enumerate(CRITERIA[:3])]
+    for segment_id in segment_ids:
+        asyncio.run(engine.execute_segmentation(segment_id))
+
+    index = SegmentMembershipIndex(db)
+    for segment_id in segment_ids:
+        bitmap = index.get_bitmap(segment_id)
+        members = _members(db, segment_id)
+        assert popcount(bitmap) == len(members)
+        assert set(index.resolve_customers(bitmap)) == members
+
+def test_overlap_and_difference_from_bitmaps(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_ids = [_create_segment(engine, f"s{i}", criteria) for i, criteria in enumerate(CRITERIA[:3])]
+    for segment_id in segment_ids:
+        asyncio.run(engine.execute_segmentation(segment_id))
+    sets = [_members(db, segment_id) for segment_id in segment_ids]
+
+    overlap = engine.analyze_segment_overlap(segment_ids)
+    assert overlap["overlap_matrix"][segment_ids[0]][segment_ids[1]]["overlap_count"] == len(sets[0] & sets[1])
+    assert overlap["common_customers"]["count"] == len(sets[0] & sets[1] & sets[2])
+    assert overlap["summary"]["total_unique_customers"] == len(sets[0] | sets[1] | sets[2])
+    assert overlap["uniqueness_analysis"][segment_ids[2]]["unique_customers"] == len(sets[2] - sets[0] - sets[1])
+
+    difference = engine.get_segment_difference(segment_ids[0], segment_ids[2])
+    assert difference["count"] == len(sets[0] - sets[2])
+    assert set(difference["customer_ids"]) == sets[0] - sets[2]
+
+def test_bitmap_follows_incremental_membership_changes(db, customers):
+    engine = DynamicSegmentationEngine(db)
+    segment_id = _create_segment(engine, "spenders", {"field": "total_spent", "operator": "greater_than", "value": 200})
+    asyncio.run(engine.execute_segmentation(segment_id))
+
+    db.query(Customer).filter(Customer.customer_id == "C0").update({"total_spent": 900.0}, synchronize_session=False)
+    db.query(Customer).filter(Customer.customer_id == "C2").update({"total_spent": 10.0}, synchronize_session=False)
+    db.commit()
+    asyncio.run(engine.execute_segmentation(segment_id, refresh_mode="full"))
+
+    index = SegmentMembershipIndex(db)
+    assert set(index.resolve_customers(index.get_bitmap(segment_id))) == {"C0", "C3", "C5"}
+    assert set(db.execute(select(SegmentMembership.customer_id).where(
+        SegmentMembership.segment_id == segment_id, SegmentMembership.is_active.is_(True)
+    )).scalars()) == {"C0", "C3", "C5"}
+
+def _wait_for_preview_sample(preview_sample):
+    deadline = time.monotonic() + 5
+    while preview_sample.get("refreshing") and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+@pytest.fixture
+def preview_sample():
+    _preview_sample.clear()
+    yield _preview_sample
+    _wait_for_preview_sample(_preview_sample)
+    _preview_sample.clear()
+
+@pytest.fixture
+def drawn_preview_sample(db, customers, preview_sample):
+    warm_preview_sample()
+    _wait_for_preview_sample(preview_sample)
+    assert preview_sample.get("current") is not None
+    return preview_sample
+
+def test_first_preview_is_exact_while_the_sample_is_drawn(db, customers, preview_sample):
+    engine = DynamicSegmentationEngine(db)
+    criteria = {"field": "age", "operator": "greater_than", "value": 40}
+    result = engine.preview_segment_size(criteria)
+    assert result["warming"] is True and result["exact"] is True
+    assert result["estimated_size"] == engine.preview_segment_size(criteria, exact=True)["estimated_size"]
+
+    _wait_for_preview_sample(preview_sample)
+    result = engine.preview_segment_size(criteria)
+    assert result["exact"] is False and "warming" not in result
+    assert result["sample_size"] == len(CUSTOMERS)
+
+def test_preview_estimates_match_exact_counts_on_a_full_sample(db, customers, drawn_preview_sample):
+    engine = DynamicSegmentationEngine(db)
+    for criteria in CRITERIA[:5]:
+        estimate = engine.preview_segment_size(criteria)
+        exact = engine.preview_segment_size(criteria, exact=True)
+        assert estimate["sample_size"] == estimate["population_size"] == len(CUSTOMERS)
+        assert estimate["estimated_size"] == exact["estimated_size"], criteria
+        assert estimate["confidence_interval"]["lower"] == estimate["confidence_interval"]["upper"] == exact["estimated_size"]
+
+def test_preview_exclusions_read_bitmaps_without_writing(db, customers, preview_sample):
+    engine = DynamicSegmentationEngine(db)
+    excluded = _create_segment(engine, "spenders", {"field": "total_spent", "operator": "greater_than", "value": 500})
+    older = {"field": "age", "operator": "greater_than", "value": 40}
+    rules = [{"type": "segment", "segment_id": excluded}]
+
+    # Without a stored bitmap the exclusion falls back to membership rows and builds nothing
+    asyncio.run(engine.execute_segmentation(excluded))
+    db.query(SegmentBitmap).delete()
+    db.commit()
+    warm_preview_sample()
+    _wait_for_preview_sample(preview_sample)
+    assert engine.preview_segment_size(older, rules)["estimated_size"] == 1  # C4
+    assert engine.membership_index.peek_bitmap(excluded) is None
+
+    SegmentMembershipIndex(db).rebuild(excluded)
+    db.commit()
+    assert engine.preview_segment_size(older, rules)["estimated_size"] == 1
+
+def test_stale_preview_sample_is_served_while_redrawn(db, customers, drawn_preview_sample):
+    engine = DynamicSegmentationEngine(db)
+    preview_sample = drawn_preview_sample
+    stale = preview_sample["current"]
+    stale["built_at"] = datetime.now() - engine.preview_sample_ttl - timedelta(seconds=1)
+
+    result = engine.preview_segment_size({"field": "age", "operator": "greater_than", "value": 40})
+    assert result["sample_age_seconds"] > engine.preview_sample_ttl.total_seconds()
+
+    _wait_for_preview_sample(preview_sample)
+    assert preview_sample["current"] is not stale
+    assert len(preview_sample["current"]["frame"]) == len(CUSTOMERS)
@@ -0,0 +1,93 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from core.write_behind import BufferFull, WriteBehindBuffer
+
+class FakeWriter:
+    """Records written chunks; fails transiently a set number of times and on rows marked bad"""
+
+    def __init__(self, transient_failures=0):
+        self.transient_failures = transient_failures
+        self.chunks = []
+        self.rows = []
+
+    def __call__(self, rows):
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise OperationalError("INSERT", {}, ConnectionError("database unavailable"))
+        if any(row.get("bad") for row in rows):
+            raise ValueError("bad row")
+        self.rows.extend(rows)
+        self.chunks.append([row["id"] for row in rows])
+
+    @property
+    def written(self):
+        return [row_id for chunk in self.chunks for row_id in chunk]
+
+def _buffer(writer, tmp_path, **kwargs):
+    return WriteBehindBuffer("test", writer, dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+def test_crash_log_segments_are_replayed_on_start(tmp_path):
+    log_path = tmp_path / "events.jsonl"
+    stamp = datetime(2026, 1, 2, 3, 4, 5)
+    (tmp_path / "events.jsonl.1.pending").write_text(json.dumps({"id": 1, "at": stamp.isoformat()}) + "\n")
+    # The active segment of the crashed process ends in a torn line
+    log_path.write_text(json.dumps({"id": 2, "at": stamp.isoformat()}) + "\n" + '{"id": 3, "at"')
+
+    writer = FakeWriter()
+    buffer = _buffer(writer, tmp_path, log_path=str(log_path), datetime_fields=("at",), flush_interval=60)
+    buffer.start()
+    buffer.stop()
+
+    assert writer.written == [1, 2]
+    assert all(row["at"] == stamp for row in writer.rows)
+    assert not list(tmp_path.glob("events.jsonl*"))
+
+def test_transient_failures_keep_the_chunk_for_a_retry(tmp_path):
+    writer = FakeWriter(transient_failures=1)
+    buffer = _buffer(writer, tmp_path)
+    for i in range(3):
+        buffer.submit({"id": i})
+
+    with pytest.raises(OperationalError):
+        buffer.flush()
+    assert buffer.depth == 3
+    assert buffer.metrics["dead_lettered"] == 0
+
+    assert buffer.flush() == 3
+    assert writer.written == [0, 1, 2]
+    assert buffer.depth == 0
+
+def test_bad_rows_are_dead_lettered_without_stalling_the_chunk(tmp_path):
+    writer = FakeWriter()
+    buffer = _buffer(writer, tmp_path, max_events=4, flush_size=4)
+    for row in ({"id": 0}, {"id": 1, "bad": True}, {"id": 2}, {"id": 3}):
+        buffer.submit(row)
+
+    assert buffer.flush() == 3
+    assert writer.chunks == [[0], [2], [3]]
+    assert buffer.metrics["dead_lettered"] == 1
+    dead = [json.loads(line) for line in (tmp_path / "dead.jsonl").read_text().splitlines()]
+    assert [entry["row"]["id"] for entry in dead] == [1]
+    assert dead[0]["error"] == "bad row"
+
+    # Every row gave its capacity back, written or not
+    for i in range(4):
+        buffer.submit({"id": 10 + i}, timeout=0)
+    with pytest.raises(BufferFull):
+        buffer.submit({"id": 14}, timeout=0)
+
+def test_stop_drains_the_buffer(tmp_path):
+    writer = FakeWriter()
+    buffer = _buffer(writer, tmp_path, flush_interval=60)
+    buffer.start()
+    for i in range(5):
+        buffer.submit({"id": i})
+    buffer.stop()
+
+    assert not buffer.running
+    assert writer.written == [0, 1, 2, 3, 4]
+    assert buffer.depth == 0